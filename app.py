@@ -2,14 +2,19 @@ import streamlit as st
 import pandas as pd
 import os
 import json
+import threading
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # Import project modules
 from src.data_processing.data_loader import DataLoader
-from src.analysis.bp_categories import BPCategorizer
-from src.analysis.correlation import CorrelationAnalyzer
+from src.analysis.bp_categories import BPCategorizer, IncrementalBPCategorizer
+from src.analysis.correlation import CorrelationAnalyzer, IncrementalCorrelationAnalyzer
 from src.data_processing.fhir import FHIRIntegration
+from src.data_processing.fhir_async import FHIRClient
+from src.data_processing.patient_catalog import PatientCatalog
+from src.data_processing.session_memory import SessionMemoryGovernor
+from src.data_processing.time_index import TimeIndexedStore
 from src.llm.recommendation import LLMRecommendationEngine
 from src.visualization.dashboard import create_dashboard
 from src.llm.recommendation_display import (
@@ -25,17 +30,166 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def get_memory_governor():
+    """Shared memory governor holding the data frames of all sessions"""
+    return SessionMemoryGovernor(spill_dir=os.path.join("data", "session_spill"))
+
+@st.cache_resource
+def get_fhir_client(base_url="https://hapi.fhir.org/baseR4"):
+    """FHIR client shared by all sessions (one connection pool and concurrency limit per server)"""
+    return FHIRClient(base_url=base_url)
+
+@st.cache_resource
+def get_patient_catalog(data_dir="data/patient_data"):
+    """Catalog of local patients, brought up to date once per server process"""
+    catalog = PatientCatalog(data_dir)
+    catalog.refresh()
+    return catalog
+
+@st.cache_resource
+def get_upload_analysis():
+    """Running BP category and correlation state of each upload store (store id -> state), updated with the rows each upload adds"""
+    return {'stores': {}, 'lock': threading.Lock()}
+
+def update_upload_analysis(store_id, bp_data, exercise_data, last_ingest):
+    """
+    Bring the BP categories and correlation results of one upload store up to date
+    
+    Only the rows added by the last upload are categorized and fed to the
+    store's running analyzer; the state is rebuilt from the full data when its
+    row counts do not line up with the store (e.g. after a server restart).
+    
+    Parameters:
+    - store_id: Owner of the upload store (see DataLoader)
+    - bp_data, exercise_data: Everything in the store (None if nothing was uploaded)
+    - last_ingest: IngestResults of the last upload
+    
+    Returns:
+    Tuple of (categorized_bp_data, correlation_results); correlation results
+    are None unless both kinds of data are available, and only hold what the
+    running sums answer (see get_detailed_upload_analysis)
+    """
+    upload_analysis = get_upload_analysis()
+    with upload_analysis['lock']:
+        state = upload_analysis['stores'].setdefault(store_id, {
+            'lock': threading.Lock(),
+            'rows': {'bp': 0, 'exercise': 0}
+        })
+    frames = {'bp': bp_data, 'exercise': exercise_data}
+    
+    with state['lock']:
+        added = {
+            kind: last_ingest[kind].new_rows if kind in last_ingest and last_ingest[kind].added else None
+            for kind in frames
+        }
+        in_step = 'analyzer' in state and all(
+            state['rows'][kind] + (len(added[kind]) if added[kind] is not None else 0)
+            == (len(frames[kind]) if frames[kind] is not None else 0)
+            for kind in frames
+        )
+        if not in_step:
+            state['analyzer'] = IncrementalCorrelationAnalyzer()
+            state['categorizer'] = IncrementalBPCategorizer()
+            state['categorized_bp_data'] = None
+            added = frames
+        
+        # New readings are categorized on their own and merged into the categorized store in time order
+        new_categories = state['categorizer'].append_readings(added['bp'])
+        if new_categories is not None:
+            categorized = new_categories.to_frame()
+            if state['categorized_bp_data'] is not None:
+                categorized = pd.concat([state['categorized_bp_data'], categorized], ignore_index=True)
+                categorized = categorized.sort_values('datetime', kind='stable', ignore_index=True)
+            state['categorized_bp_data'] = categorized
+        
+        state['analyzer'].append_readings(added['bp'])
+        state['analyzer'].append_exercises(added['exercise'])
+        state['rows'] = {kind: len(frames[kind]) if frames[kind] is not None else 0 for kind in frames}
+        
+        correlation_results = None
+        if bp_data is not None and exercise_data is not None:
+            correlation_results = state['analyzer'].get_results()
+        return state['categorized_bp_data'], correlation_results
+
+def get_detailed_upload_analysis(store_id):
+    """
+    Correlation results of an upload store with the parts built from its full
+    history (impact table, correlation matrix, resampled intervals and lag scan)
+    
+    These are computed on request rather than after every upload, and reused
+    until the store's next upload.
+    
+    Parameters:
+    - store_id: Owner of the upload store (see DataLoader)
+    
+    Returns:
+    Dictionary of correlation results, or None if the store has no analysis state
+    """
+    upload_analysis = get_upload_analysis()
+    with upload_analysis['lock']:
+        state = upload_analysis['stores'].get(store_id)
+    if state is None:
+        return None
+    
+    with state['lock']:
+        if 'analyzer' not in state:
+            return None
+        return state['analyzer'].get_results(detailed=True)
+
+@st.cache_resource
+def get_time_indexes():
+    """Date-range indexes of the sessions' loaded data: session id -> (data version, TimeIndexedStore)"""
+    return {}
+
+def get_time_index(categorized_bp_data, exercise_data):
+    """Time index of this session's frames, rebuilt only when new data was stored"""
+    time_indexes = get_time_indexes()
+    version, time_index = time_indexes.get(session_id, (None, None))
+    if version != st.session_state.data_version:
+        time_index = TimeIndexedStore(categorized_bp_data, exercise_data)
+        time_indexes[session_id] = (st.session_state.data_version, time_index)
+    return time_index
+
+def get_session_id():
+    """Identifier of the current Streamlit session"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "local"
+
+def is_session_active(session_id):
+    """Whether a Streamlit session (e.g. an idle but still open tab) is still connected"""
+    from streamlit import runtime
+    return runtime.exists() and runtime.get_instance().is_active_session(session_id)
+
+def store_session_data(bp_data, exercise_data, categorized_bp_data, correlation_results, upload_store_id=None):
+    """Store analysis frames in the memory governor instead of st.session_state"""
+    memory_governor.store(session_id, 'bp_data', bp_data)
+    memory_governor.store(session_id, 'exercise_data', exercise_data)
+    memory_governor.store(session_id, 'categorized_bp_data', categorized_bp_data)
+    memory_governor.store(session_id, 'correlation_results', correlation_results)
+    # Upload store the data came from, whose running analyzer answers detailed results
+    st.session_state.upload_store_id = upload_store_id
+    st.session_state.data_version += 1
+
+# Data frames live in the shared memory governor; session state only keeps small values
+memory_governor = get_memory_governor()
+session_id = get_session_id()
+for spilled_session in memory_governor.spill_idle_sessions():
+    get_time_indexes().pop(spilled_session, None)
+
+# Sessions idle long enough to have ended: drop their time index and upload analysis, and
+# their uploads unless the tab is still open (it reloads them from its store)
+for expired_session in memory_governor.expire_idle_sessions():
+    get_time_indexes().pop(expired_session, None)
+    with get_upload_analysis()['lock']:
+        get_upload_analysis()['stores'].pop(f"session-{expired_session}", None)
+    if not is_session_active(expired_session):
+        DataLoader(store_id=f"session-{expired_session}").discard_uploads()
+
 # Initialize session state
 if 'data_loaded' not in st.session_state:
     st.session_state.data_loaded = False
-if 'bp_data' not in st.session_state:
-    st.session_state.bp_data = None
-if 'exercise_data' not in st.session_state:
-    st.session_state.exercise_data = None
-if 'categorized_bp_data' not in st.session_state:
-    st.session_state.categorized_bp_data = None
-if 'correlation_results' not in st.session_state:
-    st.session_state.correlation_results = None
 if 'current_tab' not in st.session_state:
     st.session_state.current_tab = 0
 if 'fhir_data' not in st.session_state:
@@ -44,15 +198,31 @@ if 'recommendation' not in st.session_state:
     st.session_state.recommendation = None
 if 'patient_info' not in st.session_state:
     st.session_state.patient_info = None
+if 'data_version' not in st.session_state:
+    st.session_state.data_version = 0
+if 'upload_store_id' not in st.session_state:
+    st.session_state.upload_store_id = None
+
+# The governor drops the frames of sessions idle past its expiry, even if the tab stayed open
+if st.session_state.data_loaded and not memory_governor.has(session_id, 'bp_data'):
+    st.session_state.data_loaded = False
+    st.session_state.recommendation = None
+    st.warning("This session was idle for a long time and its data was released. Please load your data again.")
 
 # App title
 st.title("❤️ Heart Health Tracker")
 st.markdown("### Exercise Impact Dashboard & LLM-Powered Recommendations")
 
 # Initialize data loader and FHIR integration
-data_loader = DataLoader()
+data_loader = DataLoader(store_id=f"session-{session_id}")
 fhir_integration = FHIRIntegration()
 
+# Date range selected in the sidebar (None for all data)
+date_filter = None
+
+# Whether to build the full-history correlation results of an upload store
+detailed_analysis = False
+
 # Sidebar
 with st.sidebar:
     st.header("Data Sources")
@@ -60,7 +230,7 @@ with st.sidebar:
     # Data source selection
     data_source = st.radio(
         "Select Data Source",
-        ["Synthetic Data", "Upload Your Data", "Connect FHIR Server"]
+        ["Synthetic Data", "Upload Your Data", "Local Patient Data", "Connect FHIR Server"]
     )
     
     if data_source == "Synthetic Data":
@@ -78,10 +248,7 @@ with st.sidebar:
                 correlation_results = analyzer.analyze_exercise_bp_correlation(categorized_bp_data, exercise_data)
                 
                 # Store in session state
-                st.session_state.bp_data = bp_data
-                st.session_state.exercise_data = exercise_data
-                st.session_state.categorized_bp_data = categorized_bp_data
-                st.session_state.correlation_results = correlation_results
+                store_session_data(bp_data, exercise_data, categorized_bp_data, correlation_results)
                 st.session_state.data_loaded = True
                 
                 st.success("Synthetic data loaded successfully!")
@@ -89,118 +256,140 @@ with st.sidebar:
     elif data_source == "Upload Your Data":
         st.write("Upload your blood pressure and exercise data:")
         
+        # Uploads are stored per patient, or per session when no patient is given
+        upload_patient_id = st.text_input(
+            "Patient ID (optional)",
+            help="Uploads for the same patient are combined and deduplicated. "
+                 "Leave empty to keep the uploads to this session."
+        ).strip()
+        upload_store_id = f"patient-{upload_patient_id}" if upload_patient_id else f"session-{session_id}"
+        
         bp_file = st.file_uploader("Blood Pressure Data (CSV)", type="csv")
-        exercise_file = st.file_uploader("Exercise Data (CSV)", type="csv")
+        exercise_file = st.file_uploader("Exercise Data (CSV, Google Fit JSON or TCX)", type=["csv", "json", "tcx"])
         
         if (bp_file or exercise_file) and st.button("Process Uploaded Data"):
             with st.spinner("Processing uploaded data..."):
-                # Load user data
-                bp_data, exercise_data = data_loader.load_user_data(bp_file, exercise_file)
-                
-                # Categorize BP data if available
-                categorized_bp_data = None
-                if bp_data is not None:
-                    bp_categorizer = BPCategorizer()
-                    categorized_bp_data = bp_categorizer.categorize_bp_dataframe(bp_data)
+                # Load user data, streaming the uploads in chunks with a progress bar
+                upload_progress = st.progress(0.0, text="Reading uploaded files...")
+                data_loader = DataLoader(store_id=upload_store_id)
+                bp_data, exercise_data = data_loader.load_user_data(
+                    bp_file, exercise_file,
+                    progress_callback=lambda fraction, message: upload_progress.progress(fraction, text=message)
+                )
+                upload_progress.empty()
+                for kind, result in data_loader.last_ingest.items():
+                    if result.skipped:
+                        st.info(f"This {kind} file was already uploaded")
+                    elif result.new_range is not None:
+                        first, last = result.new_range
+                        st.info(f"Added {result.added:,} new {kind} rows ({first:%Y-%m-%d} to {last:%Y-%m-%d}), "
+                                f"skipped {result.duplicate_rows:,} already uploaded")
                 
-                # Run correlation analysis if both data types are available
-                correlation_results = None
-                if bp_data is not None and exercise_data is not None:
-                    analyzer = CorrelationAnalyzer()
-                    correlation_results = analyzer.analyze_exercise_bp_correlation(categorized_bp_data, exercise_data)
+                # Categorize BP data and run the correlation analysis (when both data types are
+                # available), processing only the rows this upload added
+                categorized_bp_data, correlation_results = update_upload_analysis(
+                    upload_store_id, bp_data, exercise_data, data_loader.last_ingest
+                )
                 
                 # Store in session state
-                st.session_state.bp_data = bp_data
-                st.session_state.exercise_data = exercise_data
-                st.session_state.categorized_bp_data = categorized_bp_data
-                st.session_state.correlation_results = correlation_results
+                store_session_data(bp_data, exercise_data, categorized_bp_data, correlation_results,
+                                   upload_store_id=upload_store_id)
                 st.session_state.data_loaded = True
                 
                 st.success("Uploaded data processed successfully!")
     
-    # elif data_source == "Local Patient Data":
-    #     st.write("Load local patient data:")
+    elif data_source == "Local Patient Data":
+        st.write("Load local patient data:")
         
-    #     # Find local patient data directories
-    #     patient_data_dir = "data/patient_data"
-    #     patient_dirs = [d for d in os.listdir(patient_data_dir) 
-    #                     if os.path.isdir(os.path.join(patient_data_dir, d))]
+        # Patients come from the catalog manifest rather than a directory scan
+        patient_catalog = get_patient_catalog()
+        if st.button("Rescan Patient Folders"):
+            patient_catalog.refresh()
+        patients = patient_catalog.list_patients(columns=["id", "name", "bp_category"])
         
-    #     selected_patient = st.selectbox("Select Patient", patient_dirs)
-        
-    #     if st.button("Load Patient Data"):
-    #         with st.spinner("Loading patient data..."):
-    #             try:
-    #                 # Load patient info
-    #                 patient_info_path = os.path.join(patient_data_dir, selected_patient, "patient_info.json")
-    #                 with open(patient_info_path, 'r') as f:
-    #                     patient_data = json.load(f)
-                    
-    #                 # Load device data (BP and Exercise)
-    #                 bp_data, exercise_data = fhir_integration.load_device_data(selected_patient)
-                    
-    #                 # Categorize BP data
-    #                 bp_categorizer = BPCategorizer()
-    #                 categorized_bp_data = bp_categorizer.categorize_bp_dataframe(bp_data)
-                    
-    #                 # Run correlation analysis
-    #                 analyzer = CorrelationAnalyzer()
-    #                 correlation_results = analyzer.analyze_exercise_bp_correlation(categorized_bp_data, exercise_data)
-                    
-    #                 # Prepare FHIR data for recommendations
-    #                 fhir_data = fhir_integration.prepare_fhir_data_for_llm(patient_data)
-                    
-    #                 # Store in session state
-    #                 st.session_state.patient_info = {
-    #                     "name": patient_data.get("name", "Unknown"),
-    #                     "age": patient_data.get("age", "Unknown"),
-    #                     "gender": patient_data.get("gender", "Unknown"),
-    #                     "bp_category": patient_data.get("bp_category", "Unknown"),
-    #                     "conditions": patient_data.get("conditions", []),
-    #                     "medications": patient_data.get("medications", [])
-    #                 }
-    #                 st.session_state.bp_data = bp_data
-    #                 st.session_state.exercise_data = exercise_data
-    #                 st.session_state.categorized_bp_data = categorized_bp_data
-    #                 st.session_state.correlation_results = correlation_results
-    #                 st.session_state.fhir_data = fhir_data
-    #                 st.session_state.data_loaded = True
+        if patients.empty:
+            st.info("No local patients found")
+        else:
+            patient_labels = {
+                row.id: f"{row.name or 'Unknown'} ({row.id}) - {row.bp_category or 'Unknown'}"
+                for row in patients.itertuples()
+            }
+            selected_patient = st.selectbox(
+                "Select Patient", list(patient_labels), format_func=patient_labels.get
+            )
+            
+            if st.button("Load Patient Data"):
+                with st.spinner("Loading patient data..."):
+                    try:
+                        # Load patient info
+                        patient_info_path = os.path.join(patient_catalog.data_dir, selected_patient, "patient_info.json")
+                        with open(patient_info_path, 'r') as f:
+                            patient_data = json.load(f)
+                        patient_catalog.refresh_patient(selected_patient)
+                        patient_row = patient_catalog.get_patient(selected_patient) or {}
+                        
+                        # Load device data (BP and Exercise)
+                        bp_data, exercise_data = fhir_integration.load_device_data(selected_patient)
+                        
+                        # Categorize BP data
+                        bp_categorizer = BPCategorizer()
+                        categorized_bp_data = bp_categorizer.categorize_bp_dataframe(bp_data)
+                        
+                        # Run correlation analysis
+                        analyzer = CorrelationAnalyzer()
+                        correlation_results = analyzer.analyze_exercise_bp_correlation(categorized_bp_data, exercise_data)
+                        
+                        # Prepare FHIR data for recommendations
+                        fhir_data = fhir_integration.prepare_fhir_data_for_llm(patient_data)
+                        
+                        # Store in session state (catalog fields cover both patient_info.json layouts)
+                        st.session_state.patient_info = {
+                            "name": patient_row.get("name") or "Unknown",
+                            "age": patient_row.get("age") or "Unknown",
+                            "gender": patient_row.get("gender") or "Unknown",
+                            "bp_category": patient_row.get("bp_category") or "Unknown",
+                            "conditions": patient_row.get("conditions", []),
+                            "medications": patient_row.get("medications", [])
+                        }
+                        store_session_data(bp_data, exercise_data, categorized_bp_data, correlation_results)
+                        st.session_state.fhir_data = fhir_data
+                        st.session_state.data_loaded = True
+                        
+                        st.success(f"Patient data for {patient_row.get('name') or selected_patient} loaded successfully!")
                     
-    #                 st.success(f"Patient data for {patient_data.get('name', selected_patient)} loaded successfully!")
-                
-    #             except Exception as e:
-    #                 st.error(f"Error loading patient data: {str(e)}")
-    #                 import traceback
-    #                 st.error(traceback.format_exc())
+                    except Exception as e:
+                        st.error(f"Error loading patient data: {str(e)}")
+                        import traceback
+                        st.error(traceback.format_exc())
     
     # elif data_source == "Connect FHIR Server":
     #     st.write("Connect to FHIR server to import health data:")
-        
+    
     #     fhir_server = st.text_input("FHIR Server URL", value="https://hapi.fhir.org/baseR4")
     #     patient_id = st.text_input("Patient ID")
-        
+    
     #     if patient_id and st.button("Connect and Import"):
     #         with st.spinner("Connecting to FHIR server..."):
     #             try:
     #                 # Fetch patient data from FHIR server
     #                 fhir_client = FHIRIntegration(base_url=fhir_server)
     #                 patient_data = fhir_client.fetch_patient(patient_id)
-                    
+    
     #                 if patient_data:
     #                     # Load device data
     #                     bp_data, exercise_data = fhir_client.load_device_data(patient_id)
-                        
+    
     #                     # Categorize BP data
     #                     bp_categorizer = BPCategorizer()
     #                     categorized_bp_data = bp_categorizer.categorize_bp_dataframe(bp_data)
-                        
+    
     #                     # Run correlation analysis
     #                     analyzer = CorrelationAnalyzer()
     #                     correlation_results = analyzer.analyze_exercise_bp_correlation(categorized_bp_data, exercise_data)
-                        
+    
     #                     # Prepare FHIR data for recommendations
     #                     fhir_data = fhir_client.prepare_fhir_data_for_llm(patient_data)
-                        
+    
     #                     # Store in session state
     #                     st.session_state.patient_info = {
     #                         "name": patient_data.get("name", "Unknown"),
@@ -216,7 +405,7 @@ with st.sidebar:
     #                     st.session_state.correlation_results = correlation_results
     #                     st.session_state.fhir_data = fhir_data
     #                     st.session_state.data_loaded = True
-                        
+    
     #                     st.success(f"Successfully connected to FHIR server and imported data for patient {patient_id}")
     #                 else:
     #                     st.error(f"Failed to fetch data for patient {patient_id}")
@@ -237,7 +426,7 @@ with st.sidebar:
             with st.spinner("Connecting to FHIR server..."):
                 try:
                     # Fetch patient data from FHIR server
-                    fhir_client = FHIRIntegration(base_url="https://hapi.fhir.org/baseR4")
+                    fhir_client = get_fhir_client("https://hapi.fhir.org/baseR4")
                     patient_data = fhir_client.fetch_patient(patient_id)
                     
                     if patient_data:
@@ -264,10 +453,7 @@ with st.sidebar:
                             "conditions": patient_data.get("conditions", []),
                             "medications": patient_data.get("medications", [])
                         }
-                        st.session_state.bp_data = bp_data
-                        st.session_state.exercise_data = exercise_data
-                        st.session_state.categorized_bp_data = categorized_bp_data
-                        st.session_state.correlation_results = correlation_results
+                        store_session_data(bp_data, exercise_data, categorized_bp_data, correlation_results)
                         st.session_state.fhir_data = fhir_data
                         st.session_state.data_loaded = True
                         
@@ -278,56 +464,41 @@ with st.sidebar:
                     st.error(f"Error connecting to FHIR server: {str(e)}")
                     import traceback
                     st.error(traceback.format_exc())
-
-
+    
+    
     if st.session_state.data_loaded:
-        x = 1
-        # st.header("Date Range")
-        
-        # # Get overall date range from data
-        # min_date, max_date = data_loader.get_date_range()
+        # Report how much memory this session holds in the shared governor
+        session_memory = memory_governor.session_memory_report(session_id)
+        st.caption(
+            f"Session memory: {session_memory['bytes'] / 1024:.1f} KB "
+            f"({session_memory['shared_bytes'] / 1024:.1f} KB shared with other sessions)"
+        )
+        st.header("Date Range")
         
-        # # Create date range selector
-        # date_range = st.date_input(
-        #     "Select Date Range",
-        #     value=[min_date, max_date],
-        #     min_value=min_date,
-        #     max_value=max_date
-        # )
+        # Range queries are answered from the session's time index (sorted slices and cached results)
+        time_index = get_time_index(
+            memory_governor.load(session_id, 'categorized_bp_data'),
+            memory_governor.load(session_id, 'exercise_data')
+        )
+        full_range = time_index.date_range()
         
-        # # Handle single date selection
-        # if len(date_range) == 1:
-        #     start_date = date_range[0]
-        #     end_date = date_range[0]
-        # else:
-        #     start_date = date_range[0]
-        #     end_date = date_range[1]
+        if full_range is not None and full_range[0] < full_range[1]:
+            date_filter = st.slider(
+                "Select Date Range",
+                min_value=full_range[0],
+                max_value=full_range[1],
+                value=full_range,
+                format="YYYY-MM-DD"
+            )
         
-        # # Filter data based on date range
-        # if st.button("Apply Date Filter"):
-        #     with st.spinner("Filtering data..."):
-        #         filtered_bp, filtered_exercise = data_loader.filter_by_date_range(start_date, end_date)
-                
-        #         # Categorize filtered BP data
-        #         categorized_bp = None
-        #         if filtered_bp is not None:
-        #             bp_categorizer = BPCategorizer()
-        #             categorized_bp = bp_categorizer.categorize_bp_dataframe(filtered_bp)
-                
-        #         # Run correlation analysis on filtered data
-        #         correlation_results = None
-        #         if filtered_bp is not None and filtered_exercise is not None:
-        #             analyzer = CorrelationAnalyzer()
-        #             correlation_results = analyzer.analyze_exercise_bp_correlation(categorized_bp, filtered_exercise)
-                
-        #         # Update session state with filtered data
-        #         st.session_state.bp_data = filtered_bp
-        #         st.session_state.exercise_data = filtered_exercise
-        #         st.session_state.categorized_bp_data = categorized_bp
-        #         st.session_state.correlation_results = correlation_results
-                
-        #         st.success("Data filtered successfully!")
-    
+        # Uploads only keep the results the running sums answer; the rest is built on request
+        if st.session_state.upload_store_id is not None:
+            detailed_analysis = st.checkbox(
+                "Detailed correlation analysis",
+                help="Adds the per-exercise plots, confidence intervals and follow-up window scan, "
+                     "computed over all uploaded data"
+            )
+
 
 # Main content area
 if not st.session_state.data_loaded:
@@ -359,24 +530,45 @@ if not st.session_state.data_loaded:
     
     **Exercise CSV**: Must include columns for date, time, exercise_type, duration_minutes, and intensity
     """)
-    
+
 else:
+    # Load this session's frames from the memory governor
+    bp_data = memory_governor.load(session_id, 'bp_data')
+    exercise_data = memory_governor.load(session_id, 'exercise_data')
+    categorized_bp_data = memory_governor.load(session_id, 'categorized_bp_data')
+    correlation_results = memory_governor.load(session_id, 'correlation_results')
+    
+    # Full-history results of an upload store are built on request and reused until its next upload
+    if (detailed_analysis and correlation_results is not None and
+            (date_filter is None or tuple(date_filter) == time_index.date_range())):
+        correlation_results = get_detailed_upload_analysis(st.session_state.upload_store_id) or correlation_results
+    
+    # Restrict to the selected date range with slices of the time index; the
+    # correlation for a range is computed once and cached
+    if date_filter is not None and tuple(date_filter) != time_index.date_range():
+        current_start_date, current_end_date = date_filter
+        categorized_bp_data = time_index.slice('bp', current_start_date, current_end_date)
+        exercise_data = time_index.slice('exercise', current_start_date, current_end_date)
+        correlation_results = time_index.cached(
+            'correlation', current_start_date, current_end_date,
+            lambda bp_slice, exercise_slice: CorrelationAnalyzer().analyze_exercise_bp_correlation(bp_slice, exercise_slice)
+        )
     # Determine current date range for display
-    if hasattr(st.session_state, 'bp_data') and st.session_state.bp_data is not None:
-        current_start_date = st.session_state.bp_data['date'].min().date()
-        current_end_date = st.session_state.bp_data['date'].max().date()
-    elif hasattr(st.session_state, 'exercise_data') and st.session_state.exercise_data is not None:
-        current_start_date = st.session_state.exercise_data['date'].min().date()
-        current_end_date = st.session_state.exercise_data['date'].max().date()
+    elif bp_data is not None:
+        current_start_date = bp_data['datetime'].min().date()
+        current_end_date = bp_data['datetime'].max().date()
+    elif exercise_data is not None:
+        current_start_date = exercise_data['datetime'].min().date()
+        current_end_date = exercise_data['datetime'].max().date()
     else:
         current_start_date = datetime.now().date() - timedelta(days=90)
         current_end_date = datetime.now().date()
-
+    
     # Create the dashboard
     create_dashboard(
-        st.session_state.categorized_bp_data,
-        st.session_state.exercise_data,
-        st.session_state.correlation_results,
+        categorized_bp_data,
+        exercise_data,
+        correlation_results,
         (current_start_date, current_end_date),
         st.session_state.get('patient_info'),
         st.session_state.get('fhir_data')
@@ -386,9 +578,9 @@ else:
         st.subheader("Generate Personalized Exercise Recommendations")
         
         # Check if we have the necessary data
-        if (st.session_state.categorized_bp_data is None or 
-            st.session_state.exercise_data is None or 
-            st.session_state.correlation_results is None):
+        if (categorized_bp_data is None or 
+            exercise_data is None or 
+            correlation_results is None):
             st.warning("Both blood pressure and exercise data are required to generate recommendations.")
         else:
             # Add button to generate recommendations
@@ -407,11 +599,12 @@ else:
                             # Prepare user data
                             user_data = st.session_state.get('user_info', {})
                             
-                            # Prepare BP stats
-                            bp_data = st.session_state.categorized_bp_data
+                            # Prepare BP stats (averages and categories from the time index rollups)
+                            bp_data = categorized_bp_data
+                            bp_summary = time_index.summary('bp', current_start_date, current_end_date)
                             bp_stats = {
-                                'avg_systolic': bp_data['systolic'].mean(),
-                                'avg_diastolic': bp_data['diastolic'].mean(),
+                                'avg_systolic': bp_summary['mean']['systolic'],
+                                'avg_diastolic': bp_summary['mean']['diastolic'],
                                 'max_systolic': bp_data['systolic'].max(),
                                 'min_systolic': bp_data['systolic'].min(),
                                 'max_diastolic': bp_data['diastolic'].max(),
@@ -419,15 +612,10 @@ else:
                             }
                             
                             # Add category distribution
-                            category_counts = bp_data['category'].value_counts()
-                            total = len(bp_data)
-                            bp_stats['category_distribution'] = {
-                                cat: count / total * 100 
-                                for cat, count in category_counts.items()
-                            }
+                            bp_stats['category_distribution'] = bp_summary.get('percentages', {})
                             
-                            # Get correlation summary
-                            correlation_summary = st.session_state.correlation_results.get('overall_correlation', {})
+                            # Get correlation summary (a copy: the results are shared through the governor and caches)
+                            correlation_summary = dict(correlation_results.get('overall_correlation', {}))
                             
                             # Add interpretations
                             correlation_summary['interpretations'] = []
@@ -454,7 +642,7 @@ else:
                                 )
                             
                             # Add exercise type insights
-                            type_impact = st.session_state.correlation_results.get('exercise_type_impact', {})
+                            type_impact = correlation_results.get('exercise_type_impact', {})
                             for ex_type, impact in type_impact.items():
                                 sys_change = impact.get('avg_systolic_change', 0)
                                 dia_change = impact.get('avg_diastolic_change', 0)
@@ -466,7 +654,7 @@ else:
                                     )
                             
                             # Get recent exercise history
-                            exercise_history = st.session_state.exercise_data.sort_values('date', ascending=False).head(10)
+                            exercise_history = exercise_data.sort_values('datetime', ascending=False).head(10)
                             
                             # Generate recommendations
                             recommendation_response = recommendation_engine.generate_recommendations(
@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 
+from src.data_processing.schema import date_column
+
 class BPCategorizer:
     """
     Class for categorizing blood pressure readings according to AHA guidelines
@@ -24,6 +26,12 @@ class BPCategorizer:
         'Hypertensive Crisis': '#c0392b'  # Dark Red
     }
     
+    # Category order used for categorical codes (code i -> CATEGORY_ORDER[i])
+    CATEGORY_ORDER = list(BP_CATEGORIES.keys())
+    
+    # Color lookup table indexed by category code (CATEGORY_COLORS follows the same order)
+    _COLOR_TABLE = np.array(list(CATEGORY_COLORS.values()), dtype=object)
+    
     def __init__(self):
         pass
     
@@ -52,35 +60,103 @@ class BPCategorizer:
             
         return category, self.CATEGORY_COLORS[category]
     
-    def categorize_bp_dataframe(self, bp_data):
+    def categorize_codes(self, systolic, diastolic):
+        """
+        Categorize arrays of blood pressure readings in one vectorized pass
+        
+        Parameters:
+        - systolic: Array-like of systolic readings (mmHg)
+        - diastolic: Array-like of diastolic readings (mmHg)
+        
+        Returns:
+        int8 array of category codes indexing CATEGORY_ORDER
+        """
+        systolic = np.asarray(systolic)
+        diastolic = np.asarray(diastolic)
+        
+        # Same precedence as categorize_bp, most severe category first
+        conditions = [
+            (systolic >= 180) | (diastolic >= 120),
+            (systolic >= 140) | (diastolic >= 90),
+            (systolic >= 130) | (diastolic >= 80),
+            systolic >= 120
+        ]
+        # int8 choices make np.select build the codes directly instead of an int64 temporary
+        choices = [np.int8(4), np.int8(3), np.int8(2), np.int8(1)]
+        
+        return np.select(conditions, choices, default=np.int8(0))
+    
+    def categorize(self, bp_data):
         """
-        Add category columns to a blood pressure DataFrame
+        Categorize a blood pressure DataFrame without copying it
         
         Parameters:
         - bp_data: DataFrame containing 'systolic' and 'diastolic' columns
         
         Returns:
-        DataFrame with added 'category' and 'category_color' columns
+        BPCategoryResult holding the category codes and a reference to bp_data
         """
         if bp_data is None or len(bp_data) == 0:
             return None
-            
-        # Create a copy to avoid modifying the original
-        categorized_data = bp_data.copy()
         
-        # Apply categorization function to each row
-        categories = []
-        colors = []
+        codes = self.categorize_codes(bp_data['systolic'], bp_data['diastolic'])
+        return BPCategoryResult(bp_data, codes)
+    
+    def categorize_bp_dataframe(self, bp_data, inplace=False):
+        """
+        Add a category column to a blood pressure DataFrame
+        
+        Parameters:
+        - bp_data: DataFrame containing 'systolic' and 'diastolic' columns
+        - inplace: Append the column to bp_data itself instead of a shallow copy
         
-        for _, row in categorized_data.iterrows():
-            category, color = self.categorize_bp(row['systolic'], row['diastolic'])
-            categories.append(category)
-            colors.append(color)
-            
-        categorized_data['category'] = categories
-        categorized_data['category_color'] = colors
+        Returns:
+        DataFrame with an added categorical 'category' column. Colors are
+        derived on demand with get_category_colors.
+        """
+        result = self.categorize(bp_data)
+        if result is None:
+            return None
         
-        return categorized_data
+        return result.to_frame(inplace=inplace)
+    
+    @classmethod
+    def get_category_codes(cls, categorized_data):
+        """
+        Get the category codes of a categorized DataFrame
+        
+        Parameters:
+        - categorized_data: DataFrame with 'category' column
+        
+        Returns:
+        Integer array of codes indexing CATEGORY_ORDER (-1 for unknown)
+        """
+        category = categorized_data['category']
+        
+        if isinstance(category.dtype, pd.CategoricalDtype) and list(category.cat.categories) == cls.CATEGORY_ORDER:
+            return category.cat.codes.to_numpy()
+        
+        # Plain string categories, e.g. from older callers
+        return pd.Index(cls.CATEGORY_ORDER).get_indexer(category)
+    
+    @classmethod
+    def get_category_colors(cls, categorized_data):
+        """
+        Derive the per-reading category colors without storing them in the frame
+        
+        Parameters:
+        - categorized_data: DataFrame with 'category' column
+        
+        Returns:
+        Array of hex color strings aligned with the rows of categorized_data
+        """
+        codes = cls.get_category_codes(categorized_data)
+        
+        # Unknown categories fall back to gray
+        colors = cls._COLOR_TABLE[np.clip(codes, 0, None)]
+        colors[codes < 0] = '#95a5a6'
+        
+        return colors
     
     def get_category_distribution(self, categorized_data):
         """
@@ -96,7 +172,8 @@ class BPCategorizer:
             return {}
             
         # Count occurrences of each category
-        category_counts = categorized_data['category'].value_counts().to_dict()
+        category_counts = categorized_data['category'].value_counts()
+        category_counts = category_counts[category_counts > 0].to_dict()
         
         # Calculate percentages
         total = len(categorized_data)
@@ -112,7 +189,7 @@ class BPCategorizer:
         Calculate trends in BP categories over time
         
         Parameters:
-        - categorized_data: DataFrame with 'date' and 'category' columns
+        - categorized_data: DataFrame with 'datetime' and 'category' columns
         - freq: Frequency for resampling ('D' for daily, 'W' for weekly, 'M' for monthly)
         
         Returns:
@@ -124,7 +201,7 @@ class BPCategorizer:
         # Create pivoted DataFrame with categories as columns
         # First create a DataFrame with 1s for each category
         category_data = pd.DataFrame({
-            'date': categorized_data['date'],
+            'date': date_column(categorized_data),
             'category': categorized_data['category'],
             'count': 1
         })
@@ -135,7 +212,8 @@ class BPCategorizer:
             columns='category', 
             values='count', 
             aggfunc='sum',
-            fill_value=0
+            fill_value=0,
+            observed=False
         )
         
         # Ensure all categories are present
@@ -146,4 +224,138 @@ class BPCategorizer:
         # Resample to desired frequency
         resampled = pivoted.resample(freq).sum()
         
-        return resampled
\ No newline at end of file
+        return resampled
+
+
+class BPCategoryResult:
+    """
+    Lightweight categorization result: int8 category codes referencing the source frame
+    """
+    
+    def __init__(self, source, codes):
+        self.source = source
+        self.codes = codes
+    
+    def __len__(self):
+        return len(self.codes)
+    
+    @property
+    def categories(self):
+        """Categorical view of the codes"""
+        return pd.Categorical.from_codes(self.codes, categories=BPCategorizer.CATEGORY_ORDER)
+    
+    @property
+    def colors(self):
+        """Per-reading colors derived from the codes"""
+        return BPCategorizer._COLOR_TABLE[self.codes]
+    
+    def counts(self):
+        """Number of readings in each category, keyed by category name"""
+        counts = np.bincount(self.codes, minlength=len(BPCategorizer.CATEGORY_ORDER))
+        return dict(zip(BPCategorizer.CATEGORY_ORDER, counts.tolist()))
+    
+    def to_frame(self, inplace=False):
+        """
+        Attach the categories to the source frame
+        
+        Parameters:
+        - inplace: Add the column to the source frame itself
+        
+        Returns:
+        DataFrame with a 'category' column. Without inplace this is a shallow copy
+        that shares all existing column data with the source.
+        """
+        categorized_data = self.source if inplace else self.source.copy(deep=False)
+        categorized_data['category'] = self.categories
+        return categorized_data
+
+
+class IncrementalBPCategorizer(BPCategorizer):
+    """
+    BP categorizer that keeps running category counts so appended readings
+    update the distribution and trends without re-categorizing the history
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.category_counts = np.zeros(len(self.CATEGORY_ORDER), dtype=np.int64)
+        self.daily_counts = {}  # calendar day -> count array per category
+    
+    def append_readings(self, bp_data):
+        """
+        Categorize a batch of new readings and fold it into the running state
+        
+        Parameters:
+        - bp_data: DataFrame with the new readings only
+        
+        Returns:
+        BPCategoryResult for the batch (None if the batch is empty)
+        """
+        result = self.categorize(bp_data)
+        if result is None:
+            return None
+        
+        self.category_counts += np.bincount(result.codes, minlength=len(self.CATEGORY_ORDER))
+        
+        # Per-day counts for the batch only
+        batch = pd.DataFrame({'date': date_column(bp_data).to_numpy(), 'code': result.codes})
+        for (day, code), count in batch.groupby(['date', 'code']).size().items():
+            if day not in self.daily_counts:
+                self.daily_counts[day] = np.zeros(len(self.CATEGORY_ORDER), dtype=np.int64)
+            self.daily_counts[day][code] += count
+        
+        return result
+    
+    def get_category_distribution(self, categorized_data=None):
+        """
+        Calculate the distribution of BP categories
+        
+        Parameters:
+        - categorized_data: Optional DataFrame with 'category' column; when omitted
+          the running counts of all appended readings are used
+        
+        Returns:
+        Dictionary with category counts and percentages
+        """
+        if categorized_data is not None:
+            return super().get_category_distribution(categorized_data)
+        
+        total = int(self.category_counts.sum())
+        if total == 0:
+            return {}
+        
+        category_counts = {
+            cat: int(count) for cat, count in zip(self.CATEGORY_ORDER, self.category_counts) if count > 0
+        }
+        
+        return {
+            'counts': category_counts,
+            'percentages': {cat: count/total*100 for cat, count in category_counts.items()}
+        }
+    
+    def get_category_trends(self, categorized_data=None, freq='W'):
+        """
+        Calculate trends in BP categories over time
+        
+        Parameters:
+        - categorized_data: Optional DataFrame with 'datetime' and 'category' columns;
+          when omitted the running per-day counts are used
+        - freq: Frequency for resampling ('D' for daily, 'W' for weekly, 'M' for monthly)
+        
+        Returns:
+        DataFrame with category counts over time
+        """
+        if categorized_data is not None:
+            return super().get_category_trends(categorized_data, freq)
+        
+        if not self.daily_counts:
+            return None
+        
+        days = sorted(self.daily_counts)
+        daily = pd.DataFrame(
+            np.vstack([self.daily_counts[day] for day in days]),
+            index=pd.DatetimeIndex(days, name='date'),
+            columns=self.CATEGORY_ORDER
+        )
+        
+        return daily.resample(freq).sum()
\ No newline at end of file
@@ -1,16 +1,200 @@
 import pandas as pd
 import numpy as np
-from datetime import timedelta
-from scipy.stats import pearsonr
+from scipy.stats import t as t_distribution
+
+from src.data_processing.schema import BP_VITAL_COLUMNS, date_column
+from .intensity import DEFAULT_SCORER
+from .correlation_matrix import EXERCISE_FEATURES, CorrelationEngine, pairwise_pearson, correlation_p_values
+from .resampling import DEFAULT_RESAMPLER
+
+NANOSECONDS_PER_DAY = 24 * 60 * 60 * 10**9
+NANOSECONDS_PER_HOUR = 60 * 60 * 10**9
+
+# Follow-up windows evaluated by the lag scan
+LAG_WINDOWS_HOURS = [6, 12, 24, 48, 72, 96, 120, 144, 168]
+
+
+def _match_exercise_windows(sorted_days, exercise_days, window):
+    """
+    Locate baseline and follow-up readings for each exercise day
+    
+    Parameters:
+    - sorted_days: Sorted int64 array of reading days (ns since epoch, midnight)
+    - exercise_days: int64 array of exercise days
+    - window: Follow-up window length in ns
+    
+    Returns:
+    Tuple of (baseline_pos, after_start, after_end) arrays. baseline_pos is the
+    most recent reading on an earlier day (-1 if none); [after_start, after_end)
+    are the readings after the exercise day, up to window later.
+    """
+    baseline_pos = np.searchsorted(sorted_days, exercise_days, side='left') - 1
+    after_start = np.searchsorted(sorted_days, exercise_days, side='right')
+    after_end = np.searchsorted(sorted_days, exercise_days + window, side='right')
+    return baseline_pos, after_start, after_end
+
+
+def _cumulative_sums(values):
+    """Prefix sums of values and of non-missing counts, both with a leading zero"""
+    present = ~np.isnan(values)
+    value_sums = np.concatenate(([0.0], np.cumsum(np.where(present, values, 0.0))))
+    value_counts = np.concatenate(([0], np.cumsum(present)))
+    return value_sums, value_counts
+
+
+def _window_average(value_sums, value_counts, start, end):
+    """Average of the non-missing values in [start, end) for each pair of bounds"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (value_sums[end] - value_sums[start]) / (value_counts[end] - value_counts[start])
+
+
+def _window_label(hours):
+    """'6h', '1d', '36h', ... for a follow-up window"""
+    if hours >= 24 and hours % 24 == 0:
+        return f"{int(hours // 24)}d"
+    return f"{hours:g}h"
+
+
+def _lag_effects(reading_times, prefix_sums, readings, exercise_start, exercise_end, intensity_score, windows_hours):
+    """
+    Exercise effect on BP for several follow-up windows
+    
+    For each exercise the baseline is the last reading before it starts and
+    the follow-up is the average of the readings within a window after it
+    ends. The sorted reading times and prefix sums are shared by all windows,
+    so each window costs one binary search per exercise plus O(exercises)
+    arithmetic.
+    
+    Parameters:
+    - reading_times: Sorted int64 reading timestamps (ns)
+    - prefix_sums: measure -> (value sums, non-missing counts) prefix arrays with a leading zero
+    - readings: measure -> reading values in the same order
+    - exercise_start, exercise_end: int64 exercise timestamps (ns)
+    - intensity_score: Intensity score of each exercise
+    - windows_hours: Follow-up window lengths in hours
+    
+    Returns:
+    DataFrame with one row per window: 'window', 'window_hours', matched
+    'exercises', and per measure the average change, its standard error,
+    and the correlation of the change with intensity score and its p-value
+    """
+    # Exercises in end-time order make every window's search run over sorted needles
+    order = np.argsort(exercise_end, kind='stable')
+    exercise_start = exercise_start[order]
+    exercise_end = exercise_end[order]
+    intensity_score = np.asarray(intensity_score, dtype=np.float64)[order]
+    
+    baseline_pos = np.searchsorted(reading_times, exercise_start, side='left') - 1
+    after_start = np.searchsorted(reading_times, exercise_end, side='right')
+    baseline = {
+        measure: np.where(baseline_pos >= 0, readings[measure][np.maximum(baseline_pos, 0)], np.nan)
+        for measure in BP_VITAL_COLUMNS
+    }
+    
+    rows = []
+    for hours in windows_hours:
+        after_end = np.searchsorted(reading_times, exercise_end + int(hours * NANOSECONDS_PER_HOUR), side='right')
+        matched = (baseline_pos >= 0) & (after_end > after_start)
+        
+        changes = np.empty((len(exercise_start), len(BP_VITAL_COLUMNS)))
+        for i, measure in enumerate(BP_VITAL_COLUMNS):
+            avg_after = _window_average(*prefix_sums[measure], after_start, after_end)
+            changes[:, i] = np.where(matched, avg_after - baseline[measure], np.nan)
+        
+        present = ~np.isnan(changes)
+        counts = present.sum(axis=0)
+        filled = np.where(present, changes, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = filled.sum(axis=0) / counts
+            variances = ((filled - means) ** 2 * present).sum(axis=0) / (counts - 1)
+            standard_errors = np.sqrt(variances / counts)
+        
+        r, n = pairwise_pearson(np.where(matched, intensity_score, np.nan)[:, None], changes)
+        p_values = correlation_p_values(r, n)
+        
+        row = {'window': _window_label(hours), 'window_hours': hours, 'exercises': int(matched.sum())}
+        for i, measure in enumerate(BP_VITAL_COLUMNS):
+            row[f'avg_{measure}_change'] = means[i]
+            row[f'{measure}_change_se'] = standard_errors[i]
+            row[f'{measure}_correlation'] = r[0, i]
+            row[f'{measure}_p_value'] = p_values[0, i]
+        rows.append(row)
+    
+    return pd.DataFrame(rows)
+
+
+def _average_changes(sums, counts):
+    """avg_<measure>_change entries from the change sums and non-missing counts of a group"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = sums / counts
+    return {f'avg_{measure}_change': averages[i] for i, measure in enumerate(BP_VITAL_COLUMNS)}
+
+
+class ExerciseImpactResult:
+    """
+    Lightweight exercise impact result: positions of matched exercises in the source
+    frame plus baseline and follow-up BP arrays
+    """
+    
+    def __init__(self, exercise_data, positions, intensity_score, baseline, avg_after):
+        self.exercise_data = exercise_data
+        self.positions = positions
+        self.intensity_score = intensity_score
+        self.baseline = baseline
+        self.avg_after = avg_after
+    
+    def __len__(self):
+        return len(self.positions)
+    
+    def change(self, measure):
+        """Average follow-up value minus baseline for 'systolic', 'diastolic' or 'pulse'"""
+        return self.avg_after[measure] - self.baseline[measure]
+    
+    def column(self, name):
+        """Values of an exercise_data column for the matched exercises"""
+        return self.exercise_data[name].to_numpy()[self.positions]
+    
+    def to_frame(self):
+        """
+        Materialize the impact table used by the dashboard
+        
+        Returns:
+        DataFrame with one row per matched exercise and its BP changes
+        """
+        impact = {
+            'exercise_date': date_column(self.exercise_data).to_numpy()[self.positions],
+            'exercise_type': self.column('exercise_type'),
+            'intensity': self.column('intensity'),
+            'duration_minutes': self.column('duration_minutes'),
+            'intensity_score': self.intensity_score
+        }
+        # Device features recorded with the exercises (calories, heart rate, steps)
+        for name in EXERCISE_FEATURES:
+            if name not in impact and name in self.exercise_data.columns:
+                impact[name] = self.column(name)
+        for measure in BP_VITAL_COLUMNS:
+            impact[f'baseline_{measure}'] = self.baseline[measure]
+        for measure in BP_VITAL_COLUMNS:
+            impact[f'avg_after_{measure}'] = self.avg_after[measure]
+        for measure in BP_VITAL_COLUMNS:
+            impact[f'{measure}_change'] = self.change(measure)
+        
+        return pd.DataFrame(impact)
 
 class CorrelationAnalyzer:
     """
     Analyzes correlations between exercise data and blood pressure readings
     """
     
-    def __init__(self):
+    def __init__(self, intensity_scorer=None, resampler=None):
         # Track correlation results
         self.results = {}
+        
+        # Scoring of exercise intensity (see src.analysis.intensity)
+        self.intensity_scorer = intensity_scorer or DEFAULT_SCORER
+        
+        # Bootstrap intervals and permutation tests (see src.analysis.resampling)
+        self.resampler = resampler or DEFAULT_RESAMPLER
     
     def analyze_exercise_bp_correlation(self, bp_data, exercise_data, time_window=3):
         """
@@ -26,90 +210,128 @@ class CorrelationAnalyzer:
         """
         if bp_data is None or exercise_data is None:
             return None
-            
+        
         if len(bp_data) == 0 or len(exercise_data) == 0:
             return None
-            
+        
         # Prepare data for correlation analysis
         exercise_impact = self._prepare_exercise_impact_data(bp_data, exercise_data, time_window)
         
         # Overall correlation between exercise and BP
         correlation_results = {}
         
-        # Calculate correlations if we have enough data points
+        # Correlate every exercise feature with every BP change in one pass;
+        # the overall results are the intensity score row of the matrix
+        correlation_matrix = None
         if len(exercise_impact) >= 5:
-            # Correlation between exercise and systolic BP
-            if 'systolic_change' in exercise_impact.columns and 'intensity_score' in exercise_impact.columns:
-                try:
-                    systolic_corr, systolic_p = pearsonr(
-                        exercise_impact['intensity_score'], 
-                        exercise_impact['systolic_change']
-                    )
-                    correlation_results['systolic'] = {
-                        'correlation': systolic_corr,
-                        'p_value': systolic_p,
-                        'significant': systolic_p < 0.05
-                    }
-                except:
-                    correlation_results['systolic'] = {
-                        'correlation': 0,
-                        'p_value': 1,
-                        'significant': False,
-                        'error': 'Calculation failed'
-                    }
-            
-            # Correlation between exercise and diastolic BP
-            if 'diastolic_change' in exercise_impact.columns and 'intensity_score' in exercise_impact.columns:
-                try:
-                    diastolic_corr, diastolic_p = pearsonr(
-                        exercise_impact['intensity_score'], 
-                        exercise_impact['diastolic_change']
-                    )
-                    correlation_results['diastolic'] = {
-                        'correlation': diastolic_corr,
-                        'p_value': diastolic_p,
-                        'significant': diastolic_p < 0.05
-                    }
-                except:
-                    correlation_results['diastolic'] = {
-                        'correlation': 0,
-                        'p_value': 1,
-                        'significant': False,
-                        'error': 'Calculation failed'
-                    }
-            
-            # Correlation between exercise and pulse
-            if 'pulse_change' in exercise_impact.columns and 'intensity_score' in exercise_impact.columns:
-                try:
-                    pulse_corr, pulse_p = pearsonr(
-                        exercise_impact['intensity_score'], 
-                        exercise_impact['pulse_change']
-                    )
-                    correlation_results['pulse'] = {
-                        'correlation': pulse_corr,
-                        'p_value': pulse_p,
-                        'significant': pulse_p < 0.05
-                    }
-                except:
-                    correlation_results['pulse'] = {
-                        'correlation': 0,
-                        'p_value': 1,
-                        'significant': False,
-                        'error': 'Calculation failed'
-                    }
+            correlation_matrix = CorrelationEngine(exercise_impact).matrix()
+            for measure in BP_VITAL_COLUMNS:
+                correlation_results[measure] = correlation_matrix.result('intensity_score', f'{measure}_change')
         
         # Exercise type specific analysis
         exercise_type_impact = self._analyze_exercise_type_impact(exercise_impact)
         
+        # Uncertainty of the overall correlations and per-type averages
+        self._add_resampled_intervals(exercise_impact, correlation_results, exercise_type_impact)
+        
         # Combine results
         self.results = {
             'overall_correlation': correlation_results,
             'exercise_type_impact': exercise_type_impact,
-            'exercise_impact_data': exercise_impact
+            'exercise_impact_data': exercise_impact,
+            'correlation_matrix': correlation_matrix,
+            'lag_effects': self.scan_lags(bp_data, exercise_data)
         }
         
         return self.results
     
+    def scan_lags(self, bp_data, exercise_data, windows_hours=None):
+        """
+        Evaluate the exercise effect on BP for many follow-up windows at once
+        
+        Unlike the day-based matching of the main analysis, windows are measured
+        from exercise timestamps, so sub-day windows (6h, 12h) are meaningful.
+        
+        Parameters:
+        - bp_data: DataFrame with BP readings
+        - exercise_data: DataFrame with exercise data
+        - windows_hours: Follow-up window lengths in hours (LAG_WINDOWS_HOURS if None)
+        
+        Returns:
+        DataFrame with the effect-vs-lag curve, one row per window (see _lag_effects)
+        """
+        if bp_data is None or exercise_data is None or len(bp_data) == 0 or len(exercise_data) == 0:
+            return None
+        
+        # Sort readings and build the prefix sums once for every window
+        bp_times = bp_data['datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        order = np.argsort(bp_times, kind='stable')
+        readings = {measure: bp_data[measure].to_numpy(dtype=float)[order] for measure in BP_VITAL_COLUMNS}
+        prefix_sums = {measure: _cumulative_sums(readings[measure]) for measure in BP_VITAL_COLUMNS}
+        
+        exercise_start = exercise_data['datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        duration = np.nan_to_num(exercise_data['duration_minutes'].to_numpy(dtype=float, na_value=np.nan))
+        exercise_end = exercise_start + (duration * 60 * 10**9).astype(np.int64)
+        
+        return _lag_effects(
+            bp_times[order], prefix_sums, readings, exercise_start, exercise_end,
+            self._intensity_score(exercise_data), windows_hours or LAG_WINDOWS_HOURS
+        )
+    
+    def compute_exercise_impact(self, bp_data, exercise_data, time_window=3):
+        """
+        Match exercise events with surrounding BP readings without copying either frame
+        
+        Parameters:
+        - bp_data: DataFrame with BP readings
+        - exercise_data: DataFrame with exercise data
+        - time_window: Days to look for BP changes after exercise
+        
+        Returns:
+        ExerciseImpactResult with impact arrays referencing exercise_data
+        """
+        intensity_score = self._intensity_score(exercise_data)
+        
+        # Sort readings by time once; their calendar days are then sorted as well
+        bp_times = bp_data['datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        order = np.argsort(bp_times, kind='stable')
+        sorted_days = bp_times[order]
+        sorted_days -= sorted_days % NANOSECONDS_PER_DAY
+        
+        exercise_days = date_column(exercise_data).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        window = int(time_window * NANOSECONDS_PER_DAY)
+        
+        baseline_pos, after_start, after_end = _match_exercise_windows(sorted_days, exercise_days, window)
+        
+        # Skip exercises without a baseline or follow-up readings
+        valid = (baseline_pos >= 0) & (after_end > after_start)
+        positions = np.flatnonzero(valid)
+        baseline_pos = baseline_pos[valid]
+        after_start = after_start[valid]
+        after_end = after_end[valid]
+        
+        baseline = {}
+        avg_after = {}
+        for measure in BP_VITAL_COLUMNS:
+            value_sums, value_counts = _cumulative_sums(bp_data[measure].to_numpy(dtype=float)[order])
+            avg_after[measure] = _window_average(value_sums, value_counts, after_start, after_end)
+            baseline[measure] = bp_data[measure].to_numpy()[order[baseline_pos]]
+        
+        return ExerciseImpactResult(exercise_data, positions, intensity_score[positions], baseline, avg_after)
+    
+    def _intensity_score(self, exercise_data):
+        """
+        Score each exercise as intensity level × duration
+        
+        Parameters:
+        - exercise_data: DataFrame with 'intensity' and 'duration_minutes' columns
+          (and the heart rate or calories columns a custom scorer reads)
+        
+        Returns:
+        Read-only float array of intensity scores
+        """
+        return self.intensity_scorer.score(exercise_data)
+    
     def _prepare_exercise_impact_data(self, bp_data, exercise_data, time_window=3):
         """
         Prepare data for correlation analysis by matching exercise events
@@ -123,75 +345,7 @@ class CorrelationAnalyzer:
         Returns:
         DataFrame with exercise events and corresponding BP changes
         """
-        # Create a copy of exercise data for our analysis
-        exercise_impact = exercise_data.copy()
-        
-        # Add intensity score based on intensity and duration
-        intensity_scores = {
-            'Low': 1,
-            'Moderate': 2,
-            'High': 3
-        }
-        
-        # Calculate intensity score as intensity level × duration
-        exercise_impact['intensity_score'] = exercise_impact.apply(
-            lambda row: intensity_scores.get(row['intensity'], 1) * row['duration_minutes'] / 30,
-            axis=1
-        )
-        
-        # For each exercise event, find BP readings before and after
-        bp_changes = []
-        
-        for _, exercise in exercise_impact.iterrows():
-            exercise_date = exercise['date']
-            
-            # Find BP readings before the exercise (baseline)
-            before_bp = bp_data[bp_data['date'] < exercise_date].sort_values('date', ascending=False)
-            
-            if len(before_bp) == 0:
-                continue  # Skip if no baseline available
-                
-            baseline_bp = before_bp.iloc[0]  # Most recent BP reading before exercise
-            
-            # Find BP readings after exercise within the time window
-            after_date = exercise_date + timedelta(days=time_window)
-            after_bp = bp_data[(bp_data['date'] > exercise_date) & (bp_data['date'] <= after_date)]
-            
-            if len(after_bp) == 0:
-                continue  # Skip if no follow-up readings
-                
-            # Get the average of BP readings after exercise
-            avg_after_systolic = after_bp['systolic'].mean()
-            avg_after_diastolic = after_bp['diastolic'].mean()
-            avg_after_pulse = after_bp['pulse'].mean()
-            
-            # Calculate changes
-            systolic_change = avg_after_systolic - baseline_bp['systolic']
-            diastolic_change = avg_after_diastolic - baseline_bp['diastolic']
-            pulse_change = avg_after_pulse - baseline_bp['pulse']
-            
-            # Add to the list
-            bp_changes.append({
-                'exercise_date': exercise_date,
-                'exercise_type': exercise['exercise_type'],
-                'intensity': exercise['intensity'],
-                'duration_minutes': exercise['duration_minutes'],
-                'intensity_score': exercise['intensity_score'],
-                'baseline_systolic': baseline_bp['systolic'],
-                'baseline_diastolic': baseline_bp['diastolic'],
-                'baseline_pulse': baseline_bp['pulse'],
-                'avg_after_systolic': avg_after_systolic,
-                'avg_after_diastolic': avg_after_diastolic,
-                'avg_after_pulse': avg_after_pulse,
-                'systolic_change': systolic_change,
-                'diastolic_change': diastolic_change,
-                'pulse_change': pulse_change
-            })
-        
-        # Convert to DataFrame
-        impact_df = pd.DataFrame(bp_changes)
-        
-        return impact_df
+        return self.compute_exercise_impact(bp_data, exercise_data, time_window).to_frame()
     
     def _analyze_exercise_type_impact(self, exercise_impact):
         """
@@ -205,55 +359,114 @@ class CorrelationAnalyzer:
         """
         if exercise_impact is None or len(exercise_impact) == 0:
             return {}
-            
+        
         # Group by exercise type
         if 'exercise_type' not in exercise_impact.columns:
             return {}
-            
-        type_results = {}
         
-        # Get unique exercise types
-        exercise_types = exercise_impact['exercise_type'].unique()
+        change_columns = [f'{measure}_change' for measure in BP_VITAL_COLUMNS]
+        
+        # Group on one integer key per (exercise type, intensity) pair; factorizing
+        # the two columns once is much cheaper than a two-column groupby
+        type_codes, exercise_types = pd.factorize(exercise_impact['exercise_type'], use_na_sentinel=False)
+        intensity_codes, intensities = pd.factorize(exercise_impact['intensity'], use_na_sentinel=False)
+        group_keys = type_codes * len(intensities) + intensity_codes
+        
+        # One aggregation pass: row count, and sum and non-missing count of each
+        # change column (averages skip missing changes)
+        grouped = exercise_impact[change_columns].groupby(group_keys, sort=False)
+        aggregated = grouped.agg(['sum', 'count'])
+        keys = aggregated.index.to_numpy()
+        group_type = keys // len(intensities)
+        group_intensity = np.asarray(intensities, dtype=object)[keys % len(intensities)]
+        group_rows = grouped.size().to_numpy()
+        group_sums = aggregated.xs('sum', axis=1, level=1).to_numpy()
+        group_counts = aggregated.xs('count', axis=1, level=1).to_numpy()
+        
+        type_results = {}
         
-        for ex_type in exercise_types:
-            # Filter for this exercise type
-            type_data = exercise_impact[exercise_impact['exercise_type'] == ex_type]
+        # Exercise types in order of first appearance (rows without a type are left out)
+        for type_code, ex_type in enumerate(exercise_types):
+            if pd.isna(ex_type):
+                continue
+            in_type = group_type == type_code
+            count = int(group_rows[in_type].sum())
             
-            if len(type_data) < 3:  # Need at least 3 data points for meaningful analysis
+            if count < 3:  # Need at least 3 data points for meaningful analysis
                 continue
-                
-            # Calculate average changes
-            avg_systolic_change = type_data['systolic_change'].mean()
-            avg_diastolic_change = type_data['diastolic_change'].mean()
-            avg_pulse_change = type_data['pulse_change'].mean()
             
             # Store results
             type_results[ex_type] = {
-                'count': len(type_data),
-                'avg_systolic_change': avg_systolic_change,
-                'avg_diastolic_change': avg_diastolic_change,
-                'avg_pulse_change': avg_pulse_change
+                'count': count,
+                **_average_changes(group_sums[in_type].sum(axis=0), group_counts[in_type].sum(axis=0))
             }
             
             # Add intensity breakdown if we have enough data
-            if len(type_data) >= 5:
+            if count >= 5:
                 intensity_breakdown = {}
                 
                 for intensity in ['Low', 'Moderate', 'High']:
-                    intensity_data = type_data[type_data['intensity'] == intensity]
+                    group = np.flatnonzero(in_type & (group_intensity == intensity))
                     
-                    if len(intensity_data) >= 2:
+                    if len(group) and group_rows[group[0]] >= 2:
                         intensity_breakdown[intensity] = {
-                            'count': len(intensity_data),
-                            'avg_systolic_change': intensity_data['systolic_change'].mean(),
-                            'avg_diastolic_change': intensity_data['diastolic_change'].mean(),
-                            'avg_pulse_change': intensity_data['pulse_change'].mean()
+                            'count': int(group_rows[group[0]]),
+                            **_average_changes(group_sums[group[0]], group_counts[group[0]])
                         }
                 
                 type_results[ex_type]['intensity_breakdown'] = intensity_breakdown
         
         return type_results
     
+    def _add_resampled_intervals(self, exercise_impact, correlation_results, type_results):
+        """
+        Add bootstrap confidence intervals and permutation p-values to the
+        overall correlations and the per-type average changes (in place)
+        
+        Overall correlations gain 'ci_lower', 'ci_upper' and
+        'permutation_p_value'; each exercise type gains 'confidence_intervals'
+        and 'p_values' keyed like its averages ('avg_systolic_change', ...).
+        Both also record the number of 'resamples' drawn, which is lower than
+        the resampler's n_resamples for large tables.
+        """
+        if exercise_impact is None or len(exercise_impact) == 0:
+            return
+        
+        change_columns = [f'{measure}_change' for measure in BP_VITAL_COLUMNS]
+        changes = exercise_impact[change_columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        
+        if correlation_results:
+            overall = self.resampler.correlations(
+                exercise_impact['intensity_score'].to_numpy(dtype=np.float64, na_value=np.nan), changes
+            )
+            for i, measure in enumerate(BP_VITAL_COLUMNS):
+                if measure in correlation_results:
+                    correlation_results[measure].update({
+                        'ci_lower': float(overall['ci_lower'][i]),
+                        'ci_upper': float(overall['ci_upper'][i]),
+                        'permutation_p_value': float(overall['p_value'][i]),
+                        'resamples': overall['resamples']
+                    })
+        
+        if type_results and 'exercise_type' in exercise_impact.columns:
+            type_codes, exercise_types = pd.factorize(exercise_impact['exercise_type'])
+            by_type = self.resampler.group_means(changes, type_codes, len(exercise_types))
+            
+            type_index = {ex_type: code for code, ex_type in enumerate(exercise_types)}
+            for ex_type, impact in type_results.items():
+                code = type_index.get(ex_type)
+                if code is None:
+                    continue
+                impact['confidence_intervals'] = {
+                    f'avg_{measure}_change': (float(by_type['ci_lower'][code, i]), float(by_type['ci_upper'][code, i]))
+                    for i, measure in enumerate(BP_VITAL_COLUMNS)
+                }
+                impact['p_values'] = {
+                    f'avg_{measure}_change': float(by_type['p_value'][code, i])
+                    for i, measure in enumerate(BP_VITAL_COLUMNS)
+                }
+                impact['resamples'] = by_type['resamples']
+    
     def get_correlation_summary(self):
         """
         Get a summary of correlation results in a format suitable for display
@@ -266,7 +479,7 @@ class CorrelationAnalyzer:
                 'status': 'No correlation analysis available',
                 'message': 'Please run the correlation analysis first.'
             }
-            
+        
         # Extract key information
         overall = self.results.get('overall_correlation', {})
         
@@ -303,7 +516,30 @@ class CorrelationAnalyzer:
             
             if abs(sys_change) > 5 or abs(dia_change) > 3:
                 direction = "decrease" if (sys_change < 0 and dia_change < 0) else "increase"
-                interpretations.append(f"{ex_type} appears to {direction} your blood pressure by an average of {abs(sys_change):.1f}/{abs(dia_change):.1f} mmHg.")
+                interpretation = f"{ex_type} appears to {direction} your blood pressure by an average of {abs(sys_change):.1f}/{abs(dia_change):.1f} mmHg"
+                
+                # Qualify the average with its bootstrap interval when one was computed
+                intervals = impact.get('confidence_intervals')
+                if intervals:
+                    sys_low, sys_high = intervals['avg_systolic_change']
+                    dia_low, dia_high = intervals['avg_diastolic_change']
+                    interpretation += (f" ({self.resampler.confidence_level:.0%} CI {sys_low:.1f} to {sys_high:.1f}"
+                                       f" / {dia_low:.1f} to {dia_high:.1f} mmHg")
+                    if sys_low <= 0 <= sys_high and dia_low <= 0 <= dia_high:
+                        interpretation += ", consistent with no change"
+                    interpretation += ")"
+                
+                interpretations.append(interpretation + ".")
+        
+        # Say so when large data got fewer resamples than configured
+        resamples = systolic.get('resamples', min(
+            (impact['resamples'] for impact in type_impact.values() if 'resamples' in impact), default=None
+        ))
+        if resamples is not None and resamples < self.resampler.n_resamples:
+            interpretations.append(
+                f"Confidence intervals are based on {resamples:,} resamples instead of "
+                f"{self.resampler.n_resamples:,} to keep the analysis of this much data fast."
+            )
         
         return {
             'status': 'Correlation analysis complete',
@@ -312,5 +548,463 @@ class CorrelationAnalyzer:
             'diastolic_correlation': diastolic_corr,
             'diastolic_significant': diastolic_sig,
             'interpretations': interpretations,
-            'exercise_types': list(type_impact.keys())
-        }
\ No newline at end of file
+            'exercise_types': list(type_impact.keys()),
+            'resamples': resamples,
+            'exercise_type_intervals': {
+                ex_type: impact.get('confidence_intervals') for ex_type, impact in type_impact.items()
+            }
+        }
+
+
+class _SortedColumns:
+    """
+    Growable column buffers kept sorted by an int64 key column
+    
+    Batches whose keys are not earlier than the current last key are appended in
+    amortized O(batch) time; out-of-order batches fall back to a full merge.
+    """
+    
+    def __init__(self, key, dtypes):
+        self.key = key
+        self._size = 0
+        self._data = {name: np.empty(16, dtype=dtype) for name, dtype in dtypes.items()}
+    
+    def __len__(self):
+        return self._size
+    
+    def column(self, name):
+        """View of the filled part of a column"""
+        return self._data[name][:self._size]
+    
+    def append(self, batch):
+        """
+        Add a batch of rows
+        
+        Parameters:
+        - batch: Dictionary mapping every column name to an array of new values
+        
+        Returns:
+        First row position whose contents changed
+        """
+        order = np.argsort(batch[self.key], kind='stable')
+        batch = {name: np.asarray(values)[order] for name, values in batch.items()}
+        batch_size = len(batch[self.key])
+        if batch_size == 0:
+            return self._size
+        
+        start = self._size
+        in_order = start == 0 or batch[self.key][0] >= self._data[self.key][start - 1]
+        
+        if in_order:
+            self._reserve(start + batch_size)
+            for name, values in batch.items():
+                self._data[name][start:start + batch_size] = values
+            self._size += batch_size
+            return start
+        
+        # Out-of-order batch: merge with the existing rows
+        start = int(np.searchsorted(self.column(self.key), batch[self.key][0], side='right'))
+        merged = {name: np.concatenate((self.column(name), batch[name])) for name in self._data}
+        merge_order = np.argsort(merged[self.key], kind='stable')
+        self._size = 0
+        self._reserve(len(merge_order))
+        for name, values in merged.items():
+            self._data[name][:len(merge_order)] = values[merge_order]
+        self._size = len(merge_order)
+        return start
+    
+    def _reserve(self, size):
+        """Grow the buffers geometrically to hold at least size rows"""
+        capacity = len(self._data[self.key])
+        if size <= capacity:
+            return
+        
+        capacity = max(size, capacity * 2)
+        for name, values in self._data.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self._size] = values[:self._size]
+            self._data[name] = grown
+
+
+class IncrementalCorrelationAnalyzer(CorrelationAnalyzer):
+    """
+    Correlation analyzer that keeps running state so appended readings and
+    exercises update the results in O(new rows + affected windows)
+    
+    State kept between batches:
+    - time-sorted readings with running prefix sums for the follow-up averages
+    - day-sorted exercises with their current baseline and follow-up values
+    - per-measure sufficient statistics (n, Σx, Σy, Σxy, Σx², Σy²) for the
+      intensity score / BP change correlations
+    - per (exercise type, intensity) row counts, and sums and non-missing
+      counts of the BP changes
+    """
+    
+    def __init__(self, time_window=3, intensity_scorer=None, resampler=None):
+        super().__init__(intensity_scorer, resampler)
+        self.time_window = time_window
+        self._window = int(time_window * NANOSECONDS_PER_DAY)
+        
+        reading_columns = {'time': np.int64, 'day': np.int64}
+        for measure in BP_VITAL_COLUMNS:
+            reading_columns[measure] = np.float64
+            reading_columns[f'{measure}_sum'] = np.float64
+            reading_columns[f'{measure}_count'] = np.int64
+        self._readings = _SortedColumns('time', reading_columns)
+        
+        exercise_columns = {
+            'day': np.int64,
+            'start': np.int64,
+            'end': np.int64,
+            'intensity_score': np.float64,
+            'duration_minutes': np.float64,
+            'exercise_type': object,
+            'intensity': object,
+            'matched': bool
+        }
+        for measure in BP_VITAL_COLUMNS:
+            exercise_columns[f'baseline_{measure}'] = np.float64
+            exercise_columns[f'avg_after_{measure}'] = np.float64
+        self._exercises = _SortedColumns('day', exercise_columns)
+        
+        # Sufficient statistics per measure: n, Σx, Σy, Σxy, Σx², Σy²
+        self._stats = {measure: np.zeros(6) for measure in BP_VITAL_COLUMNS}
+        
+        # (exercise_type, intensity) -> [rows, Σ change per measure, non-missing changes per measure]
+        self._group_sums = {}
+        
+        # Results of get_results(detailed=True), until the next batch is appended
+        self._detailed_results = None
+    
+    def append_readings(self, bp_data):
+        """
+        Add a batch of BP readings and refresh the exercises whose windows they touch
+        
+        Parameters:
+        - bp_data: DataFrame with the new readings only
+        """
+        if bp_data is None or len(bp_data) == 0:
+            return
+        self._detailed_results = None
+        
+        times = bp_data['datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        batch = {'time': times, 'day': times - times % NANOSECONDS_PER_DAY}
+        for measure in BP_VITAL_COLUMNS:
+            batch[measure] = bp_data[measure].to_numpy(dtype=float)
+            batch[f'{measure}_sum'] = np.zeros(len(times))
+            batch[f'{measure}_count'] = np.zeros(len(times), dtype=np.int64)
+        
+        start = self._readings.append(batch)
+        self._update_prefix_sums(start)
+        
+        # Exercises from time_window days before the earliest new reading onward can change
+        first_day = batch['day'].min()
+        first_exercise = int(np.searchsorted(self._exercises.column('day'), first_day - self._window, side='left'))
+        affected = np.arange(first_exercise, len(self._exercises))
+        
+        self._apply_contributions(affected, -1)
+        self._match(affected)
+        self._apply_contributions(affected, 1)
+    
+    def append_exercises(self, exercise_data):
+        """
+        Add a batch of exercises and match only those against the readings
+        
+        Parameters:
+        - exercise_data: DataFrame with the new exercises only
+        """
+        if exercise_data is None or len(exercise_data) == 0:
+            return
+        self._detailed_results = None
+        
+        size = len(exercise_data)
+        exercise_start = exercise_data['datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        duration = np.nan_to_num(exercise_data['duration_minutes'].to_numpy(dtype=float, na_value=np.nan))
+        batch = {
+            'day': date_column(exercise_data).to_numpy(dtype='datetime64[ns]').view(np.int64),
+            'start': exercise_start,
+            'end': exercise_start + (duration * 60 * 10**9).astype(np.int64),
+            'intensity_score': self._intensity_score(exercise_data),
+            'duration_minutes': exercise_data['duration_minutes'].to_numpy(dtype=float),
+            'exercise_type': exercise_data['exercise_type'].to_numpy(dtype=object),
+            'intensity': exercise_data['intensity'].to_numpy(dtype=object),
+            'matched': np.full(size, False)
+        }
+        for measure in BP_VITAL_COLUMNS:
+            batch[f'baseline_{measure}'] = np.full(size, np.nan)
+            batch[f'avg_after_{measure}'] = np.full(size, np.nan)
+        
+        previous_size = len(self._exercises)
+        start = self._exercises.append(batch)
+        
+        if start == previous_size:
+            new_rows = np.arange(previous_size, len(self._exercises))
+        else:
+            # After an out-of-order merge, re-match every row that does not contribute yet
+            new_rows = np.flatnonzero(~self._exercises.column('matched'))
+        
+        self._match(new_rows)
+        self._apply_contributions(new_rows, 1)
+    
+    def get_results(self, detailed=False):
+        """
+        Build the results dictionary from the running state
+        
+        The overall correlations and the exercise type impact come from the
+        running sums, so this is cheap to call after every batch. The impact
+        table, correlation matrix, resampled intervals and lag scan need the
+        full history; they are only built with detailed=True and are kept until
+        the next batch is appended.
+        
+        Parameters:
+        - detailed: Whether to add the results built from the full history
+        
+        Returns:
+        Dictionary with the same shape as analyze_exercise_bp_correlation;
+        without detailed, 'exercise_impact_data', 'correlation_matrix' and
+        'lag_effects' are None and no resampled intervals are added
+        """
+        if detailed and self._detailed_results is not None:
+            self.results = self._detailed_results
+            return self.results
+        
+        # Matched exercises are the rows counted in the per-group sums
+        matched = sum(group[0] for group in self._group_sums.values())
+        
+        correlation_results = {}
+        if matched >= 5:
+            for measure in BP_VITAL_COLUMNS:
+                correlation_results[measure] = _correlation_from_sums(self._stats[measure])
+        
+        exercise_type_impact = self._type_impact_from_sums()
+        
+        self.results = {
+            'overall_correlation': correlation_results,
+            'exercise_type_impact': exercise_type_impact,
+            'exercise_impact_data': None,
+            'correlation_matrix': None,
+            'lag_effects': None
+        }
+        
+        if detailed:
+            exercise_impact = self._impact_frame()
+            if correlation_results:
+                self.results['correlation_matrix'] = CorrelationEngine(exercise_impact).matrix()
+            self._add_resampled_intervals(exercise_impact, correlation_results, exercise_type_impact)
+            self.results['exercise_impact_data'] = exercise_impact
+            self.results['lag_effects'] = self.scan_running_lags()
+            self._detailed_results = self.results
+        
+        return self.results
+    
+    def scan_running_lags(self, windows_hours=None):
+        """
+        Effect-vs-lag curve (see CorrelationAnalyzer.scan_lags) from the running
+        state, reusing the sorted readings and their running sums
+        
+        Returns:
+        DataFrame with one row per window, or None without readings or exercises
+        """
+        if len(self._readings) == 0 or len(self._exercises) == 0:
+            return None
+        
+        # Running sums are inclusive; a leading zero makes them prefix sums
+        readings = {measure: self._readings.column(measure) for measure in BP_VITAL_COLUMNS}
+        prefix_sums = {
+            measure: (
+                np.concatenate(([0.0], self._readings.column(f'{measure}_sum'))),
+                np.concatenate(([0], self._readings.column(f'{measure}_count')))
+            )
+            for measure in BP_VITAL_COLUMNS
+        }
+        
+        return _lag_effects(
+            self._readings.column('time'), prefix_sums, readings,
+            self._exercises.column('start'), self._exercises.column('end'),
+            self._exercises.column('intensity_score'), windows_hours or LAG_WINDOWS_HOURS
+        )
+    
+    def _update_prefix_sums(self, start):
+        """Recompute the running sums from row start to the end"""
+        for measure in BP_VITAL_COLUMNS:
+            values = self._readings.column(measure)[start:]
+            present = ~np.isnan(values)
+            
+            previous_sum = self._readings.column(f'{measure}_sum')[start - 1] if start > 0 else 0.0
+            previous_count = self._readings.column(f'{measure}_count')[start - 1] if start > 0 else 0
+            
+            self._readings.column(f'{measure}_sum')[start:] = previous_sum + np.cumsum(np.where(present, values, 0.0))
+            self._readings.column(f'{measure}_count')[start:] = previous_count + np.cumsum(present)
+    
+    def _match(self, rows):
+        """Recompute baseline and follow-up values for the given exercise rows"""
+        if len(rows) == 0:
+            return
+        
+        if len(self._readings) == 0:
+            self._exercises.column('matched')[rows] = False
+            return
+        
+        days = self._exercises.column('day')[rows]
+        baseline_pos, after_start, after_end = _match_exercise_windows(
+            self._readings.column('day'), days, self._window
+        )
+        matched = (baseline_pos >= 0) & (after_end > after_start)
+        self._exercises.column('matched')[rows] = matched
+        
+        for measure in BP_VITAL_COLUMNS:
+            # Running sums are inclusive, so the sum over [start, end) is S[end-1] - S[start-1]
+            sums = self._readings.column(f'{measure}_sum')
+            counts = self._readings.column(f'{measure}_count')
+            end_sum = np.where(after_end > 0, sums[np.maximum(after_end - 1, 0)], 0.0)
+            start_sum = np.where(after_start > 0, sums[np.maximum(after_start - 1, 0)], 0.0)
+            end_count = np.where(after_end > 0, counts[np.maximum(after_end - 1, 0)], 0)
+            start_count = np.where(after_start > 0, counts[np.maximum(after_start - 1, 0)], 0)
+            
+            with np.errstate(invalid='ignore', divide='ignore'):
+                avg_after = (end_sum - start_sum) / (end_count - start_count)
+            baseline = np.where(baseline_pos >= 0, self._readings.column(measure)[np.maximum(baseline_pos, 0)], np.nan)
+            
+            self._exercises.column(f'avg_after_{measure}')[rows] = np.where(matched, avg_after, np.nan)
+            self._exercises.column(f'baseline_{measure}')[rows] = np.where(matched, baseline, np.nan)
+    
+    def _apply_contributions(self, rows, sign):
+        """Add (sign=1) or retract (sign=-1) the matched rows from the running statistics"""
+        if len(rows) == 0:
+            return
+        
+        rows = rows[self._exercises.column('matched')[rows]]
+        if len(rows) == 0:
+            return
+        
+        x = self._exercises.column('intensity_score')[rows]
+        changes = {}
+        for measure in BP_VITAL_COLUMNS:
+            y = self._exercises.column(f'avg_after_{measure}')[rows] - self._exercises.column(f'baseline_{measure}')[rows]
+            changes[measure] = y
+            
+            present = ~np.isnan(y)
+            xp = x[present]
+            yp = y[present]
+            self._stats[measure] += sign * np.array([
+                len(yp), xp.sum(), yp.sum(), (xp * yp).sum(), (xp * xp).sum(), (yp * yp).sum()
+            ])
+        
+        batch = pd.DataFrame({
+            'exercise_type': self._exercises.column('exercise_type')[rows],
+            'intensity': self._exercises.column('intensity')[rows],
+            **changes
+        })
+        # Same aggregation as _analyze_exercise_type_impact: rows without an
+        # intensity stay in their type's totals, and missing changes are skipped
+        grouped = batch.groupby(['exercise_type', 'intensity'], sort=False, dropna=False, observed=True)
+        aggregated = grouped[BP_VITAL_COLUMNS].agg(['sum', 'count'])
+        group_sums = aggregated.xs('sum', axis=1, level=1)[BP_VITAL_COLUMNS].to_numpy()
+        group_counts = aggregated.xs('count', axis=1, level=1)[BP_VITAL_COLUMNS].to_numpy()
+        group_rows = grouped.size().reindex(aggregated.index).to_numpy()
+        
+        for i, key in enumerate(aggregated.index):
+            # Missing labels as None, so all rows without a type or intensity share one key
+            key = tuple(None if pd.isna(label) else label for label in key)
+            group = self._group_sums.setdefault(key, np.zeros(1 + 2 * len(BP_VITAL_COLUMNS)))
+            group[0] += sign * group_rows[i]
+            group[1:] += sign * np.concatenate((group_sums[i], group_counts[i]))
+            if group[0] <= 0:
+                del self._group_sums[key]
+    
+    def _type_impact_from_sums(self):
+        """Exercise type impact in the nested dict shape of _analyze_exercise_type_impact"""
+        type_totals = {}
+        for (ex_type, intensity), group in self._group_sums.items():
+            type_totals.setdefault(ex_type, {})[intensity] = group
+        
+        measures = len(BP_VITAL_COLUMNS)
+        type_results = {}
+        for ex_type, by_intensity in type_totals.items():
+            if ex_type is None:
+                continue
+            total = sum(by_intensity.values())
+            count = int(round(total[0]))
+            
+            if count < 3:  # Need at least 3 data points for meaningful analysis
+                continue
+            
+            type_results[ex_type] = {
+                'count': count,
+                **_average_changes(total[1:1 + measures], total[1 + measures:])
+            }
+            
+            # Add intensity breakdown if we have enough data
+            if count >= 5:
+                intensity_breakdown = {}
+                
+                for intensity in ['Low', 'Moderate', 'High']:
+                    group = by_intensity.get(intensity)
+                    if group is None or group[0] < 2:
+                        continue
+                    
+                    intensity_breakdown[intensity] = {
+                        'count': int(round(group[0])),
+                        **_average_changes(group[1:1 + measures], group[1 + measures:])
+                    }
+                
+                type_results[ex_type]['intensity_breakdown'] = intensity_breakdown
+        
+        return type_results
+    
+    def _impact_frame(self):
+        """Materialize the impact table for the matched exercises"""
+        rows = np.flatnonzero(self._exercises.column('matched'))
+        
+        impact = {
+            'exercise_date': self._exercises.column('day')[rows].view('datetime64[ns]'),
+            'exercise_type': self._exercises.column('exercise_type')[rows],
+            'intensity': self._exercises.column('intensity')[rows],
+            'duration_minutes': self._exercises.column('duration_minutes')[rows],
+            'intensity_score': self._exercises.column('intensity_score')[rows]
+        }
+        for measure in BP_VITAL_COLUMNS:
+            impact[f'baseline_{measure}'] = self._exercises.column(f'baseline_{measure}')[rows]
+        for measure in BP_VITAL_COLUMNS:
+            impact[f'avg_after_{measure}'] = self._exercises.column(f'avg_after_{measure}')[rows]
+        for measure in BP_VITAL_COLUMNS:
+            impact[f'{measure}_change'] = impact[f'avg_after_{measure}'] - impact[f'baseline_{measure}']
+        
+        return pd.DataFrame(impact)
+
+
+def _correlation_from_sums(stats):
+    """
+    Pearson correlation and two-sided p-value from sufficient statistics
+    
+    Parameters:
+    - stats: Array of n, Σx, Σy, Σxy, Σx², Σy²
+    
+    Returns:
+    Dictionary in the format of the overall correlation results
+    """
+    n, sx, sy, sxy, sxx, syy = stats
+    covariance = n * sxy - sx * sy
+    variance_product = (n * sxx - sx * sx) * (n * syy - sy * sy)
+    
+    if n < 3 or variance_product <= 0:
+        return {
+            'correlation': np.nan,
+            'p_value': np.nan,
+            'significant': False
+        }
+    
+    r = float(np.clip(covariance / np.sqrt(variance_product), -1.0, 1.0))
+    degrees_of_freedom = n - 2
+    
+    if abs(r) == 1.0:
+        p_value = 0.0
+    else:
+        t_stat = r * np.sqrt(degrees_of_freedom / (1 - r * r))
+        p_value = float(2 * t_distribution.sf(abs(t_stat), degrees_of_freedom))
+    
+    return {
+        'correlation': r,
+        'p_value': p_value,
+        'significant': p_value < 0.05
+    }
\ No newline at end of file
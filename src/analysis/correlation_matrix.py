@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import t as t_distribution
+
+from src.data_processing.schema import BP_VITAL_COLUMNS
+
+# Exercise features and BP outcomes of an exercise impact table
+EXERCISE_FEATURES = ['intensity_score', 'duration_minutes', 'calories_burned', 'avg_heart_rate', 'steps']
+BP_OUTCOMES = [f'{measure}_change' for measure in BP_VITAL_COLUMNS]
+
+SIGNIFICANCE_LEVEL = 0.05
+
+
+def _centered(values):
+    """
+    Columns minus their means with missing entries set to 0, and the presence
+    mask as floats (a single column of ones when nothing is missing)
+    """
+    present = ~np.isnan(values)
+    if present.all():
+        return values - values.mean(axis=0), np.ones((len(values), 1))
+    
+    counts = present.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(present, values, 0.0).sum(axis=0) / counts
+    centered = values - np.nan_to_num(means)
+    centered[~present] = 0.0
+    return centered, present.astype(np.float64)
+
+
+def pairwise_pearson(x, y):
+    """
+    Pearson correlation of every column of x with every column of y
+    
+    Each pair uses the rows where both values are present. All pair sums come
+    from six matrix products over the (mean-centered) columns, so the data is
+    scanned once however many pairs there are.
+    
+    Parameters:
+    - x: (n, p) float array
+    - y: (n, q) float array
+    
+    Returns:
+    Tuple of (r, n) arrays of shape (p, q): correlations (NaN where undefined)
+    and the number of complete pairs
+    """
+    shape = (x.shape[1], y.shape[1])
+    x0, x_present = _centered(x)
+    y0, y_present = _centered(y)
+    
+    # Products with a column of ones are plain column sums, broadcast to all pairs
+    n = np.broadcast_to(x_present.T @ y_present, shape)
+    sx = np.broadcast_to(x0.T @ y_present, shape)
+    sy = np.broadcast_to(x_present.T @ y0, shape)
+    sxy = x0.T @ y0
+    sxx = np.broadcast_to((x0 * x0).T @ y_present, shape)
+    syy = np.broadcast_to(x_present.T @ (y0 * y0), shape)
+    
+    covariance = n * sxy - sx * sy
+    variance_product = (n * sxx - sx * sx) * (n * syy - sy * sy)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.clip(covariance / np.sqrt(variance_product), -1.0, 1.0)
+    r[(variance_product <= 0) | (n < 3)] = np.nan
+    
+    return r, n.round().astype(np.int64)
+
+
+def correlation_p_values(r, n):
+    """
+    Two-sided p-values of correlations from the t distribution with n - 2
+    degrees of freedom, evaluated for all pairs at once
+    
+    Returns:
+    Array shaped like r (NaN where r is NaN)
+    """
+    degrees_of_freedom = np.maximum(n - 2, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_stat = np.abs(r) * np.sqrt(degrees_of_freedom / (1 - r * r))
+    p_values = 2 * t_distribution.sf(t_stat, degrees_of_freedom)
+    p_values[np.abs(r) == 1.0] = 0.0
+    p_values[np.isnan(r)] = np.nan
+    return p_values
+
+
+def _rank_columns(values):
+    """Average ranks of each column's non-missing values (missing stay NaN)"""
+    ranks = np.full(values.shape, np.nan)
+    for j in range(values.shape[1]):
+        present = ~np.isnan(values[:, j])
+        ranks[present, j] = pd.Series(values[present, j]).rank(method='average').to_numpy()
+    return ranks
+
+
+class CorrelationMatrix:
+    """
+    Correlations, p-values and pair counts between exercise features (rows)
+    and BP outcomes (columns)
+    """
+    
+    def __init__(self, features, outcomes, r, n, method='pearson', lag=0):
+        self.features = list(features)
+        self.outcomes = list(outcomes)
+        self.method = method
+        self.lag = lag
+        self.correlation = pd.DataFrame(r, index=self.features, columns=self.outcomes)
+        self.p_value = pd.DataFrame(correlation_p_values(r, n), index=self.features, columns=self.outcomes)
+        self.n = pd.DataFrame(n, index=self.features, columns=self.outcomes)
+    
+    def result(self, feature, outcome):
+        """
+        One feature/outcome pair in the format of the overall correlation results
+        
+        Returns:
+        Dictionary with 'correlation', 'p_value' and 'significant'
+        """
+        r = float(self.correlation.at[feature, outcome])
+        p_value = float(self.p_value.at[feature, outcome])
+        return {
+            'correlation': r,
+            'p_value': p_value,
+            'significant': bool(p_value < SIGNIFICANCE_LEVEL)
+        }
+    
+    def to_frame(self):
+        """
+        Long-format table with one row per feature/outcome pair
+        
+        Returns:
+        DataFrame with 'feature', 'outcome', 'correlation', 'p_value', 'n',
+        'significant', 'method' and 'lag' columns
+        """
+        table = pd.DataFrame({
+            'feature': np.repeat(self.features, len(self.outcomes)),
+            'outcome': np.tile(self.outcomes, len(self.features)),
+            'correlation': self.correlation.to_numpy().ravel(),
+            'p_value': self.p_value.to_numpy().ravel(),
+            'n': self.n.to_numpy().ravel()
+        })
+        table['significant'] = table['p_value'] < SIGNIFICANCE_LEVEL
+        table['method'] = self.method
+        table['lag'] = self.lag
+        return table
+
+
+class CorrelationEngine:
+    """
+    Correlation matrices between the exercise features and BP outcomes of an
+    exercise impact table
+    
+    The feature and outcome columns are extracted once as float matrices in
+    exercise-date order. Pearson matrices come from a single vectorized pass
+    (see pairwise_pearson); Spearman ranks are computed once per engine; a
+    lagged matrix pairs each exercise's features with the outcomes of the
+    exercise `lag` events later, using offset views of the same matrices.
+    """
+    
+    def __init__(self, exercise_impact, features=None, outcomes=None):
+        self.features = [f for f in (features or EXERCISE_FEATURES) if f in exercise_impact.columns]
+        self.outcomes = [o for o in (outcomes or BP_OUTCOMES) if o in exercise_impact.columns]
+        
+        order = np.arange(len(exercise_impact))
+        if 'exercise_date' in exercise_impact.columns:
+            order = np.argsort(exercise_impact['exercise_date'].to_numpy(), kind='stable')
+        
+        self._values = {
+            'pearson': (
+                self._matrix(exercise_impact, self.features, order),
+                self._matrix(exercise_impact, self.outcomes, order)
+            )
+        }
+    
+    @staticmethod
+    def _matrix(frame, columns, order):
+        # Column-major, so each column is contiguous for the matrix products
+        matrix = np.empty((len(order), len(columns)), order='F')
+        for j, column in enumerate(columns):
+            matrix[:, j] = frame[column].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+        return matrix
+    
+    def _method_values(self, method):
+        if method not in ('pearson', 'spearman'):
+            raise Exception(f"Unsupported correlation method: {method}")
+        if method not in self._values:
+            x, y = self._values['pearson']
+            self._values[method] = (_rank_columns(x), _rank_columns(y))
+        return self._values[method]
+    
+    def matrix(self, method='pearson', lag=0):
+        """
+        Correlation matrix of all features against all outcomes
+        
+        Parameters:
+        - method: 'pearson', or 'spearman' (Pearson correlation of the ranks;
+          ranks are taken over each column's values once, so the result is
+          exact Spearman when no pairs are dropped for missing values or lag)
+        - lag: Number of exercise events between a feature and the outcome it
+          is paired with (0 pairs each exercise with its own outcome)
+        
+        Returns:
+        CorrelationMatrix
+        """
+        x, y = self._method_values(method)
+        if lag > 0:
+            x, y = x[:-lag], y[lag:]
+        elif lag < 0:
+            x, y = x[-lag:], y[:lag]
+        
+        r, n = pairwise_pearson(x, y)
+        return CorrelationMatrix(self.features, self.outcomes, r, n, method=method, lag=lag)
+    
+    def lagged(self, lags, method='pearson'):
+        """
+        Correlation matrices for several lags
+        
+        Returns:
+        Dictionary of lag -> CorrelationMatrix
+        """
+        return {lag: self.matrix(method, lag) for lag in lags}
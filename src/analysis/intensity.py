@@ -0,0 +1,166 @@
+import weakref
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+
+# Effort level of each logged intensity (unknown or missing intensities count as Low)
+INTENSITY_LEVELS = {
+    'Low': 1,
+    'Moderate': 2,
+    'High': 3
+}
+
+# Duration counted as one unit of exercise
+REFERENCE_MINUTES = 30
+
+
+class IntensityScorer(ABC):
+    """
+    Abstract base class for exercise intensity scoring
+    
+    A score is an effort level (1 = Low, 2 = Moderate, 3 = High) times the
+    duration in units of REFERENCE_MINUTES. Subclasses only define the
+    per-exercise levels, as column operations on the exercise frame.
+    
+    Scores are cached per dataset version: loaded frames are shared and
+    treated as read-only, so a frame object stands for one version of the data
+    and its scores are reused until the frame is garbage collected.
+    """
+    
+    def __init__(self, reference_minutes=REFERENCE_MINUTES):
+        self.reference_minutes = reference_minutes
+        self._cache = {}  # id(frame) -> (weak reference to the frame, scores)
+    
+    def score(self, exercise_data):
+        """
+        Score each exercise
+        
+        Parameters:
+        - exercise_data: DataFrame with 'duration_minutes' and the columns the
+          scorer reads
+        
+        Returns:
+        Read-only float array of intensity scores aligned with the rows
+        """
+        key = id(exercise_data)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0]() is exercise_data:
+            return cached[1]
+        
+        duration = exercise_data['duration_minutes'].to_numpy(dtype=np.float64, na_value=np.nan)
+        scores = self.levels(exercise_data) * duration / self.reference_minutes
+        scores.flags.writeable = False
+        
+        self._cache[key] = (weakref.ref(exercise_data, lambda _, key=key: self._cache.pop(key, None)), scores)
+        return scores
+    
+    @abstractmethod
+    def levels(self, exercise_data):
+        """
+        Effort level of each exercise
+        
+        Returns:
+        Float array aligned with the rows of exercise_data
+        """
+
+
+class CategoricalIntensityScorer(IntensityScorer):
+    """Effort level from the logged intensity category"""
+    
+    def __init__(self, levels=None, default_level=1, reference_minutes=REFERENCE_MINUTES):
+        super().__init__(reference_minutes)
+        self.intensity_levels = dict(INTENSITY_LEVELS if levels is None else levels)
+        self.default_level = default_level
+    
+    def levels(self, exercise_data):
+        intensity = exercise_data['intensity']
+        categorical = intensity.array if isinstance(intensity.dtype, pd.CategoricalDtype) else pd.Categorical(intensity)
+        
+        # One lookup per category; the extra last entry serves missing values (code -1)
+        table = np.array(
+            [self.intensity_levels.get(category, self.default_level) for category in categorical.categories]
+            + [self.default_level],
+            dtype=np.float64
+        )
+        return table[categorical.codes]
+
+
+class HeartRateIntensityScorer(IntensityScorer):
+    """
+    Effort level from the average heart rate as a fraction of heart rate reserve
+    
+    Following the usual heart rate reserve bands (light below 40%, moderate
+    40-59%, vigorous 60% and above), 20% of reserve scores as Low, 45% as
+    Moderate and 70% as High, linearly in between. Exercises without a heart
+    rate are scored by the fallback scorer.
+    """
+    
+    def __init__(self, resting_heart_rate=60, max_heart_rate=190, fallback=None,
+                 reference_minutes=REFERENCE_MINUTES):
+        super().__init__(reference_minutes)
+        self.resting_heart_rate = resting_heart_rate
+        self.max_heart_rate = max_heart_rate
+        self.fallback = fallback or CategoricalIntensityScorer()
+    
+    def levels(self, exercise_data):
+        if 'avg_heart_rate' not in exercise_data.columns:
+            return self.fallback.levels(exercise_data)
+        
+        heart_rate = exercise_data['avg_heart_rate'].to_numpy(dtype=np.float64, na_value=np.nan)
+        reserve = (heart_rate - self.resting_heart_rate) / (self.max_heart_rate - self.resting_heart_rate)
+        levels = np.clip(1 + (reserve - 0.2) / 0.25, 0, 4)
+        
+        missing = np.isnan(levels)
+        if missing.any():
+            levels[missing] = self.fallback.levels(exercise_data)[missing]
+        return levels
+
+
+class MetIntensityScorer(IntensityScorer):
+    """
+    Effort level from the metabolic equivalent (MET) implied by calories burned
+    
+    METs are estimated as kcal / (body weight in kg × hours); 3 METs (the
+    upper end of light activity) scores as Low, 6 as Moderate and 9 as High.
+    Exercises without calories or duration are scored by the fallback scorer.
+    """
+    
+    def __init__(self, body_weight_kg=70, fallback=None, reference_minutes=REFERENCE_MINUTES):
+        super().__init__(reference_minutes)
+        self.body_weight_kg = body_weight_kg
+        self.fallback = fallback or CategoricalIntensityScorer()
+    
+    def levels(self, exercise_data):
+        if 'calories_burned' not in exercise_data.columns:
+            return self.fallback.levels(exercise_data)
+        
+        calories = exercise_data['calories_burned'].to_numpy(dtype=np.float64, na_value=np.nan)
+        hours = exercise_data['duration_minutes'].to_numpy(dtype=np.float64, na_value=np.nan) / 60
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mets = calories / (self.body_weight_kg * hours)
+        levels = np.clip(mets / 3, 0, 5)
+        
+        missing = ~np.isfinite(mets) | (calories <= 0)
+        if missing.any():
+            levels[missing] = self.fallback.levels(exercise_data)[missing]
+        return levels
+
+
+class CompositeIntensityScorer(IntensityScorer):
+    """Weighted average of the effort levels of several scorers"""
+    
+    def __init__(self, scorers, weights=None, reference_minutes=REFERENCE_MINUTES):
+        super().__init__(reference_minutes)
+        self.scorers = list(scorers)
+        weights = np.ones(len(self.scorers)) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.weights = weights / weights.sum()
+    
+    def levels(self, exercise_data):
+        levels = np.zeros(len(exercise_data))
+        for scorer, weight in zip(self.scorers, self.weights):
+            levels += weight * scorer.levels(exercise_data)
+        return levels
+
+
+# Shared by analyzers that are not given a scorer, so cached scores carry across analyses
+DEFAULT_SCORER = CategoricalIntensityScorer()
@@ -0,0 +1,282 @@
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+DEFAULT_RESAMPLES = 10000
+CONFIDENCE_LEVEL = 0.95
+
+# Index draws per chunk of resamples. Every chunk has its own random stream,
+# so results for a seed are the same however the chunks are spread over workers
+CHUNK_DRAWS = 1 << 21
+
+# Below this many index draws in total, handing chunks to workers costs more
+# than it saves
+PARALLEL_MIN_DRAWS = 1 << 25
+
+# The cost grows with rows × resamples: larger samples get proportionally
+# fewer resamples (but never fewer than MIN_RESAMPLES), which keeps the cost
+# of a full run at FULL_RESAMPLE_ROWS rows; their intervals are narrow anyway
+FULL_RESAMPLE_ROWS = 5000
+MIN_RESAMPLES = 1000
+
+
+def _bootstrap_weights(rng, resamples, starts, sizes):
+    """
+    Times each row is drawn in resamples taken with replacement within each group
+    
+    Returns:
+    (resamples, n) float array of draw counts
+    """
+    rows = int(np.sum(sizes))
+    row_starts = np.repeat(starts, sizes)
+    row_sizes = np.repeat(sizes, sizes)
+    index = row_starts + (rng.random((resamples, rows)) * row_sizes).astype(np.int64)
+    index += np.arange(resamples)[:, None] * rows
+    return np.bincount(index.ravel(), minlength=resamples * rows).reshape(resamples, rows).astype(np.float64)
+
+
+def _group_columns(values, starts, sizes):
+    """
+    Values and presence of each group in separate blocks of columns, so the
+    per-group sums of any row weighting are one matrix product
+    
+    Returns:
+    Tuple of (n, groups * m) arrays (values with missing entries as 0, presence)
+    """
+    present = ~np.isnan(values)
+    groups = np.repeat(np.arange(len(sizes)), sizes)
+    blocks = np.zeros((len(values), len(sizes), values.shape[1]))
+    masks = np.zeros_like(blocks)
+    blocks[np.arange(len(values)), groups] = np.where(present, values, 0.0)
+    masks[np.arange(len(values)), groups] = present
+    return blocks.reshape(len(values), -1), masks.reshape(len(values), -1)
+
+
+def _bootstrap_group_means(rng, resamples, values, starts, sizes):
+    """Group means of resamples drawn with replacement within each group"""
+    weights = _bootstrap_weights(rng, resamples, starts, sizes)
+    blocks, masks = _group_columns(values, starts, sizes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (weights @ blocks) / (weights @ masks)
+    return means.reshape(resamples, len(sizes), values.shape[1])
+
+
+def _permuted_group_means(rng, resamples, values, starts, sizes):
+    """Group means after shuffling the rows across groups"""
+    index = rng.permuted(np.tile(np.arange(len(values)), (resamples, 1)), axis=1)
+    means = np.empty((resamples, len(sizes), values.shape[1]))
+    
+    # One column at a time, so each gather is a flat 2-D take
+    for j in range(values.shape[1]):
+        column = values[:, j]
+        present = ~np.isnan(column)
+        if present.all():
+            means[:, :, j] = np.add.reduceat(column[index], starts, axis=1) / sizes
+            continue
+        
+        counts = np.add.reduceat(present[index], starts, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[:, :, j] = np.add.reduceat(np.where(present, column, 0.0)[index], starts, axis=1) / counts
+    
+    return means
+
+
+def _correlation_from_sums(n, sx, sy, sxy, sxx, syy):
+    covariance = n * sxy - sx * sy
+    variance_product = (n * sxx - sx * sx) * (n * syy - sy * sy)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(variance_product > 0, covariance / np.sqrt(variance_product), np.nan)
+
+
+def _pair_columns(x, y):
+    """
+    Per-row terms of the correlation sums of x with each column of y, over
+    the rows where both are present
+    
+    Returns:
+    List of six (n, m) arrays: presence, x, y, x·y, x², y²
+    """
+    present = ~np.isnan(x)[:, None] & ~np.isnan(y)
+    x = np.where(present, x[:, None], 0.0)
+    y = np.where(present, y, 0.0)
+    return [present.astype(np.float64), x, y, x * y, x * x, y * y]
+
+
+def _bootstrap_correlations(rng, resamples, x, y):
+    """Correlations of resamples of (x, y) pairs drawn with replacement"""
+    weights = _bootstrap_weights(rng, resamples, np.array([0]), np.array([len(x)]))
+    sums = np.split(weights @ np.hstack(_pair_columns(x, y)), 6, axis=1)
+    return _correlation_from_sums(*sums)
+
+
+def _permuted_correlations(rng, resamples, x, y):
+    """Correlations after shuffling x against y (same null distribution as shuffling y)"""
+    index = rng.permuted(np.tile(np.arange(len(x)), (resamples, 1)), axis=1)
+    shuffled = x[index]
+    x_present = ~np.isnan(shuffled)
+    shuffled = np.where(x_present, shuffled, 0.0)
+    x_present = x_present.astype(np.float64)
+    
+    y_present = ~np.isnan(y)
+    y = np.where(y_present, y, 0.0)
+    y_present = y_present.astype(np.float64)
+    
+    return _correlation_from_sums(
+        x_present @ y_present, shuffled @ y_present, x_present @ y,
+        shuffled @ y, (shuffled * shuffled) @ y_present, x_present @ (y * y)
+    )
+
+
+def _run_chunk(statistic, resamples, seed, arrays):
+    """Evaluate a statistic on one chunk of resamples (runs in workers)"""
+    return statistic(np.random.default_rng(seed), resamples, *arrays)
+
+
+class ResamplingEngine:
+    """
+    Bootstrap confidence intervals and permutation p-values for exercise effects
+    
+    Resamples are drawn as index matrices (one row per resample) and every
+    statistic is evaluated for a whole chunk of resamples with array
+    operations. Large resample counts are split into chunks that run on a
+    thread pool (the matrix products and bincounts release the GIL), or on a
+    process pool with use_processes; each chunk's random stream is spawned
+    from the seed, so a seeded engine gives the same results serially and in
+    parallel.
+    
+    Samples larger than full_resample_rows get fewer resamples (see
+    resample_count); every result reports the number it used.
+    """
+    
+    def __init__(self, n_resamples=DEFAULT_RESAMPLES, confidence_level=CONFIDENCE_LEVEL, seed=None,
+                 max_workers=None, parallel_min_draws=PARALLEL_MIN_DRAWS, full_resample_rows=FULL_RESAMPLE_ROWS,
+                 min_resamples=MIN_RESAMPLES, use_processes=False):
+        self.n_resamples = n_resamples
+        self.confidence_level = confidence_level
+        self.seed = seed
+        self.max_workers = max_workers
+        self.parallel_min_draws = parallel_min_draws
+        self.full_resample_rows = full_resample_rows
+        self.min_resamples = min_resamples
+        self.use_processes = use_processes
+    
+    def resample_count(self, rows):
+        """
+        Number of resamples drawn for a sample of `rows` rows: n_resamples up
+        to full_resample_rows rows, then fewer in proportion to the size, down
+        to min_resamples
+        """
+        if rows <= self.full_resample_rows:
+            return self.n_resamples
+        scaled = self.n_resamples * self.full_resample_rows // rows
+        return int(min(self.n_resamples, max(self.min_resamples, scaled)))
+    
+    def _resample(self, statistic, rows, *arrays):
+        """Concatenated statistic values of resample_count(rows) resamples of `rows` rows"""
+        resamples = self.resample_count(rows)
+        chunk = int(min(resamples, max(1, CHUNK_DRAWS // max(rows, 1))))
+        sizes = [min(chunk, resamples - start) for start in range(0, resamples, chunk)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(sizes))
+        
+        if len(sizes) > 1 and resamples * rows >= self.parallel_min_draws:
+            executor = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+            with executor(max_workers=self.max_workers) as pool:
+                results = list(pool.map(
+                    _run_chunk, [statistic] * len(sizes), sizes, seeds, [arrays] * len(sizes)
+                ))
+        else:
+            results = [_run_chunk(statistic, size, seed, arrays) for size, seed in zip(sizes, seeds)]
+        
+        return np.concatenate(results)
+    
+    def _interval(self, resampled):
+        """Percentile interval over the resample axis"""
+        alpha = 1 - self.confidence_level
+        with warnings.catch_warnings():
+            # Statistics undefined in every resample (e.g. a group without values) stay NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            lower, upper = np.nanpercentile(resampled, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+        return lower, upper
+    
+    @staticmethod
+    def _p_value(observed, permuted, center):
+        """Two-sided permutation p-value of deviations from center"""
+        extreme = np.abs(permuted - center) >= np.abs(observed - center) - 1e-12
+        return np.where(np.isnan(observed), np.nan, (1 + extreme.sum(axis=0)) / (1 + len(permuted)))
+    
+    def group_means(self, values, group_codes, n_groups):
+        """
+        Means of each group with bootstrap intervals and permutation p-values
+        
+        The p-value tests whether a group's mean differs from the mean of all
+        rows more than it would if group labels were assigned at random.
+        
+        Parameters:
+        - values: (n, m) float array (missing values are skipped)
+        - group_codes: Group of each row, 0..n_groups-1 (rows with other codes are left out)
+        - n_groups: Number of groups
+        
+        Returns:
+        Dictionary of (n_groups, m) arrays 'mean', 'ci_lower', 'ci_upper' and
+        'p_value' (NaN for groups without rows), and the number of
+        'resamples' drawn
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(len(group_codes), -1)
+        group_codes = np.asarray(group_codes)
+        kept = (group_codes >= 0) & (group_codes < n_groups)
+        order = np.argsort(group_codes[kept], kind='stable')
+        values = values[kept][order]
+        codes = group_codes[kept][order]
+        
+        present_groups = np.flatnonzero(np.bincount(codes, minlength=n_groups))
+        sizes = np.bincount(codes, minlength=n_groups)[present_groups]
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        
+        result = {name: np.full((n_groups, values.shape[1]), np.nan) for name in
+                  ['mean', 'ci_lower', 'ci_upper', 'p_value']}
+        result['resamples'] = self.resample_count(len(values))
+        if len(values) == 0:
+            return result
+        
+        blocks, masks = _group_columns(values, starts, sizes)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            observed = (blocks.sum(axis=0) / masks.sum(axis=0)).reshape(len(sizes), -1)
+        lower, upper = self._interval(self._resample(_bootstrap_group_means, len(values), values, starts, sizes))
+        permuted = self._resample(_permuted_group_means, len(values), values, starts, sizes)
+        
+        present = ~np.isnan(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            center = np.where(present, values, 0.0).sum(axis=0) / present.sum(axis=0)
+        result['mean'][present_groups] = observed
+        result['ci_lower'][present_groups] = lower
+        result['ci_upper'][present_groups] = upper
+        result['p_value'][present_groups] = self._p_value(observed, permuted, center)
+        return result
+    
+    def correlations(self, x, y):
+        """
+        Correlations of x with each column of y, with bootstrap intervals and
+        permutation p-values (rows with missing values are skipped per column)
+        
+        Returns:
+        Dictionary of (m,) arrays 'correlation', 'ci_lower', 'ci_upper' and
+        'p_value', and the number of 'resamples' drawn
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64).reshape(len(x), -1)
+        
+        observed = _correlation_from_sums(*[column.sum(axis=0) for column in _pair_columns(x, y)])
+        lower, upper = self._interval(self._resample(_bootstrap_correlations, len(x), x, y))
+        permuted = self._resample(_permuted_correlations, len(x), x, y)
+        
+        return {
+            'correlation': observed,
+            'ci_lower': lower,
+            'ci_upper': upper,
+            'p_value': self._p_value(observed, permuted, 0.0),
+            'resamples': self.resample_count(len(x))
+        }
+
+
+# Seeded, so repeated analyses of the same data report the same intervals
+DEFAULT_RESAMPLER = ResamplingEngine(seed=0)
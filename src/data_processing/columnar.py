@@ -0,0 +1,315 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from .file_lock import file_lock
+
+# On-disk columnar layout for compact frames. A dataset is a directory with a
+# header.json describing the columns and one raw little-endian file per column:
+#   - numeric columns: the values in their compact dtype
+#   - 'datetime': int64 nanoseconds since the epoch (NaT as the int64 minimum)
+#   - categoricals: integer codes (-1 for missing), categories listed in the header;
+#     the codes use the narrowest integer type pandas itself would use for the
+#     category count, so they can be mapped without conversion
+# Column files are appended chunk by chunk, so a frame can be written without
+# ever being held in memory as a whole. Fixed-width columns can also be opened
+# as read-only memory maps, which makes opening a dataset O(1) whatever its size.
+
+HEADER_FILE = "header.json"
+FORMAT_VERSION = 1
+
+
+def _column_file(name):
+    return f"{name}.bin"
+
+
+class ColumnarWriter:
+    """
+    Append DataFrame chunks to a columnar dataset
+    
+    The first chunk fixes the columns; with append=True an existing dataset is
+    extended instead of replaced. Categorical (and string) columns keep
+    one growing category list, so codes written for earlier chunks stay valid.
+    A numeric column whose later chunk needs a wider dtype (e.g. an int16 column
+    that starts having missing values) is promoted in place.
+    """
+    
+    def __init__(self, path, append=False):
+        self.path = path
+        self.rows = 0
+        self._columns = None  # name -> {'kind', 'dtype', 'categories'}
+        self._category_codes = {}  # column -> {category: code}
+        
+        # Continue an existing dataset after its last row
+        if append and os.path.exists(os.path.join(path, HEADER_FILE)):
+            header = read_header(path)
+            self.rows = header['rows']
+            self._columns = {column.pop('name'): column for column in header['columns']}
+            self._category_codes = {
+                name: {category: code for code, category in enumerate(column['categories'])}
+                for name, column in self._columns.items() if column['kind'] == 'category'
+            }
+            # Drop anything an interrupted append wrote past the last complete row
+            for name, column in self._columns.items():
+                column_path = os.path.join(path, _column_file(name))
+                if os.path.exists(column_path):
+                    os.truncate(column_path, self.rows * np.dtype(column['dtype']).itemsize)
+            return
+        
+        # Start from an empty directory so stale column files never mix in
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+    
+    def append(self, chunk):
+        """
+        Append a chunk of rows
+        
+        Parameters:
+        - chunk: DataFrame with the same columns as the first chunk
+        """
+        if self._columns is None:
+            self._columns = {name: self._describe(chunk[name]) for name in chunk.columns}
+            self._category_codes = {
+                name: {} for name, column in self._columns.items() if column['kind'] == 'category'
+            }
+        elif list(chunk.columns) != list(self._columns):
+            raise Exception(f"Chunk columns {list(chunk.columns)} do not match {list(self._columns)}")
+        
+        for name, column in self._columns.items():
+            values = self._encode(name, column, chunk[name])
+            with open(os.path.join(self.path, _column_file(name)), 'ab') as f:
+                values.tofile(f)
+        
+        self.rows += len(chunk)
+        self._write_header()
+    
+    def close(self):
+        """Write the final header and return the dataset path"""
+        if self._columns is None:
+            self._columns = {}
+        self._write_header()
+        return self.path
+    
+    @staticmethod
+    def _describe(series):
+        if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object \
+                or pd.api.types.is_string_dtype(series.dtype):
+            return {'kind': 'category', 'dtype': 'int8', 'categories': []}
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            return {'kind': 'datetime', 'dtype': 'int64'}
+        if pd.api.types.is_bool_dtype(series.dtype):
+            return {'kind': 'numeric', 'dtype': 'bool'}
+        return {'kind': 'numeric', 'dtype': np.dtype(series.dtype).name}
+    
+    def _encode(self, name, column, series):
+        if column['kind'] == 'datetime':
+            values = pd.to_datetime(series)
+            if values.dt.tz is not None:
+                values = values.dt.tz_convert(None)
+            return values.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        
+        if column['kind'] == 'category':
+            codes_by_category = self._category_codes[name]
+            chunk = pd.Categorical(series)
+            
+            # Map the chunk's own categories onto the dataset's growing category list
+            mapping = np.empty(len(chunk.categories) + 1, dtype=np.int32)
+            mapping[-1] = -1
+            for i, category in enumerate(chunk.categories):
+                if category not in codes_by_category:
+                    codes_by_category[category] = len(column['categories'])
+                    column['categories'].append(category)
+                mapping[i] = codes_by_category[category]
+            
+            # Widen the codes once the category list outgrows them
+            dtype = _code_dtype(len(column['categories']))
+            if np.dtype(column['dtype']).itemsize < dtype.itemsize:
+                self._promote(name, column, dtype)
+            return mapping[chunk.codes].astype(column['dtype'])
+        
+        values = series.to_numpy()
+        dtype = np.dtype(column['dtype'])
+        if values.dtype != dtype:
+            target = np.promote_types(dtype, values.dtype)
+            if target != dtype:
+                self._promote(name, column, target)
+                dtype = target
+        return values.astype(dtype, copy=False)
+    
+    def _promote(self, name, column, dtype):
+        """Rewrite an already written column in a wider dtype"""
+        column_path = os.path.join(self.path, _column_file(name))
+        if os.path.exists(column_path):
+            # Write a new file and swap it in: readers may have the old one memory-mapped
+            written = np.fromfile(column_path, dtype=np.dtype(column['dtype']), count=self.rows).astype(dtype)
+            written.tofile(column_path + ".tmp")
+            os.replace(column_path + ".tmp", column_path)
+        column['dtype'] = np.dtype(dtype).name
+    
+    def _write_header(self):
+        header = {
+            'version': FORMAT_VERSION,
+            'rows': self.rows,
+            'columns': [dict(column, name=name) for name, column in self._columns.items()]
+        }
+        tmp_path = os.path.join(self.path, HEADER_FILE + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(header, f, default=str)
+        os.replace(tmp_path, os.path.join(self.path, HEADER_FILE))
+
+
+def _code_dtype(category_count):
+    """Integer type pandas uses for the codes of a categorical with this many categories"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if category_count < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def read_header(path):
+    """
+    Read the header of a columnar dataset
+    
+    Returns:
+    Dictionary with 'version', 'rows' and the 'columns' descriptions
+    """
+    with open(os.path.join(path, HEADER_FILE), 'r') as f:
+        return json.load(f)
+
+
+def read_columnar(path, columns=None, mmap=False):
+    """
+    Load a columnar dataset into a DataFrame
+    
+    Parameters:
+    - path: Dataset directory written by ColumnarWriter
+    - columns: Names of the columns to load (all if None)
+    - mmap: Back the columns with read-only memory maps of the column files
+      instead of reading them; pages are only loaded when rows are accessed
+      and can be dropped again by the OS under memory pressure
+    
+    Returns:
+    DataFrame in the compact schema (read-only when mmap is set)
+    """
+    header = read_header(path)
+    rows = header['rows']
+    data = {}
+    
+    for column in header['columns']:
+        name = column['name']
+        if columns is not None and name not in columns:
+            continue
+        
+        dtype = np.dtype(column['dtype'])
+        column_path = os.path.join(path, _column_file(name))
+        if mmap and rows:
+            values = np.memmap(column_path, dtype=dtype, mode='r', shape=(rows,))
+        else:
+            values = np.fromfile(column_path, dtype=dtype, count=rows)
+        
+        if column['kind'] == 'datetime':
+            data[name] = values.view('datetime64[ns]')
+        elif column['kind'] == 'category':
+            # Codes were written by ColumnarWriter, so skip the validation pass over every row
+            data[name] = pd.Categorical.from_codes(values, categories=column['categories'], validate=False)
+        else:
+            data[name] = values
+    
+    # Without copy=False the mapped columns would be copied into consolidated blocks
+    return pd.DataFrame(data, copy=not mmap)
+
+
+def write_columnar(frame, path):
+    """Write a whole DataFrame as a columnar dataset"""
+    writer = ColumnarWriter(path)
+    writer.append(frame)
+    return writer.close()
+
+
+SOURCES_FILE = "sources.json"
+
+
+def _source_signature(sources):
+    """mtime and size of each source file (None for missing files), JSON-comparable"""
+    signature = {}
+    for source in sources:
+        try:
+            stat = os.stat(source)
+            signature[source] = [stat.st_mtime, stat.st_size]
+        except OSError:
+            signature[source] = None
+    return signature
+
+
+def _is_fresh(path, signature):
+    """Whether the dataset at path was built from sources with this signature"""
+    try:
+        with open(os.path.join(path, SOURCES_FILE), 'r') as f:
+            return json.load(f) == signature
+    except (OSError, ValueError):
+        return False
+
+
+def _replace_dataset(frame, signature, path):
+    """
+    Write a dataset next to path and swap it in, so path never holds a
+    half-written dataset (callers hold the dataset's exclusive lock)
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{os.path.basename(path)}-", dir=parent)
+    write_columnar(frame, staging)
+    with open(os.path.join(staging, SOURCES_FILE), 'w') as f:
+        json.dump(signature, f)
+    
+    # A directory can only be renamed over an empty one, so move the old dataset aside first;
+    # open memory maps of its files stay valid after it is deleted
+    retired = staging + ".old"
+    if os.path.exists(path):
+        os.rename(path, retired)
+    os.replace(staging, path)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def cached_columnar(path, sources, build, mmap=True):
+    """
+    Open a columnar dataset derived from source files, rebuilding it when they change
+    
+    Readers share a lock file next to the dataset and a rebuild takes it
+    exclusively, so sessions and processes opening the same dataset never see
+    it half-written; the new dataset is built in a sibling directory and
+    swapped in.
+    
+    Parameters:
+    - path: Dataset directory
+    - sources: Paths of the files the dataset is derived from (missing files
+      are part of the signature too)
+    - build: Function returning the DataFrame to store (or None) when the
+      dataset is missing or stale
+    - mmap: Open the dataset with memory-mapped columns (see read_columnar)
+    
+    Returns:
+    DataFrame read from the dataset, or None if build returned None
+    """
+    signature = _source_signature(sources)
+    lock_path = os.path.abspath(path) + ".lock"
+    
+    with file_lock(lock_path, shared=True):
+        if _is_fresh(path, signature):
+            return read_columnar(path, mmap=mmap)
+    
+    with file_lock(lock_path):
+        # Another session may have rebuilt the dataset while this one waited for the lock
+        if not _is_fresh(path, signature):
+            data = build()
+            if data is None:
+                if os.path.exists(path):
+                    shutil.rmtree(path)
+                return None
+            _replace_dataset(data, signature, path)
+        
+        return read_columnar(path, mmap=mmap)
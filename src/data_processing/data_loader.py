@@ -1,13 +1,25 @@
 import pandas as pd
 import os
+import shutil
 from datetime import datetime
 
+from .schema import (
+    to_compact_bp, to_compact_exercise, valid_bp_rows, valid_exercise_rows, memory_report
+)
+from .device_store import DeviceDataStore, store_dir_name
+from .time_index import TimeIndexedStore
+from . import omron, google_fit
+
 class DataLoader:
     """
     General utility for loading and managing data from various sources
+    
+    Parameters:
+    - store_id: Owner of the uploaded data (a patient or session id); each
+      owner has its own device store, so uploads never mix between patients
     """
     
-    def __init__(self):
+    def __init__(self, store_id="local"):
         # Define paths
         self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
         self.synthetic_dir = os.path.join(self.data_dir, 'synthetic')
@@ -23,6 +35,32 @@ class DataLoader:
         self.exercise_data = None
         self.fhir_data = None
         
+        # Date-range index over bp_data/exercise_data, rebuilt when either frame is replaced
+        self._time_index = None
+        self._time_index_sources = (None, None)
+        
+        # Per-row memory footprint of the last loaded frames, before and after compaction
+        self.memory_reports = {}
+        
+        # Deduplicated store of everything this owner uploaded so far, and what the last upload added
+        self.store_id = store_id
+        self.device_store = DeviceDataStore(os.path.join(self.user_data_dir, 'store', store_dir_name(store_id)))
+        self.last_ingest = {}
+    
+    def _read_bp_csv(self, path):
+        """Read a blood pressure CSV into the compact schema"""
+        raw_data = pd.read_csv(path)
+        bp_data = to_compact_bp(raw_data)
+        self.memory_reports['bp'] = memory_report(raw_data, bp_data)
+        return bp_data
+    
+    def _read_exercise_csv(self, path):
+        """Read an exercise CSV into the compact schema"""
+        raw_data = pd.read_csv(path)
+        exercise_data = to_compact_exercise(raw_data)
+        self.memory_reports['exercise'] = memory_report(raw_data, exercise_data)
+        return exercise_data
+        
     def load_synthetic_data(self):
         """Load synthetic data for demonstration"""
         bp_path = os.path.join(self.synthetic_dir, 'omron_data.csv')
@@ -33,64 +71,153 @@ class DataLoader:
             from synthetic_data_generator import main as generate_data
             generate_data()
         
-        # Load the data
-        self.bp_data = pd.read_csv(bp_path)
-        self.exercise_data = pd.read_csv(exercise_path)
-        
-        # Convert date columns
-        self.bp_data['date'] = pd.to_datetime(self.bp_data['date'])
-        self.exercise_data['date'] = pd.to_datetime(self.exercise_data['date'])
-        
-        # Create datetime columns by combining date and time
-        self.bp_data['datetime'] = pd.to_datetime(
-            self.bp_data['date'].dt.strftime('%Y-%m-%d') + ' ' + self.bp_data['time']
-        )
-        self.exercise_data['datetime'] = pd.to_datetime(
-            self.exercise_data['date'].dt.strftime('%Y-%m-%d') + ' ' + self.exercise_data['time']
-        )
+        # Load the data in the compact schema
+        self.bp_data = self._read_bp_csv(bp_path)
+        self.exercise_data = self._read_exercise_csv(exercise_path)
         
         return self.bp_data, self.exercise_data
     
-    def load_user_data(self, bp_file=None, exercise_file=None):
+    def load_user_data(self, bp_file=None, exercise_file=None, progress_callback=None, chunk_rows=100000):
         """
         Load user-provided data files
         
+        Uploads are parsed straight from their in-memory buffer in chunks of
+        chunk_rows rows; each chunk is converted to the compact schema, stripped
+        of invalid rows and merged into the owner's device store on its own, so
+        memory use is bounded by the chunk size rather than the file size. A
+        file uploaded before is skipped without being parsed, and only readings
+        not already stored are added.
+        
+        The returned frames hold everything this owner uploaded so far, as
+        read-only memory maps of the store; the rows each file added are kept
+        in last_ingest for incremental analysis.
+        
         Parameters:
         - bp_file: File object for blood pressure data
         - exercise_file: File object for exercise data
+        - progress_callback: Optional function called as (fraction, message)
+          while the files are parsed
+        - chunk_rows: Number of CSV rows parsed at a time
         
         Returns:
         Tuple of (bp_data, exercise_data) DataFrames
         """
-        # Save uploaded files
+        self.last_ingest = {}
+        
         if bp_file is not None:
-            bp_path = os.path.join(self.user_data_dir, 'omron_data.csv')
-            with open(bp_path, 'wb') as f:
-                f.write(bp_file.getbuffer())
-            self.bp_data = pd.read_csv(bp_path)
-            self.bp_data['date'] = pd.to_datetime(self.bp_data['date'])
-            self.bp_data['datetime'] = pd.to_datetime(
-                self.bp_data['date'].dt.strftime('%Y-%m-%d') + ' ' + self.bp_data['time']
+            self.last_ingest['bp'] = self.device_store.ingest(
+                bp_file, 'bp',
+                lambda source: self._ingest(
+                    source, 'bp', omron, omron.to_compact, valid_bp_rows,
+                    progress_callback, chunk_rows, label="blood pressure"
+                )
             )
         
         if exercise_file is not None:
-            exercise_path = os.path.join(self.user_data_dir, 'google_fit.csv')
-            with open(exercise_path, 'wb') as f:
-                f.write(exercise_file.getbuffer())
-            self.exercise_data = pd.read_csv(exercise_path)
-            self.exercise_data['date'] = pd.to_datetime(self.exercise_data['date'])
-            self.exercise_data['datetime'] = pd.to_datetime(
-                self.exercise_data['date'].dt.strftime('%Y-%m-%d') + ' ' + self.exercise_data['time']
+            self.last_ingest['exercise'] = self.device_store.ingest(
+                exercise_file, 'exercise',
+                lambda source: self._ingest(
+                    source, 'exercise', google_fit, to_compact_exercise, valid_exercise_rows,
+                    progress_callback, chunk_rows, label="exercise"
+                )
             )
         
+        for kind, result in self.last_ingest.items():
+            if result.skipped:
+                print(f"Skipped {kind} file already uploaded")
+            elif result.duplicate_rows:
+                print(f"Skipped {result.duplicate_rows} {kind} rows already uploaded")
+        
+        self.bp_data = self.device_store.load('bp')
+        self.exercise_data = self.device_store.load('exercise')
+        
         return self.bp_data, self.exercise_data
     
+    def discard_uploads(self):
+        """Delete this owner's device store"""
+        shutil.rmtree(self.device_store.store_dir, ignore_errors=True)
+        self.last_ingest = {}
+    
+    def _ingest(self, source, kind, parser, to_compact, valid_rows, progress_callback=None,
+                chunk_rows=100000, label=None):
+        """
+        Stream an upload as compact chunks
+        
+        The export layout is detected from the first bytes of the file, and
+        the matching parser yields chunks in the internal layout. Each chunk is
+        converted to the compact schema and stripped of invalid rows; the
+        device store deduplicates and writes them one at a time, so the upload
+        is never held in memory as a whole.
+        
+        Parameters:
+        - source: Uploaded file (any binary file object, e.g. Streamlit's
+          UploadedFile) or a path
+        - kind: 'bp' or 'exercise'
+        - parser: Module providing detect_schema and read_chunks (omron or google_fit)
+        - to_compact: Compact schema conversion for one chunk
+        - valid_rows: Row validation for one compact chunk
+        - progress_callback: Optional function called as (fraction, message)
+        - chunk_rows: Number of CSV rows parsed at a time
+        - label: Name of the data in progress messages
+        
+        Yields:
+        Compact DataFrame chunks of the valid rows
+        """
+        label = label or kind
+        raw_rows = 0
+        raw_bytes_per_row = 0
+        compact_rows = 0
+        compact_bytes = 0
+        rejected = 0
+        
+        handle = open(source, 'rb') if isinstance(source, str) else source
+        try:
+            handle.seek(0, os.SEEK_END)
+            total_bytes = max(handle.tell(), 1)
+            handle.seek(0)
+            schema = parser.detect_schema(handle.read(4096))
+            if schema is None:
+                raise Exception(f"Unrecognised {label} file format")
+            handle.seek(0)
+            
+            for raw_chunk in parser.read_chunks(handle, schema, chunk_rows):
+                compact = to_compact(raw_chunk, errors='coerce')
+                valid = valid_rows(compact)
+                rejected += int(len(valid) - valid.sum())
+                # Deep memory accounting of string columns is slow, so size the first chunk and extrapolate
+                if raw_rows == 0 and len(raw_chunk):
+                    raw_bytes_per_row = raw_chunk.memory_usage(deep=True).sum() / len(raw_chunk)
+                raw_rows += len(raw_chunk)
+                
+                # Re-compact so vitals that were only float because of rejected rows become integers again
+                if not valid.all():
+                    compact = to_compact(compact[valid].reset_index(drop=True))
+                compact_rows += len(compact)
+                compact_bytes += int(compact.memory_usage(deep=True).sum())
+                yield compact
+                
+                if progress_callback is not None:
+                    progress_callback(
+                        min(handle.tell() / total_bytes, 1.0),
+                        f"Loaded {compact_rows:,} {label} rows"
+                    )
+        finally:
+            if handle is not source:
+                handle.close()
+        
+        report = memory_report(raw_rows * raw_bytes_per_row, compact_bytes, rows=compact_rows)
+        report['rejected_rows'] = rejected
+        self.memory_reports[kind] = report
+        
+        if rejected:
+            print(f"Skipped {rejected} invalid {label} rows")
+    
     def get_date_range(self):
         """Get the overall date range covered by the data"""
-        bp_min = self.bp_data['date'].min() if self.bp_data is not None else None
-        bp_max = self.bp_data['date'].max() if self.bp_data is not None else None
-        ex_min = self.exercise_data['date'].min() if self.exercise_data is not None else None
-        ex_max = self.exercise_data['date'].max() if self.exercise_data is not None else None
+        bp_min = self.bp_data['datetime'].min() if self.bp_data is not None else None
+        bp_max = self.bp_data['datetime'].max() if self.bp_data is not None else None
+        ex_min = self.exercise_data['datetime'].min() if self.exercise_data is not None else None
+        ex_max = self.exercise_data['datetime'].max() if self.exercise_data is not None else None
         
         # Combine date ranges
         all_dates = [d for d in [bp_min, bp_max, ex_min, ex_max] if d is not None]
@@ -99,22 +226,23 @@ class DataLoader:
         
         return min(all_dates).date(), max(all_dates).date()
     
+    @property
+    def time_index(self):
+        """TimeIndexedStore over the current bp_data and exercise_data"""
+        sources = (self.bp_data, self.exercise_data)
+        if self._time_index is None or any(old is not new for old, new in zip(self._time_index_sources, sources)):
+            self._time_index = TimeIndexedStore(*sources)
+            self._time_index_sources = sources
+        return self._time_index
+    
     def filter_by_date_range(self, start_date, end_date):
-        """Filter data to a specific date range"""
-        if self.bp_data is not None:
-            self.filtered_bp_data = self.bp_data[
-                (self.bp_data['date'] >= pd.Timestamp(start_date)) & 
-                (self.bp_data['date'] <= pd.Timestamp(end_date))
-            ]
-        else:
-            self.filtered_bp_data = None
-            
-        if self.exercise_data is not None:
-            self.filtered_exercise_data = self.exercise_data[
-                (self.exercise_data['date'] >= pd.Timestamp(start_date)) & 
-                (self.exercise_data['date'] <= pd.Timestamp(end_date))
-            ]
-        else:
-            self.filtered_exercise_data = None
-            
+        """
+        Filter data to a specific date range (both days included)
+        
+        Returns:
+        Tuple of (bp_data, exercise_data) slices of the time-sorted frames
+        """
+        self.filtered_bp_data = self.time_index.slice('bp', start_date, end_date)
+        self.filtered_exercise_data = self.time_index.slice('exercise', start_date, end_date)
+        
         return self.filtered_bp_data, self.filtered_exercise_data
\ No newline at end of file
@@ -0,0 +1,360 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from .columnar import ColumnarWriter, read_columnar, read_header
+from .file_lock import file_lock
+
+# Columns identifying a reading or a workout; two rows with the same values
+# are the same measurement, whichever file they came from
+ROW_KEY_COLUMNS = {
+    'bp': ['datetime', 'systolic', 'diastolic', 'pulse'],
+    'exercise': ['datetime', 'exercise_type', 'duration_minutes']
+}
+
+HASH_BLOCK_SIZE = 1 << 20
+
+# Rows written at a time when merging staged rows into a stored dataset
+MERGE_CHUNK_ROWS = 100000
+
+
+def content_hash(source):
+    """
+    SHA-256 of a file's contents
+    
+    Parameters:
+    - source: Path, or a binary file object (in-memory uploads are hashed
+      straight from their buffer)
+    
+    Returns:
+    Hex digest
+    """
+    digest = hashlib.sha256()
+    
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    if hasattr(source, 'getbuffer'):
+        with source.getbuffer() as buffer:
+            digest.update(buffer)
+        return digest.hexdigest()
+    
+    position = source.tell()
+    source.seek(0)
+    for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b''):
+        digest.update(block)
+    source.seek(position)
+    return digest.hexdigest()
+
+
+def _contains(sorted_keys, keys):
+    """Which of keys are in the sorted key array (one binary search per key)"""
+    positions = np.searchsorted(sorted_keys, keys)
+    found = positions < len(sorted_keys)
+    found[found] = sorted_keys[positions[found]] == keys[found]
+    return found
+
+
+def store_dir_name(owner):
+    """
+    Directory name of the store of one owner (a patient or session id)
+    
+    Characters that are not safe in a path are replaced, and a hash of the
+    full id is appended so two owners never end up sharing a directory.
+    """
+    safe = re.sub(r'[^A-Za-z0-9_-]', '_', str(owner))[:64]
+    return f"{safe}-{hashlib.sha256(str(owner).encode('utf-8')).hexdigest()[:16]}"
+
+
+def row_keys(data, kind):
+    """
+    64-bit key per row from its timestamp and device values
+    
+    Parameters:
+    - data: Compact BP or exercise DataFrame
+    - kind: 'bp' or 'exercise'
+    
+    Returns:
+    uint64 array, one key per row
+    """
+    key_data = {}
+    for column in ROW_KEY_COLUMNS[kind]:
+        if column not in data.columns:
+            continue
+        values = data[column]
+        if column == 'datetime':
+            key_data[column] = values.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        elif pd.api.types.is_numeric_dtype(values.dtype):
+            # Same value whether stored as int16 or float32
+            key_data[column] = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            key_data[column] = values.astype(object).to_numpy()
+    
+    return pd.util.hash_pandas_object(pd.DataFrame(key_data), index=False).to_numpy()
+
+
+class IngestResult:
+    """Outcome of ingesting one file into a DeviceDataStore"""
+    
+    def __init__(self, kind, file_hash, skipped=False, new_rows=None, duplicate_rows=0):
+        self.kind = kind
+        self.file_hash = file_hash
+        self.skipped = skipped
+        self.new_rows = new_rows
+        self.duplicate_rows = duplicate_rows
+    
+    @property
+    def added(self):
+        return 0 if self.new_rows is None else len(self.new_rows)
+    
+    @property
+    def new_range(self):
+        """(first, last) timestamp of the added rows, or None if nothing was added"""
+        if not self.added:
+            return None
+        return self.new_rows['datetime'].min(), self.new_rows['datetime'].max()
+
+
+class DeviceDataStore:
+    """
+    Deduplicated store of uploaded device data
+    
+    Every ingested file is identified by the SHA-256 of its contents, and files
+    already seen are skipped without being parsed. Rows are identified by a
+    64-bit key over their timestamp and device values; the store keeps the keys
+    sorted so each upload is merged with one searchsorted pass, and only rows
+    with unseen keys are added. Data is kept per kind ('bp', 'exercise') as a
+    time-sorted columnar dataset under store_dir.
+    
+    A store holds the data of one patient or session, so each owner gets its
+    own store_dir (see store_dir_name). Several store objects, in one process
+    or several, may open the same directory: changes are made under an
+    exclusive lock file and the manifest is re-read under it.
+    """
+    
+    MANIFEST_FILE = "manifest.json"
+    LOCK_FILE = ".lock"
+    
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock_path = os.path.join(store_dir, self.LOCK_FILE)
+        self._manifest_path = os.path.join(store_dir, self.MANIFEST_FILE)
+        self._manifest = self._load_manifest()
+    
+    def has_file(self, file_hash):
+        return file_hash in self._manifest['files']
+    
+    def ingest(self, source, kind, parse, name=None):
+        """
+        Add the new rows of a file to the store
+        
+        Parameters:
+        - source: Path or binary file object
+        - kind: 'bp' or 'exercise'
+        - parse: Function turning the source into compact DataFrame chunks
+          (an iterable of frames, or one frame); only called when the file
+          has not been seen before
+        - name: File name recorded in the manifest
+        
+        Returns:
+        IngestResult with the rows that were added
+        """
+        file_hash = content_hash(source)
+        
+        with file_lock(self._lock_path):
+            # Another session may have ingested files since this store was opened
+            self._manifest = self._load_manifest()
+            if self.has_file(file_hash):
+                return IngestResult(kind, file_hash, skipped=True)
+            
+            new_rows, duplicates = self._merge(parse(source), kind)
+            
+            self._manifest['files'][file_hash] = {
+                'kind': kind,
+                'name': name or getattr(source, 'name', source if isinstance(source, str) else None),
+                'rows': len(new_rows) + duplicates,
+                'added': len(new_rows),
+                'ingested_at': datetime.now().isoformat()
+            }
+            self._save_manifest()
+        
+        return IngestResult(kind, file_hash, new_rows=new_rows, duplicate_rows=duplicates)
+    
+    def merge(self, data, kind):
+        """
+        Merge compact rows into the store, skipping rows already present
+        
+        Parameters:
+        - data: Compact BP or exercise DataFrame, or an iterable of such chunks
+        - kind: 'bp' or 'exercise'
+        
+        Returns:
+        Tuple of (memory-mapped DataFrame of the added rows in input order,
+        number of duplicate rows)
+        """
+        with file_lock(self._lock_path):
+            return self._merge(data, kind)
+    
+    def _merge(self, chunks, kind):
+        """
+        merge, with the store lock already held
+        
+        Each chunk is deduplicated against the stored keys and the keys added
+        by earlier chunks, and its new rows are appended to a staging dataset,
+        so only one chunk is in memory at a time. The staged rows are then
+        added to the stored dataset and returned memory-mapped.
+        """
+        if isinstance(chunks, pd.DataFrame):
+            chunks = [chunks]
+        
+        stored_keys = self._load_keys(kind)
+        staging_path = self._staging_path(kind)
+        writer = ColumnarWriter(staging_path)
+        added_keys = np.zeros(0, dtype=np.uint64)  # sorted
+        rows = 0
+        
+        for chunk in chunks:
+            rows += len(chunk)
+            keys = row_keys(chunk, kind)
+            
+            # Unique keys of the chunk, first occurrence kept
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            first = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]] if len(keys) else np.zeros(0, dtype=bool)
+            unique_keys = sorted_keys[first]
+            unique_rows = order[first]
+            
+            # Sorted-key merge against the store and this upload so far: one binary search per unique key
+            new = ~(_contains(stored_keys, unique_keys) | _contains(added_keys, unique_keys))
+            if not new.any():
+                continue
+            
+            writer.append(chunk.iloc[np.sort(unique_rows[new])])
+            added_keys = np.insert(added_keys, np.searchsorted(added_keys, unique_keys[new]), unique_keys[new])
+        
+        writer.close()
+        if len(added_keys) == 0:
+            return read_columnar(staging_path), rows
+        
+        self._append_staged(staging_path, kind)
+        self._save_keys(kind, np.insert(stored_keys, np.searchsorted(stored_keys, added_keys), added_keys))
+        
+        return read_columnar(staging_path, mmap=True), rows - len(added_keys)
+    
+    def load(self, kind):
+        """
+        All stored rows of a kind, sorted by time
+        
+        Returns:
+        Compact DataFrame backed by read-only memory maps, or None if nothing
+        was stored yet
+        """
+        with file_lock(self._lock_path, shared=True):
+            return self._load(kind)
+    
+    def _load(self, kind):
+        path = self._data_path(kind)
+        if not os.path.exists(os.path.join(path, "header.json")):
+            return None
+        return read_columnar(path, mmap=True)
+    
+    def row_count(self, kind):
+        path = self._data_path(kind)
+        if not os.path.exists(os.path.join(path, "header.json")):
+            return 0
+        return read_header(path)['rows']
+    
+    def _append_staged(self, staging_path, kind):
+        """
+        Add the staged rows to the time-sorted dataset chunk by chunk,
+        appending in place when they are all newer than the stored rows
+        """
+        path = self._data_path(kind)
+        stored = self._load(kind)
+        staged = read_columnar(staging_path, mmap=True)
+        staged_order = np.argsort(staged['datetime'].to_numpy().view(np.int64), kind='stable')
+        
+        if stored is None or stored.empty:
+            self._write_sorted(ColumnarWriter(path), [staged], staged_order)
+            return
+        
+        staged = staged.reindex(columns=stored.columns)
+        stored_times = stored['datetime'].to_numpy().view(np.int64)
+        staged_times = staged['datetime'].to_numpy().view(np.int64)
+        
+        if staged_times[staged_order[0]] >= stored_times[-1]:
+            self._write_sorted(ColumnarWriter(path, append=True), [staged], staged_order)
+            return
+        
+        # Interleaved rows: merge the two sorted runs into a new dataset (stored rows
+        # first on equal times) and swap it in
+        order = np.argsort(np.concatenate((stored_times, staged_times)), kind='stable')
+        rewrite_path = path + ".rewrite"
+        self._write_sorted(ColumnarWriter(rewrite_path), [stored, staged], order)
+        retired_path = path + ".old"
+        shutil.rmtree(retired_path, ignore_errors=True)
+        os.rename(path, retired_path)
+        os.replace(rewrite_path, path)
+        # Memory maps of the old dataset stay valid after its files are deleted
+        shutil.rmtree(retired_path, ignore_errors=True)
+    
+    @staticmethod
+    def _write_sorted(writer, frames, order):
+        """
+        Write the rows of frames (numbered consecutively across the frames)
+        in the given order, MERGE_CHUNK_ROWS at a time
+        """
+        offsets = np.cumsum([0] + [len(frame) for frame in frames])
+        for start in range(0, len(order), MERGE_CHUNK_ROWS):
+            rows = order[start:start + MERGE_CHUNK_ROWS]
+            source = np.searchsorted(offsets, rows, side='right') - 1
+            parts = [frames[i].iloc[rows[source == i] - offsets[i]] for i in range(len(frames))]
+            chunk = pd.concat([part for part in parts if len(part)], ignore_index=True)
+            # Concatenation groups the rows by frame; put them back in merge order
+            chunk = chunk.iloc[np.argsort(np.argsort(source, kind='stable'), kind='stable')]
+            writer.append(chunk.reset_index(drop=True))
+        writer.close()
+    
+    def _data_path(self, kind):
+        return os.path.join(self.store_dir, kind)
+    
+    def _staging_path(self, kind):
+        return os.path.join(self.store_dir, f"{kind}_staging")
+    
+    def _keys_path(self, kind):
+        return os.path.join(self.store_dir, f"{kind}_keys.bin")
+    
+    def _load_keys(self, kind):
+        path = self._keys_path(kind)
+        if not os.path.exists(path):
+            return np.zeros(0, dtype=np.uint64)
+        return np.fromfile(path, dtype=np.uint64)
+    
+    def _save_keys(self, kind, keys):
+        tmp_path = self._keys_path(kind) + ".tmp"
+        keys.astype(np.uint64).tofile(tmp_path)
+        os.replace(tmp_path, self._keys_path(kind))
+    
+    def _load_manifest(self):
+        if os.path.exists(self._manifest_path):
+            try:
+                with open(self._manifest_path, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+        return {'files': {}}
+    
+    def _save_manifest(self):
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self._manifest_path)
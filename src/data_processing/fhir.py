@@ -1,208 +1,326 @@
 import requests
 import json
 import os
-import pandas as pd
-from datetime import datetime
+import threading
+
+from .schema import merge_bp_frames
+from .fhir_cache import FHIRHTTPCache
+from .omron import parse_omron_csv
+from .google_fit import parse_google_fit
+from .columnar import cached_columnar
+from .loinc import VITALS, lookup_vital, normalize_value
+from .patient_index import PatientIndex, patient_name, save_patient_info
+from .fhir_extract import PatientRecordBuilder, VitalsSeries, build_patient_records, build_patient_data
+
 
 class FHIRIntegration:
     """
     Class to integrate with FHIR server and local patient data
     """
     
-    def __init__(self, base_url="https://hapi.fhir.org/baseR4", data_dir="data/patient_data"):
+    def __init__(self, base_url="https://hapi.fhir.org/baseR4", data_dir="data/patient_data", use_cache=True, cache_ttls=None):
         self.base_url = base_url
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
+        
+        # HTTP cache of raw FHIR responses, revalidated with ETag/Last-Modified
+        self.cache = None
+        if use_cache:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(data_dir)), "fhir_cache")
+            self.cache = FHIRHTTPCache(cache_dir, ttls=cache_ttls)
+        
+        # Name index over the saved patients, built on first search. The lock lets
+        # the async client save and search from worker threads.
+        self._patient_index = None
+        self._index_lock = threading.RLock()
+    
+    # Resources returned alongside each Patient in a consolidated search. Observations
+    # are searched separately so only vital signs are paged in, not the labs, social
+    # history and surveys a _revinclude would also bring back.
+    REVINCLUDES = ["Condition:patient", "MedicationRequest:patient"]
+    
+    def _get_json(self, url, resource_type=None):
+        """
+        GET a FHIR URL, through the HTTP cache when enabled
+        
+        Returns:
+        Tuple of (status_code, body); body is None unless the status is 200
+        """
+        if self.cache is not None:
+            return self.cache.get_json(url, resource_type=resource_type)
+        
+        resp = requests.get(url)
+        if resp.status_code != 200:
+            return resp.status_code, None
+        return resp.status_code, resp.json()
     
-    def fetch_patient(self, patient_id):
-        """Fetch a patient's complete data from FHIR server."""
-        patient_data = {}
+    def _get_bundle_resources(self, url, resource_type=None):
+        """
+        Collect the resources of a search Bundle, following 'next' links across pages
+        
+        Returns:
+        Tuple of (status_code of the first page, list of resources)
+        """
+        resources = []
+        first_status = None
+        
+        while url:
+            status, bundle = self._get_json(url, resource_type=resource_type)
+            if first_status is None:
+                first_status = status
+            if status != 200:
+                break
+            
+            for entry in bundle.get("entry", []):
+                resources.append(entry.get("resource", {}))
+            
+            # Move on to the next page, if any
+            url = None
+            for link in bundle.get("link", []):
+                if link.get("relation") == "next":
+                    url = link.get("url")
+                    break
         
-        # First try to load from local cache if available
+        return first_status, resources
+    
+    def load_local_patient(self, patient_id):
+        """Load a saved patient_info.json, or None if missing or unreadable"""
         local_path = os.path.join(self.data_dir, patient_id, "patient_info.json")
         if os.path.exists(local_path):
             try:
                 with open(local_path, 'r') as f:
                     return json.load(f)
             except:
-                pass  # If loading fails, proceed with fetching from server
+                pass
+        return None
+    
+    def save_patient(self, patient_id, patient_data):
+        """Save patient data to data_dir/<patient_id>/patient_info.json and keep the name index current"""
+        save_patient_info(self.data_dir, patient_id, patient_data)
+        
+        with self._index_lock:
+            if self._patient_index is not None:
+                self._patient_index.add(patient_id, patient_name(patient_data))
+    
+    @property
+    def patient_index(self):
+        """Local PatientIndex over data_dir, loaded on first use"""
+        with self._index_lock:
+            if self._patient_index is None:
+                self._patient_index = PatientIndex(self.data_dir)
+            return self._patient_index
+    
+    def search_local_patient(self, patient_name):
+        """
+        Look up a patient by exact full name in the locally saved patients only
+        
+        Returns:
+        Dictionary with patient basic information, or None unless exactly one
+        saved patient has that name
+        """
+        with self._index_lock:
+            return self.patient_index.find(patient_name)
+    
+    def fetch_patient(self, patient_id, consolidated=True):
+        """
+        Fetch a patient's complete data from FHIR server.
+        
+        With the HTTP cache enabled, responses are revalidated against the server
+        so updated conditions and medications are picked up; the saved
+        patient_info.json is only used when the server cannot be reached.
+        Without the cache, a saved patient_info.json is returned as-is.
+        
+        Parameters:
+        - patient_id: FHIR Patient id
+        - consolidated: Fetch the Patient with its conditions and medications in
+          one _revinclude search and its vital signs in a second one, instead
+          of four requests
+        """
+        # Without the HTTP cache, load from the local copy if available
+        if self.cache is None:
+            local_patient = self.load_local_patient(patient_id)
+            if local_patient is not None:
+                return local_patient
         
-        # 1. Get patient demographics
-        patient_url = f"{self.base_url}/Patient/{patient_id}"
         try:
-            resp = requests.get(patient_url)
-            if resp.status_code != 200:
-                print(f"Error fetching patient {patient_id}: {resp.status_code}")
-                return None
-            
-            patient_json = resp.json()
-            
-            # Extract name
-            name = patient_json.get("name", [{}])[0]
-            given_name = name.get("given", ["Unknown"])[0]
-            family_name = name.get("family", "Unknown")
-            full_name = f"{given_name} {family_name}"
-            
-            # Extract gender and birth date
-            gender = patient_json.get("gender", "unknown")
-            birth_date = patient_json.get("birthDate", "Unknown")
-            
-            # Calculate age
-            try:
-                birth_year = int(birth_date.split("-")[0])
-                current_year = datetime.now().year
-                age = current_year - birth_year
-            except:
-                age = "Unknown"
-            
-            patient_data["demographics"] = {
-                "id": patient_id,
-                "name": full_name,
-                "gender": gender,
-                "birth_date": birth_date,
-                "age": age
-            }
-            
-            # 2. Get conditions
-            conditions_url = f"{self.base_url}/Condition?patient={patient_id}&_count=100"
-            resp = requests.get(conditions_url)
-            conditions = []
-            
-            if resp.status_code == 200:
-                bundle = resp.json()
-                if "entry" in bundle:
-                    for entry in bundle["entry"]:
-                        resource = entry.get("resource", {})
-                        coding = resource.get("code", {}).get("coding", [{}])[0]
-                        display = coding.get("display", "Unknown Condition")
-                        conditions.append(display)
-            
-            patient_data["conditions"] = conditions
-            
-            # 3. Get medications
-            meds_url = f"{self.base_url}/MedicationRequest?patient={patient_id}&_count=100"
-            resp = requests.get(meds_url)
-            medications = []
-            
-            if resp.status_code == 200:
-                bundle = resp.json()
-                if "entry" in bundle:
-                    for entry in bundle["entry"]:
-                        resource = entry.get("resource", {})
-                        med_concept = resource.get("medicationCodeableConcept", {})
-                        if "text" in med_concept:
-                            medications.append(med_concept["text"])
-                        elif "coding" in med_concept and med_concept["coding"]:
-                            medications.append(med_concept["coding"][0].get("display", "Unknown Medication"))
-            
-            patient_data["medications"] = medications
-            
-            # 4. Get vital signs
-            vitals_url = f"{self.base_url}/Observation?patient={patient_id}&category=vital-signs&_count=100"
-            resp = requests.get(vitals_url)
-            vitals = {}
-            
-            if resp.status_code == 200:
-                bundle = resp.json()
-                if "entry" in bundle:
-                    for entry in bundle["entry"]:
-                        resource = entry.get("resource", {})
-                        
-                        # Get observation code
-                        code_coding = resource.get("code", {}).get("coding", [{}])[0]
-                        code = code_coding.get("code", "")
-                        display = code_coding.get("display", "Unknown Vital")
-                        
-                        # Get observation value
-                        value_quantity = resource.get("valueQuantity", {})
-                        value = value_quantity.get("value", "")
-                        unit = value_quantity.get("unit", "")
-                        
-                        if code and value:
-                            vitals[display] = {
-                                "value": value,
-                                "unit": unit
-                            }
-            
-            patient_data["vitals"] = vitals
-            
-            # Determine BP category based on vitals
-            systolic = vitals.get("Systolic BP", {}).get("value", 120)
-            diastolic = vitals.get("Diastolic BP", {}).get("value", 80)
-            
-            if isinstance(systolic, str):
-                try:
-                    systolic = float(systolic)
-                except:
-                    systolic = 120
-            
-            if isinstance(diastolic, str):
-                try:
-                    diastolic = float(diastolic)
-                except:
-                    diastolic = 80
-            
-            if systolic >= 140 or diastolic >= 90:
-                bp_category = "Hypertension Stage 2" if (systolic >= 160 or diastolic >= 100) else "Hypertension Stage 1"
-            elif systolic >= 130 or diastolic >= 80:
-                bp_category = "Hypertension Stage 1"
-            elif systolic >= 120:
-                bp_category = "Elevated"
+            if consolidated:
+                # 1. Get the patient, its conditions, medications and vital signs in two searches
+                records = self._fetch_patient_group([patient_id])
+                if patient_id not in records:
+                    print(f"Error fetching patient {patient_id}: not found")
+                    return self.load_local_patient(patient_id)
+                
+                record = records[patient_id]
             else:
-                bp_category = "Normal"
-            
-            patient_data["bp_category"] = bp_category
-            patient_data["has_hypertension"] = "Hypertension" in conditions or "hypertension" in ' '.join(conditions).lower()
-            
-            # Create directory for this patient
-            patient_dir = os.path.join(self.data_dir, patient_id)
-            os.makedirs(patient_dir, exist_ok=True)
+                # 1. Get patient demographics
+                patient_url = f"{self.base_url}/Patient/{patient_id}"
+                status, patient_json = self._get_json(patient_url)
+                if status != 200:
+                    print(f"Error fetching patient {patient_id}: {status}")
+                    return self.load_local_patient(patient_id)
+                
+                # 2-4. Get conditions, medications and vital signs
+                record = PatientRecordBuilder(patient_id, patient_json)
+                searches = [
+                    f"{self.base_url}/Condition?patient={patient_id}&_count=100",
+                    f"{self.base_url}/MedicationRequest?patient={patient_id}&_count=100",
+                    f"{self.base_url}/Observation?patient={patient_id}&category=vital-signs&_count=100"
+                ]
+                for url in searches:
+                    status, bundle = self._get_json(url)
+                    if status == 200:
+                        for entry in bundle.get("entry", []):
+                            record.add(entry.get("resource", {}))
             
-            # Save patient data to JSON
-            with open(local_path, "w") as f:
-                json.dump(patient_data, f, indent=2)
+            patient_data = record.build()
+            self.save_patient(patient_id, patient_data)
             
             return patient_data
             
         except Exception as e:
             print(f"Error fetching patient data: {str(e)}")
-            return None
+            # Fall back to the last saved copy when the server is unavailable
+            return self.load_local_patient(patient_id)
+    
+    def fetch_patients(self, patient_ids, batch_size=20):
+        """
+        Fetch several patients with consolidated _revinclude searches
+        
+        Parameters:
+        - patient_ids: List of FHIR Patient ids
+        - batch_size: Number of patients requested per search
+        
+        Returns:
+        Dictionary mapping patient id to patient data (patients not found are omitted)
+        """
+        patients = {}
+        
+        for start in range(0, len(patient_ids), batch_size):
+            batch = patient_ids[start:start + batch_size]
+            
+            try:
+                # Vitals of the whole batch are converted to arrays in one pass
+                batch_data = build_patient_data(self._fetch_patient_group(batch))
+            except Exception as e:
+                print(f"Error fetching patients: {str(e)}")
+                batch_data = {}
+            
+            for patient_id in batch:
+                if patient_id in batch_data:
+                    patient_data = batch_data[patient_id]
+                    self.save_patient(patient_id, patient_data)
+                    patients[patient_id] = patient_data
+                else:
+                    # Fall back to the last saved copy
+                    local_patient = self.load_local_patient(patient_id)
+                    if local_patient is not None:
+                        patients[patient_id] = local_patient
+        
+        return patients
+    
+    def group_search_urls(self, patient_ids):
+        """
+        Searches that fetch a group of patients with their conditions, medications and vital signs
+        
+        Returns:
+        List of (search URL, resource type for the cache TTL) tuples
+        """
+        ids = ",".join(patient_ids)
+        revincludes = "".join(f"&_revinclude={revinclude}" for revinclude in self.REVINCLUDES)
+        return [
+            # The result carries conditions and medications, so cache it with the Bundle TTL
+            (f"{self.base_url}/Patient?_id={ids}{revincludes}&_count=100", "Bundle"),
+            (f"{self.base_url}/Observation?patient={ids}&category=vital-signs&_count=100", "Observation")
+        ]
+    
+    def _fetch_patient_group(self, patient_ids):
+        """
+        Run the Patient?_id=...&_revinclude=... and vital-sign Observation searches and demultiplex the result
+        
+        Returns:
+        Dictionary mapping patient id to PatientRecordBuilder
+        """
+        resources = []
+        for search_url, resource_type in self.group_search_urls(patient_ids):
+            status, found = self._get_bundle_resources(search_url, resource_type=resource_type)
+            if status != 200:
+                raise Exception(f"search returned {status}")
+            resources.extend(found)
+        
+        return build_patient_records(resources, patient_ids)
     
-    def load_device_data(self, patient_id):
-        """Load Omron and Google Fit data for a patient from local directory."""
+    def load_device_data(self, patient_id, include_fhir_vitals=True, mmap=True):
+        """
+        Load Omron and Google Fit data for a patient from local directory.
+        
+        With include_fhir_vitals, blood pressure Observations saved in the
+        patient's patient_info.json are merged into the Omron readings; a
+        reading present in both (same minute) is kept once, from the device.
+        
+        The parsed frames are kept as fixed-width columnar datasets in the
+        patient's 'columnar' folder and only rebuilt when the source files
+        change. With mmap the frames are backed by read-only memory maps of
+        those datasets, so opening a long history is O(1) and only the pages
+        an analysis touches are read.
+        """
         patient_dir = os.path.join(self.data_dir, patient_id)
+        columnar_dir = os.path.join(patient_dir, "columnar")
         
-        # Load Omron data
+        # Load Omron data (merged with FHIR Observations when requested)
         omron_path = os.path.join(patient_dir, "omron", "omron_data.csv")
+        bp_sources = [omron_path]
+        if include_fhir_vitals:
+            bp_sources.append(os.path.join(patient_dir, "patient_info.json"))
+        bp_data = cached_columnar(
+            os.path.join(columnar_dir, "bp" if include_fhir_vitals else "bp_device"),
+            bp_sources,
+            lambda: self._build_bp_data(patient_id, omron_path, include_fhir_vitals),
+            mmap=mmap
+        )
+        
+        # Load Google Fit data
+        fit_path = os.path.join(patient_dir, "google_fit", "google_fit.csv")
+        exercise_data = cached_columnar(
+            os.path.join(columnar_dir, "exercise"),
+            [fit_path],
+            lambda: self._build_exercise_data(fit_path),
+            mmap=mmap
+        )
+        
+        return bp_data, exercise_data    
+    
+    def _build_bp_data(self, patient_id, omron_path, include_fhir_vitals):
+        """Parse a patient's Omron export and merge in the FHIR BP Observations"""
         bp_data = None
         if os.path.exists(omron_path):
             try:
-                bp_data = pd.read_csv(omron_path)
-                # Convert date columns
-                bp_data['date'] = pd.to_datetime(bp_data['date'])
-                # Create datetime column by combining date and time
-                bp_data['datetime'] = pd.to_datetime(
-                    bp_data['date'].dt.strftime('%Y-%m-%d') + ' ' + bp_data['time']
-                )
+                # Detects the export layout and converts to the compact schema
+                bp_data = parse_omron_csv(omron_path)
             except Exception as e:
                 print(f"Error loading Omron data: {str(e)}")
         
-        # Load Google Fit data
-        fit_path = os.path.join(patient_dir, "google_fit", "google_fit.csv")
-        exercise_data = None
-        if os.path.exists(fit_path):
-            try:
-                exercise_data = pd.read_csv(fit_path)
-                # Convert date columns
-                exercise_data['date'] = pd.to_datetime(exercise_data['date'])
-                # Create datetime column by combining date and time
-                exercise_data['datetime'] = pd.to_datetime(
-                    exercise_data['date'].dt.strftime('%Y-%m-%d') + ' ' + exercise_data['time']
-                )
-            except Exception as e:
-                print(f"Error loading Google Fit data: {str(e)}")
+        # Merge in BP readings from FHIR Observations
+        if include_fhir_vitals:
+            patient_data = self.load_local_patient(patient_id)
+            if patient_data and patient_data.get("vitals_series"):
+                try:
+                    fhir_bp = VitalsSeries.from_dict(patient_data["vitals_series"]).to_bp_frame()
+                    bp_data = merge_bp_frames(bp_data, fhir_bp)
+                except Exception as e:
+                    print(f"Error loading FHIR BP observations: {str(e)}")
         
-        return bp_data, exercise_data    
+        return bp_data
+    
+    def _build_exercise_data(self, fit_path):
+        """Parse a patient's Google Fit export"""
+        if not os.path.exists(fit_path):
+            return None
+        try:
+            # Detects the export layout and converts to the compact schema
+            return parse_google_fit(fit_path)
+        except Exception as e:
+            print(f"Error loading Google Fit data: {str(e)}")
+            return None
     
     def prepare_fhir_data_for_llm(self, patient_data):
         """
@@ -217,18 +335,6 @@ class FHIRIntegration:
         if not patient_data:
             return None
         
-        # LOINC codes mapping
-        loinc_codes = {
-            "8867-4": "Heart rate",
-            "8480-6": "Systolic BP",
-            "8462-4": "Diastolic BP",
-            "8310-5": "Body temperature",
-            "9279-1": "Respiratory rate",
-            "8302-2": "Height",
-            "29463-7": "Weight",
-            "39156-5": "BMI"
-        }
-        
         # Prepare LLM-friendly data
         llm_fhir_data = {
             "patient_info": {
@@ -243,36 +349,43 @@ class FHIRIntegration:
             "allergies": patient_data.get("allergy_ids", [])
         }
         
-        # Process vital signs using LOINC codes
+        # Resolve each vital (keyed by LOINC code or any display synonym) to its canonical name
         vitals = patient_data.get("vitals", {})
-        for code, display_name in loinc_codes.items():
-            # Try to find the vital sign using LOINC code or display name
-            value = None
+        found = {}
+        for key, value in vitals.items():
+            definition = lookup_vital(key)
+            if definition is not None and definition.code not in found:
+                found[definition.code] = value
+        
+        # Add vital signs in canonical order
+        for code, definition in VITALS.items():
+            if code not in found:
+                continue
             
-            # First, try direct matching
-            if code in vitals:
-                value = vitals[code]
-            elif display_name in vitals:
-                value = vitals[display_name]
+            value = found[code]
             
-            # If value found, add to vital signs
-            if value is not None:
-                # Handle different value formats
-                if isinstance(value, dict):
-                    # If it's a dictionary with 'value' and 'unit'
-                    if "value" in value and "unit" in value:
-                        llm_fhir_data["vital_signs"][display_name] = f"{value['value']} {value['unit']}"
-                    else:
-                        llm_fhir_data["vital_signs"][display_name] = str(value)
+            # Handle different value formats
+            if isinstance(value, dict):
+                # If it's a dictionary with 'value' and 'unit'
+                if "value" in value and "unit" in value:
+                    _, amount, unit = normalize_value(code, value["value"], value["unit"])
+                    llm_fhir_data["vital_signs"][definition.name] = f"{amount} {unit}"
                 else:
-                    # If it's a simple value
-                    llm_fhir_data["vital_signs"][display_name] = str(value)
+                    llm_fhir_data["vital_signs"][definition.name] = str(value)
+            else:
+                # If it's a simple value
+                llm_fhir_data["vital_signs"][definition.name] = str(value)
         
         return llm_fhir_data
     
     def search_patient_by_name(self, patient_name):
         """
-        Search for a patient by full name in the FHIR server
+        Search for a patient by full name, locally first and then in the FHIR server
+        
+        The server is skipped only when exactly one saved patient has this
+        exact name in the local name index. A prefix or fuzzy local match could
+        be a different patient who exists only on the server, so those go to
+        the server search; PatientIndex.search ranks them for a picker.
         
         Parameters:
         - patient_name: Full name of the patient (first_name last_name)
@@ -280,6 +393,10 @@ class FHIRIntegration:
         Returns:
         Dictionary with patient basic information or None if not found
         """
+        local_patient = self.search_local_patient(patient_name)
+        if local_patient is not None:
+            return local_patient
+        
         search_url = f"{self.base_url}/Patient?name={patient_name}"
         
         try:
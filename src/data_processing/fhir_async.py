@@ -0,0 +1,255 @@
+import os
+import asyncio
+import threading
+import aiohttp
+from urllib.parse import urlparse
+
+from .fhir import FHIRIntegration
+from .fhir_extract import build_patient_records
+from .fhir_cache import FHIRHTTPCache
+
+
+class AsyncFHIRIntegration:
+    """
+    asyncio counterpart of FHIRIntegration
+    
+    All requests share one aiohttp connection pool, and the number of requests
+    in flight to each FHIR server is bounded by a semaphore, so many dashboard
+    users can fetch patients concurrently without opening a connection each.
+    Responses go through the same on-disk HTTP cache as FHIRIntegration.
+    """
+    
+    def __init__(self, base_url="https://hapi.fhir.org/baseR4", data_dir="data/patient_data",
+                 max_concurrency=10, use_cache=True, cache_ttls=None, timeout=30):
+        self.base_url = base_url
+        self.data_dir = data_dir
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        os.makedirs(data_dir, exist_ok=True)
+        
+        # Local file handling and LLM formatting are shared with the sync client;
+        # its file I/O is run in worker threads
+        self._sync = FHIRIntegration(base_url, data_dir, use_cache=False)
+        
+        self.cache = None
+        if use_cache:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(data_dir)), "fhir_cache")
+            self.cache = FHIRHTTPCache(cache_dir, ttls=cache_ttls)
+        
+        self._session = None
+        self._semaphores = {}  # server netloc -> asyncio.Semaphore
+    
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            # The limit applies per server, so a slow server cannot hold up requests to the others
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+    
+    def _semaphore(self, url):
+        server = urlparse(url).netloc
+        if server not in self._semaphores:
+            self._semaphores[server] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[server]
+    
+    async def _get_json(self, url, resource_type=None):
+        """
+        GET a FHIR URL, through the HTTP cache when enabled
+        
+        Returns:
+        Tuple of (status_code, body); body is None unless the status is 200
+        """
+        entry = None
+        headers = {'Accept': 'application/fhir+json'}
+        if self.cache is not None:
+            # Cache entries are files on disk, so read and write them off the event loop
+            entry, fresh = await asyncio.to_thread(self.cache.lookup, url, resource_type)
+            if fresh:
+                return 200, entry['body']
+            headers = self.cache.request_headers(entry)
+        
+        session = await self._get_session()
+        try:
+            async with self._semaphore(url):
+                async with session.get(url, headers=headers) as resp:
+                    status = resp.status
+                    response_headers = resp.headers
+                    body = await resp.json(content_type=None) if status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Server unreachable: serve the stale copy if we have one
+            if entry is not None:
+                return 200, entry['body']
+            raise
+        
+        if self.cache is not None:
+            return await asyncio.to_thread(self.cache.record_response, url, entry, status, response_headers, body)
+        
+        return status, body
+    
+    async def _get_bundle_resources(self, url, resource_type=None):
+        """
+        Collect the resources of a search Bundle, following 'next' links across pages
+        
+        Returns:
+        Tuple of (status_code of the first page, list of resources)
+        """
+        resources = []
+        first_status = None
+        
+        while url:
+            status, bundle = await self._get_json(url, resource_type=resource_type)
+            if first_status is None:
+                first_status = status
+            if status != 200:
+                break
+            
+            for entry in bundle.get("entry", []):
+                resources.append(entry.get("resource", {}))
+            
+            url = None
+            for link in bundle.get("link", []):
+                if link.get("relation") == "next":
+                    url = link.get("url")
+                    break
+        
+        return first_status, resources
+    
+    async def fetch_patient(self, patient_id):
+        """
+        Fetch a patient's complete data with a consolidated _revinclude search and a vital-sign search
+        
+        Returns:
+        Patient data in the patient_info.json structure, or None if not found
+        """
+        # Without the HTTP cache, load from the local copy if available
+        if self.cache is None:
+            local_patient = await asyncio.to_thread(self._sync.load_local_patient, patient_id)
+            if local_patient is not None:
+                return local_patient
+        
+        try:
+            # The patient search and the vital-sign search run concurrently
+            searches = await asyncio.gather(*(
+                self._get_bundle_resources(search_url, resource_type=resource_type)
+                for search_url, resource_type in self._sync.group_search_urls([patient_id])
+            ))
+            resources = []
+            for status, found in searches:
+                if status != 200:
+                    print(f"Error fetching patient {patient_id}: {status}")
+                    return await asyncio.to_thread(self._sync.load_local_patient, patient_id)
+                resources.extend(found)
+            
+            records = build_patient_records(resources, [patient_id])
+            if patient_id not in records:
+                print(f"Error fetching patient {patient_id}: not found")
+                return await asyncio.to_thread(self._sync.load_local_patient, patient_id)
+            
+            patient_data = records[patient_id].build()
+            await asyncio.to_thread(self._sync.save_patient, patient_id, patient_data)
+            
+            return patient_data
+        
+        except Exception as e:
+            print(f"Error fetching patient data: {str(e)}")
+            # Fall back to the last saved copy when the server is unavailable
+            return await asyncio.to_thread(self._sync.load_local_patient, patient_id)
+    
+    async def fetch_patients(self, patient_ids):
+        """
+        Fetch several patients concurrently
+        
+        Returns:
+        Dictionary mapping patient id to patient data (patients not found are omitted)
+        """
+        results = await asyncio.gather(*(self.fetch_patient(patient_id) for patient_id in patient_ids))
+        return {patient_id: data for patient_id, data in zip(patient_ids, results) if data is not None}
+    
+    async def search_patient_by_name(self, patient_name):
+        """
+        Search for a patient by full name, locally first and then in the FHIR server
+        
+        Returns:
+        Dictionary with patient basic information or None if not found
+        """
+        # The first search builds the name index from disk, so run it off the event loop
+        local_patient = await asyncio.to_thread(self._sync.search_local_patient, patient_name)
+        if local_patient is not None:
+            return local_patient
+        
+        search_url = f"{self.base_url}/Patient?name={patient_name}"
+        
+        try:
+            status, bundle = await self._get_json(search_url)
+            
+            if status == 200 and bundle.get("total", 0) > 0:
+                # Return the first matching patient
+                first_patient = bundle["entry"][0]["resource"]
+                return {
+                    "id": first_patient.get("id"),
+                    "name": f"{first_patient.get('name', [{}])[0].get('given', [''])[0]} {first_patient.get('name', [{}])[0].get('family', '')}"
+                }
+            
+            return None
+        
+        except Exception as e:
+            print(f"Error searching for patient: {str(e)}")
+            return None
+    
+    async def load_device_data(self, patient_id):
+        """Load Omron and Google Fit data for a patient without blocking the event loop"""
+        return await asyncio.to_thread(self._sync.load_device_data, patient_id)
+    
+    def prepare_fhir_data_for_llm(self, patient_data):
+        """Format FHIR data for the LLM recommendation prompt (no I/O, so not async)"""
+        return self._sync.prepare_fhir_data_for_llm(patient_data)
+    
+    async def close(self):
+        """Close the shared connection pool"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class FHIRClient:
+    """
+    Synchronous facade over AsyncFHIRIntegration for Streamlit
+    
+    The async client runs on one event loop in a background thread, so every
+    Streamlit session calling into this facade shares the same connection pool
+    and concurrency limit. Methods block until their result is ready.
+    """
+    
+    def __init__(self, base_url="https://hapi.fhir.org/baseR4", data_dir="data/patient_data",
+                 max_concurrency=10, **kwargs):
+        self.client = AsyncFHIRIntegration(base_url, data_dir, max_concurrency=max_concurrency, **kwargs)
+        
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+    
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+    
+    def fetch_patient(self, patient_id):
+        return self._run(self.client.fetch_patient(patient_id))
+    
+    def fetch_patients(self, patient_ids):
+        return self._run(self.client.fetch_patients(patient_ids))
+    
+    def search_patient_by_name(self, patient_name):
+        return self._run(self.client.search_patient_by_name(patient_name))
+    
+    def load_device_data(self, patient_id):
+        return self._run(self.client.load_device_data(patient_id))
+    
+    def prepare_fhir_data_for_llm(self, patient_data):
+        return self.client.prepare_fhir_data_for_llm(patient_data)
+    
+    def close(self):
+        """Close the connection pool and stop the background event loop"""
+        self._run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
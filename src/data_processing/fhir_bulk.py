@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import tempfile
+import requests
+
+from .fhir_extract import referenced_patient_id
+from .fhir_store import build_from_store, load_store, merge_resource, save_store, stored_patients
+from .patient_index import save_patient_info
+
+
+class FHIRBulkExporter:
+    """
+    Ingest a patient cohort through the FHIR Bulk Data $export flow
+    
+    The export is kicked off asynchronously, its status URL is polled until the
+    server publishes the manifest, and each NDJSON output file is streamed line by
+    line into the same patient_info.json structure that
+    FHIRIntegration.fetch_patient produces. Resources are regrouped by patient
+    on disk, so only one patient is held in memory at a time.
+    
+    Each patient's resources are also kept in data_dir/<patient_id>/fhir_resources.json
+    (the store FHIRSync uses), so a later _since export only has to carry the
+    resources that changed.
+    """
+    
+    # Resource types needed to build patient_info.json, in processing order
+    EXPORT_TYPES = ["Patient", "Condition", "MedicationRequest", "Observation"]
+    
+    def __init__(self, base_url="https://hapi.fhir.org/baseR4", data_dir="data/patient_data",
+                 session=None, poll_interval=5, max_wait=3600, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.data_dir = data_dir
+        self.session = session or requests.Session()
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.timeout = timeout
+        os.makedirs(data_dir, exist_ok=True)
+    
+    def kick_off(self, group_id=None, since=None):
+        """
+        Start a bulk export
+        
+        Parameters:
+        - group_id: Export only the members of this Group (all patients if None)
+        - since: Only include resources updated after this FHIR instant
+        
+        Returns:
+        Status URL to poll
+        """
+        if group_id:
+            export_url = f"{self.base_url}/Group/{group_id}/$export"
+        else:
+            export_url = f"{self.base_url}/Patient/$export"
+        
+        params = {'_type': ','.join(self.EXPORT_TYPES)}
+        if since:
+            params['_since'] = since
+        
+        resp = self.session.get(
+            export_url,
+            params=params,
+            headers={'Accept': 'application/fhir+json', 'Prefer': 'respond-async'},
+            timeout=self.timeout
+        )
+        
+        if resp.status_code != 202 or 'Content-Location' not in resp.headers:
+            raise Exception(f"Bulk export kick-off failed: {resp.status_code}")
+        
+        return resp.headers['Content-Location']
+    
+    def wait_for_manifest(self, status_url):
+        """
+        Poll an export status URL until the export completes
+        
+        Parameters:
+        - status_url: URL returned by kick_off
+        
+        Returns:
+        Completion manifest with the 'output' file list
+        """
+        started = time.time()
+        
+        while True:
+            resp = self.session.get(status_url, headers={'Accept': 'application/json'}, timeout=self.timeout)
+            
+            if resp.status_code == 200:
+                return resp.json()
+            
+            if resp.status_code != 202:
+                raise Exception(f"Bulk export failed: {resp.status_code}")
+            
+            if time.time() - started > self.max_wait:
+                raise Exception("Bulk export did not complete in time")
+            
+            # Honour the server's Retry-After hint when it gives one in seconds
+            retry_after = resp.headers.get('Retry-After', '')
+            delay = int(retry_after) if retry_after.isdigit() else self.poll_interval
+            time.sleep(delay)
+    
+    def iter_resources(self, file_url):
+        """
+        Stream the resources of one NDJSON output file
+        
+        Parameters:
+        - file_url: URL of the file, from the manifest
+        
+        Yields:
+        One resource dictionary per line
+        """
+        with self.session.get(file_url, headers={'Accept': 'application/fhir+ndjson'},
+                              stream=True, timeout=self.timeout) as resp:
+            if resp.status_code != 200:
+                raise Exception(f"Error downloading {file_url}: {resp.status_code}")
+            
+            for line in resp.iter_lines():
+                if line:
+                    yield json.loads(line)
+    
+    def ingest_manifest(self, manifest, incremental=False):
+        """
+        Build and save patient_info.json for every patient in a completed export
+        
+        The NDJSON files are first regrouped by patient into spill files in a
+        temporary directory. Each patient is then built, written out and released
+        before the next one is read, so memory does not grow with the cohort.
+        
+        A full export replaces each exported patient's stored resources. An
+        incremental (_since) export only holds what changed, so its resources are
+        merged by id into the stored ones, and changed conditions and observations
+        are picked up for stored patients whose Patient resource is not in the
+        export. Deletions are not part of a _since export; FHIRSync applies them.
+        
+        Parameters:
+        - manifest: Completion manifest from wait_for_manifest
+        - incremental: The export was limited with _since
+        
+        Returns:
+        List of the ingested patient ids
+        """
+        outputs = manifest.get('output', [])
+        patient_ids = []
+        known = set()
+        stored = stored_patients(self.data_dir) if incremental else set()
+        
+        with tempfile.TemporaryDirectory(prefix="fhir_bulk_") as spill_dir:
+            # Patients first, so resources of patients outside the export are skipped
+            for resource_type in self.EXPORT_TYPES:
+                for output in outputs:
+                    if output.get('type') != resource_type:
+                        continue
+                    
+                    for resource in self.iter_resources(output['url']):
+                        if resource_type == "Patient":
+                            patient_id = resource.get("id")
+                            if not patient_id:
+                                continue
+                        else:
+                            patient_id = referenced_patient_id(resource)
+                            if patient_id not in known and patient_id not in stored:
+                                continue
+                        
+                        if patient_id not in known:
+                            known.add(patient_id)
+                            patient_ids.append(patient_id)
+                        
+                        self._spill(spill_dir, patient_id, resource)
+            
+            ingested = []
+            for patient_id in patient_ids:
+                patient_data = self._build_spilled(spill_dir, patient_id, incremental)
+                if patient_data is not None:
+                    save_patient_info(self.data_dir, patient_id, patient_data)
+                    ingested.append(patient_id)
+        
+        return ingested
+    
+    def _spill(self, spill_dir, patient_id, resource):
+        """Append a resource to its patient's spill file"""
+        with open(os.path.join(spill_dir, f"{patient_id}.ndjson"), "a") as f:
+            f.write(json.dumps(resource) + "\n")
+    
+    def _build_spilled(self, spill_dir, patient_id, incremental):
+        """
+        Merge one patient's spill file into its resource store and delete the file
+        
+        Returns:
+        Patient data built from the updated store, or None without a Patient resource
+        """
+        path = os.path.join(spill_dir, f"{patient_id}.ndjson")
+        store = load_store(self.data_dir, patient_id) if incremental else {}
+        
+        with open(path, "r") as f:
+            for line in f:
+                merge_resource(store, json.loads(line))
+        os.remove(path)
+        
+        if "Patient" not in store:
+            return None
+        
+        save_store(self.data_dir, patient_id, store)
+        return build_from_store(patient_id, store)
+    
+    def export_patients(self, group_id=None, since=None):
+        """
+        Run a complete bulk export: kick-off, polling and NDJSON ingestion
+        
+        Parameters:
+        - group_id: Export only the members of this Group (all patients if None)
+        - since: Only include resources updated after this FHIR instant; they
+          are merged into the patients' stored resources
+        
+        Returns:
+        List of the ingested patient ids
+        """
+        status_url = self.kick_off(group_id, since)
+        manifest = self.wait_for_manifest(status_url)
+        patient_ids = self.ingest_manifest(manifest, incremental=since is not None)
+        
+        # Let the server release the export files
+        try:
+            self.session.delete(status_url, timeout=self.timeout)
+        except requests.RequestException:
+            pass
+        
+        return patient_ids
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import requests
+from email.utils import format_datetime
+from datetime import datetime, timezone
+
+
+class FHIRHTTPCache:
+    """
+    On-disk cache of raw FHIR responses with conditional revalidation
+    
+    Each response is stored with its ETag / meta.versionId and Last-Modified /
+    meta.lastUpdated. Within the TTL of its resource type a cached response is
+    returned without contacting the server; after that it is revalidated with
+    If-None-Match / If-Modified-Since, so an unchanged resource costs one 304.
+    """
+    
+    # Seconds a cached response is served without revalidation, per resource type
+    DEFAULT_TTLS = {
+        'Patient': 24 * 60 * 60,
+        'Condition': 60 * 60,
+        'MedicationRequest': 60 * 60,
+        'Observation': 15 * 60,
+        'Bundle': 15 * 60
+    }
+    DEFAULT_TTL = 15 * 60
+    
+    def __init__(self, cache_dir="data/fhir_cache", ttls=None, session=None, timeout=30):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.session = session or requests.Session()
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    def get_json(self, url, resource_type=None, headers=None):
+        """
+        Get a FHIR response body, from the cache when it is fresh or still valid
+        
+        Parameters:
+        - url: Full request URL
+        - resource_type: Resource type used for the TTL (derived from the URL if omitted)
+        - headers: Extra request headers
+        
+        Returns:
+        Tuple of (status_code, body). A revalidated (304) response is reported as 200.
+        """
+        entry, fresh = self.lookup(url, resource_type)
+        
+        # Fresh enough to skip the server entirely
+        if fresh:
+            return 200, entry['body']
+        
+        try:
+            resp = self.session.get(url, headers=self.request_headers(entry, headers), timeout=self.timeout)
+        except requests.RequestException:
+            # Server unreachable: serve the stale copy if we have one
+            if entry is not None:
+                return 200, entry['body']
+            raise
+        
+        body = resp.json() if resp.status_code == 200 else None
+        return self.record_response(url, entry, resp.status_code, resp.headers, body)
+    
+    def lookup(self, url, resource_type=None):
+        """
+        Find the cached entry for a URL
+        
+        Returns:
+        Tuple of (entry or None, whether the entry is still within its TTL)
+        """
+        resource_type = resource_type or self.resource_type_from_url(url)
+        entry = self._read_entry(url)
+        
+        if entry is None:
+            return None, False
+        
+        return entry, time.time() - entry['fetched_at'] < self.ttl_for(resource_type)
+    
+    def request_headers(self, entry, headers=None):
+        """Request headers for a fetch, conditional on the cached entry if there is one"""
+        request_headers = {'Accept': 'application/fhir+json'}
+        if headers:
+            request_headers.update(headers)
+        if entry is not None:
+            if entry.get('etag'):
+                request_headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                request_headers['If-Modified-Since'] = entry['last_modified']
+        
+        return request_headers
+    
+    def record_response(self, url, entry, status, headers, body):
+        """
+        Update the cache from a server response
+        
+        Parameters:
+        - url: Request URL
+        - entry: Cached entry the request was conditional on (or None)
+        - status: Response status code
+        - headers: Response headers
+        - body: Parsed JSON body for a 200 response, otherwise None
+        
+        Returns:
+        Tuple of (status_code, body), with a 304 reported as 200 and the cached body
+        """
+        if status == 304 and entry is not None:
+            entry['fetched_at'] = time.time()
+            self._write_entry(url, entry)
+            return 200, entry['body']
+        
+        if status != 200:
+            return status, None
+        
+        self._write_entry(url, {
+            'url': url,
+            'etag': headers.get('ETag') or self._etag_from_body(body),
+            'last_modified': headers.get('Last-Modified') or self._last_modified_from_body(body),
+            'fetched_at': time.time(),
+            'body': body
+        })
+        
+        return 200, body
+    
+    def invalidate(self, url):
+        """Remove the cached response for a URL"""
+        path = self._entry_path(url)
+        if os.path.exists(path):
+            os.remove(path)
+    
+    def ttl_for(self, resource_type):
+        """TTL in seconds for a resource type"""
+        return self.ttls.get(resource_type, self.DEFAULT_TTL)
+    
+    @staticmethod
+    def resource_type_from_url(url):
+        """Resource type of a read or search URL, e.g. 'Condition' for .../Condition?patient=1"""
+        path = url.split('?', 1)[0].rstrip('/')
+        segments = path.split('/')
+        
+        # .../Type/id for reads, .../Type for searches
+        for segment in reversed(segments[-2:]):
+            if segment[:1].isupper():
+                return segment
+        
+        return None
+    
+    @staticmethod
+    def _etag_from_body(body):
+        """Weak ETag built from meta.versionId when the server sent no ETag header"""
+        version_id = body.get('meta', {}).get('versionId')
+        return f'W/"{version_id}"' if version_id else None
+    
+    @staticmethod
+    def _last_modified_from_body(body):
+        """HTTP date built from meta.lastUpdated when the server sent no Last-Modified header"""
+        last_updated = body.get('meta', {}).get('lastUpdated')
+        if not last_updated:
+            return None
+        
+        try:
+            updated = datetime.fromisoformat(last_updated.replace('Z', '+00:00'))
+            if updated.tzinfo is None:
+                updated = updated.replace(tzinfo=timezone.utc)
+            return format_datetime(updated.astimezone(timezone.utc), usegmt=True)
+        except ValueError:
+            return None
+    
+    def _entry_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + '.json')
+    
+    def _read_entry(self, url):
+        path = self._entry_path(url)
+        if not os.path.exists(path):
+            return None
+        
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _write_entry(self, url, entry):
+        # Write to a temporary file of our own first, so readers never see a
+        # partial entry and concurrent writers never share a file
+        path = self._entry_path(url)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
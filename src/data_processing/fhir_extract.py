@@ -0,0 +1,578 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from .schema import to_compact_bp, time_of_day_from_datetime
+from .loinc import VITALS, SYSTOLIC_CODE, DIASTOLIC_CODE, HEART_RATE_CODE, lookup_vital, unit_conversion
+
+LOINC_SYSTEM = "http://loinc.org"
+
+
+def referenced_patient_id(resource):
+    """Id of the patient a Condition/MedicationRequest/Observation belongs to"""
+    reference = resource.get("subject", resource.get("patient", {})).get("reference", "")
+    if "Patient/" in reference:
+        return reference.split("Patient/", 1)[1].split("/")[0]
+    return None
+
+
+def is_vital_sign(observation):
+    """Whether an Observation is in the vital-signs category"""
+    categories = observation.get("category")
+    if not categories:
+        return False
+    
+    # Usual case: vital-signs is the first coding of the first category
+    try:
+        if categories[0]["coding"][0]["code"] == "vital-signs":
+            return True
+    except (KeyError, IndexError, TypeError):
+        pass
+    
+    for category in observation.get("category", ()):
+        for coding in category.get("coding", ()):
+            if coding.get("code") == "vital-signs":
+                return True
+    return False
+
+
+def _pick_coding(concept):
+    """
+    Choose the coding of a CodeableConcept to report
+    
+    Prefers a LOINC coding, then any coding with a display, instead of
+    blindly taking the first coding.
+    
+    Returns:
+    Tuple of (code, display), either of which may be None
+    """
+    codings = concept.get("coding") or ()
+    
+    # Common case: a single coding, or a LOINC coding listed first
+    if codings:
+        first = codings[0]
+        if len(codings) == 1 or first.get("system") == LOINC_SYSTEM:
+            return first.get("code"), first.get("display") or concept.get("text")
+    
+    chosen = None
+    
+    for coding in codings:
+        if coding.get("system") == LOINC_SYSTEM:
+            chosen = coding
+            break
+        if chosen is None and coding.get("display"):
+            chosen = coding
+    
+    if chosen is None and codings:
+        chosen = codings[0]
+    if chosen is None:
+        return None, concept.get("text")
+    
+    return chosen.get("code"), chosen.get("display") or concept.get("text")
+
+
+class VitalsSeries:
+    """
+    Array-backed time series of vital-sign readings
+    
+    Each reading is a (LOINC code, effective time, value, unit) record. Codes
+    and units are stored once in lookup tables and referenced by small integer
+    indices; times are datetime64[ns] (UTC, NaT when unknown) and values float64.
+    """
+    
+    def __init__(self, codes=None, displays=None, units=None,
+                 code_index=None, times=None, values=None, unit_index=None):
+        self.codes = list(codes or [])
+        self.displays = list(displays or [])
+        self.units = list(units or [])
+        self.code_index = np.asarray(code_index if code_index is not None else [], dtype=np.int32)
+        self.times = np.asarray(times if times is not None else [], dtype='datetime64[ns]')
+        self.values = np.asarray(values if values is not None else [], dtype=np.float64)
+        self.unit_index = np.asarray(unit_index if unit_index is not None else [], dtype=np.int32)
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def series(self, code):
+        """
+        Readings of one LOINC code in time order
+        
+        Returns:
+        Tuple of (times, values) arrays
+        """
+        if code not in self.codes:
+            return np.array([], dtype='datetime64[ns]'), np.array([], dtype=np.float64)
+        
+        # Sort on the int64 view so unknown (NaT) times come first, as in latest()
+        mask = self.code_index == self.codes.index(code)
+        order = np.argsort(self.times[mask].view(np.int64), kind='stable')
+        return self.times[mask][order], self.values[mask][order]
+    
+    def latest(self):
+        """
+        Most recent reading of each code
+        
+        Returns:
+        Dictionary mapping code to {'display', 'value', 'unit', 'time'}
+        """
+        if len(self) == 0:
+            return {}
+        
+        # Unknown times sort first so any dated reading wins over them
+        time_keys = self.times.view(np.int64)
+        order = np.lexsort((time_keys, self.code_index))
+        sorted_codes = self.code_index[order]
+        last = order[np.r_[sorted_codes[1:] != sorted_codes[:-1], True]]
+        
+        latest = {}
+        for i in last:
+            code_idx = self.code_index[i]
+            latest[self.codes[code_idx]] = {
+                'display': self.displays[code_idx],
+                'value': float(self.values[i]),
+                'unit': self.units[self.unit_index[i]],
+                'time': None if np.isnat(self.times[i]) else str(np.datetime_as_string(self.times[i], unit='s'))
+            }
+        
+        return latest
+    
+    def to_frame(self):
+        """Readings as a DataFrame with 'code', 'time', 'value' and 'unit' columns"""
+        return pd.DataFrame({
+            'code': pd.Categorical.from_codes(self.code_index, categories=self.codes) if self.codes else [],
+            'time': self.times,
+            'value': self.values,
+            'unit': pd.Categorical.from_codes(self.unit_index, categories=self.units) if self.units else []
+        })
+    
+    def to_bp_frame(self):
+        """
+        Blood pressure readings in the compact Omron schema
+        
+        Systolic and diastolic readings taken at the same time (e.g. the
+        components of one 85354-9 panel) form a row; a heart rate with the
+        same time becomes its pulse. Times are local wall-clock times, like
+        the device exports.
+        
+        Returns:
+        Compact BP DataFrame ('datetime', 'systolic', 'diastolic', 'pulse',
+        'time_of_day') sorted by time, or None if there are no BP readings
+        """
+        if SYSTOLIC_CODE not in self.codes or DIASTOLIC_CODE not in self.codes:
+            return None
+        
+        frame = self.to_frame()
+        frame = frame[frame['code'].isin([SYSTOLIC_CODE, DIASTOLIC_CODE, HEART_RATE_CODE]) & frame['time'].notna()]
+        
+        # One column per code, one row per timestamp (the last reading wins on exact repeats)
+        wide = frame.drop_duplicates(['time', 'code'], keep='last').pivot(
+            index='time', columns='code', values='value'
+        )
+        wide = wide.dropna(subset=[SYSTOLIC_CODE, DIASTOLIC_CODE]).sort_index()
+        if wide.empty:
+            return None
+        
+        datetimes = pd.Series(wide.index.to_numpy(), name='datetime')
+        raw = pd.DataFrame({
+            'datetime': datetimes,
+            'systolic': wide[SYSTOLIC_CODE].to_numpy(),
+            'diastolic': wide[DIASTOLIC_CODE].to_numpy(),
+            'pulse': wide[HEART_RATE_CODE].to_numpy() if HEART_RATE_CODE in wide.columns else np.nan,
+            'time_of_day': time_of_day_from_datetime(datetimes)
+        })
+        
+        return to_compact_bp(raw)
+    
+    def to_dict(self):
+        """Columnar JSON-serializable form, stored in patient_info.json"""
+        return {
+            'codes': self.codes,
+            'displays': self.displays,
+            'units': self.units,
+            'code_index': self.code_index.tolist(),
+            'times_ms': _epoch_ms(self.times),
+            'values': self.values.tolist(),
+            'unit_index': self.unit_index.tolist()
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a series saved with to_dict"""
+        return cls(
+            data.get('codes'), data.get('displays'), data.get('units'),
+            data.get('code_index'), _from_epoch_ms(data.get('times_ms', [])),
+            data.get('values'), data.get('unit_index')
+        )
+
+
+def _epoch_ms(times):
+    """datetime64[ns] array as a list of epoch milliseconds (None for NaT)"""
+    ms = (times.view(np.int64) // 1_000_000).tolist()
+    if np.isnat(times).any():
+        ms = [None if nat else value for value, nat in zip(ms, np.isnat(times))]
+    return ms
+
+
+def _from_epoch_ms(ms):
+    """Inverse of _epoch_ms"""
+    values = np.array([np.nan if value is None else value for value in ms], dtype=np.float64)
+    times = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+    valid = ~np.isnan(values)
+    times[valid] = (values[valid].astype(np.int64) * 1_000_000).view('datetime64[ns]')
+    return times
+
+
+# Trailing UTC offset of a dateTime with a time part ('Z', '+02:00', '-0500')
+_UTC_OFFSET = r'(T[0-9:.]+)(?:Z|[+-][0-9]{2}:?[0-9]{2})$'
+
+
+def _parse_times(times):
+    """
+    Parse FHIR dateTime strings to naive local wall-clock datetime64[ns]
+    
+    Each timestamp keeps the clock time it was recorded with and its offset
+    is dropped, which is the convention of the device CSV exports; converting
+    to UTC instead would shift FHIR readings away from the device readings
+    they duplicate.
+    """
+    if len(times) == 0:
+        return np.array([], dtype='datetime64[ns]')
+    
+    local = pd.Series(times, dtype=object).str.replace(_UTC_OFFSET, r'\1', regex=True)
+    parsed = pd.to_datetime(local, errors='coerce', format='ISO8601')
+    return parsed.to_numpy(dtype='datetime64[ns]')
+
+
+class PatientRecordBuilder:
+    """
+    Single-pass builder of the patient_info.json structure for one patient
+    
+    Resources are added in any order as a Bundle or NDJSON stream is walked
+    once; vital-sign readings (including the components of panels such as
+    blood pressure) are collected into flat columns and converted to a
+    VitalsSeries when the record is built.
+    """
+    
+    def __init__(self, patient_id, patient_resource=None):
+        self.patient_id = patient_id
+        self.patient_resource = patient_resource
+        self.conditions = []
+        self.medications = []
+        
+        # Flat (code, time, value, unit) reading columns, converted to arrays in build()
+        self._codes = []
+        self._times = []
+        self._values = []
+        self._units = []
+        self._displays = {}  # code -> display of its first reading
+    
+    def add(self, resource):
+        """Add one resource (Patient, Condition, MedicationRequest or Observation)"""
+        resource_type = resource.get("resourceType")
+        
+        if resource_type == "Observation":
+            if is_vital_sign(resource):
+                self._add_observation(resource)
+        
+        elif resource_type == "Condition":
+            code, display = _pick_coding(resource.get("code", {}))
+            self.conditions.append(display or "Unknown Condition")
+        
+        elif resource_type == "MedicationRequest":
+            med_concept = resource.get("medicationCodeableConcept", {})
+            if "text" in med_concept:
+                self.medications.append(med_concept["text"])
+            elif med_concept.get("coding"):
+                code, display = _pick_coding(med_concept)
+                self.medications.append(display or "Unknown Medication")
+        
+        elif resource_type == "Patient":
+            self.patient_resource = resource
+    
+    def _add_observation(self, resource):
+        time = resource.get("effectiveDateTime") or resource.get("effectiveInstant") \
+            or resource.get("effectivePeriod", {}).get("start") or resource.get("issued")
+        
+        # The observation's own value, then each component (e.g. systolic/diastolic of a BP panel)
+        quantity = resource.get("valueQuantity")
+        if quantity:
+            self._add_reading(resource.get("code", {}), quantity, time)
+        
+        if "component" in resource:
+            for component in resource["component"]:
+                quantity = component.get("valueQuantity")
+                if quantity:
+                    self._add_reading(component.get("code", {}), quantity, time)
+    
+    def _add_reading(self, concept, quantity, time):
+        value = quantity.get("value")
+        if value is None:
+            return
+        
+        # Inline fast path of _pick_coding for the usual single-coding concept
+        codings = concept.get("coding")
+        if codings and len(codings) == 1:
+            code = codings[0].get("code")
+            if code and code not in self._displays:
+                self._displays[code] = codings[0].get("display") or concept.get("text") or code
+        else:
+            code, display = _pick_coding(concept)
+            if code and code not in self._displays:
+                self._displays[code] = display or code
+        
+        if not code:
+            return
+        
+        self._codes.append(code)
+        self._times.append(time)
+        self._values.append(value)
+        self._units.append(quantity.get("unit") or quantity.get("code") or "")
+    
+    def vitals_series(self):
+        """The collected vital-sign readings as a VitalsSeries"""
+        return _vitals_series_batch([self])[0]
+    
+    def build(self, series=None):
+        """
+        Build the patient_info.json structure
+        
+        Parameters:
+        - series: Precomputed VitalsSeries (built from this builder's readings if None)
+        
+        Returns:
+        Dictionary with demographics, conditions, medications, the latest value
+        of each vital, the full vitals series and the BP category
+        """
+        patient_data = {
+            "demographics": _demographics(self.patient_id, self.patient_resource or {}),
+            "conditions": self.conditions,
+            "medications": self.medications
+        }
+        
+        # Latest reading of each vital, keyed by display name as before
+        series = self.vitals_series() if series is None else series
+        vitals = {}
+        for code, reading in series.latest().items():
+            vitals[reading['display']] = {
+                "value": reading['value'],
+                "unit": reading['unit']
+            }
+        
+        patient_data["vitals"] = vitals
+        patient_data["vitals_series"] = series.to_dict()
+        
+        return finalize_patient_data(patient_data)
+
+
+def _vitals_series_batch(builders):
+    """
+    Convert the readings of several builders to VitalsSeries in one vectorized pass
+    
+    Value coercion, time parsing and code/unit factorization run once over the
+    concatenated readings instead of once per patient.
+    """
+    lengths = [len(builder._values) for builder in builders]
+    if sum(lengths) == 0:
+        return [VitalsSeries() for _ in builders]
+    
+    codes = np.asarray([code for builder in builders for code in builder._codes], dtype=object)
+    units = np.asarray([unit for builder in builders for unit in builder._units], dtype=object)
+    times = [time for builder in builders for time in builder._times]
+    values = [value for builder in builders for value in builder._values]
+    
+    # Non-numeric values are dropped in one vectorized pass
+    values = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    times = _parse_times(times)
+    code_index, code_table = pd.factorize(codes)
+    unit_index, unit_table = pd.factorize(units)
+    
+    # Fold synonym codes into canonical vitals and convert to canonical units;
+    # the LOINC index is consulted once per distinct code/unit, not per reading
+    code_index, code_table, values, unit_index, unit_table = _normalize_vitals(
+        code_index, code_table, values, unit_index, unit_table
+    )
+    
+    series = []
+    start = 0
+    for builder, length in zip(builders, lengths):
+        end = start + length
+        keep = ~np.isnan(values[start:end])
+        
+        # Re-index codes and units to the ones this patient actually has
+        used_codes, patient_codes = _local_factorize(code_index[start:end][keep])
+        used_units, patient_units = _local_factorize(unit_index[start:end][keep])
+        patient_code_table = [code_table[i] for i in used_codes]
+        
+        displays = [
+            VITALS[code].name if code in VITALS else builder._displays.get(code, code)
+            for code in patient_code_table
+        ]
+        
+        series.append(VitalsSeries(
+            patient_code_table, displays,
+            [unit_table[i] for i in used_units], patient_codes,
+            times[start:end][keep], values[start:end][keep], patient_units
+        ))
+        start = end
+    
+    return series
+
+
+def _normalize_vitals(code_index, code_table, values, unit_index, unit_table):
+    """
+    Map reading codes to canonical LOINC codes and values to canonical units
+    
+    Returns:
+    Tuple of (code_index, code_table, values, unit_index, unit_table) after normalization
+    """
+    definitions = [lookup_vital(code) for code in code_table]
+    canonical_codes = np.asarray(
+        [definition.code if definition else code for code, definition in zip(code_table, definitions)],
+        dtype=object
+    )
+    canonical_index, canonical_table = pd.factorize(canonical_codes)
+    
+    # One conversion per distinct (code, unit) pair present in the data
+    pairs = code_index.astype(np.int64) * len(unit_table) + unit_index
+    unique_pairs, pair_index = np.unique(pairs, return_inverse=True)
+    scales = np.ones(len(unique_pairs))
+    offsets = np.zeros(len(unique_pairs))
+    pair_units = []
+    for i, pair in enumerate(unique_pairs):
+        definition = definitions[pair // len(unit_table)]
+        unit = unit_table[pair % len(unit_table)]
+        conversion = unit_conversion(definition, unit) if definition else None
+        if conversion is not None:
+            scales[i], offsets[i] = conversion
+            unit = definition.unit
+        pair_units.append(unit)
+    
+    pair_index = pair_index.ravel()
+    values = values * scales[pair_index] + offsets[pair_index]
+    pair_unit_index, new_unit_table = pd.factorize(np.asarray(pair_units, dtype=object))
+    
+    return (canonical_index[code_index], canonical_table, values,
+            pair_unit_index[pair_index], new_unit_table)
+
+
+def _local_factorize(indices):
+    """Renumber global factor indices to 0..k-1 in order of first appearance"""
+    used, first, inverse = np.unique(indices, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return used[order], rank[inverse.ravel()]
+
+
+def build_patient_data(builders):
+    """
+    Build the patient_info.json structures of several patients
+    
+    Parameters:
+    - builders: Dictionary mapping patient id to PatientRecordBuilder
+    
+    Returns:
+    Dictionary mapping patient id to patient data
+    """
+    patient_ids = list(builders)
+    series = _vitals_series_batch([builders[patient_id] for patient_id in patient_ids])
+    return {
+        patient_id: builders[patient_id].build(patient_series)
+        for patient_id, patient_series in zip(patient_ids, series)
+    }
+
+
+def _demographics(patient_id, patient_json):
+    """Demographics block of patient_info.json from a Patient resource"""
+    names = patient_json.get("name") or [{}]
+    given = names[0].get("given") or ["Unknown"]
+    full_name = f"{given[0]} {names[0].get('family', 'Unknown')}"
+    
+    birth_date = patient_json.get("birthDate", "Unknown")
+    
+    # Calculate age
+    try:
+        age = datetime.now().year - int(birth_date.split("-")[0])
+    except (AttributeError, ValueError):
+        age = "Unknown"
+    
+    return {
+        "id": patient_id,
+        "name": full_name,
+        "gender": patient_json.get("gender", "unknown"),
+        "birth_date": birth_date,
+        "age": age
+    }
+
+
+def finalize_patient_data(patient_data):
+    """Fill in the BP category and hypertension flag once all resources are added"""
+    vitals = patient_data["vitals"]
+    conditions = patient_data["conditions"]
+    
+    # Determine BP category based on vitals
+    systolic = vitals.get("Systolic BP", {}).get("value", 120)
+    diastolic = vitals.get("Diastolic BP", {}).get("value", 80)
+    
+    if isinstance(systolic, str):
+        try:
+            systolic = float(systolic)
+        except ValueError:
+            systolic = 120
+    
+    if isinstance(diastolic, str):
+        try:
+            diastolic = float(diastolic)
+        except ValueError:
+            diastolic = 80
+    
+    if systolic >= 140 or diastolic >= 90:
+        bp_category = "Hypertension Stage 2" if (systolic >= 160 or diastolic >= 100) else "Hypertension Stage 1"
+    elif systolic >= 130 or diastolic >= 80:
+        bp_category = "Hypertension Stage 1"
+    elif systolic >= 120:
+        bp_category = "Elevated"
+    else:
+        bp_category = "Normal"
+    
+    patient_data["bp_category"] = bp_category
+    patient_data["has_hypertension"] = "Hypertension" in conditions or "hypertension" in ' '.join(conditions).lower()
+    
+    return patient_data
+
+
+def build_patient_records(resources, patient_ids=None):
+    """
+    Demultiplex resources into per-patient records in a single pass
+    
+    Parameters:
+    - resources: Iterable of FHIR resources (Bundle entries or NDJSON lines)
+    - patient_ids: Only build records for these ids (all patients if None)
+    
+    Returns:
+    Dictionary mapping patient id to PatientRecordBuilder, for patients whose
+    Patient resource was seen
+    """
+    wanted = set(patient_ids) if patient_ids is not None else None
+    builders = {}
+    reference_ids = {}  # subject reference -> patient id, since references repeat per patient
+    
+    for resource in resources:
+        if resource.get("resourceType") == "Patient":
+            patient_id = resource.get("id")
+        else:
+            reference = resource.get("subject", resource.get("patient", {})).get("reference", "")
+            patient_id = reference_ids.get(reference)
+            if patient_id is None:
+                patient_id = reference_ids[reference] = referenced_patient_id(resource)
+        
+        if patient_id is None or (wanted is not None and patient_id not in wanted):
+            continue
+        
+        builder = builders.get(patient_id)
+        if builder is None:
+            builder = builders[patient_id] = PatientRecordBuilder(patient_id)
+        builder.add(resource)
+    
+    return {patient_id: builder for patient_id, builder in builders.items()
+            if builder.patient_resource is not None}
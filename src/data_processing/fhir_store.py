@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from .fhir_extract import PatientRecordBuilder, is_vital_sign
+
+
+STORE_FILE = "fhir_resources.json"
+
+# Fields of each resource needed to rebuild patient_info.json
+KEPT_FIELDS = ["resourceType", "id", "meta", "name", "gender", "birthDate",
+               "subject", "patient", "code", "category", "medicationCodeableConcept",
+               "valueQuantity", "component",
+               "effectiveDateTime", "effectiveInstant", "effectivePeriod", "issued"]
+
+
+def trim_resource(resource):
+    """Copy of a resource with only the fields needed to rebuild patient_info.json"""
+    return {field: resource[field] for field in KEPT_FIELDS if field in resource}
+
+
+def resource_key(resource):
+    """Store key of a resource: its id, or a hash of its content when it has none"""
+    if resource.get("id"):
+        return resource["id"]
+    return hashlib.sha1(json.dumps(resource, sort_keys=True).encode()).hexdigest()
+
+
+def merge_resource(store, resource):
+    """
+    Add or replace one resource in a patient's resource store
+    
+    The store holds the Patient resource under 'Patient' and every other type
+    as a dictionary by resource id. Observations other than vital signs are
+    not needed for patient_info.json and are skipped.
+    
+    Returns:
+    True if the resource was stored
+    """
+    resource_type = resource.get("resourceType")
+    if not resource_type:
+        return False
+    if resource_type == "Observation" and not is_vital_sign(resource):
+        return False
+    
+    if resource_type == "Patient":
+        store["Patient"] = trim_resource(resource)
+    else:
+        store.setdefault(resource_type, {})[resource_key(resource)] = trim_resource(resource)
+    return True
+
+
+def build_from_store(patient_id, store):
+    """
+    Rebuild patient_info.json data from a resource store
+    
+    Returns:
+    Patient data, or None if the store has no Patient resource
+    """
+    if "Patient" not in store:
+        return None
+    
+    record = PatientRecordBuilder(patient_id, store["Patient"])
+    for resource_type, by_id in store.items():
+        if resource_type != "Patient":
+            for resource in by_id.values():
+                record.add(resource)
+    
+    return record.build()
+
+
+def store_path(data_dir, patient_id):
+    return os.path.join(data_dir, patient_id, STORE_FILE)
+
+
+def load_store(data_dir, patient_id):
+    """A patient's stored resources, or an empty store if there are none"""
+    path = store_path(data_dir, patient_id)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+
+def save_store(data_dir, patient_id, store):
+    """Write a patient's resource store through a temporary file of its own"""
+    patient_dir = os.path.join(data_dir, patient_id)
+    os.makedirs(patient_dir, exist_ok=True)
+    
+    fd, tmp_path = tempfile.mkstemp(dir=patient_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(store, f)
+        os.replace(tmp_path, store_path(data_dir, patient_id))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def stored_patients(data_dir):
+    """Ids of the patients under data_dir that have a resource store"""
+    try:
+        folders = [entry for entry in os.scandir(data_dir) if entry.is_dir()]
+    except OSError:
+        return set()
+    return {folder.name for folder in folders if os.path.exists(os.path.join(folder.path, STORE_FILE))}
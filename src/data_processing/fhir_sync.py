@@ -0,0 +1,222 @@
+import os
+import json
+import tempfile
+import requests
+from datetime import datetime, timezone
+
+from .fhir_store import build_from_store, load_store, merge_resource, save_store, trim_resource
+from .patient_index import save_patient_info
+
+
+class FHIRSync:
+    """
+    Incremental refresh of stored patient records
+    
+    For every patient and resource type the sync keeps a _lastUpdated watermark
+    and only asks the server for resources changed after it. Changed resources
+    are merged by id into a per-patient resource store, deletions are picked up
+    from the type-level _history, and patient_info.json is rebuilt from the store.
+    
+    State lives in data_dir/sync_state.json (watermarks) and
+    data_dir/<patient_id>/fhir_resources.json (trimmed resources by id).
+    """
+    
+    SYNC_TYPES = ["Condition", "MedicationRequest", "Observation"]
+    
+    def __init__(self, base_url="https://hapi.fhir.org/baseR4", data_dir="data/patient_data",
+                 session=None, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.data_dir = data_dir
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.state_path = os.path.join(data_dir, "sync_state.json")
+        os.makedirs(data_dir, exist_ok=True)
+    
+    def sync_patients(self, patient_ids):
+        """
+        Bring the stored records of a patient panel up to date
+        
+        Parameters:
+        - patient_ids: List of FHIR Patient ids
+        
+        Returns:
+        Dictionary with the number of patients synced, resources updated and
+        resources deleted
+        """
+        state = self._load_state()
+        sync_started = datetime.now(timezone.utc).isoformat()
+        summary = {'patients': 0, 'updated': 0, 'deleted': 0}
+        
+        stores = {}
+        for patient_id in patient_ids:
+            try:
+                store = load_store(self.data_dir, patient_id)
+                watermarks = state['patients'].setdefault(patient_id, {})
+                summary['updated'] += self._pull_changes(patient_id, store, watermarks, sync_started)
+                stores[patient_id] = store
+            except Exception as e:
+                print(f"Error syncing patient {patient_id}: {str(e)}")
+        
+        # Deletions are only visible in the type history, which is read once for all patients
+        summary['deleted'] = self._apply_deletions(stores, state['history'], sync_started)
+        
+        for patient_id, store in stores.items():
+            save_store(self.data_dir, patient_id, store)
+            save_patient_info(self.data_dir, patient_id, build_from_store(patient_id, store))
+            summary['patients'] += 1
+        
+        self._save_state(state)
+        return summary
+    
+    def _pull_changes(self, patient_id, store, watermarks, sync_started):
+        """Fetch resources changed since the patient's watermarks and merge them into its store"""
+        updated = 0
+        
+        # Patient resource itself
+        resources = self._search(f"{self.base_url}/Patient", {'_id': patient_id}, watermarks.get("Patient"))
+        if resources:
+            store["Patient"] = trim_resource(resources[-1])
+            updated += 1
+        watermarks["Patient"] = self._new_watermark(resources, watermarks.get("Patient"), sync_started)
+        
+        for resource_type in self.SYNC_TYPES:
+            params = {'patient': patient_id, '_count': 100}
+            if resource_type == "Observation":
+                params['category'] = "vital-signs"
+            
+            resources = self._search(f"{self.base_url}/{resource_type}", params, watermarks.get(resource_type))
+            for resource in resources:
+                merge_resource(store, resource)
+            updated += len(resources)
+            
+            watermarks[resource_type] = self._new_watermark(resources, watermarks.get(resource_type), sync_started)
+        
+        if "Patient" not in store:
+            raise Exception("patient not found")
+        
+        return updated
+    
+    def _apply_deletions(self, stores, history_watermarks, sync_started):
+        """Remove resources deleted on the server since the last sync"""
+        deleted = 0
+        
+        for resource_type in self.SYNC_TYPES:
+            since = history_watermarks.get(resource_type)
+            
+            # Nothing stored before this sync can have been deleted since
+            if since is None:
+                history_watermarks[resource_type] = sync_started
+                continue
+            
+            # Keep the old watermark on failure so the next sync asks again
+            try:
+                entries = self._get_entries(f"{self.base_url}/{resource_type}/_history",
+                                            {'_since': since, '_count': 100})
+            except Exception as e:
+                print(f"Error reading {resource_type} history: {str(e)}")
+                continue
+            history_watermarks[resource_type] = sync_started
+            
+            deleted_ids = set()
+            for entry in entries:
+                request = entry.get("request", {})
+                if request.get("method") != "DELETE":
+                    continue
+                
+                # request.url looks like 'Condition/123' or 'Condition/123/_history/2'
+                parts = request.get("url", "").split("/")
+                if len(parts) >= 2:
+                    deleted_ids.add(parts[1])
+            
+            # One history read serves the whole panel; each store drops the deleted ids it holds
+            for store in stores.values():
+                resources = store.get(resource_type, {})
+                for resource_id in deleted_ids:
+                    if resources.pop(resource_id, None) is not None:
+                        deleted += 1
+        
+        return deleted
+    
+    def _search(self, url, params, watermark):
+        """Run a search, limited to resources updated after the watermark"""
+        if watermark:
+            params = dict(params, _lastUpdated=f"gt{watermark}")
+        
+        return [entry["resource"] for entry in self._get_entries(url, params) if "resource" in entry]
+    
+    def _get_entries(self, url, params=None):
+        """
+        Collect the entries of a Bundle, following 'next' links across pages
+        
+        The search parameters are passed separately so requests URL-encodes them
+        (a '+00:00' offset in a timestamp would otherwise arrive as a space);
+        'next' links come back from the server already encoded.
+        """
+        entries = []
+        
+        while url:
+            resp = self.session.get(url, params=params, headers={'Accept': 'application/fhir+json'},
+                                    timeout=self.timeout)
+            if resp.status_code != 200:
+                raise Exception(f"{url} returned {resp.status_code}")
+            
+            bundle = resp.json()
+            entries.extend(bundle.get("entry", []))
+            
+            url, params = None, None
+            for link in bundle.get("link", []):
+                if link.get("relation") == "next":
+                    url = link.get("url")
+                    break
+        
+        return entries
+    
+    @staticmethod
+    def _new_watermark(resources, watermark, sync_started):
+        """
+        Latest meta.lastUpdated among the fetched resources, or the old watermark
+        
+        Instants are compared as parsed datetimes, since servers mix offsets
+        ('Z', '+02:00') and fractional-second precision, so the strings do not
+        sort in time order.
+        """
+        updated = []
+        for resource in resources:
+            last_updated = resource.get("meta", {}).get("lastUpdated")
+            if not last_updated:
+                continue
+            try:
+                instant = datetime.fromisoformat(last_updated.replace('Z', '+00:00'))
+            except ValueError:
+                continue
+            # FHIR instants carry an offset; treat one without as UTC so all compare
+            if instant.tzinfo is None:
+                instant = instant.replace(tzinfo=timezone.utc)
+            updated.append(instant)
+        
+        if updated:
+            return max(updated).isoformat()
+        if resources:
+            # Server sent no lastUpdated, so fall back to the time the sync started
+            return sync_started
+        return watermark
+    
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+        return {'patients': {}, 'history': {}}
+    
+    def _save_state(self, state):
+        # A temporary file of our own, so a concurrent sync or reader never sees half a state
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp_path, self.state_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
@@ -0,0 +1,39 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """
+    Hold an advisory lock on a lock file, across threads and processes
+    
+    Every call opens its own handle, so two holders in one process exclude each
+    other just like holders in different processes (and nesting the lock on the
+    same path in one thread deadlocks).
+    
+    Parameters:
+    - path: Lock file path (created if missing)
+    - shared: Take a shared (reader) lock instead of an exclusive one; on
+      Windows every lock is exclusive
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a+b') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,305 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import xml.etree.ElementTree as ET
+from dateutil.tz import tzlocal
+
+from .schema import to_compact_exercise
+
+# Parsers for exercise exports. Layouts are recognised from the first bytes:
+#   - 'internal': the app's own google_fit.csv (date, time, exercise_type, ...)
+#   - 'sessions_json': Google Takeout Fit session files ('All Sessions/*.json',
+#     one session object each) or a Fit REST sessions.list response
+#   - 'tcx': Training Center XML activities (Takeout 'Activities/*.tcx')
+# Sessions are collected column by column and then mapped onto the internal
+# exercise layout with vectorized operations.
+
+INTERNAL_COLUMNS = ['date', 'time', 'exercise_type', 'duration_minutes', 'intensity',
+                    'calories_burned', 'avg_heart_rate', 'steps']
+
+# Google Fit activity names (Takeout) -> internal exercise types
+ACTIVITY_NAMES = {
+    'running': 'Running', 'running.jogging': 'Running', 'running.treadmill': 'Running', 'jogging': 'Running',
+    'walking': 'Walking', 'walking.fitness': 'Walking', 'walking.treadmill': 'Walking', 'hiking': 'Walking',
+    'biking': 'Cycling', 'biking.road': 'Cycling', 'biking.mountain': 'Cycling', 'biking.stationary': 'Cycling',
+    'biking.spinning': 'Cycling', 'cycling': 'Cycling', 'biking.indoor': 'Cycling',
+    'swimming': 'Swimming', 'swimming.pool': 'Swimming', 'swimming.open_water': 'Swimming',
+    'strength_training': 'Weight Training', 'weightlifting': 'Weight Training',
+    'yoga': 'Yoga'
+}
+
+# Google Fit REST activity type codes -> internal exercise types
+ACTIVITY_CODES = {
+    1: 'Cycling', 7: 'Walking', 8: 'Running', 14: 'Cycling', 15: 'Cycling', 16: 'Cycling',
+    17: 'Cycling', 35: 'Walking', 56: 'Running', 57: 'Running', 58: 'Running', 82: 'Swimming',
+    83: 'Swimming', 84: 'Swimming', 80: 'Weight Training', 97: 'Weight Training', 100: 'Yoga',
+    93: 'Walking', 94: 'Walking'
+}
+
+# TCX Sport attribute -> internal exercise types
+TCX_SPORTS = {'running': 'Running', 'biking': 'Cycling', 'walking': 'Walking', 'swimming': 'Swimming'}
+
+# Typical intensity of each exercise type, used when no heart rate was recorded
+DEFAULT_INTENSITY = {
+    'Running': 'High', 'Cycling': 'Moderate', 'Swimming': 'Moderate',
+    'Walking': 'Low', 'Weight Training': 'Moderate', 'Yoga': 'Low'
+}
+
+TCX_NS = '{http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2}'
+
+
+def detect_schema(header_bytes):
+    """
+    Identify an exercise export layout from the first bytes of the file
+    
+    Parameters:
+    - header_bytes: Start of the file
+    
+    Returns:
+    'internal', 'sessions_json' or 'tcx', or None if the layout is not recognised
+    """
+    text = header_bytes.decode('utf-8-sig', errors='replace').lstrip()
+    
+    if text.startswith('{') or text.startswith('['):
+        return 'sessions_json'
+    if text.startswith('<') and 'TrainingCenterDatabase' in text:
+        return 'tcx'
+    
+    header = text.splitlines()[0].lower() if text else ""
+    if 'exercise_type' in header and 'date' in header:
+        return 'internal'
+    return None
+
+
+def _session_records(document):
+    """Session objects of a Takeout session file, a list of them or a sessions.list response"""
+    if isinstance(document, list):
+        return document
+    if 'session' in document:
+        return document['session']
+    return [document]
+
+
+def _aggregate_value(aggregates, metric):
+    for aggregate in aggregates:
+        if aggregate.get('metricName') == metric:
+            return aggregate.get('floatValue', aggregate.get('intValue'))
+    return None
+
+
+def parse_sessions(documents):
+    """
+    Collect Google Fit sessions into columns
+    
+    Parameters:
+    - documents: Iterable of parsed JSON documents (session files or sessions.list responses)
+    
+    Returns:
+    DataFrame with raw 'start', 'end', 'activity', 'calories', 'avg_heart_rate'
+    and 'steps' columns, one row per session
+    """
+    columns = {'start': [], 'end': [], 'activity': [], 'calories': [], 'avg_heart_rate': [], 'steps': []}
+    
+    for document in documents:
+        for session in _session_records(document):
+            aggregates = session.get('aggregate', [])
+            columns['start'].append(session.get('startTime', session.get('startTimeMillis')))
+            columns['end'].append(session.get('endTime', session.get('endTimeMillis')))
+            columns['activity'].append(session.get('fitnessActivity', session.get('activityType')))
+            columns['calories'].append(_aggregate_value(aggregates, 'com.google.calories.expended'))
+            columns['avg_heart_rate'].append(_aggregate_value(aggregates, 'com.google.heart_rate.summary'))
+            columns['steps'].append(_aggregate_value(aggregates, 'com.google.step_count.delta'))
+    
+    return pd.DataFrame(columns)
+
+
+def parse_tcx(handle):
+    """
+    Collect the activities of a TCX file into columns
+    
+    Parameters:
+    - handle: Binary file object or path of a TCX document
+    
+    Returns:
+    DataFrame with the same raw columns as parse_sessions
+    """
+    columns = {'start': [], 'end': [], 'activity': [], 'calories': [], 'avg_heart_rate': [], 'steps': []}
+    
+    for _, element in ET.iterparse(handle, events=('end',)):
+        if element.tag != f'{TCX_NS}Activity':
+            continue
+        
+        seconds = calories = heart_beats = 0.0
+        for lap in element.iter(f'{TCX_NS}Lap'):
+            lap_seconds = float(lap.findtext(f'{TCX_NS}TotalTimeSeconds', '0') or 0)
+            seconds += lap_seconds
+            calories += float(lap.findtext(f'{TCX_NS}Calories', '0') or 0)
+            lap_heart_rate = lap.findtext(f'{TCX_NS}AverageHeartRateBpm/{TCX_NS}Value')
+            if lap_heart_rate:
+                heart_beats += float(lap_heart_rate) * lap_seconds
+        
+        start = pd.Timestamp(element.findtext(f'{TCX_NS}Id'))
+        columns['start'].append(start.isoformat())
+        columns['end'].append((start + pd.Timedelta(seconds=seconds)).isoformat())
+        columns['activity'].append(element.get('Sport'))
+        columns['calories'].append(calories)
+        columns['avg_heart_rate'].append(heart_beats / seconds if heart_beats and seconds else None)
+        columns['steps'].append(None)
+        element.clear()
+    
+    return pd.DataFrame(columns)
+
+
+# Explicit UTC offset after the time part of an ISO string ('+02:00', '-0500')
+_UTC_OFFSET = r'(T[0-9:.]+)[+-][0-9]{2}:?[0-9]{2}$'
+
+
+def _to_datetime(values, timezone):
+    """
+    Parse ISO strings or epoch milliseconds to naive wall-clock datetimes
+    
+    With a timezone every time is converted to it. Without one, times are
+    local wall-clock time like the device CSVs and FHIR readings (see
+    fhir_extract._parse_times): ISO strings keep the clock time of their own
+    offset, and UTC times (epoch milliseconds, 'Z' or a zero offset, as TCX
+    files and Takeout give them) are converted to the timezone of this machine.
+    """
+    numeric = pd.to_numeric(values, errors='coerce')
+    epoch = numeric.notna()
+    text = values.astype(str)
+    
+    if timezone is None:
+        utc = epoch | text.str.contains(r'(?:Z|[+-]00:?00)$', regex=True)
+        parsed = pd.to_datetime(text.str.replace(_UTC_OFFSET, r'\1', regex=True).where(~utc),
+                                format='ISO8601', errors='coerce')
+        if utc.any():
+            parsed[utc] = _to_datetime(values[utc], tzlocal())
+        return parsed
+    
+    parsed = pd.to_datetime(text.where(~epoch), utc=True, format='ISO8601', errors='coerce')
+    if epoch.any():
+        parsed[epoch] = pd.to_datetime(numeric[epoch], unit='ms', utc=True)
+    return parsed.dt.tz_convert(timezone).dt.tz_localize(None)
+
+
+def sessions_to_internal(sessions, timezone=None):
+    """
+    Map raw session columns onto the internal exercise layout
+    
+    Parameters:
+    - sessions: DataFrame from parse_sessions or parse_tcx
+    - timezone: Timezone the session times are shown in (local wall-clock time if None)
+    
+    Returns:
+    DataFrame with 'datetime', 'exercise_type', 'duration_minutes', 'intensity',
+    'calories_burned', 'avg_heart_rate' and 'steps'
+    """
+    start = _to_datetime(sessions['start'], timezone)
+    end = _to_datetime(sessions['end'], timezone)
+    duration = ((end - start).dt.total_seconds() / 60).round()
+    
+    # Map the distinct activity names once instead of row by row
+    activity = sessions['activity'].astype('category')
+    names = []
+    for category in activity.cat.categories:
+        if isinstance(category, (int, np.integer)) or str(category).isdigit():
+            names.append(ACTIVITY_CODES.get(int(category), 'Other'))
+        else:
+            key = str(category).lower()
+            names.append(ACTIVITY_NAMES.get(key) or TCX_SPORTS.get(key) or key.replace('_', ' ').title())
+    exercise_type = pd.Series(np.asarray(names, dtype=object)[activity.cat.codes.to_numpy()], index=sessions.index)
+    exercise_type[activity.cat.codes.to_numpy() < 0] = None
+    
+    heart_rate = pd.to_numeric(sessions['avg_heart_rate'], errors='coerce')
+    hr_values = heart_rate.to_numpy(dtype=np.float64)
+    default_intensity = exercise_type.map(DEFAULT_INTENSITY).fillna('Moderate').to_numpy(dtype=object)
+    intensity = np.select(
+        [np.isnan(hr_values), hr_values < 110, hr_values < 140],
+        [default_intensity, 'Low', 'Moderate'],
+        default='High'
+    )
+    
+    return pd.DataFrame({
+        'datetime': start,
+        'exercise_type': exercise_type,
+        'duration_minutes': duration,
+        'intensity': intensity,
+        'calories_burned': pd.to_numeric(sessions['calories'], errors='coerce').round(),
+        'avg_heart_rate': heart_rate.round(),
+        # Sessions without a step count stay missing rather than counting as 0 steps
+        'steps': pd.to_numeric(sessions['steps'], errors='coerce')
+    })
+
+
+def read_chunks(handle, schema, chunk_rows=100000, timezone=None):
+    """
+    Stream a detected exercise export in chunks in the internal layout
+    
+    Session exports are parsed whole (they hold one row per workout); the
+    internal CSV is read chunk_rows rows at a time.
+    
+    Parameters:
+    - handle: Binary file object positioned at the start of the file
+    - schema: Result of detect_schema
+    - chunk_rows: Number of CSV rows parsed at a time
+    - timezone: Timezone for session start times (see sessions_to_internal)
+    
+    Yields:
+    DataFrames ready for to_compact_exercise
+    """
+    if schema == 'internal':
+        dtypes = {'date': str, 'time': str, 'datetime': str, 'exercise_type': 'category', 'intensity': 'category'}
+        yield from pd.read_csv(handle, chunksize=chunk_rows, dtype=dtypes)
+    elif schema == 'sessions_json':
+        yield sessions_to_internal(parse_sessions([json.load(handle)]), timezone)
+    elif schema == 'tcx':
+        yield sessions_to_internal(parse_tcx(handle), timezone)
+    else:
+        raise Exception(f"Unsupported exercise export layout: {schema}")
+
+
+def parse_google_fit(path, timezone=None):
+    """
+    Load an exercise export in any recognised layout
+    
+    Parameters:
+    - path: Internal google_fit.csv, a Takeout session JSON or TCX file, or a
+      directory of them (e.g. Takeout 'Fit/All Sessions')
+    - timezone: Timezone for session start times (local wall-clock time if None)
+    
+    Returns:
+    DataFrame in the compact exercise schema
+    """
+    if os.path.isdir(path):
+        return _parse_session_directory(path, timezone)
+    
+    with open(path, 'rb') as f:
+        schema = detect_schema(f.read(4096))
+        if schema is None:
+            raise Exception(f"{path} is not a recognised exercise export")
+        f.seek(0)
+        chunks = [to_compact_exercise(chunk, errors='coerce') for chunk in read_chunks(f, schema, timezone=timezone)]
+    
+    if len(chunks) == 1:
+        return chunks[0]
+    # Re-compact so enum categories and integer dtypes are unified across chunks
+    return to_compact_exercise(pd.concat(chunks, ignore_index=True))
+
+
+def _parse_session_directory(path, timezone):
+    """Parse every session JSON and TCX file of a Takeout directory in one batch"""
+    documents = []
+    tcx_frames = []
+    
+    for name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, name)
+        if name.endswith('.json'):
+            with open(file_path, 'rb') as f:
+                documents.append(json.load(f))
+        elif name.endswith('.tcx'):
+            tcx_frames.append(parse_tcx(file_path))
+    
+    sessions = pd.concat([parse_sessions(documents)] + tcx_frames, ignore_index=True)
+    exercise_data = to_compact_exercise(sessions_to_internal(sessions, timezone), errors='coerce')
+    return exercise_data.sort_values('datetime', ignore_index=True)
@@ -0,0 +1,135 @@
+from types import MappingProxyType
+from collections import namedtuple
+
+# Immutable LOINC index for vital signs, built once at import. Maps LOINC codes
+# and display-name synonyms to a canonical vital, and observed units to the
+# vital's canonical unit.
+
+VitalDefinition = namedtuple('VitalDefinition', ['code', 'name', 'unit'])
+
+SYSTOLIC_CODE = "8480-6"
+DIASTOLIC_CODE = "8462-4"
+HEART_RATE_CODE = "8867-4"
+BP_PANEL_CODE = "85354-9"
+
+# Canonical vitals, in the order they are presented to the LLM
+VITALS = MappingProxyType({
+    HEART_RATE_CODE: VitalDefinition(HEART_RATE_CODE, "Heart rate", "/min"),
+    SYSTOLIC_CODE: VitalDefinition(SYSTOLIC_CODE, "Systolic BP", "mmHg"),
+    DIASTOLIC_CODE: VitalDefinition(DIASTOLIC_CODE, "Diastolic BP", "mmHg"),
+    "8310-5": VitalDefinition("8310-5", "Body temperature", "Cel"),
+    "9279-1": VitalDefinition("9279-1", "Respiratory rate", "/min"),
+    "8302-2": VitalDefinition("8302-2", "Height", "cm"),
+    "29463-7": VitalDefinition("29463-7", "Weight", "kg"),
+    "39156-5": VitalDefinition("39156-5", "BMI", "kg/m2")
+})
+
+# Other LOINC codes and display names that denote the same vitals
+_SYNONYMS = {
+    HEART_RATE_CODE: ["8889-8", "Heart rate", "Pulse", "Pulse rate",
+                      "Heart rate by Pulse oximetry"],
+    SYSTOLIC_CODE: ["8459-0", "8460-8", "Systolic BP", "Systolic blood pressure",
+                    "Systolic blood pressure--sitting", "Systolic blood pressure--standing"],
+    DIASTOLIC_CODE: ["8453-3", "8454-1", "Diastolic BP", "Diastolic blood pressure",
+                     "Diastolic blood pressure--sitting", "Diastolic blood pressure--standing"],
+    "8310-5": ["8331-1", "8332-9", "8328-7", "Body temperature", "Oral temperature",
+               "Temperature", "Body Temperature"],
+    "9279-1": ["Respiratory rate", "Respiration rate", "Breathing rate"],
+    "8302-2": ["8306-3", "8308-9", "Height", "Body height", "Body Height",
+               "Body height --standing", "Body height Measured"],
+    "29463-7": ["3141-9", "3142-7", "Weight", "Body weight", "Body Weight",
+                "Body weight Measured"],
+    "39156-5": ["BMI", "Body mass index", "Body mass index (BMI) [Ratio]"]
+}
+
+# Multiplier and offset converting an observed unit to the canonical unit
+_UNIT_CONVERSIONS = {
+    "/min": {"/min": (1.0, 0.0), "{beats}/min": (1.0, 0.0), "beats/min": (1.0, 0.0),
+             "bpm": (1.0, 0.0), "{breaths}/min": (1.0, 0.0), "breaths/min": (1.0, 0.0)},
+    "mmHg": {"mmhg": (1.0, 0.0), "mm[hg]": (1.0, 0.0), "mm hg": (1.0, 0.0)},
+    "Cel": {"cel": (1.0, 0.0), "°c": (1.0, 0.0), "c": (1.0, 0.0), "degc": (1.0, 0.0),
+            "[degf]": (5.0 / 9.0, -32.0 * 5.0 / 9.0), "°f": (5.0 / 9.0, -32.0 * 5.0 / 9.0),
+            "f": (5.0 / 9.0, -32.0 * 5.0 / 9.0), "degf": (5.0 / 9.0, -32.0 * 5.0 / 9.0)},
+    "cm": {"cm": (1.0, 0.0), "m": (100.0, 0.0), "mm": (0.1, 0.0),
+           "[in_i]": (2.54, 0.0), "in": (2.54, 0.0), "[in_us]": (2.54, 0.0)},
+    "kg": {"kg": (1.0, 0.0), "g": (0.001, 0.0), "[lb_av]": (0.45359237, 0.0),
+           "lb": (0.45359237, 0.0), "lbs": (0.45359237, 0.0)},
+    "kg/m2": {"kg/m2": (1.0, 0.0), "kg/m^2": (1.0, 0.0), "kg/(m2)": (1.0, 0.0)}
+}
+
+
+def _build_index():
+    """Map every code and lower-cased synonym to its canonical VitalDefinition"""
+    index = {}
+    for code, definition in VITALS.items():
+        index[code] = definition
+        index[definition.name.lower()] = definition
+        for synonym in _SYNONYMS.get(code, []):
+            index[synonym.lower()] = definition
+    return MappingProxyType(index)
+
+
+_INDEX = _build_index()
+UNIT_CONVERSIONS = MappingProxyType({
+    unit: MappingProxyType(conversions) for unit, conversions in _UNIT_CONVERSIONS.items()
+})
+
+
+def lookup_vital(code_or_name):
+    """
+    Find the canonical vital for a LOINC code or display name
+    
+    Parameters:
+    - code_or_name: LOINC code (e.g. '8480-6') or display name (any case)
+    
+    Returns:
+    VitalDefinition, or None if the vital is not indexed
+    """
+    if not code_or_name:
+        return None
+    return _INDEX.get(code_or_name) or _INDEX.get(str(code_or_name).lower())
+
+
+def unit_conversion(definition, unit):
+    """
+    Conversion of an observed unit to a vital's canonical unit
+    
+    Parameters:
+    - definition: VitalDefinition from lookup_vital
+    - unit: Observed unit string
+    
+    Returns:
+    Tuple of (multiplier, offset), or None if the unit is not recognised
+    """
+    if unit is None:
+        return None
+    if unit == definition.unit:
+        return (1.0, 0.0)
+    return UNIT_CONVERSIONS[definition.unit].get(unit.strip().lower())
+
+
+def normalize_value(code_or_name, value, unit):
+    """
+    Convert a single reading to its vital's canonical name and unit
+    
+    Returns:
+    Tuple of (canonical name, value, canonical unit); unknown vitals or units
+    are returned unchanged
+    """
+    definition = lookup_vital(code_or_name)
+    if definition is None:
+        return code_or_name, value, unit
+    
+    conversion = unit_conversion(definition, unit)
+    if conversion is None:
+        return definition.name, value, unit
+    if conversion == (1.0, 0.0):
+        return definition.name, value, definition.unit
+    
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return definition.name, value, unit
+    
+    scale, offset = conversion
+    return definition.name, round(value * scale + offset, 2), definition.unit
@@ -0,0 +1,217 @@
+import re
+import csv
+import numpy as np
+import pandas as pd
+
+from .schema import to_compact_bp
+
+# Parsers for blood pressure exports. Two layouts are recognised from the
+# header line:
+#   - 'internal': the app's own omron_data.csv (date, time, systolic, ...)
+#   - 'omron_connect': the OMRON connect CSV export, whose headers carry units
+#     ('Systolic (mmHg)', 'Pulse (bpm)') and vary between app versions and
+#     languages
+# Both are mapped column-wise onto the internal layout and compacted.
+
+# Normalized header (lower case, letters only) -> internal column
+COLUMN_ALIASES = {
+    'date': 'date', 'measurementdate': 'date', 'datum': 'date', 'fecha': 'date',
+    'time': 'time', 'measurementtime': 'time', 'zeit': 'time', 'hora': 'time',
+    'datetime': 'datetime', 'measurementdatetime': 'datetime', 'dateandtime': 'datetime',
+    'systolic': 'systolic', 'systolicmmhg': 'systolic', 'sysmmhg': 'systolic', 'sys': 'systolic',
+    'systole': 'systolic', 'systolemmhg': 'systolic',
+    'diastolic': 'diastolic', 'diastolicmmhg': 'diastolic', 'diammhg': 'diastolic', 'dia': 'diastolic',
+    'diastole': 'diastolic', 'diastolemmhg': 'diastolic',
+    'pulse': 'pulse', 'pulsebpm': 'pulse', 'pulsebeatsmin': 'pulse', 'pulsemin': 'pulse',
+    'heartrate': 'pulse', 'heartratebpm': 'pulse', 'puls': 'pulse', 'pulsschlagmin': 'pulse',
+    'timeofday': 'time_of_day',
+    'irregularheartbeatdetected': 'irregular_heartbeat', 'irregularheartbeat': 'irregular_heartbeat',
+    'ihb': 'irregular_heartbeat', 'bodymovement': 'body_movement', 'bodymovementdetected': 'body_movement'
+}
+
+INTERNAL_COLUMNS = ['date', 'time', 'systolic', 'diastolic', 'pulse', 'time_of_day']
+
+DEVICE_FLAG_COLUMNS = ('irregular_heartbeat', 'body_movement')
+
+# Date and time formats tried, in order, on a sample before parsing a whole column
+DATETIME_FORMATS = [
+    '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y/%m/%d %H:%M:%S',
+    '%m/%d/%Y %H:%M', '%m/%d/%Y %I:%M %p', '%m/%d/%Y %I:%M:%S %p', '%d/%m/%Y %H:%M',
+    '%d.%m.%Y %H:%M', '%b %d %Y %I:%M %p', '%b %d %Y %H:%M', '%d %b %Y %H:%M'
+]
+
+
+def _normalize_header(name):
+    return re.sub(r'[^a-z]', '', name.lower())
+
+
+def _header_columns(header_bytes):
+    """Column names from the first line of a CSV file"""
+    text = header_bytes.decode('utf-8-sig', errors='replace')
+    first_line = text.splitlines()[0] if text else ""
+    delimiter = ';' if first_line.count(';') > first_line.count(',') else ','
+    columns = next(csv.reader([first_line], delimiter=delimiter), [])
+    return [column.strip() for column in columns], delimiter
+
+
+def detect_schema(header_bytes):
+    """
+    Identify a blood pressure CSV layout from the first bytes of the file
+    
+    Parameters:
+    - header_bytes: Start of the file (at least the header line)
+    
+    Returns:
+    Dictionary with the layout 'name', the 'delimiter' and the 'columns' map
+    from file column to internal column, or None if the file is not a
+    recognised blood pressure export
+    """
+    columns, delimiter = _header_columns(header_bytes)
+    
+    column_map = {}
+    for column in columns:
+        internal = COLUMN_ALIASES.get(_normalize_header(column))
+        if internal is not None and internal not in column_map.values():
+            column_map[column] = internal
+    
+    mapped = set(column_map.values())
+    if not {'systolic', 'diastolic'} <= mapped or not mapped & {'date', 'datetime'}:
+        return None
+    
+    name = 'internal' if all(column in INTERNAL_COLUMNS for column in column_map) else 'omron_connect'
+    return {'name': name, 'delimiter': delimiter, 'columns': column_map}
+
+
+def parse_datetimes(dates, times=None):
+    """
+    Parse date (and optional time) strings into datetime64 values
+    
+    The format is detected once on a sample and then applied to the whole
+    column, which is much faster than per-value inference; values that do not
+    match become NaT.
+    
+    Parameters:
+    - dates: Series of date or date-time strings
+    - times: Optional Series of time strings
+    
+    Returns:
+    datetime64 Series
+    """
+    if times is not None:
+        text = dates.astype(str).str.strip() + ' ' + times.astype(str).str.strip()
+    else:
+        text = dates.astype(str).str.strip()
+    text = text.str.replace(',', '', regex=False)
+    
+    sample = text.dropna().head(20)
+    for datetime_format in DATETIME_FORMATS:
+        candidates = [datetime_format]
+        if times is None:
+            candidates.append(datetime_format.split(' ')[0])
+        for candidate in candidates:
+            parsed = pd.to_datetime(sample, format=candidate, errors='coerce')
+            if len(sample) and parsed.notna().all():
+                return pd.to_datetime(text, format=candidate, errors='coerce')
+    
+    return pd.to_datetime(text, format='mixed', errors='coerce')
+
+
+def normalize_chunk(raw_data, schema):
+    """
+    Map a chunk of a detected export onto the internal blood pressure layout
+    
+    Parameters:
+    - raw_data: DataFrame read with the schema's columns
+    - schema: Result of detect_schema
+    
+    Returns:
+    DataFrame with 'datetime' (or 'date'/'time'), 'systolic', 'diastolic' and
+    optionally 'pulse', 'time_of_day' and device flag columns
+    """
+    raw_data = raw_data.rename(columns=schema['columns'])
+    if schema['name'] == 'internal':
+        return raw_data
+    
+    if 'datetime' in raw_data.columns:
+        raw_data['datetime'] = parse_datetimes(raw_data['datetime'])
+    else:
+        raw_data['datetime'] = parse_datetimes(raw_data['date'], raw_data.get('time'))
+        raw_data = raw_data.drop(columns=[c for c in ('date', 'time') if c in raw_data.columns])
+    
+    # Device flags are exported as text ('Yes', '-', '1'); keep them as booleans
+    for column in DEVICE_FLAG_COLUMNS:
+        if column in raw_data.columns:
+            flags = raw_data[column].astype(str).str.strip().str.lower()
+            raw_data[column] = flags.isin(['yes', 'true', '1', 'y', 'x', 'detected', 'ja', 'si'])
+    
+    return raw_data
+
+
+def read_chunks(handle, schema, chunk_rows=100000):
+    """
+    Stream a detected blood pressure CSV in normalized chunks
+    
+    Parameters:
+    - handle: Binary file object positioned at the start of the file
+    - schema: Result of detect_schema
+    - chunk_rows: Number of rows parsed at a time
+    
+    Yields:
+    DataFrames in the internal layout (see normalize_chunk)
+    """
+    dtypes = {column: str for column, internal in schema['columns'].items()
+              if internal in ('date', 'time', 'datetime') + DEVICE_FLAG_COLUMNS}
+    dtypes.update({column: 'category' for column, internal in schema['columns'].items()
+                   if internal == 'time_of_day'})
+    
+    reader = pd.read_csv(
+        handle,
+        sep=schema['delimiter'],
+        usecols=list(schema['columns']),
+        dtype=dtypes,
+        chunksize=chunk_rows,
+        encoding='utf-8-sig',
+        skipinitialspace=True
+    )
+    for raw_chunk in reader:
+        yield normalize_chunk(raw_chunk, schema)
+
+
+def to_compact(raw_data, errors='coerce'):
+    """
+    Compact a normalized chunk, keeping the device flag columns next to the vitals
+    
+    Returns:
+    DataFrame in the compact BP schema
+    """
+    compact = to_compact_bp(raw_data, errors=errors)
+    
+    for column in DEVICE_FLAG_COLUMNS:
+        if column in raw_data.columns:
+            compact[column] = raw_data[column].to_numpy(dtype=np.bool_)
+    
+    return compact
+
+
+def parse_omron_csv(path):
+    """
+    Load a blood pressure CSV in any recognised layout
+    
+    Parameters:
+    - path: Path to an OMRON connect export or an internal omron_data.csv
+    
+    Returns:
+    DataFrame in the compact BP schema
+    """
+    with open(path, 'rb') as f:
+        schema = detect_schema(f.read(4096))
+        if schema is None:
+            raise Exception(f"{path} is not a recognised blood pressure export")
+        
+        f.seek(0)
+        chunks = [to_compact(chunk) for chunk in read_chunks(f, schema)]
+    
+    if len(chunks) == 1:
+        return chunks[0]
+    # Re-compact so enum categories and integer dtypes are unified across chunks
+    return to_compact(pd.concat(chunks, ignore_index=True))
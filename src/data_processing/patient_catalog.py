@@ -0,0 +1,278 @@
+import os
+import json
+import sqlite3
+import threading
+import pandas as pd
+from contextlib import contextmanager
+
+from . import omron, google_fit
+
+
+# Per-patient files tracked by the catalog, relative to the patient folder
+INFO_FILE = "patient_info.json"
+OMRON_FILE = os.path.join("omron", "omron_data.csv")
+FIT_FILE = os.path.join("google_fit", "google_fit.csv")
+
+COLUMNS = [
+    "id", "name", "age", "gender", "birth_date", "bp_category", "has_hypertension",
+    "conditions", "medications",
+    "bp_rows", "bp_start", "bp_end", "exercise_rows", "exercise_start", "exercise_end",
+    "info_mtime", "omron_mtime", "fit_mtime"
+]
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _device_summary(path, parser):
+    """
+    Count and first/last date of the timestamped rows of a device export
+    
+    Parameters:
+    - path: Device file in any layout the parser recognises
+    - parser: Module providing detect_schema and read_chunks (omron or google_fit)
+    """
+    if not os.path.exists(path):
+        return 0, None, None
+    
+    count, first, last = 0, None, None
+    try:
+        with open(path, 'rb') as f:
+            schema = parser.detect_schema(f.read(4096))
+            if schema is None:
+                print(f"Error reading {path}: unrecognised export layout")
+                return 0, None, None
+            f.seek(0)
+            
+            for chunk in parser.read_chunks(f, schema):
+                if 'datetime' in chunk.columns:
+                    times = pd.to_datetime(chunk['datetime'], errors='coerce')
+                elif 'date' in chunk.columns:
+                    times = omron.parse_datetimes(chunk['date'], chunk.get('time'))
+                else:
+                    continue
+                times = times.dropna()
+                if times.empty:
+                    continue
+                count += len(times)
+                first = times.min() if first is None else min(first, times.min())
+                last = times.max() if last is None else max(last, times.max())
+    except Exception as e:
+        print(f"Error reading {path}: {str(e)}")
+        return 0, None, None
+    
+    if not count:
+        return 0, None, None
+    return count, first.strftime("%Y-%m-%d"), last.strftime("%Y-%m-%d")
+
+
+def _info_summary(path):
+    """Catalog fields of a patient_info.json, flat or with a demographics block"""
+    try:
+        with open(path, 'r') as f:
+            patient_data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    
+    demographics = patient_data.get("demographics", patient_data)
+    age = demographics.get("age")
+    return {
+        "name": demographics.get("name"),
+        "age": age if isinstance(age, int) else None,
+        "gender": demographics.get("gender"),
+        "birth_date": demographics.get("birth_date"),
+        "bp_category": patient_data.get("bp_category"),
+        "has_hypertension": int(bool(patient_data.get("has_hypertension", False))),
+        "conditions": json.dumps(patient_data.get("conditions", [])),
+        "medications": json.dumps(patient_data.get("medications", []))
+    }
+
+
+class PatientCatalog:
+    """
+    SQLite manifest of the patients under data_dir
+    
+    One row per patient folder holds the demographics, BP category, device data
+    row counts and date ranges, and the mtimes of the files they came from.
+    refresh() only stats the files and re-reads those whose mtime changed, so
+    the patient picker and cohort queries read a single table instead of
+    opening every patient_info.json.
+    """
+    
+    CATALOG_FILE = "patient_catalog.sqlite"
+    
+    def __init__(self, data_dir="data/patient_data", db_path=None):
+        self.data_dir = data_dir
+        # Kept outside data_dir: SQLite's journal files would otherwise change the
+        # folder's mtime on every write and make the name index rescan it
+        self.db_path = db_path or os.path.join(os.path.dirname(os.path.abspath(data_dir)), self.CATALOG_FILE)
+        os.makedirs(data_dir, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS patients ("
+                "id TEXT PRIMARY KEY, name TEXT, age INTEGER, gender TEXT, birth_date TEXT, "
+                "bp_category TEXT, has_hypertension INTEGER, conditions TEXT, medications TEXT, "
+                "bp_rows INTEGER, bp_start TEXT, bp_end TEXT, "
+                "exercise_rows INTEGER, exercise_start TEXT, exercise_end TEXT, "
+                "info_mtime REAL, omron_mtime REAL, fit_mtime REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS patients_name ON patients (name)")
+    
+    @contextmanager
+    def _connect(self):
+        """Short-lived connection (usable from any Streamlit thread), committed on success"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def refresh(self):
+        """
+        Bring the catalog up to date with the patient folders on disk
+        
+        Returns:
+        Dictionary with the number of patients added, updated and removed
+        """
+        summary = {'added': 0, 'updated': 0, 'removed': 0}
+        
+        with self._lock, self._connect() as conn:
+            known = {
+                row[0]: row[1:]
+                for row in conn.execute("SELECT id, info_mtime, omron_mtime, fit_mtime FROM patients")
+            }
+            
+            try:
+                folders = [entry for entry in os.scandir(self.data_dir) if entry.is_dir()]
+            except OSError:
+                folders = []
+            
+            seen = set()
+            for folder in folders:
+                mtimes = (
+                    _mtime(os.path.join(folder.path, INFO_FILE)),
+                    _mtime(os.path.join(folder.path, OMRON_FILE)),
+                    _mtime(os.path.join(folder.path, FIT_FILE))
+                )
+                if mtimes == (None, None, None):
+                    continue
+                
+                seen.add(folder.name)
+                previous = known.get(folder.name)
+                if previous == mtimes:
+                    continue
+                
+                self._update(conn, folder.name, mtimes, previous)
+                summary['updated' if previous is not None else 'added'] += 1
+            
+            removed = [(patient_id,) for patient_id in known if patient_id not in seen]
+            conn.executemany("DELETE FROM patients WHERE id = ?", removed)
+            summary['removed'] = len(removed)
+        
+        return summary
+    
+    def refresh_patient(self, patient_id):
+        """Re-read one patient's files if they changed (e.g. right after loading or saving it)"""
+        patient_dir = os.path.join(self.data_dir, patient_id)
+        mtimes = (
+            _mtime(os.path.join(patient_dir, INFO_FILE)),
+            _mtime(os.path.join(patient_dir, OMRON_FILE)),
+            _mtime(os.path.join(patient_dir, FIT_FILE))
+        )
+        
+        with self._lock, self._connect() as conn:
+            if mtimes == (None, None, None):
+                conn.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+                return
+            
+            row = conn.execute(
+                "SELECT info_mtime, omron_mtime, fit_mtime FROM patients WHERE id = ?", (patient_id,)
+            ).fetchone()
+            if row != mtimes:
+                self._update(conn, patient_id, mtimes, row)
+    
+    def _update(self, conn, patient_id, mtimes, previous):
+        """Re-read the files of one patient whose mtimes changed and upsert its row"""
+        patient_dir = os.path.join(self.data_dir, patient_id)
+        info_mtime, omron_mtime, fit_mtime = mtimes
+        
+        row = {}
+        if previous is not None:
+            cursor = conn.execute("SELECT * FROM patients WHERE id = ?", (patient_id,))
+            row = dict(zip([c[0] for c in cursor.description], cursor.fetchone()))
+            previous_info, previous_omron, previous_fit = previous
+        else:
+            previous_info = previous_omron = previous_fit = False
+        
+        if info_mtime != previous_info:
+            row.update(_info_summary(os.path.join(patient_dir, INFO_FILE)))
+        if omron_mtime != previous_omron:
+            row["bp_rows"], row["bp_start"], row["bp_end"] = _device_summary(os.path.join(patient_dir, OMRON_FILE), omron)
+        if fit_mtime != previous_fit:
+            row["exercise_rows"], row["exercise_start"], row["exercise_end"] = _device_summary(os.path.join(patient_dir, FIT_FILE), google_fit)
+        
+        row.update({"id": patient_id, "info_mtime": info_mtime, "omron_mtime": omron_mtime, "fit_mtime": fit_mtime})
+        conn.execute(
+            f"INSERT OR REPLACE INTO patients ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            [row.get(column) for column in COLUMNS]
+        )
+    
+    def list_patients(self, where=None, params=(), columns=None):
+        """
+        Patients in the catalog as a DataFrame, sorted by name
+        
+        Parameters:
+        - where: Optional SQL condition for cohort selection,
+                 e.g. "bp_category = ? AND bp_rows > 0"
+        - params: Parameters for the placeholders in where
+        - columns: Catalog columns to return (all but the file mtimes if None)
+        
+        Returns:
+        DataFrame with one row per patient (conditions and medications as lists)
+        """
+        columns = list(columns or COLUMNS[:-3])
+        query = f"SELECT {', '.join(columns)} FROM patients"
+        if where:
+            query += f" WHERE {where}"
+        query += " ORDER BY name, id"
+        
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        patients = pd.DataFrame.from_records(rows, columns=columns)
+        
+        for column in ["conditions", "medications"]:
+            if column in patients:
+                patients[column] = [json.loads(value) if value else [] for value in patients[column]]
+        if "has_hypertension" in patients:
+            patients["has_hypertension"] = patients["has_hypertension"].fillna(0).astype(bool)
+        return patients
+    
+    def get_patient(self, patient_id):
+        """
+        Catalog row of one patient
+        
+        Returns:
+        Dictionary of catalog fields, or None if the patient is not catalogued
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(f"SELECT {', '.join(COLUMNS[:-3])} FROM patients WHERE id = ?", (patient_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        
+        patient = dict(zip(COLUMNS, row))
+        patient["conditions"] = json.loads(patient["conditions"] or "[]")
+        patient["medications"] = json.loads(patient["medications"] or "[]")
+        patient["has_hypertension"] = bool(patient["has_hypertension"])
+        return patient
+    
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
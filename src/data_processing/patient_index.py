@@ -0,0 +1,326 @@
+import os
+import json
+import bisect
+import tempfile
+import unicodedata
+import re
+from collections import defaultdict
+
+
+def normalize_name(name):
+    """
+    Split a patient name into normalized tokens
+    
+    Accents are stripped, case is folded and punctuation is dropped, so
+    'José  O'Brien' and 'jose obrien' give the same tokens.
+    
+    Returns:
+    List of name tokens
+    """
+    if not name:
+        return []
+    name = unicodedata.normalize('NFKD', str(name))
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = name.casefold().replace("'", "")
+    return re.findall(r"[a-z0-9]+", name)
+
+
+def trigrams(token):
+    """Character trigrams of a token, padded so short tokens still have some"""
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def patient_name(patient_data):
+    """Display name from either patient_info.json layout (flat or with a demographics block)"""
+    if "demographics" in patient_data:
+        return patient_data["demographics"].get("name")
+    return patient_data.get("name")
+
+
+def save_patient_info(data_dir, patient_id, patient_data):
+    """
+    Save patient data to data_dir/<patient_id>/patient_info.json
+    
+    Returns:
+    Path of the written file
+    """
+    patient_dir = os.path.join(data_dir, patient_id)
+    os.makedirs(patient_dir, exist_ok=True)
+    
+    path = os.path.join(patient_dir, "patient_info.json")
+    _write_json(path, patient_data, indent=2)
+    return path
+
+
+def _write_json(path, data, **kwargs):
+    """Write JSON through a temporary file of its own, so concurrent writers and readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class PatientIndex:
+    """
+    Local name index over data_dir/<patient_id>/patient_info.json
+    
+    Names are held as normalized tokens in an inverted index, a sorted token
+    list for prefix search and a trigram index for fuzzy matches. The index is
+    persisted next to the patient folders together with each file's mtime, so
+    refresh() only re-reads patient_info.json files that changed.
+    """
+    
+    INDEX_FILE = "patient_index.json"
+    
+    def __init__(self, data_dir="data/patient_data", min_similarity=0.5):
+        self.data_dir = data_dir
+        self.min_similarity = min_similarity
+        self.index_path = os.path.join(data_dir, self.INDEX_FILE)
+        
+        self._entries = {}                     # patient id -> {'name', 'mtime'}
+        self._tokens = defaultdict(set)        # token -> patient ids
+        self._trigrams = defaultdict(set)      # trigram -> tokens
+        self._sorted_tokens = []
+        self._dir_mtime = None
+        
+        self._load()
+        self.refresh()
+    
+    def refresh(self):
+        """
+        Bring the index up to date with the patient folders on disk
+        
+        Returns:
+        Number of patients added, updated or removed
+        """
+        try:
+            self._dir_mtime = os.stat(self.data_dir).st_mtime
+            folders = [entry for entry in os.scandir(self.data_dir) if entry.is_dir()]
+        except OSError:
+            return 0
+        
+        changed = 0
+        seen = set()
+        for folder in folders:
+            path = os.path.join(folder.path, "patient_info.json")
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            
+            seen.add(folder.name)
+            entry = self._entries.get(folder.name)
+            if entry is not None and entry['mtime'] == mtime:
+                continue
+            
+            try:
+                with open(path, 'r') as f:
+                    name = patient_name(json.load(f))
+            except (OSError, ValueError):
+                continue
+            
+            self._set(folder.name, name, mtime)
+            changed += 1
+        
+        for patient_id in set(self._entries) - seen:
+            self.remove(patient_id)
+            changed += 1
+        
+        if changed:
+            self._save()
+        
+        return changed
+    
+    def add(self, patient_id, name):
+        """Index or re-index one patient, e.g. right after its patient_info.json is saved"""
+        path = os.path.join(self.data_dir, patient_id, "patient_info.json")
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        
+        # Not persisted here: the next refresh() sees the new mtime and re-reads the file
+        self._set(patient_id, name, mtime)
+    
+    def remove(self, patient_id):
+        """Drop a patient from the index"""
+        entry = self._entries.pop(patient_id, None)
+        if entry is None:
+            return
+        
+        for token in normalize_name(entry['name']):
+            patients = self._tokens.get(token)
+            if patients is None:
+                continue
+            patients.discard(patient_id)
+            if not patients:
+                del self._tokens[token]
+                self._drop_token(token)
+    
+    def search(self, query, limit=10):
+        """
+        Find patients by name
+        
+        Tries an exact token match first, then a prefix match on every token
+        (so 'eli rod' finds 'Elizabeth Rodriguez'), then trigram similarity to
+        tolerate typos.
+        
+        Parameters:
+        - query: Full or partial patient name
+        - limit: Maximum number of matches to return (all if None)
+        
+        Returns:
+        List of dictionaries with 'id', 'name' and 'score' (1.0 for exact
+        matches), best first
+        """
+        self._refresh_if_changed()
+        
+        query_tokens = normalize_name(query)
+        if not query_tokens:
+            return []
+        
+        # Exact: every query token is a name token
+        matches = self._intersect(self._tokens.get(token, frozenset()) for token in query_tokens)
+        if matches:
+            return self._results({patient_id: 1.0 for patient_id in matches}, limit)
+        
+        # Prefix: every query token starts some name token
+        matches = self._intersect(self._prefix_patients(token) for token in query_tokens)
+        if matches:
+            return self._results({patient_id: 0.9 for patient_id in matches}, limit)
+        
+        # Fuzzy: score each patient by the mean best trigram similarity of the query tokens
+        scores = defaultdict(float)
+        for token in query_tokens:
+            best = {}
+            for name_token, similarity in self._similar_tokens(token):
+                for patient_id in self._tokens[name_token]:
+                    if similarity > best.get(patient_id, 0.0):
+                        best[patient_id] = similarity
+            for patient_id, similarity in best.items():
+                scores[patient_id] += similarity / len(query_tokens)
+        
+        scores = {pid: score for pid, score in scores.items() if score >= self.min_similarity}
+        return self._results(scores, limit)
+    
+    def find(self, query):
+        """
+        The saved patient a full name refers to
+        
+        Only an exact match counts: the query must have the same name tokens
+        as the patient (in any order, ignoring case and accents) and no other
+        saved patient may share them. Prefix and fuzzy matches could be a
+        different person, so they are left to search() and the caller.
+        
+        Returns:
+        Dictionary with patient 'id' and 'name', or None without a single exact match
+        """
+        query_tokens = sorted(normalize_name(query))
+        matches = [
+            result for result in self.search(query, limit=None)
+            if result["score"] == 1.0 and sorted(normalize_name(result["name"])) == query_tokens
+        ]
+        if len(matches) != 1:
+            return None
+        return {"id": matches[0]["id"], "name": matches[0]["name"]}
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _set(self, patient_id, name, mtime):
+        self.remove(patient_id)
+        self._entries[patient_id] = {'name': name, 'mtime': mtime}
+        
+        for token in normalize_name(name):
+            if token not in self._tokens:
+                bisect.insort(self._sorted_tokens, token)
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].add(token)
+            self._tokens[token].add(patient_id)
+    
+    def _drop_token(self, token):
+        position = bisect.bisect_left(self._sorted_tokens, token)
+        if position < len(self._sorted_tokens) and self._sorted_tokens[position] == token:
+            del self._sorted_tokens[position]
+        
+        for trigram in trigrams(token):
+            tokens = self._trigrams.get(trigram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._trigrams[trigram]
+    
+    def _prefix_patients(self, prefix):
+        """Patient ids with a name token starting with prefix"""
+        patients = set()
+        position = bisect.bisect_left(self._sorted_tokens, prefix)
+        while position < len(self._sorted_tokens) and self._sorted_tokens[position].startswith(prefix):
+            patients |= self._tokens[self._sorted_tokens[position]]
+            position += 1
+        return patients
+    
+    def _similar_tokens(self, token):
+        """Name tokens sharing trigrams with token, with their Dice similarity"""
+        query_trigrams = trigrams(token)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for name_token in self._trigrams.get(trigram, ()):
+                shared[name_token] += 1
+        
+        for name_token, count in shared.items():
+            similarity = 2.0 * count / (len(query_trigrams) + len(name_token) + 1)
+            if similarity >= self.min_similarity:
+                yield name_token, similarity
+    
+    @staticmethod
+    def _intersect(sets):
+        sets = sorted(sets, key=len)
+        if not sets or not sets[0]:
+            return set()
+        result = set(sets[0])
+        for patients in sets[1:]:
+            result &= patients
+            if not result:
+                break
+        return result
+    
+    def _results(self, scores, limit):
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self._entries[item[0]]['name'] or ""))
+        return [
+            {"id": patient_id, "name": self._entries[patient_id]['name'], "score": round(score, 3)}
+            for patient_id, score in ranked[:limit]
+        ]
+    
+    def _refresh_if_changed(self):
+        """Rescan when patient folders were added or removed (cheap: one stat call)"""
+        try:
+            dir_mtime = os.stat(self.data_dir).st_mtime
+        except OSError:
+            return
+        if dir_mtime != self._dir_mtime:
+            self.refresh()
+    
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        
+        for patient_id, entry in entries.items():
+            self._set(patient_id, entry.get('name'), entry.get('mtime'))
+    
+    def _save(self):
+        try:
+            _write_json(self.index_path, self._entries)
+            # Writing the index file inside data_dir is not a change to the patient folders
+            self._dir_mtime = os.stat(self.data_dir).st_mtime
+        except OSError as e:
+            print(f"Error saving patient index: {str(e)}")
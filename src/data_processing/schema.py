@@ -0,0 +1,301 @@
+import pandas as pd
+import numpy as np
+
+# Canonical compact schema for loaded device data. Readings keep a single
+# datetime64 column; 'date' and 'time' are derived on demand with
+# date_column / time_column instead of being stored next to it.
+
+BP_VITAL_COLUMNS = ['systolic', 'diastolic', 'pulse']
+
+EXERCISE_NUMERIC_COLUMNS = {
+    'duration_minutes': np.int16,
+    'calories_burned': np.int16,
+    'avg_heart_rate': np.int16,
+    'steps': np.int32
+}
+
+# Known values for enum columns, in display order
+INTENSITY_LEVELS = ['Low', 'Moderate', 'High']
+TIME_OF_DAY_VALUES = ['Morning', 'Afternoon', 'Evening', 'Night']
+
+
+def _parse_datetime(raw_data, errors='raise'):
+    """Combine the raw 'date' and 'time' columns into one datetime64 column"""
+    if 'datetime' in raw_data.columns:
+        return pd.to_datetime(raw_data['datetime'], errors=errors)
+    
+    if 'time' in raw_data.columns:
+        return pd.to_datetime(
+            raw_data['date'].astype(str) + ' ' + raw_data['time'].astype(str),
+            errors=errors
+        )
+    
+    return pd.to_datetime(raw_data['date'], errors=errors)
+
+
+def _compact_integer(values, dtype):
+    """
+    Downcast a numeric column to an integer type
+    
+    Fractional values are rounded to the nearest integer rather than truncated.
+    The column falls back to float32 when values are missing or do not fit
+    dtype, so out-of-range values reach validation instead of wrapping around.
+    """
+    values = pd.to_numeric(values, errors='coerce').round()
+    
+    limits = np.iinfo(dtype)
+    if values.isna().any() or values.min() < limits.min or values.max() > limits.max:
+        return values.astype(np.float32)
+    
+    return values.astype(dtype)
+
+
+def _compact_enum(values, known_values=None):
+    """Convert a string column to a categorical, keeping unseen values as extra categories"""
+    if known_values is None:
+        return values.astype('category')
+    
+    extra_values = sorted(set(values.dropna().unique()) - set(known_values))
+    return pd.Categorical(values, categories=known_values + extra_values)
+
+
+def to_compact_bp(raw_data, errors='raise'):
+    """
+    Convert a raw blood pressure DataFrame to the compact schema
+    
+    Parameters:
+    - raw_data: DataFrame with 'date', 'time', 'systolic', 'diastolic', 'pulse'
+      and optionally 'time_of_day' columns
+    - errors: 'coerce' turns unparseable timestamps into NaT instead of raising
+    
+    Returns:
+    DataFrame with 'datetime', int16 vitals and a categorical 'time_of_day'
+    """
+    compact = pd.DataFrame({'datetime': _parse_datetime(raw_data, errors)})
+    
+    for column in BP_VITAL_COLUMNS:
+        if column in raw_data.columns:
+            compact[column] = _compact_integer(raw_data[column], np.int16)
+    
+    if 'time_of_day' in raw_data.columns:
+        compact['time_of_day'] = _compact_enum(raw_data['time_of_day'], TIME_OF_DAY_VALUES)
+    
+    return compact
+
+
+def to_compact_exercise(raw_data, errors='raise'):
+    """
+    Convert a raw exercise DataFrame to the compact schema
+    
+    Parameters:
+    - raw_data: DataFrame with 'date', 'time', 'exercise_type', 'duration_minutes',
+      'intensity' and optional metric columns
+    - errors: 'coerce' turns unparseable timestamps into NaT instead of raising
+    
+    Returns:
+    DataFrame with 'datetime', categorical enums and downcast numeric columns
+    """
+    compact = pd.DataFrame({'datetime': _parse_datetime(raw_data, errors)})
+    
+    if 'exercise_type' in raw_data.columns:
+        compact['exercise_type'] = _compact_enum(raw_data['exercise_type'])
+    
+    for column, dtype in EXERCISE_NUMERIC_COLUMNS.items():
+        if column in raw_data.columns:
+            compact[column] = _compact_integer(raw_data[column], dtype)
+    
+    if 'intensity' in raw_data.columns:
+        compact['intensity'] = _compact_enum(raw_data['intensity'], INTENSITY_LEVELS)
+    
+    # Keep any extra columns the source provided
+    for column in raw_data.columns:
+        if column not in compact.columns and column not in ('date', 'time', 'datetime'):
+            compact[column] = raw_data[column].to_numpy()
+    
+    return compact
+
+
+def time_of_day_from_datetime(datetimes):
+    """
+    Classify reading times into TIME_OF_DAY_VALUES
+    
+    Parameters:
+    - datetimes: datetime64 Series
+    
+    Returns:
+    Categorical with Morning (5-11h), Afternoon (12-16h), Evening (17-22h) or Night
+    """
+    hours = datetimes.dt.hour.to_numpy()
+    codes = np.select(
+        [(hours >= 5) & (hours < 12), (hours >= 12) & (hours < 17), (hours >= 17) & (hours < 23)],
+        [0, 1, 2],
+        default=3
+    )
+    return pd.Categorical.from_codes(codes, categories=TIME_OF_DAY_VALUES)
+
+
+def merge_bp_frames(primary, secondary, resolution='min'):
+    """
+    Merge two compact BP frames into one time-ordered frame without duplicates
+    
+    A secondary reading whose timestamp falls in the same resolution bucket
+    (same minute by default) as a primary reading is treated as the same
+    measurement and dropped. Every primary row is kept, so back-to-back
+    readings of one device within a minute all stay.
+    
+    Parameters:
+    - primary: Compact BP DataFrame that wins on duplicates (e.g. device data)
+    - secondary: Compact BP DataFrame to merge in (e.g. FHIR Observations)
+    - resolution: pandas frequency used to match timestamps
+    
+    Returns:
+    Compact BP DataFrame sorted by 'datetime'
+    """
+    if secondary is None or secondary.empty:
+        return primary
+    if primary is None or primary.empty:
+        return secondary
+    
+    columns = [col for col in primary.columns if col in secondary.columns]
+    primary_buckets = primary['datetime'].dt.floor(resolution).to_numpy().view(np.int64)
+    secondary_buckets = secondary['datetime'].dt.floor(resolution).to_numpy().view(np.int64)
+    new_secondary = secondary.loc[~np.isin(secondary_buckets, primary_buckets), columns]
+    
+    # Primary rows first, so a stable sort keeps them ahead of secondary rows at the same time
+    combined = pd.concat([primary[columns], new_secondary], ignore_index=True)
+    order = np.argsort(combined['datetime'].to_numpy(), kind='stable')
+    
+    # Re-compact so enum categories and integer dtypes are unified across both sources
+    return to_compact_bp(combined.iloc[order].reset_index(drop=True))
+
+
+# Plausible ranges used to reject malformed rows on ingest
+BP_VALID_RANGES = {
+    'systolic': (50, 300),
+    'diastolic': (30, 200),
+    'pulse': (20, 250)
+}
+
+EXERCISE_VALID_RANGES = {
+    'duration_minutes': (1, 1440),
+    'calories_burned': (0, 10000),
+    'avg_heart_rate': (20, 250),
+    'steps': (0, 200000)
+}
+
+
+def _valid_mask(compact, valid_ranges, required):
+    """Rows with a timestamp, every required column present and values within range"""
+    valid = ~np.isnat(compact['datetime'].to_numpy(dtype='datetime64[ns]'))
+    
+    for column, (low, high) in valid_ranges.items():
+        if column not in compact.columns:
+            continue
+        values = compact[column].to_numpy(dtype=np.float32, na_value=np.nan)
+        missing = np.isnan(values)
+        if column in required:
+            valid &= ~missing
+        with np.errstate(invalid='ignore'):
+            valid &= missing | ((values >= low) & (values <= high))
+    
+    return valid
+
+
+def valid_bp_rows(compact):
+    """
+    Flag the usable rows of a compact BP frame
+    
+    Returns:
+    Boolean array, False for rows without a timestamp, without systolic or
+    diastolic values, with implausible vitals or with systolic <= diastolic
+    """
+    valid = _valid_mask(compact, BP_VALID_RANGES, required=['systolic', 'diastolic'])
+    
+    if 'systolic' in compact.columns and 'diastolic' in compact.columns:
+        with np.errstate(invalid='ignore'):
+            valid &= (
+                compact['systolic'].to_numpy(dtype=np.float32, na_value=np.nan) >
+                compact['diastolic'].to_numpy(dtype=np.float32, na_value=np.nan)
+            )
+    
+    return valid
+
+
+def valid_exercise_rows(compact):
+    """
+    Flag the usable rows of a compact exercise frame
+    
+    Returns:
+    Boolean array, False for rows without a timestamp or with implausible metrics
+    """
+    return _valid_mask(compact, EXERCISE_VALID_RANGES, required=['duration_minutes'])
+
+
+def date_column(data):
+    """
+    Derive the calendar date of each row
+    
+    Parameters:
+    - data: DataFrame in the compact schema (or a legacy frame with 'date')
+    
+    Returns:
+    datetime64 Series normalized to midnight, named 'date'
+    """
+    if 'datetime' in data.columns:
+        return data['datetime'].dt.normalize().rename('date')
+    
+    return pd.to_datetime(data['date']).dt.normalize().rename('date')
+
+
+def time_column(data):
+    """
+    Derive the 'HH:MM' time of each row
+    
+    Parameters:
+    - data: DataFrame in the compact schema
+    
+    Returns:
+    String Series named 'time'
+    """
+    return data['datetime'].dt.strftime('%H:%M').rename('time')
+
+
+def memory_report(before, after, rows=None):
+    """
+    Compare the memory footprint of a frame before and after compaction
+    
+    Parameters:
+    - before: DataFrame as originally loaded, or its size in bytes (e.g. summed
+      over the chunks of a streamed file)
+    - after: DataFrame in the compact schema, or its size in bytes
+    - rows: Number of rows, when neither frame is given (the per-row counts
+      are None without it)
+    
+    Returns:
+    Dictionary with total and per-row byte counts
+    """
+    if isinstance(before, pd.DataFrame):
+        rows = len(before)
+        before_bytes = int(before.memory_usage(deep=True).sum())
+    else:
+        before_bytes = int(before)
+    if isinstance(after, pd.DataFrame):
+        rows = len(after)
+        after_bytes = int(after.memory_usage(deep=True).sum())
+    else:
+        after_bytes = int(after)
+    
+    if rows is None:
+        before_per_row = after_per_row = None
+    else:
+        before_per_row = before_bytes / max(rows, 1)
+        after_per_row = after_bytes / max(rows, 1)
+    
+    return {
+        'rows': rows,
+        'before_bytes': before_bytes,
+        'after_bytes': after_bytes,
+        'before_bytes_per_row': before_per_row,
+        'after_bytes_per_row': after_per_row,
+        'reduction_pct': (1 - after_bytes / before_bytes) * 100 if before_bytes else 0.0
+    }
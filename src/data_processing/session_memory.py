@@ -0,0 +1,392 @@
+import os
+import time
+import shutil
+import pickle
+import hashlib
+import tempfile
+import threading
+import pandas as pd
+
+SPILL_PREFIX = "session-"
+SPILL_FILE = "values.pkl"
+
+
+def _column_fingerprint(series):
+    """Content hash of a single column (values and dtype, ignoring the index)"""
+    hashed = pd.util.hash_pandas_object(series, index=False).to_numpy()
+    digest = hashlib.sha1(hashed.tobytes())
+    digest.update(str(series.dtype).encode())
+    return digest.hexdigest()
+
+
+def _index_fingerprint(frame):
+    """Content hash of a DataFrame index"""
+    hashed = pd.util.hash_pandas_object(frame.index.to_series(), index=False).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+
+class _FrameRecord:
+    """A shared DataFrame held once by the governor, with its column fingerprints"""
+    
+    def __init__(self, frame):
+        self.frame = frame
+        self.index_fingerprint = _index_fingerprint(frame)
+        self.column_fingerprints = {col: _column_fingerprint(frame[col]) for col in frame.columns}
+        self.fingerprint = hashlib.sha1(
+            (self.index_fingerprint + '|' + '|'.join(
+                f"{col}:{fp}" for col, fp in self.column_fingerprints.items()
+            )).encode()
+        ).hexdigest()
+        self.bytes = int(frame.memory_usage(deep=True).sum())
+        self.refcount = 0
+
+
+class SessionMemoryGovernor:
+    """
+    Holds the DataFrames of many Streamlit sessions with as little duplication as possible
+    
+    - Frames with identical content are stored once, across keys and across sessions.
+    - A frame that extends a stored frame with extra columns (e.g. categorized BP data)
+      is stored as the base frame plus only the added columns.
+    - Sessions idle for longer than idle_timeout seconds are spilled to disk and
+      transparently restored on their next access.
+    - Sessions idle for longer than expire_timeout seconds are assumed to have
+      ended and are dropped, spill file included (see expire_idle_sessions).
+    
+    Each spilled session gets its own directory under spill_dir, created with
+    owner-only permissions under an unpredictable name, and only files the
+    governor wrote itself are ever unpickled.
+    
+    Stored frames are shared between sessions and must be treated as read-only.
+    """
+    
+    def __init__(self, spill_dir="data/session_spill", idle_timeout=900, expire_timeout=6 * 3600):
+        self.spill_dir = spill_dir
+        self.idle_timeout = idle_timeout
+        self.expire_timeout = expire_timeout
+        os.makedirs(spill_dir, mode=0o700, exist_ok=True)
+        
+        self._lock = threading.RLock()
+        self._frames = {}  # fingerprint -> _FrameRecord
+        self._sessions = {}  # session_id -> {'entries': {key: entry}, 'last_access': float}
+        self._spilled = {}  # session_id -> (spill file path, last access)
+        
+        self._remove_stale_spills()
+    
+    def store(self, session_id, key, value):
+        """
+        Store a value for a session
+        
+        Parameters:
+        - session_id: Identifier of the user session
+        - key: Name of the value (e.g. 'bp_data')
+        - value: DataFrame, dictionary/list containing DataFrames, or any other object
+        """
+        with self._lock:
+            session = self._touch(session_id)
+            
+            # Release whatever was stored under this key before
+            old_entry = session['entries'].pop(key, None)
+            if old_entry is not None:
+                self._release(old_entry)
+            
+            session['entries'][key] = self._encode(value)
+    
+    def load(self, session_id, key, default=None):
+        """
+        Load a value stored for a session
+        
+        Parameters:
+        - session_id: Identifier of the user session
+        - key: Name of the value
+        - default: Value returned when nothing is stored under key
+        
+        Returns:
+        The stored value, rebuilt from shared frames
+        """
+        with self._lock:
+            session = self._touch(session_id)
+            
+            if key not in session['entries']:
+                return default
+            
+            return self._decode(session['entries'][key])
+    
+    def has(self, session_id, key):
+        """Whether anything, None included, is stored for a session under key"""
+        with self._lock:
+            return key in self._touch(session_id)['entries']
+    
+    def release_session(self, session_id):
+        """Drop everything stored for a session, including any spill file"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                for entry in session['entries'].values():
+                    self._release(entry)
+            
+            spilled = self._spilled.pop(session_id, None)
+            if spilled is not None:
+                self._remove_spill(spilled[0])
+    
+    def expire_idle_sessions(self, now=None):
+        """
+        Drop sessions (live or spilled) idle for longer than expire_timeout
+        
+        Streamlit does not report sessions that end, so this sweep is what
+        eventually frees their frames and deletes their spill files.
+        
+        Returns:
+        List of expired session ids, so callers can drop their own per-session state
+        """
+        now = time.time() if now is None else now
+        
+        with self._lock:
+            expired = [
+                session_id for session_id, session in self._sessions.items()
+                if now - session['last_access'] >= self.expire_timeout
+            ]
+            expired += [
+                session_id for session_id, (_, last_access) in self._spilled.items()
+                if now - last_access >= self.expire_timeout
+            ]
+            for session_id in expired:
+                self.release_session(session_id)
+        
+        return expired
+    
+    def spill_idle_sessions(self, now=None):
+        """
+        Move sessions that have been idle longer than idle_timeout to disk
+        
+        Returns:
+        List of spilled session ids
+        """
+        now = time.time() if now is None else now
+        spilled = []
+        
+        with self._lock:
+            for session_id, session in list(self._sessions.items()):
+                if now - session['last_access'] < self.idle_timeout:
+                    continue
+                
+                values = {key: self._decode(entry) for key, entry in session['entries'].items()}
+                
+                # mkdtemp creates a fresh 0700 directory, so no other user can plant or swap the file
+                spill_path = os.path.join(tempfile.mkdtemp(prefix=SPILL_PREFIX, dir=self.spill_dir), SPILL_FILE)
+                descriptor = os.open(spill_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(descriptor, 'wb') as f:
+                    pickle.dump(values, f, protocol=pickle.HIGHEST_PROTOCOL)
+                
+                for entry in session['entries'].values():
+                    self._release(entry)
+                
+                del self._sessions[session_id]
+                self._spilled[session_id] = (spill_path, session['last_access'])
+                spilled.append(session_id)
+        
+        return spilled
+    
+    def session_memory_report(self, session_id):
+        """
+        Report the memory held for one session
+        
+        Returns:
+        Dictionary with the bytes referenced by the session, the part of it that is
+        shared with other keys or sessions, and whether the session is spilled
+        """
+        with self._lock:
+            if session_id in self._spilled:
+                return {
+                    'session_id': session_id,
+                    'spilled': True,
+                    'bytes': 0,
+                    'shared_bytes': 0,
+                    'spill_bytes': os.path.getsize(self._spilled[session_id][0])
+                }
+            
+            session = self._sessions.get(session_id, {'entries': {}})
+            fingerprints = []
+            for entry in session['entries'].values():
+                self._collect_frames(entry, fingerprints)
+            
+            total = 0
+            shared = 0
+            for fingerprint in set(fingerprints):
+                record = self._frames[fingerprint]
+                total += record.bytes
+                if record.refcount > fingerprints.count(fingerprint):
+                    shared += record.bytes
+            
+            return {
+                'session_id': session_id,
+                'spilled': False,
+                'keys': list(session['entries'].keys()),
+                'bytes': total,
+                'shared_bytes': shared
+            }
+    
+    def memory_report(self):
+        """
+        Report the memory held by the governor as a whole
+        
+        Returns:
+        Dictionary with the number of live/spilled sessions, unique frames and bytes
+        """
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'spilled_sessions': len(self._spilled),
+                'unique_frames': len(self._frames),
+                'bytes': sum(record.bytes for record in self._frames.values())
+            }
+    
+    def _touch(self, session_id):
+        """Mark a session as active, restoring it from disk if it was spilled"""
+        session = self._sessions.get(session_id)
+        
+        if session is None:
+            session = {'entries': {}, 'last_access': time.time()}
+            self._sessions[session_id] = session
+            
+            spilled = self._spilled.pop(session_id, None)
+            if spilled is not None and os.path.exists(spilled[0]):
+                with open(spilled[0], 'rb') as f:
+                    values = pickle.load(f)
+                self._remove_spill(spilled[0])
+                
+                for key, value in values.items():
+                    session['entries'][key] = self._encode(value)
+        
+        session['last_access'] = time.time()
+        return session
+    
+    @staticmethod
+    def _remove_spill(spill_path):
+        """Delete a spill file together with its session directory"""
+        shutil.rmtree(os.path.dirname(spill_path), ignore_errors=True)
+    
+    def _remove_stale_spills(self):
+        """Delete spill directories of earlier server processes that have outlived expire_timeout"""
+        now = time.time()
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            try:
+                stale = now - os.path.getmtime(path) >= self.expire_timeout
+            except OSError:
+                continue
+            # Spill files of the old flat layout are never read again
+            if name.endswith('.pkl') or (name.startswith(SPILL_PREFIX) and stale):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+    
+    def _encode(self, value):
+        """Convert a value into an entry that references shared frames"""
+        if isinstance(value, pd.DataFrame):
+            return self._encode_frame(value)
+        
+        if isinstance(value, dict):
+            return ('dict', {k: self._encode(v) for k, v in value.items()})
+        
+        if isinstance(value, list):
+            return ('list', [self._encode(v) for v in value])
+        
+        return ('value', value)
+    
+    def _encode_frame(self, frame):
+        """Store a frame once, or as column additions on top of an already stored frame"""
+        record = _FrameRecord(frame)
+        
+        if record.fingerprint in self._frames:
+            self._frames[record.fingerprint].refcount += 1
+            return ('frame', record.fingerprint)
+        
+        # Look for a stored frame this one only adds columns to
+        base = self._find_base(record)
+        if base is not None:
+            added_columns = [col for col in frame.columns if col not in base.column_fingerprints]
+            added = frame[added_columns]
+            added_record = _FrameRecord(added)
+            if added_record.fingerprint not in self._frames:
+                self._frames[added_record.fingerprint] = added_record
+            self._frames[added_record.fingerprint].refcount += 1
+            base.refcount += 1
+            return ('derived', base.fingerprint, added_record.fingerprint, list(frame.columns))
+        
+        record.refcount = 1
+        self._frames[record.fingerprint] = record
+        return ('frame', record.fingerprint)
+    
+    def _find_base(self, record):
+        """Find the largest stored frame whose columns all appear unchanged in record"""
+        best = None
+        
+        for candidate in self._frames.values():
+            if candidate.index_fingerprint != record.index_fingerprint:
+                continue
+            if len(candidate.column_fingerprints) >= len(record.column_fingerprints):
+                continue
+            
+            matches = all(
+                record.column_fingerprints.get(col) == fp
+                for col, fp in candidate.column_fingerprints.items()
+            )
+            if matches and (best is None or len(candidate.column_fingerprints) > len(best.column_fingerprints)):
+                best = candidate
+        
+        return best
+    
+    def _decode(self, entry):
+        """Rebuild a stored value from its entry"""
+        kind = entry[0]
+        
+        if kind == 'frame':
+            return self._frames[entry[1]].frame
+        
+        if kind == 'derived':
+            # Shallow copy shares the base frame's column data; only the added columns are attached
+            _, base_fp, added_fp, columns = entry
+            frame = self._frames[base_fp].frame.copy(deep=False)
+            added = self._frames[added_fp].frame
+            for col in added.columns:
+                frame[col] = added[col]
+            return frame[columns] if list(frame.columns) != columns else frame
+        
+        if kind == 'dict':
+            return {k: self._decode(v) for k, v in entry[1].items()}
+        
+        if kind == 'list':
+            return [self._decode(v) for v in entry[1]]
+        
+        return entry[1]
+    
+    def _release(self, entry):
+        """Drop the frame references held by an entry"""
+        fingerprints = []
+        self._collect_frames(entry, fingerprints)
+        
+        for fingerprint in fingerprints:
+            record = self._frames.get(fingerprint)
+            if record is None:
+                continue
+            record.refcount -= 1
+            if record.refcount <= 0:
+                del self._frames[fingerprint]
+    
+    def _collect_frames(self, entry, fingerprints):
+        """Append the fingerprints of all frames referenced by an entry"""
+        kind = entry[0]
+        
+        if kind == 'frame':
+            fingerprints.append(entry[1])
+        elif kind == 'derived':
+            fingerprints.append(entry[1])
+            fingerprints.append(entry[2])
+        elif kind == 'dict':
+            for v in entry[1].values():
+                self._collect_frames(v, fingerprints)
+        elif kind == 'list':
+            for v in entry[1]:
+                self._collect_frames(v, fingerprints)
@@ -0,0 +1,235 @@
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+from .schema import BP_VITAL_COLUMNS
+
+NANOSECONDS_PER_DAY = 24 * 60 * 60 * 10**9
+
+
+def _day_start_ns(value):
+    """Midnight of a date as int64 nanoseconds since the epoch"""
+    return pd.Timestamp(value).normalize().value
+
+
+class _DailyRollup:
+    """
+    Per-day prefix sums of a time-sorted frame
+    
+    Row i of every table holds the totals of all days before day i, so the
+    totals of any run of days are one subtraction. Rows are processed in
+    blocks, so building the rollup of a memory-mapped frame never materializes
+    a full-length temporary.
+    """
+    
+    BLOCK_ROWS = 1 << 20
+    
+    def __init__(self, times, frame, sum_columns, count_column=None):
+        self.row_offsets = self._day_offsets(times)
+        day_count = len(self.row_offsets) - 1
+        
+        columns = [column for column in sum_columns if column in frame.columns]
+        daily_sums = {column: np.zeros(day_count) for column in columns}
+        daily_counts = {column: np.zeros(day_count, dtype=np.int64) for column in columns}
+        
+        self.categories = None
+        codes = None
+        if count_column is not None and count_column in frame.columns \
+                and isinstance(frame[count_column].dtype, pd.CategoricalDtype):
+            self.categories = list(frame[count_column].cat.categories)
+            codes = frame[count_column].array.codes
+            daily_categories = np.zeros(day_count * len(self.categories), dtype=np.int64)
+        values = {column: frame[column].array for column in columns}
+        
+        for lo in range(0, len(times), self.BLOCK_ROWS):
+            hi = min(lo + self.BLOCK_ROWS, len(times))
+            day_of_row = np.searchsorted(self.row_offsets, np.arange(lo, hi), side='right') - 1
+            
+            for column in columns:
+                block = np.asarray(values[column][lo:hi], dtype=np.float64)
+                present = ~np.isnan(block)
+                daily_sums[column] += np.bincount(day_of_row[present], block[present], day_count)
+                daily_counts[column] += np.bincount(day_of_row[present], minlength=day_count)
+            
+            if codes is not None:
+                block_codes = codes[lo:hi]
+                known = block_codes >= 0
+                daily_categories += np.bincount(
+                    day_of_row[known] * len(self.categories) + block_codes[known],
+                    minlength=len(daily_categories)
+                )
+        
+        self.sums = {column: self._prefix(daily_sums[column]) for column in columns}
+        self.counts = {column: self._prefix(daily_counts[column]) for column in columns}
+        self.category_counts = None
+        if codes is not None:
+            self.category_counts = self._prefix(daily_categories.reshape(day_count, len(self.categories)))
+    
+    @classmethod
+    def _day_offsets(cls, times):
+        """First row of every day of the sorted timestamps, followed by the row count"""
+        offsets = [np.zeros(min(len(times), 1), dtype=np.int64)]
+        for lo in range(0, len(times), cls.BLOCK_ROWS):
+            # Include the previous block's last row so a day starting on a block edge is found
+            start = max(lo - 1, 0)
+            days = times[start:lo + cls.BLOCK_ROWS] // NANOSECONDS_PER_DAY
+            offsets.append(np.flatnonzero(days[1:] != days[:-1]) + start + 1)
+        offsets.append(np.array([len(times)], dtype=np.int64))
+        return np.concatenate(offsets)
+    
+    @staticmethod
+    def _prefix(daily):
+        return np.concatenate((np.zeros((1,) + daily.shape[1:], dtype=daily.dtype), np.cumsum(daily, axis=0)))
+    
+    def day_bounds(self, lo_row, hi_row):
+        """Day indices [first, last) covering rows [lo_row, hi_row), which lie on day boundaries"""
+        return (int(np.searchsorted(self.row_offsets, lo_row)), int(np.searchsorted(self.row_offsets, hi_row)))
+
+
+class TimeIndexedStore:
+    """
+    Time-sorted BP and exercise frames answering date-range queries
+    
+    Frames are sorted by 'datetime' once; a range query is two binary searches
+    on the int64 timestamps and returns a positional slice of the stored frame
+    instead of a boolean-mask copy. Per-day prefix sums of the vitals, exercise
+    durations and BP category counts answer summaries for any range of days
+    without touching the rows, and results computed for a range (e.g. the
+    correlation analysis) are cached by the rows they cover.
+    
+    Rows without a timestamp are left out. Stored frames are shared with the
+    slices handed out and must be treated as read-only.
+    """
+    
+    def __init__(self, bp_data=None, exercise_data=None, max_cached_ranges=32):
+        self.max_cached_ranges = max_cached_ranges
+        self._frames = {}
+        self._times = {}
+        self._rollups = {}
+        self._cache = OrderedDict()
+        
+        for kind, frame, sum_columns, count_column in [
+            ('bp', bp_data, BP_VITAL_COLUMNS, 'category'),
+            ('exercise', exercise_data, ['duration_minutes', 'calories_burned'], 'exercise_type')
+        ]:
+            if frame is None:
+                continue
+            # Rows without a timestamp belong to no date range, and NaT would sort last and break the binary searches
+            missing_times = frame['datetime'].isna()
+            if missing_times.any():
+                frame = frame[~missing_times.to_numpy()].reset_index(drop=True)
+            if not frame['datetime'].is_monotonic_increasing:
+                frame = frame.sort_values('datetime', kind='stable', ignore_index=True)
+            times = frame['datetime'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+            self._frames[kind] = frame
+            self._times[kind] = times
+            self._rollups[kind] = _DailyRollup(times, frame, sum_columns, count_column)
+    
+    def frame(self, kind):
+        """Whole time-sorted frame of a kind ('bp' or 'exercise'), or None"""
+        return self._frames.get(kind)
+    
+    def date_range(self):
+        """
+        First and last calendar date over all stored frames
+        
+        Returns:
+        Tuple of (start_date, end_date), or None if nothing is stored
+        """
+        bounds = [(times[0], times[-1]) for times in self._times.values() if len(times)]
+        if not bounds:
+            return None
+        first = min(start for start, _ in bounds)
+        last = max(end for _, end in bounds)
+        return pd.Timestamp(first).date(), pd.Timestamp(last).date()
+    
+    def bounds(self, kind, start_date=None, end_date=None):
+        """
+        Row positions of a date range
+        
+        Parameters:
+        - kind: 'bp' or 'exercise'
+        - start_date: First day included (from the first row if None)
+        - end_date: Last day included, whole day (to the last row if None)
+        
+        Returns:
+        Tuple (lo, hi) such that rows lo..hi-1 fall in the range
+        """
+        times = self._times[kind]
+        lo = 0 if start_date is None else int(np.searchsorted(times, _day_start_ns(start_date), side='left'))
+        if end_date is None:
+            hi = len(times)
+        else:
+            hi = int(np.searchsorted(times, _day_start_ns(end_date) + NANOSECONDS_PER_DAY, side='left'))
+        return lo, max(lo, hi)
+    
+    def slice(self, kind, start_date=None, end_date=None):
+        """
+        Rows of a kind within a date range (inclusive of both days)
+        
+        Returns:
+        Positional slice of the stored frame, or None if the kind is not stored
+        """
+        if kind not in self._frames:
+            return None
+        lo, hi = self.bounds(kind, start_date, end_date)
+        return self._frames[kind].iloc[lo:hi]
+    
+    def summary(self, kind, start_date=None, end_date=None):
+        """
+        Totals of a date range from the per-day rollups
+        
+        Returns:
+        Dictionary with the row 'count', 'mean' and 'total' of each rolled-up
+        column, and for BP the category 'counts' and 'percentages' (same shape
+        as BPCategorizer.get_category_distribution). None if the kind is not stored.
+        """
+        if kind not in self._frames:
+            return None
+        rollup = self._rollups[kind]
+        first, last = rollup.day_bounds(*self.bounds(kind, start_date, end_date))
+        
+        count = int(rollup.row_offsets[last] - rollup.row_offsets[first])
+        summary = {'count': count, 'mean': {}, 'total': {}}
+        for column, sums in rollup.sums.items():
+            total = sums[last] - sums[first]
+            present = rollup.counts[column][last] - rollup.counts[column][first]
+            summary['total'][column] = float(total)
+            summary['mean'][column] = float(total / present) if present else None
+        
+        if rollup.category_counts is not None:
+            counts = rollup.category_counts[last] - rollup.category_counts[first]
+            summary['counts'] = {
+                category: int(n) for category, n in zip(rollup.categories, counts) if n > 0
+            }
+            summary['percentages'] = {
+                category: n / count * 100 for category, n in summary['counts'].items()
+            } if count else {}
+        
+        return summary
+    
+    def cached(self, name, start_date, end_date, compute):
+        """
+        Result of compute(bp_slice, exercise_slice) for a date range, cached
+        
+        Ranges selecting the same rows share one cache entry, so moving a date
+        slider over days without readings does not recompute anything.
+        
+        Parameters:
+        - name: Name of the computation (e.g. 'correlation')
+        - start_date, end_date: Date range (see bounds)
+        - compute: Function of the BP and exercise slices
+        
+        Returns:
+        The computed (or cached) result
+        """
+        key = (name,) + tuple(self.bounds(kind, start_date, end_date) for kind in sorted(self._frames))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        
+        result = compute(self.slice('bp', start_date, end_date), self.slice('exercise', start_date, end_date))
+        self._cache[key] = result
+        while len(self._cache) > self.max_cached_ranges:
+            self._cache.popitem(last=False)
+        return result
@@ -132,6 +132,7 @@ Please format your response in the following sections:
             
             # Most frequent exercise types
             ex_type_counts = exercise_history['exercise_type'].value_counts()
+            ex_type_counts = ex_type_counts[ex_type_counts > 0]
             prompt += "Most frequent exercise types:\n"
             for ex_type, count in ex_type_counts.head(3).items():
                 prompt += f"- {ex_type}: {count} sessions\n"
@@ -142,6 +143,7 @@ Please format your response in the following sections:
             
             # Intensity distribution
             intensity_dist = exercise_history['intensity'].value_counts(normalize=True) * 100
+            intensity_dist = intensity_dist[intensity_dist > 0]
             prompt += "\nIntensity distribution:\n"
             for intensity, percentage in intensity_dist.items():
                 prompt += f"- {intensity}: {percentage:.1f}%\n"
@@ -4,6 +4,8 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+from src.analysis.bp_categories import BPCategorizer
+
 def create_bp_trend_chart(bp_data):
     """
     Create a time series chart of blood pressure readings
@@ -27,6 +29,7 @@ def create_bp_trend_chart(bp_data):
     
     # Sort by date and time
     sorted_data = bp_data.sort_values('datetime')
+    marker_colors = BPCategorizer.get_category_colors(sorted_data)
     
     # Create figure
     fig = go.Figure()
@@ -40,7 +43,7 @@ def create_bp_trend_chart(bp_data):
         line=dict(color='#ff7f0e', width=2),
         marker=dict(
             size=8,
-            color=sorted_data['category_color'],
+            color=marker_colors,
             line=dict(width=1, color='#333')
         )
     ))
@@ -54,7 +57,7 @@ def create_bp_trend_chart(bp_data):
         line=dict(color='#1f77b4', width=2),
         marker=dict(
             size=8,
-            color=sorted_data['category_color'],
+            color=marker_colors,
             line=dict(width=1, color='#333')
         )
     ))
@@ -144,15 +147,14 @@ def create_bp_category_distribution(bp_data):
         )
         return fig
     
-    # Count categories
-    category_counts = bp_data['category'].value_counts().reset_index()
-    category_counts.columns = ['Category', 'Count']
-    
-    # Get colors for each category
-    category_colors = {}
-    for cat in category_counts['Category']:
-        color = bp_data[bp_data['category'] == cat]['category_color'].iloc[0]
-        category_colors[cat] = color
+    # Count categories from their codes
+    codes = BPCategorizer.get_category_codes(bp_data)
+    counts = np.bincount(codes[codes >= 0], minlength=len(BPCategorizer.CATEGORY_ORDER))
+    category_counts = pd.DataFrame({
+        'Category': BPCategorizer.CATEGORY_ORDER,
+        'Count': counts
+    })
+    category_counts = category_counts[category_counts['Count'] > 0]
     
     # Create pie chart
     fig = px.pie(
@@ -160,7 +162,7 @@ def create_bp_category_distribution(bp_data):
         values='Count', 
         names='Category',
         color='Category',
-        color_discrete_map=category_colors,
+        color_discrete_map=BPCategorizer.CATEGORY_COLORS,
         title='Blood Pressure Category Distribution'
     )
     
@@ -4,6 +4,8 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+from src.analysis.bp_categories import BPCategorizer
+
 def create_exercise_bp_correlation_plot(correlation_results):
     """
     Create a scatter plot showing correlation between exercise intensity and BP changes
@@ -224,6 +226,24 @@ def create_diastolic_correlation_plot(correlation_results):
     
     return fig
 
+def _interval_error_bars(changes, intervals, key):
+    """
+    Asymmetric error bars from the bootstrap confidence intervals of average changes
+    
+    Returns:
+    Plotly error_y settings, or None unless every bar has an interval
+    """
+    if not intervals or not all(intervals):
+        return None
+    
+    return dict(
+        type='data',
+        symmetric=False,
+        array=[interval[key][1] - change for interval, change in zip(intervals, changes)],
+        arrayminus=[change - interval[key][0] for interval, change in zip(intervals, changes)],
+        thickness=1.5
+    )
+
 def create_exercise_type_impact_chart(correlation_results):
     """
     Create a bar chart showing the impact of different exercise types on BP
@@ -255,6 +275,7 @@ def create_exercise_type_impact_chart(correlation_results):
     systolic_changes = []
     diastolic_changes = []
     counts = []
+    intervals = []
     
     for ex_type, impact in type_impact.items():
         if impact.get('count', 0) >= 2:  # Only include types with at least 2 data points
@@ -262,6 +283,7 @@ def create_exercise_type_impact_chart(correlation_results):
             systolic_changes.append(impact.get('avg_systolic_change', 0))
             diastolic_changes.append(impact.get('avg_diastolic_change', 0))
             counts.append(impact.get('count', 0))
+            intervals.append(impact.get('confidence_intervals'))
     
     if not exercise_types:
         # No valid exercise types found
@@ -283,6 +305,7 @@ def create_exercise_type_impact_chart(correlation_results):
         y=systolic_changes,
         name='Systolic Change',
         marker_color='#ff7f0e',
+        error_y=_interval_error_bars(systolic_changes, intervals, 'avg_systolic_change'),
         text=counts,
         textposition='auto',
         hovertemplate='<b>%{x}</b><br>Systolic Change: %{y:.1f} mmHg<br>Sessions: %{text}<extra></extra>'
@@ -294,6 +317,7 @@ def create_exercise_type_impact_chart(correlation_results):
         y=diastolic_changes,
         name='Diastolic Change',
         marker_color='#1f77b4',
+        error_y=_interval_error_bars(diastolic_changes, intervals, 'avg_diastolic_change'),
         text=counts,
         textposition='auto',
         hovertemplate='<b>%{x}</b><br>Diastolic Change: %{y:.1f} mmHg<br>Sessions: %{text}<extra></extra>'
@@ -320,6 +344,74 @@ def create_exercise_type_impact_chart(correlation_results):
     
     return fig
 
+def create_lag_effect_plot(correlation_results):
+    """
+    Create a line chart of the average BP change after exercise for each follow-up window
+    
+    Parameters:
+    - correlation_results: Dictionary with correlation analysis results
+    
+    Returns:
+    Plotly figure
+    """
+    if (correlation_results is None or 
+        correlation_results.get('lag_effects') is None or 
+        correlation_results['lag_effects']['exercises'].sum() == 0):
+        # Create empty figure with message
+        fig = go.Figure()
+        fig.add_annotation(
+            text="No lag analysis data available",
+            xref="paper", yref="paper",
+            x=0.5, y=0.5, showarrow=False,
+            font=dict(size=16)
+        )
+        return fig
+    
+    lag_effects = correlation_results['lag_effects']
+    
+    # Create figure
+    fig = go.Figure()
+    
+    # One line per measure, with 95% error bars from the standard error of the mean change
+    for measure, name, color in [('systolic', 'Systolic Change', '#ff7f0e'), ('diastolic', 'Diastolic Change', '#1f77b4')]:
+        fig.add_trace(go.Scatter(
+            x=lag_effects['window'],
+            y=lag_effects[f'avg_{measure}_change'],
+            mode='lines+markers',
+            name=name,
+            line=dict(color=color, width=2),
+            error_y=dict(type='data', array=1.96 * lag_effects[f'{measure}_change_se'], thickness=1.5),
+            customdata=np.stack([
+                lag_effects['exercises'],
+                lag_effects[f'{measure}_correlation'],
+                lag_effects[f'{measure}_p_value']
+            ], axis=-1),
+            hovertemplate=(
+                f'<b>%{{x}} after exercise</b><br>{name}: %{{y:.1f}} mmHg<br>Sessions: %{{customdata[0]}}'
+                '<br>Correlation with intensity: %{customdata[1]:.3f} (p = %{customdata[2]:.3f})<extra></extra>'
+            )
+        ))
+    
+    # Add zero line
+    fig.add_shape(
+        type="line",
+        x0=-0.5,
+        x1=len(lag_effects) - 0.5,
+        y0=0, y1=0,
+        line=dict(color="black", width=1, dash="dot"),
+    )
+    
+    # Update layout
+    fig.update_layout(
+        title='Average BP Change by Follow-up Window',
+        xaxis_title='Follow-up Window After Exercise',
+        yaxis_title='Blood Pressure Change (mmHg)',
+        template='plotly_white',
+        height=400
+    )
+    
+    return fig
+
 def create_correlation_summary_card(correlation_results):
     """
     Create a text summary of correlation findings
@@ -444,6 +536,7 @@ def create_combined_timeline(bp_data, exercise_data):
     if bp_data is not None and len(bp_data) > 0:
         # Sort by date
         sorted_bp = bp_data.sort_values('datetime')
+        marker_colors = BPCategorizer.get_category_colors(sorted_bp)
         
         # Add systolic line
         fig.add_trace(go.Scatter(
@@ -454,7 +547,7 @@ def create_combined_timeline(bp_data, exercise_data):
             line=dict(color='#ff7f0e', width=2),
             marker=dict(
                 size=8,
-                color=sorted_bp['category_color'],
+                color=marker_colors,
                 line=dict(width=1, color='#333')
             )
         ))
@@ -468,7 +561,7 @@ def create_combined_timeline(bp_data, exercise_data):
             line=dict(color='#1f77b4', width=2),
             marker=dict(
                 size=8,
-                color=sorted_bp['category_color'],
+                color=marker_colors,
                 line=dict(width=1, color='#333')
             )
         ))
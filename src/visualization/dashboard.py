@@ -20,6 +20,7 @@ from .correlation_plots import (
     create_exercise_bp_correlation_plot,
     create_diastolic_correlation_plot,
     create_exercise_type_impact_chart,
+    create_lag_effect_plot,
     create_correlation_summary_card,
     create_combined_timeline
 )
@@ -225,6 +226,11 @@ def create_correlation_tab(bp_data, exercise_data, correlation_results, date_ran
     type_impact_fig = create_exercise_type_impact_chart(correlation_results)
     st.plotly_chart(type_impact_fig, use_container_width=True)
     
+    # Exercise effect over different follow-up windows
+    st.subheader("Impact by Time After Exercise")
+    lag_fig = create_lag_effect_plot(correlation_results)
+    st.plotly_chart(lag_fig, use_container_width=True)
+    
     # Correlation explanation
     with st.expander("Understanding Correlation Analysis"):
         st.markdown("""
@@ -237,6 +243,7 @@ def create_correlation_tab(bp_data, exercise_data, correlation_results, date_ran
         - **Correlation values** range from -1 to 1. Values close to -1 suggest exercise strongly reduces BP, while values close to 0 indicate little relationship.
         - **Statistical significance** indicates whether the observed correlation is likely real or due to random chance.
         - **Exercise type impact** shows which activities have the greatest effect on your blood pressure measurements.
+        - **Time after exercise** shows how the average change develops from a few hours to a week after a session.
         
         For the most accurate analysis, continue tracking both exercise and blood pressure regularly.
         """)
@@ -298,6 +305,7 @@ def create_recommendation_tab(
                         # Add category distribution if available
                         if 'category' in bp_data.columns:
                             category_counts = bp_data['category'].value_counts()
+                            category_counts = category_counts[category_counts > 0]
                             total = len(bp_data)
                             bp_stats['category_distribution'] = {
                                 cat: count / total * 100 
@@ -344,7 +352,7 @@ def create_recommendation_tab(
                                 )
                         
                         # Get recent exercise history
-                        exercise_history = exercise_data.sort_values('date', ascending=False).head(10)
+                        exercise_history = exercise_data.sort_values('datetime', ascending=False).head(10)
                         
                         # Generate recommendations
                         recommendation_response = recommendation_engine.generate_recommendations(
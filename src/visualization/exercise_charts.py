@@ -4,6 +4,8 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+from src.data_processing.schema import date_column
+
 def create_exercise_calendar(exercise_data):
     """
     Create a heatmap calendar of exercise activity
@@ -26,7 +28,7 @@ def create_exercise_calendar(exercise_data):
         return fig
     
     # Group by date and calculate total duration
-    daily_exercise = exercise_data.groupby('date')['duration_minutes'].sum().reset_index()
+    daily_exercise = exercise_data.groupby(date_column(exercise_data))['duration_minutes'].sum().reset_index()
     
     # Create a date range for all days in the range
     date_range = pd.date_range(
@@ -96,7 +98,8 @@ def create_exercise_type_distribution(exercise_data):
         return fig
     
     # Count exercise types
-    type_counts = exercise_data['exercise_type'].value_counts().reset_index()
+    type_counts = exercise_data['exercise_type'].value_counts()
+    type_counts = type_counts[type_counts > 0].reset_index()
     type_counts.columns = ['Exercise Type', 'Count']
     
     # Create color map
@@ -150,7 +153,8 @@ def create_exercise_intensity_chart(exercise_data):
         return fig
     
     # Count intensity levels
-    intensity_counts = exercise_data['intensity'].value_counts().reset_index()
+    intensity_counts = exercise_data['intensity'].value_counts()
+    intensity_counts = intensity_counts[intensity_counts > 0].reset_index()
     intensity_counts.columns = ['Intensity', 'Count']
     
     # Create color map
@@ -265,6 +269,8 @@ def create_exercise_timeline(exercise_data):
     min_duration = exercise_data['duration_minutes'].min()
     max_duration = exercise_data['duration_minutes'].max()
     
+    # Add marker sizes to a shallow copy so shared input frames are never modified
+    exercise_data = exercise_data.copy(deep=False)
     exercise_data['marker_size'] = exercise_data['duration_minutes'].apply(
         lambda x: 10 + (x - min_duration) / (max_duration - min_duration) * 15
         if max_duration > min_duration else 15
@@ -0,0 +1,26 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+# The app runs from the repository root, so tests import the same way (src.…)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+PATIENT_DATA_DIR = os.path.join(ROOT_DIR, "data", "patient_data")
+
+
+@pytest.fixture(scope="session")
+def device_data(tmp_path_factory):
+    """Compact (bp, exercise) frames of the bundled sample patient 47047908, as writable copies"""
+    from src.data_processing.fhir import FHIRIntegration
+
+    # Loaded from a copy, so the columnar cache the load writes stays out of the repository
+    data_dir = tmp_path_factory.mktemp("patient_data")
+    shutil.copytree(os.path.join(PATIENT_DATA_DIR, "47047908"), data_dir / "47047908",
+                    ignore=shutil.ignore_patterns("columnar"))
+    bp_data, exercise_data = FHIRIntegration(data_dir=str(data_dir), use_cache=False).load_device_data(
+        "47047908", include_fhir_vitals=False, mmap=False
+    )
+    return bp_data, exercise_data
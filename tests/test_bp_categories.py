@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from src.analysis.bp_categories import BPCategorizer
+from src.visualization.bp_charts import create_bp_category_distribution, create_bp_trend_chart
+
+
+def test_colors_are_derived_from_category_codes(device_data):
+    categorizer = BPCategorizer()
+    categorized = categorizer.categorize_bp_dataframe(device_data[0])
+
+    assert 'category_color' not in categorized.columns
+    assert isinstance(categorized['category'].dtype, pd.CategoricalDtype)
+
+    expected = [categorizer.categorize_bp(systolic, diastolic)
+                for systolic, diastolic in zip(categorized['systolic'], categorized['diastolic'])]
+    assert categorized['category'].tolist() == [category for category, _ in expected]
+    assert BPCategorizer.get_category_colors(categorized).tolist() == [color for _, color in expected]
+
+
+def test_plain_string_categories_and_unknown_labels():
+    frame = pd.DataFrame({'category': ['Elevated', 'Normal', 'Not a category']})
+
+    colors = BPCategorizer.get_category_colors(frame)
+
+    assert colors.tolist() == [BPCategorizer.CATEGORY_COLORS['Elevated'], BPCategorizer.CATEGORY_COLORS['Normal'],
+                               '#95a5a6']
+
+
+def test_categorizing_does_not_touch_the_source_frame(device_data):
+    bp_data = device_data[0].copy()
+    columns = list(bp_data.columns)
+
+    categorized = BPCategorizer().categorize_bp_dataframe(bp_data)
+
+    assert list(bp_data.columns) == columns
+    # A shallow copy: the vitals are shared, not duplicated
+    assert np.shares_memory(categorized['systolic'].to_numpy(), bp_data['systolic'].to_numpy())
+
+
+def test_charts_color_readings_by_category(device_data):
+    categorized = BPCategorizer().categorize_bp_dataframe(device_data[0])
+    counts = categorized['category'].value_counts()
+
+    pie = create_bp_category_distribution(categorized).data[0]
+    for label, value, color in zip(pie.labels, pie.values, pie.marker.colors):
+        assert value == counts[label]
+        assert color == BPCategorizer.CATEGORY_COLORS[label]
+
+    trend = create_bp_trend_chart(categorized)
+    sorted_data = categorized.sort_values('datetime')
+    assert list(trend.data[0].marker.color) == BPCategorizer.get_category_colors(sorted_data).tolist()
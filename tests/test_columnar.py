@@ -0,0 +1,114 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing.columnar import ColumnarWriter, cached_columnar, read_columnar, read_header, write_columnar
+from src.data_processing.fhir import FHIRIntegration
+from src.data_processing.google_fit import parse_google_fit
+from src.data_processing.omron import parse_omron_csv
+
+from conftest import PATIENT_DATA_DIR
+
+
+def _assert_same(loaded, frame):
+    """Same columns, dtypes and values, whether the columns are arrays or memory maps"""
+    assert list(loaded.columns) == list(frame.columns)
+    for column in frame.columns:
+        assert loaded[column].dtype == frame[column].dtype, column
+        np.testing.assert_array_equal(loaded[column].astype(object).to_numpy(),
+                                      frame[column].astype(object).to_numpy())
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_round_trip_keeps_the_compact_schema(tmp_path, device_data, mmap):
+    for i, frame in enumerate(device_data):
+        path = write_columnar(frame, str(tmp_path / str(i)))
+
+        loaded = read_columnar(path, mmap=mmap)
+
+        _assert_same(loaded, frame)
+        if mmap:
+            assert isinstance(loaded['datetime'].array._ndarray.base, np.memmap)
+            with pytest.raises(ValueError):
+                loaded['systolic' if i == 0 else 'duration_minutes'].to_numpy()[0] = 1
+    assert list(read_columnar(str(tmp_path / "0"), columns=['datetime', 'pulse']).columns) == ['datetime', 'pulse']
+
+
+def test_chunks_grow_categories_and_widen_columns(tmp_path):
+    frame = pd.DataFrame({
+        'datetime': pd.date_range("2025-01-01", periods=300, freq="h"),
+        'steps': np.arange(300, dtype=np.int16),
+        'label': [f"type {i}" for i in range(300)],
+        'flag': np.arange(300) % 2 == 0
+    })
+    frame.loc[250, 'datetime'] = pd.NaT
+    chunks = [frame.iloc[:100], frame.iloc[100:200].astype({'steps': np.float32}), frame.iloc[200:]]
+    chunks[1].iloc[3, 1] = np.nan
+
+    writer = ColumnarWriter(str(tmp_path / "data"))
+    for chunk in chunks:
+        writer.append(chunk)
+    writer.close()
+    expected = pd.concat(chunks, ignore_index=True)
+
+    loaded = read_columnar(str(tmp_path / "data"), mmap=True)
+
+    assert {column['name']: column['dtype'] for column in read_header(str(tmp_path / "data"))['columns']} == {
+        'datetime': 'int64', 'steps': 'float32', 'label': 'int16', 'flag': 'bool'}
+    np.testing.assert_array_equal(loaded['steps'].to_numpy(), expected['steps'].to_numpy())
+    assert loaded['label'].astype(object).tolist() == expected['label'].tolist()
+    assert loaded['datetime'].isna().tolist() == expected['datetime'].isna().tolist()
+    assert loaded['flag'].tolist() == expected['flag'].tolist()
+
+    # Appending continues after the last row
+    writer = ColumnarWriter(str(tmp_path / "data"), append=True)
+    writer.append(frame.iloc[:5])
+    writer.close()
+    assert len(read_columnar(str(tmp_path / "data"))) == len(frame) + 5
+
+
+def test_cached_datasets_are_rebuilt_only_when_a_source_changes(tmp_path):
+    source = tmp_path / "source.csv"
+    missing = tmp_path / "not_yet.csv"
+    source.write_text("value\n1\n2\n")
+    builds = []
+
+    def build():
+        builds.append(1)
+        return pd.read_csv(source).astype({'value': np.int16})
+
+    path = str(tmp_path / "cache")
+    first = cached_columnar(path, [str(source), str(missing)], build)
+    second = cached_columnar(path, [str(source), str(missing)], build)
+    assert len(builds) == 1
+    assert second['value'].tolist() == first['value'].tolist() == [1, 2]
+
+    source.write_text("value\n1\n2\n3\n")
+    os.utime(source, (1, 1))
+    assert cached_columnar(path, [str(source), str(missing)], build)['value'].tolist() == [1, 2, 3]
+    missing.write_text("")
+    cached_columnar(path, [str(source), str(missing)], build)
+    assert len(builds) == 3
+    # The mapped frame handed out before the rebuild is still readable
+    assert first['value'].tolist() == [1, 2]
+
+    assert cached_columnar(path, [str(source)], lambda: None) is None
+    assert not os.path.exists(path)
+    assert [name for name in os.listdir(tmp_path) if name.startswith(".cache")] == []
+
+
+def test_memory_mapped_patient_data_matches_parsing_the_csvs(tmp_path):
+    shutil.copytree(os.path.join(PATIENT_DATA_DIR, "47047908"), tmp_path / "p1",
+                    ignore=shutil.ignore_patterns("columnar"))
+    integration = FHIRIntegration(data_dir=str(tmp_path), use_cache=False)
+
+    bp_data, exercise_data = integration.load_device_data("p1", include_fhir_vitals=False)
+    again, _ = integration.load_device_data("p1", include_fhir_vitals=False)
+
+    _assert_same(bp_data, parse_omron_csv(str(tmp_path / "p1" / "omron" / "omron_data.csv")))
+    _assert_same(exercise_data, parse_google_fit(str(tmp_path / "p1" / "google_fit" / "google_fit.csv")))
+    _assert_same(again, bp_data)
+    assert os.path.exists(tmp_path / "p1" / "columnar" / "bp_device" / "header.json")
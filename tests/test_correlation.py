@@ -0,0 +1,355 @@
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import pearsonr
+
+from src.analysis.bp_categories import BPCategorizer, IncrementalBPCategorizer
+from src.analysis.correlation import (
+    LAG_WINDOWS_HOURS, CorrelationAnalyzer, ExerciseImpactResult, IncrementalCorrelationAnalyzer
+)
+from src.analysis.resampling import ResamplingEngine
+from src.data_processing.schema import BP_VITAL_COLUMNS
+
+
+def _reference_impact(bp_data, exercise_data, time_window=3):
+    """Row-by-row matching as the analyzer originally did it, for comparison"""
+    bp_days = bp_data['datetime'].dt.normalize()
+    rows = []
+    for _, exercise in exercise_data.iterrows():
+        day = exercise['datetime'].normalize()
+        before = bp_data[bp_days < day].sort_values('datetime', kind='stable')
+        after = bp_data[(bp_days > day) & (bp_days <= day + pd.Timedelta(days=time_window))]
+        if len(before) == 0 or len(after) == 0:
+            continue
+        row = {'exercise_date': day, 'exercise_type': exercise['exercise_type']}
+        for measure in BP_VITAL_COLUMNS:
+            row[f'{measure}_change'] = after[measure].mean() - before[measure].iloc[-1]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def test_impact_matches_the_row_by_row_reference(device_data):
+    bp_data, exercise_data = device_data
+
+    impact = CorrelationAnalyzer().compute_exercise_impact(bp_data, exercise_data).to_frame()
+    expected = _reference_impact(bp_data, exercise_data)
+
+    assert len(impact) == len(expected) > 0
+    assert (impact['exercise_date'] == expected['exercise_date']).all()
+    assert impact['exercise_type'].tolist() == expected['exercise_type'].tolist()
+    for measure in BP_VITAL_COLUMNS:
+        np.testing.assert_allclose(impact[f'{measure}_change'], expected[f'{measure}_change'])
+
+
+def test_results_reference_the_source_frames(device_data):
+    bp_data, exercise_data = (frame.copy() for frame in device_data)
+    columns = (list(bp_data.columns), list(exercise_data.columns))
+
+    categories = BPCategorizer().categorize(bp_data)
+    impact = CorrelationAnalyzer().compute_exercise_impact(bp_data, exercise_data)
+
+    assert categories.source is bp_data
+    assert categories.codes.dtype == np.int8
+    assert isinstance(impact, ExerciseImpactResult)
+    assert impact.exercise_data is exercise_data
+    assert impact.column('exercise_type').tolist() == \
+        exercise_data['exercise_type'].to_numpy()[impact.positions].tolist()
+    # Neither input gains or loses columns
+    assert (list(bp_data.columns), list(exercise_data.columns)) == columns
+
+
+def test_categorizing_a_large_frame_needs_less_memory_than_a_copy():
+    rows = 1_000_000
+    rng = np.random.default_rng(0)
+    bp_data = pd.DataFrame({
+        'datetime': pd.date_range("2020-01-01", periods=rows, freq="min", unit="ns"),
+        'systolic': rng.integers(100, 190, rows).astype(np.int16),
+        'diastolic': rng.integers(60, 125, rows).astype(np.int16),
+        'pulse': rng.integers(50, 100, rows).astype(np.int16)
+    })
+    frame_bytes = bp_data.memory_usage(deep=True).sum()
+
+    tracemalloc.start()
+    try:
+        categorized = BPCategorizer().categorize_bp_dataframe(bp_data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < frame_bytes / 2
+    assert categorized['category'].memory_usage(deep=False) < 2 * rows
+
+
+@pytest.mark.parametrize("frame", ["bp", "exercise"])
+def test_empty_inputs_give_no_results(device_data, frame):
+    bp_data, exercise_data = device_data
+    if frame == "bp":
+        bp_data = bp_data.iloc[:0]
+    else:
+        exercise_data = exercise_data.iloc[:0]
+
+    assert CorrelationAnalyzer().analyze_exercise_bp_correlation(bp_data, exercise_data) is None
+
+
+def _with_gaps(bp_data, exercise_data):
+    """Sample data with missing pulses and intensities, as real exports have"""
+    bp_data = bp_data.copy()
+    bp_data['pulse'] = bp_data['pulse'].astype(float)
+    bp_data.loc[bp_data.index[::3], 'pulse'] = np.nan
+
+    exercise_data = exercise_data.copy()
+    exercise_data['intensity'] = exercise_data['intensity'].astype(object)
+    exercise_data.loc[exercise_data.index[::4], 'intensity'] = np.nan
+    return bp_data, exercise_data
+
+
+def _without_resampling(type_impact):
+    return {
+        ex_type: {key: value for key, value in impact.items()
+                  if key not in ('confidence_intervals', 'p_values', 'resamples')}
+        for ex_type, impact in type_impact.items()
+    }
+
+
+def _assert_nested_close(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, dict):
+            _assert_nested_close(actual[key], value)
+        else:
+            np.testing.assert_allclose(actual[key], value, equal_nan=True)
+
+
+@pytest.fixture
+def resampler():
+    return ResamplingEngine(n_resamples=200, seed=0)
+
+
+@pytest.mark.parametrize("bp_batches,exercise_batches,shuffled", [(1, 1, False), (3, 2, False), (5, 4, True)])
+def test_incremental_matches_batch_with_missing_values(device_data, resampler, bp_batches, exercise_batches,
+                                                       shuffled):
+    bp_data, exercise_data = _with_gaps(*device_data)
+    batch = CorrelationAnalyzer(resampler=resampler).analyze_exercise_bp_correlation(bp_data, exercise_data)
+
+    bp_rows = np.random.default_rng(1).permutation(len(bp_data)) if shuffled else np.arange(len(bp_data))
+    incremental = IncrementalCorrelationAnalyzer(resampler=resampler)
+    for rows in np.array_split(bp_rows, bp_batches):
+        incremental.append_readings(bp_data.iloc[rows])
+    for rows in np.array_split(np.arange(len(exercise_data)), exercise_batches):
+        incremental.append_exercises(exercise_data.iloc[rows])
+    results = incremental.get_results()
+
+    assert batch['exercise_type_impact'], "sample data should produce per-type results"
+    _assert_nested_close(_without_resampling(results['exercise_type_impact']),
+                         _without_resampling(batch['exercise_type_impact']))
+    for measure in BP_VITAL_COLUMNS:
+        np.testing.assert_allclose(results['overall_correlation'][measure]['correlation'],
+                                   batch['overall_correlation'][measure]['correlation'], equal_nan=True)
+        np.testing.assert_allclose(results['overall_correlation'][measure]['p_value'],
+                                   batch['overall_correlation'][measure]['p_value'], equal_nan=True)
+
+
+def test_incremental_keeps_rows_without_intensity_in_type_totals(device_data, resampler):
+    bp_data, exercise_data = _with_gaps(*device_data)
+
+    incremental = IncrementalCorrelationAnalyzer(resampler=resampler)
+    incremental.append_readings(bp_data)
+    incremental.append_exercises(exercise_data)
+    results = incremental.get_results(detailed=True)
+
+    impact = results['exercise_impact_data']
+    for ex_type, type_result in results['exercise_type_impact'].items():
+        rows = impact[impact['exercise_type'] == ex_type]
+        assert type_result['count'] == len(rows)
+        # Averages skip missing changes instead of counting them as zero
+        np.testing.assert_allclose(type_result['avg_pulse_change'], rows['pulse_change'].mean())
+
+
+def test_incremental_builds_full_history_results_only_on_request(device_data, resampler, monkeypatch):
+    bp_data, exercise_data = device_data
+    batch = CorrelationAnalyzer(resampler=resampler).analyze_exercise_bp_correlation(bp_data, exercise_data)
+    incremental = IncrementalCorrelationAnalyzer(resampler=resampler)
+    incremental.append_readings(bp_data)
+    incremental.append_exercises(exercise_data.iloc[:-3])
+
+    impact_frames = []
+    original_impact_frame = IncrementalCorrelationAnalyzer._impact_frame
+    monkeypatch.setattr(IncrementalCorrelationAnalyzer, '_impact_frame',
+                        lambda self: impact_frames.append(1) or original_impact_frame(self))
+
+    summary = incremental.get_results()
+    assert summary['overall_correlation'] and summary['exercise_type_impact']
+    assert summary['exercise_impact_data'] is None
+    assert summary['correlation_matrix'] is None and summary['lag_effects'] is None
+    assert 'ci_lower' not in summary['overall_correlation']['systolic']
+    assert impact_frames == []
+
+    # Detailed results are reused until the next batch
+    first = incremental.get_results(detailed=True)
+    assert incremental.get_results(detailed=True) is first
+    incremental.append_exercises(exercise_data.iloc[-3:])
+    detailed = incremental.get_results(detailed=True)
+    assert detailed is not first
+    assert impact_frames == [1, 1]
+
+    assert len(detailed['exercise_impact_data']) == len(batch['exercise_impact_data'])
+    assert 'ci_lower' in detailed['overall_correlation']['systolic']
+    assert detailed['exercise_type_impact'].keys() == batch['exercise_type_impact'].keys()
+    for ex_type, impact in detailed['exercise_type_impact'].items():
+        assert impact['confidence_intervals'].keys() == batch['exercise_type_impact'][ex_type]['confidence_intervals'].keys()
+    np.testing.assert_allclose(detailed['correlation_matrix'].result('intensity_score', 'systolic_change')['correlation'],
+                               batch['overall_correlation']['systolic']['correlation'])
+    pd.testing.assert_frame_equal(detailed['lag_effects'], batch['lag_effects'], check_exact=False)
+
+
+def test_appended_readings_only_rematch_the_affected_exercises(device_data, resampler, monkeypatch):
+    bp_data, exercise_data = device_data
+    split = len(bp_data) - 5
+    incremental = IncrementalCorrelationAnalyzer(resampler=resampler)
+    incremental.append_readings(bp_data.iloc[:split])
+    incremental.append_exercises(exercise_data)
+
+    matched_rows = []
+    original_match = IncrementalCorrelationAnalyzer._match
+    monkeypatch.setattr(IncrementalCorrelationAnalyzer, '_match',
+                        lambda self, rows: matched_rows.append(len(rows)) or original_match(self, rows))
+    incremental.append_readings(bp_data.iloc[split:])
+
+    # Only exercises within time_window days before the new readings are touched
+    first_new_day = bp_data['datetime'].iloc[split:].min().normalize()
+    affected = (exercise_data['datetime'].dt.normalize() >= first_new_day - pd.Timedelta(days=3)).sum()
+    assert matched_rows == [affected]
+    assert affected < len(exercise_data)
+
+
+def test_incremental_categorizer_matches_batch(device_data):
+    bp_data = device_data[0]
+    batch = BPCategorizer()
+    categorized = batch.categorize_bp_dataframe(bp_data)
+
+    incremental = IncrementalBPCategorizer()
+    for rows in np.array_split(np.arange(len(bp_data)), 4):
+        incremental.append_readings(bp_data.iloc[rows])
+
+    expected = batch.get_category_distribution(categorized)
+    actual = incremental.get_category_distribution()
+    assert actual['counts'] == expected['counts']
+    pd.testing.assert_series_equal(pd.Series(actual['percentages']).sort_index(),
+                                   pd.Series(expected['percentages']).sort_index())
+    expected_trends = batch.get_category_trends(categorized)[BPCategorizer.CATEGORY_ORDER]
+    actual_trends = incremental.get_category_trends()[BPCategorizer.CATEGORY_ORDER]
+    assert (actual_trends.index == expected_trends.index).all()
+    np.testing.assert_array_equal(actual_trends.to_numpy(), expected_trends.to_numpy())
+
+
+def _reference_type_impact(exercise_impact):
+    """Per-type filtering as _analyze_exercise_type_impact originally did it (one mask per type and intensity)"""
+    type_results = {}
+    for ex_type in exercise_impact['exercise_type'].unique():
+        type_data = exercise_impact[exercise_impact['exercise_type'] == ex_type]
+        if len(type_data) < 3:
+            continue
+        type_results[ex_type] = {'count': len(type_data),
+                                 **{f'avg_{m}_change': type_data[f'{m}_change'].mean() for m in BP_VITAL_COLUMNS}}
+        if len(type_data) >= 5:
+            breakdown = {}
+            for intensity in ['Low', 'Moderate', 'High']:
+                intensity_data = type_data[type_data['intensity'] == intensity]
+                if len(intensity_data) >= 2:
+                    breakdown[intensity] = {'count': len(intensity_data),
+                                            **{f'avg_{m}_change': intensity_data[f'{m}_change'].mean()
+                                               for m in BP_VITAL_COLUMNS}}
+            type_results[ex_type]['intensity_breakdown'] = breakdown
+    return type_results
+
+
+def _random_impact(size, seed=0):
+    """Impact table with many types, missing types and intensities, and missing changes"""
+    rng = np.random.default_rng(seed)
+    impact = pd.DataFrame({
+        'exercise_type': rng.choice(['Running', 'Yoga', 'Cycling', 'Swimming', 'Rare', None], size,
+                                    p=[.3, .25, .2, .15, .004, .096]),
+        'intensity': rng.choice(['Low', 'Moderate', 'High', 'Extreme', None], size),
+        **{f'{m}_change': rng.normal(0, 8, size) for m in BP_VITAL_COLUMNS}
+    })
+    impact.loc[rng.random(size) < 0.1, 'pulse_change'] = np.nan
+    return impact
+
+
+@pytest.mark.parametrize("source", ["sample", "random"])
+def test_type_impact_matches_the_per_type_reference(device_data, source):
+    if source == "sample":
+        impact = CorrelationAnalyzer().compute_exercise_impact(*_with_gaps(*device_data)).to_frame()
+    else:
+        impact = _random_impact(2000)
+
+    type_impact = CorrelationAnalyzer()._analyze_exercise_type_impact(impact)
+    expected = _reference_type_impact(impact)
+
+    assert any('intensity_breakdown' in result for result in expected.values())
+    _assert_nested_close(type_impact, expected)
+    # Types keep their order of first appearance
+    assert list(type_impact) == list(expected)
+
+
+def _reference_lag_effects(bp_data, exercise_data, intensity_score, hours):
+    """One follow-up window scanned exercise by exercise, with timestamps instead of days"""
+    bp_data = bp_data.sort_values('datetime', kind='stable')
+    changes = []
+    for (_, exercise), score in zip(exercise_data.iterrows(), intensity_score):
+        start = exercise['datetime']
+        end = start + pd.Timedelta(minutes=np.nan_to_num(exercise['duration_minutes']))
+        before = bp_data[bp_data['datetime'] < start]
+        after = bp_data[(bp_data['datetime'] > end) & (bp_data['datetime'] <= end + pd.Timedelta(hours=hours))]
+        if len(before) == 0 or len(after) == 0:
+            continue
+        changes.append([score] + [after[measure].mean() - before[measure].iloc[-1] for measure in BP_VITAL_COLUMNS])
+    return pd.DataFrame(changes, columns=['intensity_score'] + list(BP_VITAL_COLUMNS))
+
+
+def _assert_lag_row(row, expected):
+    assert row['exercises'] == len(expected)
+    for measure in BP_VITAL_COLUMNS:
+        change = expected[measure].dropna()
+        np.testing.assert_allclose(row[f'avg_{measure}_change'], change.mean())
+        np.testing.assert_allclose(row[f'{measure}_change_se'], change.std() / np.sqrt(len(change)))
+        if len(change) < 3:
+            continue
+        r, p = pearsonr(expected.loc[change.index, 'intensity_score'], change)
+        np.testing.assert_allclose([row[f'{measure}_correlation'], row[f'{measure}_p_value']], [r, p])
+
+
+def test_lag_scan_matches_one_reference_scan_per_window(device_data):
+    bp_data, exercise_data = _with_gaps(*device_data)
+    analyzer = CorrelationAnalyzer()
+
+    lags = analyzer.scan_lags(bp_data, exercise_data)
+
+    assert lags['window_hours'].tolist() == LAG_WINDOWS_HOURS
+    assert lags['window'].tolist()[:4] == ['6h', '12h', '1d', '2d']
+    intensity_score = analyzer._intensity_score(exercise_data)
+    for _, row in lags.iterrows():
+        expected = _reference_lag_effects(bp_data, exercise_data, intensity_score, row['window_hours'])
+        assert len(expected) > 0
+        _assert_lag_row(row, expected)
+    # Longer windows match every exercise that short ones do
+    assert lags['exercises'].is_monotonic_increasing
+
+
+def test_running_lag_scan_matches_the_batch_scan(device_data):
+    bp_data, exercise_data = _with_gaps(*device_data)
+    windows = [1.5, 36, 72]
+    batch = CorrelationAnalyzer().scan_lags(bp_data, exercise_data, windows)
+
+    incremental = IncrementalCorrelationAnalyzer()
+    assert incremental.scan_running_lags() is None
+    for rows in np.array_split(np.random.default_rng(2).permutation(len(bp_data)), 3):
+        incremental.append_readings(bp_data.iloc[rows])
+    for rows in np.array_split(np.arange(len(exercise_data)), 2):
+        incremental.append_exercises(exercise_data.iloc[rows])
+    running = incremental.scan_running_lags(windows)
+
+    assert running['window'].tolist() == ['1.5h', '36h', '3d']
+    pd.testing.assert_frame_equal(running, batch, check_exact=False)
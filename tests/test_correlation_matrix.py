@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import pearsonr, spearmanr
+
+from src.analysis.correlation import CorrelationAnalyzer
+from src.analysis.correlation_matrix import (
+    BP_OUTCOMES, EXERCISE_FEATURES, CorrelationEngine, correlation_p_values, pairwise_pearson
+)
+from src.analysis.resampling import ResamplingEngine
+from src.data_processing.schema import BP_VITAL_COLUMNS
+
+
+def _reference_pair(x, y):
+    """pearsonr over the rows where both values are present, one pair at a time"""
+    present = ~(np.isnan(x) | np.isnan(y))
+    if present.sum() < 3 or np.ptp(x[present]) == 0 or np.ptp(y[present]) == 0:
+        return np.nan, np.nan
+    result = pearsonr(x[present], y[present])
+    return result[0], result[1]
+
+
+def _random_impact(size, seed=0):
+    rng = np.random.default_rng(seed)
+    intensity = rng.uniform(0, 6, size)
+    impact = pd.DataFrame({
+        'exercise_date': pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.permutation(size), unit='D'),
+        'intensity_score': intensity,
+        'duration_minutes': rng.integers(10, 90, size).astype(float),
+        'calories_burned': rng.normal(300, 80, size),
+        'avg_heart_rate': rng.normal(120, 15, size),
+        'steps': np.zeros(size),
+        'systolic_change': -1.5 * intensity + rng.normal(0, 4, size),
+        'diastolic_change': rng.normal(0, 4, size),
+        'pulse_change': 2 * intensity + rng.normal(0, 3, size)
+    })
+    for column in ['calories_burned', 'avg_heart_rate', 'pulse_change']:
+        impact.loc[rng.random(size) < 0.15, column] = np.nan
+    return impact
+
+
+@pytest.fixture(params=["sample", "random"])
+def impact(request, device_data):
+    if request.param == "sample":
+        return CorrelationAnalyzer().compute_exercise_impact(*device_data).to_frame()
+    return _random_impact(400)
+
+
+def test_matrix_matches_pearsonr_for_every_pair(impact):
+    matrix = CorrelationEngine(impact).matrix()
+
+    assert matrix.features == [f for f in EXERCISE_FEATURES if f in impact.columns]
+    assert matrix.outcomes == BP_OUTCOMES
+    for feature in matrix.features:
+        for outcome in matrix.outcomes:
+            x = impact[feature].to_numpy(dtype=float, na_value=np.nan)
+            y = impact[outcome].to_numpy(dtype=float, na_value=np.nan)
+            r, p_value = _reference_pair(x, y)
+            np.testing.assert_allclose(matrix.correlation.at[feature, outcome], r, rtol=1e-9, equal_nan=True)
+            np.testing.assert_allclose(matrix.p_value.at[feature, outcome], p_value, rtol=1e-6, atol=1e-300,
+                                       equal_nan=True)
+            assert matrix.n.at[feature, outcome] == (~(np.isnan(x) | np.isnan(y))).sum()
+
+
+def test_overall_correlations_match_the_pearsonr_results(device_data):
+    analyzer = CorrelationAnalyzer(resampler=ResamplingEngine(n_resamples=50, seed=0))
+    results = analyzer.analyze_exercise_bp_correlation(*device_data)
+    impact = results['exercise_impact_data']
+
+    for measure in BP_VITAL_COLUMNS:
+        r, p_value = pearsonr(impact['intensity_score'], impact[f'{measure}_change'])
+        overall = results['overall_correlation'][measure]
+        assert overall['correlation'] == pytest.approx(r)
+        assert overall['p_value'] == pytest.approx(p_value)
+        assert overall['significant'] == (p_value < 0.05)
+
+
+def test_spearman_and_lagged_matrices():
+    impact = _random_impact(300).dropna()
+    order = np.argsort(impact['exercise_date'].to_numpy(), kind='stable')
+    engine = CorrelationEngine(impact)
+
+    spearman = engine.matrix('spearman')
+    for feature in ['intensity_score', 'calories_burned']:
+        for outcome in BP_OUTCOMES:
+            np.testing.assert_allclose(spearman.correlation.at[feature, outcome],
+                                       spearmanr(impact[feature], impact[outcome])[0], rtol=1e-9)
+
+    # Lag 2 pairs each exercise with the outcome two exercises later, in date order
+    lagged = engine.lagged([2])[2]
+    x = impact['intensity_score'].to_numpy()[order][:-2]
+    y = impact['systolic_change'].to_numpy()[order][2:]
+    np.testing.assert_allclose(lagged.correlation.at['intensity_score', 'systolic_change'], pearsonr(x, y)[0])
+    table = lagged.to_frame()
+    assert len(table) == len(lagged.features) * len(BP_OUTCOMES) and (table['lag'] == 2).all()
+
+
+def test_undefined_correlations_are_nan():
+    x = np.array([[1.0, 5.0], [2.0, 5.0], [3.0, 5.0], [np.nan, 5.0]])
+    y = np.array([[2.0], [1.0], [np.nan], [4.0]])
+
+    r, n = pairwise_pearson(x, y)
+
+    # Two complete pairs in the first column, a constant second column
+    assert n.tolist() == [[2], [3]]
+    assert np.isnan(r).all()
+    assert np.isnan(correlation_p_values(r, n)).all()
+    assert correlation_p_values(np.array([1.0, -1.0]), np.array([10, 10])).tolist() == [0.0, 0.0]
@@ -0,0 +1,74 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing import data_loader, omron
+from src.data_processing.data_loader import DataLoader
+from src.data_processing.device_store import DeviceDataStore
+from src.data_processing.schema import to_compact_bp, to_compact_exercise, valid_bp_rows
+
+from conftest import PATIENT_DATA_DIR
+
+BP_PATH = os.path.join(PATIENT_DATA_DIR, "47047908", "omron", "omron_data.csv")
+EXERCISE_PATH = os.path.join(PATIENT_DATA_DIR, "47047908", "google_fit", "google_fit.csv")
+
+
+@pytest.fixture
+def loader(tmp_path, monkeypatch):
+    """DataLoader whose device store lives under tmp_path"""
+    monkeypatch.setattr(data_loader, "DeviceDataStore", lambda path: DeviceDataStore(str(tmp_path / "store")))
+    return DataLoader(store_id="test")
+
+
+def _upload(path):
+    """In-memory upload, like Streamlit's UploadedFile"""
+    with open(path, 'rb') as f:
+        return io.BytesIO(f.read())
+
+
+def _reference(path, to_compact):
+    """Whole-file load as before chunked ingest, in the store's time order"""
+    compact = to_compact(pd.read_csv(path))
+    return compact.sort_values('datetime', kind='stable').reset_index(drop=True)
+
+
+def test_chunks_match_a_whole_file_load(loader):
+    chunks = list(loader._ingest(BP_PATH, 'bp', omron, omron.to_compact, valid_bp_rows, chunk_rows=7))
+
+    assert [len(chunk) for chunk in chunks[:-1]] == [7] * (len(chunks) - 1)
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), to_compact_bp(pd.read_csv(BP_PATH)))
+    assert loader.memory_reports['bp']['rows'] == sum(len(chunk) for chunk in chunks)
+
+
+def test_chunked_upload_matches_a_whole_file_load(loader):
+    progress = []
+
+    bp_data, exercise_data = loader.load_user_data(
+        _upload(BP_PATH), _upload(EXERCISE_PATH), chunk_rows=5,
+        progress_callback=lambda fraction, message: progress.append(fraction)
+    )
+
+    for loaded, expected in [(bp_data, _reference(BP_PATH, to_compact_bp)),
+                             (exercise_data, _reference(EXERCISE_PATH, to_compact_exercise))]:
+        assert list(loaded.columns) == list(expected.columns)
+        for column in expected.columns:
+            np.testing.assert_array_equal(np.asarray(loaded[column]), np.asarray(expected[column]))
+    # Reported once per chunk of each file, ending with the whole file read
+    assert len(progress) >= len(bp_data) // 5 + len(exercise_data) // 5
+    assert progress[-1] == pytest.approx(1.0)
+
+
+def test_invalid_rows_are_dropped_chunk_by_chunk(loader):
+    raw = pd.read_csv(BP_PATH, dtype=str)
+    raw.loc[3, 'systolic'] = 'err'
+    raw.loc[11, 'diastolic'] = '400'
+    raw.loc[12, 'date'] = 'not a date'
+
+    bp_data, _ = loader.load_user_data(io.BytesIO(raw.to_csv(index=False).encode()), chunk_rows=4)
+
+    assert len(bp_data) == len(raw) - 3
+    assert loader.memory_reports['bp']['rejected_rows'] == 3
+    assert bp_data['systolic'].dtype == np.int16
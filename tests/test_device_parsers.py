@@ -0,0 +1,164 @@
+import io
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing import google_fit, omron
+from src.data_processing.patient_catalog import PatientCatalog
+from src.data_processing.schema import to_compact_bp, to_compact_exercise
+
+from conftest import PATIENT_DATA_DIR
+
+BP_PATH = os.path.join(PATIENT_DATA_DIR, "47047908", "omron", "omron_data.csv")
+EXERCISE_PATH = os.path.join(PATIENT_DATA_DIR, "47047908", "google_fit", "google_fit.csv")
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    """Run with the machine's timezone set to America/New_York"""
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _omron_connect_export(raw, delimiter=",", date_format="%m/%d/%Y", time_format="%I:%M %p", headers=None):
+    """The sample readings as an OMRON connect export with unit headers and device flags"""
+    headers = headers or ["Date", "Time", "Systolic (mmHg)", "Diastolic (mmHg)", "Pulse (bpm)",
+                          "Irregular heartbeat detected", "Notes"]
+    times = pd.to_datetime(raw['date'] + ' ' + raw['time'])
+    export = pd.DataFrame({
+        headers[0]: times.dt.strftime(date_format), headers[1]: times.dt.strftime(time_format),
+        headers[2]: raw['systolic'], headers[3]: raw['diastolic'], headers[4]: raw['pulse'],
+        headers[5]: np.where(np.arange(len(raw)) % 5 == 0, "Yes", "-"), headers[6]: ""
+    })
+    return export.to_csv(index=False, sep=delimiter).encode()
+
+
+def test_internal_csvs_parse_like_read_csv():
+    assert omron.detect_schema(open(BP_PATH, 'rb').read(4096))['name'] == 'internal'
+    assert google_fit.detect_schema(open(EXERCISE_PATH, 'rb').read(4096)) == 'internal'
+
+    pd.testing.assert_frame_equal(omron.parse_omron_csv(BP_PATH), to_compact_bp(pd.read_csv(BP_PATH)))
+    pd.testing.assert_frame_equal(google_fit.parse_google_fit(EXERCISE_PATH),
+                                  to_compact_exercise(pd.read_csv(EXERCISE_PATH)))
+
+
+@pytest.mark.parametrize("delimiter,date_format,time_format,headers", [
+    (",", "%m/%d/%Y", "%I:%M %p", None),
+    (";", "%d.%m.%Y", "%H:%M", ["Datum", "Zeit", "Systole (mmHg)", "Diastole (mmHg)", "Puls (Schlag/Min)",
+                       "IHB", "Notiz"])
+])
+def test_omron_connect_exports_match_the_internal_csv(tmp_path, delimiter, date_format, time_format, headers):
+    raw = pd.read_csv(BP_PATH)
+    path = tmp_path / "export.csv"
+    path.write_bytes(_omron_connect_export(raw, delimiter, date_format, time_format, headers))
+
+    schema = omron.detect_schema(path.read_bytes()[:4096])
+    bp_data = omron.parse_omron_csv(str(path))
+
+    assert schema['name'] == 'omron_connect' and schema['delimiter'] == delimiter
+    expected = to_compact_bp(raw)
+    for column in ['datetime', 'systolic', 'diastolic', 'pulse']:
+        np.testing.assert_array_equal(bp_data[column].to_numpy(), expected[column].to_numpy())
+    assert bp_data['irregular_heartbeat'].sum() == len(raw[::5])
+
+
+def test_unknown_layouts_are_not_detected():
+    assert omron.detect_schema(b"when,high,low\n2025-01-01,120,80\n") is None
+    assert google_fit.detect_schema(b"date,distance\n2025-01-01,5\n") is None
+    assert google_fit.detect_schema(b'{"session": []}') == 'sessions_json'
+    assert google_fit.detect_schema(b'<?xml version="1.0"?>\n<TrainingCenterDatabase xmlns="x">') == 'tcx'
+
+
+def test_parse_datetimes_detects_one_format_per_column():
+    dates = pd.Series(["31.12.2024", "01.01.2025", "bad"])
+    times = pd.Series(["07:05", "19:30", "08:00"])
+
+    parsed = omron.parse_datetimes(dates, times)
+
+    assert parsed.tolist()[:2] == [pd.Timestamp("2024-12-31 07:05"), pd.Timestamp("2025-01-01 19:30")]
+    assert pd.isna(parsed.iloc[2])
+
+
+def _session(start, end, activity, steps=None, heart_rate=None):
+    aggregate = [{'metricName': 'com.google.calories.expended', 'floatValue': 250.4}]
+    if steps is not None:
+        aggregate.append({'metricName': 'com.google.step_count.delta', 'intValue': steps})
+    if heart_rate is not None:
+        aggregate.append({'metricName': 'com.google.heart_rate.summary', 'floatValue': heart_rate})
+    return {'startTime': start, 'endTime': end, 'fitnessActivity': activity, 'aggregate': aggregate}
+
+
+def test_sessions_are_in_local_wall_clock_time(tmp_path, new_york):
+    sessions = {'session': [
+        # UTC times are shown in the machine's timezone, on either side of a DST change
+        _session("2025-01-10T12:00:00.000Z", "2025-01-10T12:45:00.000Z", "running", steps=6000, heart_rate=150),
+        _session("2025-07-10T12:00:00Z", "2025-07-10T12:30:00Z", "walking"),
+        # An explicit offset keeps the clock time it was recorded at, like FHIR readings
+        _session("2025-03-01T07:30:00+01:00", "2025-03-01T08:30:00+01:00", "yoga")
+    ]}
+    path = tmp_path / "sessions.json"
+    path.write_text(json.dumps(sessions))
+
+    exercise_data = google_fit.parse_google_fit(str(path))
+
+    assert exercise_data['datetime'].dt.strftime('%Y-%m-%d %H:%M').tolist() == [
+        "2025-01-10 07:00", "2025-07-10 08:00", "2025-03-01 07:30"]
+    assert exercise_data['duration_minutes'].tolist() == [45, 30, 60]
+    assert exercise_data['exercise_type'].astype(str).tolist() == ["Running", "Walking", "Yoga"]
+    assert exercise_data['intensity'].astype(str).tolist() == ["High", "Low", "Low"]
+    # Sessions without a step count are missing, not 0 steps
+    assert exercise_data['steps'].iloc[0] == 6000 and exercise_data['steps'].iloc[1:].isna().all()
+
+    in_utc = google_fit.parse_google_fit(str(path), timezone="UTC")
+    assert in_utc['datetime'].dt.strftime('%H:%M').tolist() == ["12:00", "12:00", "06:30"]
+
+
+def test_epoch_milliseconds_and_tcx_files(tmp_path, new_york):
+    start = int(pd.Timestamp("2025-01-10T12:00:00Z").timestamp() * 1000)
+    rest_response = {'session': [{'startTimeMillis': str(start), 'endTimeMillis': str(start + 20 * 60000),
+                                  'activityType': 8}]}
+    (tmp_path / "rest.json").write_text(json.dumps(rest_response))
+    (tmp_path / "ride.tcx").write_text(
+        '<?xml version="1.0"?>\n'
+        '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">'
+        '<Activities><Activity Sport="Biking"><Id>2025-01-11T15:00:00Z</Id>'
+        '<Lap><TotalTimeSeconds>1800</TotalTimeSeconds><Calories>300</Calories>'
+        '<AverageHeartRateBpm><Value>120</Value></AverageHeartRateBpm></Lap>'
+        '<Lap><TotalTimeSeconds>1800</TotalTimeSeconds><Calories>200</Calories>'
+        '<AverageHeartRateBpm><Value>140</Value></AverageHeartRateBpm></Lap>'
+        '</Activity></Activities></TrainingCenterDatabase>'
+    )
+
+    exercise_data = google_fit.parse_google_fit(str(tmp_path))
+
+    assert exercise_data['datetime'].dt.strftime('%Y-%m-%d %H:%M').tolist() == [
+        "2025-01-10 07:00", "2025-01-11 10:00"]
+    assert exercise_data['exercise_type'].astype(str).tolist() == ["Running", "Cycling"]
+    assert exercise_data['duration_minutes'].tolist() == [20, 60]
+    assert exercise_data['calories_burned'].iloc[1] == 500
+    assert exercise_data['avg_heart_rate'].iloc[1] == 130
+
+
+def test_catalog_summarizes_native_exports(tmp_path):
+    data_dir = tmp_path / "patient_data"
+    shutil.copytree(os.path.join(PATIENT_DATA_DIR, "47047908"), data_dir / "p1",
+                    ignore=shutil.ignore_patterns("columnar"))
+    raw = pd.read_csv(BP_PATH)
+    (data_dir / "p1" / "omron" / "omron_data.csv").write_bytes(_omron_connect_export(raw, ";", "%d.%m.%Y", "%H:%M"))
+
+    catalog = PatientCatalog(str(data_dir))
+    catalog.refresh()
+
+    times = pd.to_datetime(raw['date'])
+    patient = catalog.get_patient("p1")
+    assert (patient['bp_rows'], patient['bp_start'], patient['bp_end']) == (
+        len(raw), times.min().strftime("%Y-%m-%d"), times.max().strftime("%Y-%m-%d"))
+    assert patient['exercise_rows'] == len(pd.read_csv(EXERCISE_PATH))
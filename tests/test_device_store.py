@@ -0,0 +1,103 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing.device_store import DeviceDataStore, content_hash, row_keys, store_dir_name
+from src.data_processing.schema import to_compact_bp, to_compact_exercise
+
+from conftest import PATIENT_DATA_DIR
+
+BP_PATH = os.path.join(PATIENT_DATA_DIR, "47047908", "omron", "omron_data.csv")
+EXERCISE_PATH = os.path.join(PATIENT_DATA_DIR, "47047908", "google_fit", "google_fit.csv")
+BP_KEY = ['datetime', 'systolic', 'diastolic', 'pulse']
+
+
+def _csv(frame):
+    return io.BytesIO(frame.to_csv(index=False).encode())
+
+
+def _parse_bp(source):
+    source.seek(0)
+    return to_compact_bp(pd.read_csv(source))
+
+
+def _reference(*raw_frames):
+    """Every upload concatenated and deduplicated as a whole, as before the store"""
+    return to_compact_bp(pd.concat(raw_frames, ignore_index=True)).drop_duplicates(BP_KEY)
+
+
+def _rows(frame):
+    """Sorted row tuples, whatever the column storage (arrays or memory maps)"""
+    return sorted(zip(*(frame[column].astype(object).tolist() for column in frame.columns)))
+
+
+def test_overlapping_uploads_only_add_unseen_rows(tmp_path):
+    raw = pd.read_csv(BP_PATH)
+    first, second = raw.iloc[:40], raw.iloc[25:]
+    store = DeviceDataStore(str(tmp_path / "store"))
+
+    result = store.ingest(_csv(first), 'bp', _parse_bp)
+    assert (result.added, result.duplicate_rows) == (40, 0)
+
+    result = store.ingest(_csv(second), 'bp', _parse_bp)
+
+    assert (result.added, result.duplicate_rows) == (len(raw) - 40, 15)
+    assert result.new_range == (to_compact_bp(raw.iloc[40:])['datetime'].min(),
+                                to_compact_bp(raw.iloc[40:])['datetime'].max())
+    stored = store.load('bp')
+    assert stored['datetime'].is_monotonic_increasing
+    reference = _reference(first, second)
+    assert list(stored.columns) == list(reference.columns)
+    assert _rows(stored) == _rows(reference)
+    assert store.row_count('bp') == len(reference)
+
+
+def test_a_file_seen_before_is_skipped_without_parsing(tmp_path):
+    store = DeviceDataStore(str(tmp_path / "store"))
+    upload = _csv(pd.read_csv(BP_PATH))
+    store.ingest(upload, 'bp', _parse_bp)
+
+    parsed = []
+    result = store.ingest(io.BytesIO(upload.getvalue()), 'bp', lambda source: parsed.append(source))
+
+    assert result.skipped and result.added == 0 and parsed == []
+    assert result.file_hash == content_hash(BP_PATH)
+
+
+def test_rows_repeated_within_one_upload_are_stored_once(tmp_path):
+    raw = pd.read_csv(BP_PATH).iloc[:10]
+    store = DeviceDataStore(str(tmp_path / "store"))
+
+    new_rows, duplicates = store.merge([to_compact_bp(raw), to_compact_bp(pd.concat([raw.iloc[:3]] * 2))], 'bp')
+
+    assert (len(new_rows), duplicates) == (10, 6)
+    np.testing.assert_array_equal(np.asarray(new_rows['systolic']), raw['systolic'].to_numpy())
+
+
+def test_row_keys_ignore_the_integer_width():
+    compact = to_compact_bp(pd.read_csv(BP_PATH))
+    widened = compact.astype({'systolic': np.float32, 'diastolic': np.float32, 'pulse': np.float32})
+    changed = compact.copy()
+    changed.loc[0, 'pulse'] += 1
+
+    np.testing.assert_array_equal(row_keys(compact, 'bp'), row_keys(widened, 'bp'))
+    assert (row_keys(compact, 'bp') != row_keys(changed, 'bp')).tolist() == [True] + [False] * (len(compact) - 1)
+
+
+def test_kinds_and_owners_are_kept_apart(tmp_path):
+    assert store_dir_name("patient-1/../x") != store_dir_name("patient-1_.._x")
+    assert os.sep not in store_dir_name("patient-1/../x")
+
+    store = DeviceDataStore(str(tmp_path / store_dir_name("patient-1")))
+    other = DeviceDataStore(str(tmp_path / store_dir_name("patient-1")))
+    store.ingest(BP_PATH, 'bp', lambda path: to_compact_bp(pd.read_csv(path)))
+    store.ingest(EXERCISE_PATH, 'exercise', lambda path: to_compact_exercise(pd.read_csv(path)))
+
+    # A second store object on the same directory sees the first one's uploads
+    assert other.ingest(BP_PATH, 'bp', lambda path: pytest.fail("parsed again")).skipped
+    assert other.row_count('bp') == len(pd.read_csv(BP_PATH))
+    assert other.row_count('exercise') == len(pd.read_csv(EXERCISE_PATH))
+    assert DeviceDataStore(str(tmp_path / store_dir_name("patient-2"))).load('bp') is None
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from src.data_processing.fhir import FHIRIntegration
+from src.data_processing.fhir_async import AsyncFHIRIntegration, FHIRClient
+
+PATIENT_IDS = [f"p{i}" for i in range(8)]
+
+
+def _resources(patient_id):
+    """A patient with a condition, a medication and a BP panel"""
+    subject = {'reference': f'Patient/{patient_id}'}
+    return [
+        {'resourceType': 'Patient', 'id': patient_id, 'name': [{'given': ['Pat'], 'family': patient_id.upper()}]},
+        {'resourceType': 'Condition', 'id': f'{patient_id}-c1', 'subject': subject, 'code': {'text': 'Hypertension'}},
+        {'resourceType': 'MedicationRequest', 'id': f'{patient_id}-m1', 'subject': subject,
+         'medicationCodeableConcept': {'text': 'Lisinopril'}},
+        {'resourceType': 'Observation', 'id': f'{patient_id}-o1', 'subject': subject,
+         'category': [{'coding': [{'code': 'vital-signs'}]}],
+         'code': {'coding': [{'system': 'http://loinc.org', 'code': '85354-9'}]},
+         'effectiveDateTime': '2025-01-25T09:30:00Z',
+         'component': [
+             {'code': {'coding': [{'code': '8480-6'}]}, 'valueQuantity': {'value': 141, 'unit': 'mm[Hg]'}},
+             {'code': {'coding': [{'code': '8462-4'}]}, 'valueQuantity': {'value': 92, 'unit': 'mm[Hg]'}}
+         ]}
+    ]
+
+
+class _SlowSearchHandler(BaseHTTPRequestHandler):
+    """Patient and vital-sign searches that take a moment, counting the requests in flight"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+        finally:
+            # Counted out before responding: the client may start its next request as soon as it has the response
+            with server.lock:
+                server.in_flight -= 1
+
+        if server.status != 200:
+            return self._send(server.status, {'resourceType': 'OperationOutcome'})
+
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        resource_type = url.path.rsplit('/', 1)[-1]
+        if resource_type == 'Patient':
+            matches = [r for patient_id in query['_id'].split(',') for r in _resources(patient_id)
+                       if r['resourceType'] != 'Observation']
+        else:
+            matches = [r for patient_id in query['patient'].split(',') for r in _resources(patient_id)
+                       if r['resourceType'] == resource_type]
+        self._send(200, {'resourceType': 'Bundle', 'entry': [{'resource': r} for r in matches]})
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/fhir+json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fhir_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowSearchHandler)
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.delay = 0.05
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/baseR4"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+async def _fetch_all(client, patient_ids):
+    try:
+        return await client.fetch_patients(patient_ids)
+    finally:
+        await client.close()
+
+
+def test_async_fetch_matches_the_sync_client(tmp_path, fhir_server):
+    client = AsyncFHIRIntegration(fhir_server.base_url, str(tmp_path / "async" / "patients"))
+    patients = asyncio.run(_fetch_all(client, PATIENT_IDS))
+
+    expected = FHIRIntegration(fhir_server.base_url, str(tmp_path / "sync" / "patients"),
+                               use_cache=False).fetch_patients(PATIENT_IDS)
+
+    assert sorted(patients) == PATIENT_IDS
+    assert json.loads(json.dumps(patients)) == json.loads(json.dumps(expected))
+    for patient_id in PATIENT_IDS:
+        assert (tmp_path / "async" / "patients" / patient_id / "patient_info.json").exists()
+
+
+def test_requests_in_flight_are_bounded_per_server(tmp_path, fhir_server):
+    client = AsyncFHIRIntegration(fhir_server.base_url, str(tmp_path / "patients"), max_concurrency=3,
+                                  use_cache=False)
+
+    started = time.perf_counter()
+    patients = asyncio.run(_fetch_all(client, PATIENT_IDS))
+    elapsed = time.perf_counter() - started
+
+    assert len(patients) == len(PATIENT_IDS)
+    assert fhir_server.max_in_flight == 3
+    # 16 searches three at a time, not one after the other
+    assert elapsed < 2 * len(PATIENT_IDS) * fhir_server.delay
+
+
+def test_server_errors_fall_back_to_the_saved_copy(tmp_path, fhir_server, capsys):
+    data_dir = tmp_path / "patients"
+    saved = asyncio.run(_fetch_all(AsyncFHIRIntegration(fhir_server.base_url, str(data_dir)), ["p1"]))["p1"]
+
+    fhir_server.status = 500
+    client = AsyncFHIRIntegration(fhir_server.base_url, str(data_dir), cache_ttls={'Bundle': 0, 'Observation': 0})
+
+    assert asyncio.run(_fetch_all(client, ["p1", "p2"])) == {"p1": saved}
+    assert "Error fetching patient p1: 500" in capsys.readouterr().out
+
+
+def test_unreachable_server_falls_back_to_the_saved_copy(tmp_path, fhir_server):
+    data_dir = tmp_path / "patients"
+    saved = asyncio.run(_fetch_all(AsyncFHIRIntegration(fhir_server.base_url, str(data_dir), use_cache=False),
+                                   ["p1"]))["p1"]
+    fhir_server.shutdown()
+    fhir_server.server_close()
+
+    # The saved patient_info.json is returned without any cached response to serve
+    client = AsyncFHIRIntegration(fhir_server.base_url, str(data_dir), timeout=2)
+    assert client.cache.lookup(client._sync.group_search_urls(["p1"])[0][0])[0] is None
+
+    assert asyncio.run(_fetch_all(client, ["p1"])) == {"p1": saved}
+
+
+def test_sync_facade_shares_one_event_loop(tmp_path, fhir_server):
+    client = FHIRClient(fhir_server.base_url, str(tmp_path / "patients"), max_concurrency=2, use_cache=False)
+    try:
+        results = {}
+        threads = [threading.Thread(target=lambda pid=patient_id: results.update({pid: client.fetch_patient(pid)}))
+                   for patient_id in PATIENT_IDS[:4]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        client.close()
+
+    assert sorted(results) == PATIENT_IDS[:4]
+    assert all(results[patient_id]['conditions'] == ["Hypertension"] for patient_id in results)
+    assert fhir_server.max_in_flight == 2
+    assert not client._thread.is_alive()
@@ -0,0 +1,203 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from src.data_processing import fhir_bulk, fhir_store
+from src.data_processing.fhir_bulk import FHIRBulkExporter
+from src.data_processing.fhir_extract import build_patient_data, build_patient_records
+
+COHORT_SIZE = 40
+
+
+def _export_files():
+    """NDJSON contents per resource type; the last condition belongs to a patient outside the export"""
+    files = {'Patient': [], 'Condition': [], 'MedicationRequest': [], 'Observation': []}
+    for i in range(COHORT_SIZE):
+        patient_id = f"p{i}"
+        subject = {'reference': f'Patient/{patient_id}'}
+        files['Patient'].append({'resourceType': 'Patient', 'id': patient_id,
+                                 'name': [{'given': ['Pat'], 'family': f'Number{i}'}]})
+        files['Condition'].append({'resourceType': 'Condition', 'id': f'{patient_id}-c1', 'subject': subject,
+                                   'code': {'text': 'Hypertension' if i % 2 else 'Diabetes'}})
+        files['MedicationRequest'].append({'resourceType': 'MedicationRequest', 'id': f'{patient_id}-m1',
+                                           'subject': subject,
+                                           'medicationCodeableConcept': {'text': 'Lisinopril'}})
+        for day in range(1, 4):
+            files['Observation'].append({
+                'resourceType': 'Observation', 'id': f'{patient_id}-o{day}', 'subject': subject,
+                'category': [{'coding': [{'code': 'vital-signs'}]}],
+                'code': {'coding': [{'system': 'http://loinc.org', 'code': '85354-9'}]},
+                'effectiveDateTime': f'2025-01-0{day}T08:00:00Z',
+                'component': [
+                    {'code': {'coding': [{'code': '8480-6'}]}, 'valueQuantity': {'value': 120 + i, 'unit': 'mm[Hg]'}},
+                    {'code': {'coding': [{'code': '8462-4'}]}, 'valueQuantity': {'value': 80 + day, 'unit': 'mm[Hg]'}}
+                ]
+            })
+    files['Condition'].append({'resourceType': 'Condition', 'id': 'unknown-c1',
+                               'subject': {'reference': 'Patient/unknown'}, 'code': {'text': 'Asthma'}})
+    return files
+
+
+class _ExportHandler(BaseHTTPRequestHandler):
+    """Bulk Data server: kick-off, two in-progress polls, the manifest, NDJSON files and cleanup"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests.append(("GET", url.path, {k: v[0] for k, v in parse_qs(url.query).items()}))
+        origin = f"http://{self.headers['Host']}"
+
+        if url.path.endswith("/$export"):
+            self._send(202, headers={'Content-Location': f"{origin}/export-status/1"})
+        elif url.path == "/export-status/1":
+            self.server.polls += 1
+            if self.server.polls < 3:
+                self._send(202, headers={'Retry-After': '0'})
+            else:
+                manifest = {'output': [{'type': resource_type, 'url': f"{origin}/files/{resource_type}.ndjson"}
+                                       for resource_type in self.server.files]}
+                self._send(200, json.dumps(manifest))
+        elif url.path.startswith("/files/"):
+            resources = self.server.files[url.path.split("/")[-1].split(".")[0]]
+            # Blank lines between resources are allowed and skipped
+            self._send(200, "\n\n".join(json.dumps(resource) for resource in resources) + "\n")
+        else:
+            self._send(404)
+
+    def do_DELETE(self):
+        self.server.requests.append(("DELETE", self.path, {}))
+        self._send(202)
+
+    def _send(self, status, body="", headers=None):
+        payload = body.encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def export_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ExportHandler)
+    server.files = _export_files()
+    server.requests = []
+    server.polls = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_export_saves_every_patient_and_returns_ids(tmp_path, export_server):
+    exporter = FHIRBulkExporter(export_server.base_url, str(tmp_path / "patients"), poll_interval=60)
+
+    patient_ids = exporter.export_patients(since="2025-01-01T00:00:00Z")
+
+    assert patient_ids == [f"p{i}" for i in range(COHORT_SIZE)]
+
+    # Same records as building the whole export in memory
+    resources = [resource for resource_type in FHIRBulkExporter.EXPORT_TYPES
+                 for resource in export_server.files[resource_type]]
+    expected = build_patient_data(build_patient_records(resources))
+    for patient_id in patient_ids:
+        with open(tmp_path / "patients" / patient_id / "patient_info.json") as f:
+            assert json.load(f) == json.loads(json.dumps(expected[patient_id]))
+    assert not (tmp_path / "patients" / "unknown").exists()
+
+    # Kick-off, polls until the manifest (Retry-After: 0 overrides poll_interval), files, then cleanup
+    assert export_server.requests[0] == ("GET", "/Patient/$export", {
+        '_type': "Patient,Condition,MedicationRequest,Observation", '_since': "2025-01-01T00:00:00Z"
+    })
+    assert export_server.polls == 3
+    assert export_server.requests[-1][:2] == ("DELETE", "/export-status/1")
+
+
+def test_only_one_patient_is_held_in_memory_at_a_time(tmp_path, export_server, monkeypatch):
+    live = {'now': 0, 'max': 0}
+
+    class _CountingBuilder(fhir_store.PatientRecordBuilder):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            live['now'] += 1
+            live['max'] = max(live['max'], live['now'])
+
+        def build(self, *args, **kwargs):
+            live['now'] -= 1
+            return super().build(*args, **kwargs)
+
+    monkeypatch.setattr(fhir_store, "PatientRecordBuilder", _CountingBuilder)
+    spill_root = tmp_path / "spill"
+    spill_root.mkdir()
+    monkeypatch.setattr(fhir_bulk.tempfile, "tempdir", str(spill_root))
+
+    patient_ids = FHIRBulkExporter(export_server.base_url, str(tmp_path / "patients")).export_patients()
+
+    assert len(patient_ids) == COHORT_SIZE
+    assert live == {'now': 0, 'max': 1}
+    # Spill files are gone once the export is ingested
+    assert list(spill_root.iterdir()) == []
+
+
+def test_group_export_uses_the_group_endpoint(tmp_path, export_server):
+    status_url = FHIRBulkExporter(export_server.base_url, str(tmp_path)).kick_off(group_id="cohort")
+
+    assert status_url == f"{export_server.base_url}/export-status/1"
+    assert export_server.requests == [("GET", "/Group/cohort/$export",
+                                       {'_type': "Patient,Condition,MedicationRequest,Observation"})]
+
+
+def _patient_info(data_dir, patient_id):
+    with open(data_dir / patient_id / "patient_info.json") as f:
+        return json.load(f)
+
+
+def test_since_export_merges_changes_into_the_stored_records(tmp_path, export_server):
+    data_dir = tmp_path / "patients"
+    exporter = FHIRBulkExporter(export_server.base_url, str(data_dir))
+    exporter.export_patients()
+    before = {patient_id: _patient_info(data_dir, patient_id) for patient_id in ("p0", "p1", "p2")}
+
+    # Since then: p1 was renamed, p2 got a new condition and its first reading
+    # was corrected, and the last condition still belongs to nobody we store
+    full = export_server.files
+    renamed = dict(full['Patient'][1], name=[{'given': ['Pat'], 'family': 'Renamed'}])
+    corrected = json.loads(json.dumps(full['Observation'][6]))
+    corrected['component'][0]['valueQuantity']['value'] = 150
+    export_server.files = {
+        'Patient': [renamed],
+        'Condition': [{'resourceType': 'Condition', 'id': 'p2-c2', 'subject': {'reference': 'Patient/p2'},
+                       'code': {'text': 'Asthma'}}, full['Condition'][-1]],
+        'MedicationRequest': [],
+        'Observation': [corrected]
+    }
+    export_server.polls = 0
+
+    assert exporter.export_patients(since="2025-02-01T00:00:00Z") == ["p1", "p2"]
+
+    # Only the demographics of p1 changed; its conditions, medications and vitals are kept
+    p1 = _patient_info(data_dir, "p1")
+    assert p1['demographics']['name'] == "Pat Renamed"
+    assert {key: value for key, value in p1.items() if key != 'demographics'} == \
+        {key: value for key, value in before['p1'].items() if key != 'demographics'}
+
+    # p2 is in the export only through its changed resources
+    p2 = _patient_info(data_dir, "p2")
+    assert p2['demographics'] == before['p2']['demographics']
+    assert p2['conditions'] == ["Diabetes", "Asthma"]
+    assert p2['medications'] == ["Lisinopril"]
+    series, previous = p2['vitals_series'], before['p2']['vitals_series']
+    assert series['times_ms'] == previous['times_ms']
+    assert series['values'] == [150.0] + previous['values'][1:]
+
+    # Untouched patients are left as they were
+    assert _patient_info(data_dir, "p0") == before['p0']
+    assert not (data_dir / "unknown").exists()
@@ -0,0 +1,146 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from src.data_processing.fhir import FHIRIntegration
+from src.data_processing.fhir_cache import FHIRHTTPCache
+
+BASE_URL = "http://fhir.test/baseR4"
+
+
+class _Response:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class _RevalidatingServer:
+    """requests.Session stand-in answering conditional GETs for one versioned resource per URL"""
+
+    def __init__(self, resources, etags=True):
+        self.resources = resources
+        self.etags = etags
+        self.requests = []
+        self.offline = False
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append((url, dict(headers or {})))
+        if self.offline:
+            raise requests.ConnectionError("server unreachable")
+        body = self.resources[url]
+        version = body['meta']['versionId']
+        response_headers = {'ETag': f'W/"{version}"'} if self.etags else {}
+        if headers.get('If-None-Match') == f'W/"{version}"':
+            return _Response(304, headers=response_headers)
+        return _Response(200, body, response_headers)
+
+
+def _patient(version, family="Lee"):
+    return {'resourceType': 'Patient', 'id': 'p1', 'name': [{'given': ['Ann'], 'family': family}],
+            'meta': {'versionId': str(version), 'lastUpdated': '2025-01-20T10:00:00+01:00'}}
+
+
+def test_fresh_responses_skip_the_server(tmp_path):
+    url = f"{BASE_URL}/Patient/p1"
+    server = _RevalidatingServer({url: _patient(1)})
+    cache = FHIRHTTPCache(str(tmp_path), session=server)
+
+    assert cache.get_json(url) == (200, _patient(1))
+    assert cache.get_json(url) == (200, _patient(1))
+
+    assert len(server.requests) == 1
+    assert 'If-None-Match' not in server.requests[0][1]
+
+
+def test_expired_responses_are_revalidated_with_one_conditional_request(tmp_path):
+    url = f"{BASE_URL}/Condition?patient=p1"
+    server = _RevalidatingServer({url: _patient(1)})
+    cache = FHIRHTTPCache(str(tmp_path), ttls={'Condition': 0}, session=server)
+    cache.get_json(url)
+
+    # Unchanged: a 304 is answered from the cache
+    assert cache.get_json(url) == (200, _patient(1))
+    assert server.requests[-1][1]['If-None-Match'] == 'W/"1"'
+
+    # Changed on the server: the new version replaces the cached one
+    server.resources[url] = _patient(2, family="Chan")
+    assert cache.get_json(url) == (200, _patient(2, family="Chan"))
+    assert cache.get_json(url) == (200, _patient(2, family="Chan"))
+    assert server.requests[-1][1]['If-None-Match'] == 'W/"2"'
+    assert len(server.requests) == 4
+
+
+def test_validators_fall_back_to_resource_meta(tmp_path):
+    url = f"{BASE_URL}/Patient/p1"
+    server = _RevalidatingServer({url: _patient(7)}, etags=False)
+    cache = FHIRHTTPCache(str(tmp_path), ttls={'Patient': 0}, session=server)
+
+    cache.get_json(url)
+    cache.get_json(url)
+
+    headers = server.requests[-1][1]
+    assert headers['If-None-Match'] == 'W/"7"'
+    assert headers['If-Modified-Since'] == "Mon, 20 Jan 2025 09:00:00 GMT"
+
+
+def test_ttls_are_per_resource_type(tmp_path):
+    cache = FHIRHTTPCache(str(tmp_path), ttls={'Observation': 60})
+
+    assert cache.ttl_for('Observation') == 60
+    assert cache.ttl_for('Patient') == FHIRHTTPCache.DEFAULT_TTLS['Patient']
+    assert cache.resource_type_from_url(f"{BASE_URL}/Condition?patient=1") == 'Condition'
+    assert cache.resource_type_from_url(f"{BASE_URL}/Patient/p1") == 'Patient'
+
+
+def test_stale_copy_is_served_when_the_server_is_unreachable(tmp_path):
+    url = f"{BASE_URL}/Patient/p1"
+    server = _RevalidatingServer({url: _patient(1)})
+    cache = FHIRHTTPCache(str(tmp_path), ttls={'Patient': 0}, session=server)
+    cache.get_json(url)
+
+    server.offline = True
+
+    assert cache.get_json(url) == (200, _patient(1))
+
+
+def test_concurrent_writers_never_leave_a_partial_entry(tmp_path):
+    url = f"{BASE_URL}/Patient/p1"
+    cache = FHIRHTTPCache(str(tmp_path))
+    bodies = [_patient(version, family="x" * 20000) for version in range(40)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda body: cache.record_response(url, None, 200, {}, body), bodies))
+
+    entry, _ = cache.lookup(url)
+    assert entry is not None
+    assert entry['body'] in bodies
+    assert entry['etag'] == f'W/"{entry["body"]["meta"]["versionId"]}"'
+    assert os.listdir(tmp_path) == [os.path.basename(cache._entry_path(url))]
+
+
+def test_repeat_patient_loads_cost_only_not_modified_round_trips(tmp_path):
+    search_url = (f"{BASE_URL}/Patient?_id=p1&_revinclude=Condition:patient&_revinclude=MedicationRequest:patient"
+                  f"&_count=100")
+    vitals_url = f"{BASE_URL}/Observation?patient=p1&category=vital-signs&_count=100"
+    bundle = {'resourceType': 'Bundle', 'meta': {'versionId': '1'}, 'entry': [
+        {'resource': _patient(1)},
+        {'resource': {'resourceType': 'Condition', 'id': 'c1', 'subject': {'reference': 'Patient/p1'},
+                      'code': {'text': 'Hypertension'}}}
+    ]}
+    vitals = {'resourceType': 'Bundle', 'meta': {'versionId': '1'}, 'entry': []}
+    server = _RevalidatingServer({search_url: bundle, vitals_url: vitals})
+    integration = FHIRIntegration(BASE_URL, str(tmp_path / "patients"), cache_ttls={'Bundle': 0, 'Observation': 0})
+    integration.cache.session = server
+
+    first = integration.fetch_patient("p1")
+    second = integration.fetch_patient("p1")
+
+    assert first == second
+    assert first['conditions'] == ["Hypertension"]
+    assert [url for url, _ in server.requests] == [search_url, vitals_url, search_url, vitals_url]
+    assert all(headers['If-None-Match'] == 'W/"1"' for _, headers in server.requests[2:])
@@ -0,0 +1,130 @@
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from src.data_processing import fhir
+from src.data_processing.fhir import FHIRIntegration
+
+BASE_URL = "http://fhir.test/baseR4"
+PAGE_SIZE = 4
+
+
+def _resources(patient_id):
+    """A patient with two conditions, a medication, a BP panel and a lab result"""
+    subject = {'reference': f'Patient/{patient_id}'}
+    return [
+        {'resourceType': 'Patient', 'id': patient_id, 'name': [{'given': ['Pat'], 'family': patient_id.upper()}]},
+        {'resourceType': 'Condition', 'id': f'{patient_id}-c1', 'subject': subject, 'code': {'text': 'Hypertension'}},
+        {'resourceType': 'Condition', 'id': f'{patient_id}-c2', 'subject': subject, 'code': {'text': 'Asthma'}},
+        {'resourceType': 'MedicationRequest', 'id': f'{patient_id}-m1', 'subject': subject,
+         'medicationCodeableConcept': {'text': 'Lisinopril'}},
+        {'resourceType': 'Observation', 'id': f'{patient_id}-o1', 'subject': subject,
+         'category': [{'coding': [{'code': 'vital-signs'}]}],
+         'code': {'coding': [{'system': 'http://loinc.org', 'code': '85354-9'}]},
+         'effectiveDateTime': '2025-01-25T09:30:00Z',
+         'component': [
+             {'code': {'coding': [{'code': '8480-6'}]}, 'valueQuantity': {'value': 141, 'unit': 'mm[Hg]'}},
+             {'code': {'coding': [{'code': '8462-4'}]}, 'valueQuantity': {'value': 92, 'unit': 'mm[Hg]'}}
+         ]},
+        {'resourceType': 'Observation', 'id': f'{patient_id}-o2', 'subject': subject,
+         'category': [{'coding': [{'code': 'laboratory'}]}],
+         'code': {'coding': [{'system': 'http://loinc.org', 'code': '2093-3'}]},
+         'effectiveDateTime': '2025-01-25T09:30:00Z', 'valueQuantity': {'value': 180, 'unit': 'mg/dL'}}
+    ]
+
+
+def _category(resource):
+    return [coding['code'] for category in resource.get('category', []) for coding in category['coding']]
+
+
+class _Response:
+    def __init__(self, body, status_code=200):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class _SearchServer:
+    """Stand-in for requests.get answering reads and searches, with paged Bundles"""
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        parsed = urlparse(url)
+        query = parse_qs(parsed.query)
+        resource_type = parsed.path.rsplit('/', 1)[-1]
+
+        if parsed.path.startswith("/baseR4/Patient/"):
+            return _Response(_resources(resource_type)[0])
+        if resource_type == 'Patient':
+            matches = [r for patient_id in query['_id'][0].split(',') for r in _resources(patient_id)
+                       if r['resourceType'] == 'Patient' or f"{r['resourceType']}:patient" in query['_revinclude']]
+        else:
+            matches = [r for patient_id in query['patient'][0].split(',') for r in _resources(patient_id)
+                       if r['resourceType'] == resource_type
+                       and ('category' not in query or query['category'][0] in _category(r))]
+
+        # Page the matches, linking to the next page like a FHIR server
+        offset = int(query.get('_offset', ['0'])[0])
+        bundle = {'resourceType': 'Bundle',
+                  'entry': [{'resource': r} for r in matches[offset:offset + PAGE_SIZE]]}
+        if offset + PAGE_SIZE < len(matches):
+            bundle['link'] = [{'relation': 'next', 'url': f"{url.split('&_offset=')[0]}&_offset={offset + PAGE_SIZE}"}]
+        return _Response(bundle)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = _SearchServer()
+    monkeypatch.setattr(fhir.requests, 'get', server.get)
+    return server
+
+
+def _integration(tmp_path):
+    return FHIRIntegration(BASE_URL, str(tmp_path / "patients"), use_cache=False)
+
+
+def test_consolidated_fetch_needs_two_searches_instead_of_four_requests(tmp_path, server):
+    consolidated = _integration(tmp_path / "a").fetch_patient("p1")
+    consolidated_urls = list(server.urls)
+    server.urls.clear()
+    separate = _integration(tmp_path / "b").fetch_patient("p1", consolidated=False)
+
+    assert consolidated == separate
+    assert consolidated['conditions'] == ["Hypertension", "Asthma"]
+    assert consolidated['medications'] == ["Lisinopril"]
+    assert consolidated['vitals']
+    # A read and three searches, against a Patient search with its conditions and
+    # medications (one page of four resources) and a vital-sign search
+    assert len(server.urls) == 4
+    assert [urlparse(url).path for url in consolidated_urls] == ["/baseR4/Patient", "/baseR4/Observation"]
+
+
+def test_consolidated_fetch_leaves_out_non_vital_observations(tmp_path, server):
+    _integration(tmp_path).fetch_patient("p1")
+
+    assert not any('Observation:patient' in url for url in server.urls)
+    vital_search = parse_qs(urlparse(server.urls[-1]).query)
+    assert vital_search['category'] == ['vital-signs']
+    assert vital_search['patient'] == ['p1']
+
+
+def test_multi_patient_batches_are_demultiplexed_by_subject(tmp_path, server):
+    patient_ids = [f"p{i}" for i in range(5)]
+
+    patients = _integration(tmp_path).fetch_patients(patient_ids, batch_size=3)
+
+    assert sorted(patients) == patient_ids
+    for patient_id, patient_data in patients.items():
+        assert patient_data['demographics']['name'] == f"Pat {patient_id.upper()}"
+        assert patient_data['conditions'] == ["Hypertension", "Asthma"]
+        assert patient_data['vitals']
+    # Two searches per batch of 3, each followed through its pages (4 resources and a vital sign per patient)
+    searches = [(urlparse(url).path, url.split('=', 1)[1].split('&')[0]) for url in server.urls if '_offset' not in url]
+    assert searches == [("/baseR4/Patient", "p0,p1,p2"), ("/baseR4/Observation", "p0,p1,p2"),
+                        ("/baseR4/Patient", "p3,p4"), ("/baseR4/Observation", "p3,p4")]
+    assert len(server.urls) == 3 + 1 + 2 + 1
@@ -0,0 +1,228 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing.fhir import FHIRIntegration
+from src.data_processing.fhir_extract import (
+    PatientRecordBuilder, VitalsSeries, build_patient_data, build_patient_records, finalize_patient_data
+)
+from src.data_processing.schema import merge_bp_frames, to_compact_bp
+
+from conftest import PATIENT_DATA_DIR
+
+LOINC = "http://loinc.org"
+
+
+def _observation(patient_id, obs_id, code, display, value, unit, time):
+    return {'resourceType': 'Observation', 'id': obs_id, 'subject': {'reference': f'Patient/{patient_id}'},
+            'category': [{'coding': [{'code': 'vital-signs'}]}],
+            'code': {'coding': [{'system': LOINC, 'code': code, 'display': display}]},
+            'effectiveDateTime': time, 'valueQuantity': {'value': value, 'unit': unit}}
+
+
+def _bundle(patient_id, systolic=(128, 142), diastolic=(82, 91)):
+    """Patient, conditions, medications and two days of vitals, in time order like a server returns them"""
+    subject = {'reference': f'Patient/{patient_id}'}
+    resources = [
+        {'resourceType': 'Patient', 'id': patient_id, 'gender': 'female', 'birthDate': '1970-05-02',
+         'name': [{'given': ['Ann', 'Marie'], 'family': f'Lee-{patient_id}'}]},
+        {'resourceType': 'Condition', 'id': 'c1', 'subject': subject,
+         'code': {'coding': [{'system': 'http://snomed.info/sct', 'code': '38341003',
+                              'display': 'Hypertension'}]}},
+        {'resourceType': 'MedicationRequest', 'id': 'm1', 'subject': subject,
+         'medicationCodeableConcept': {'text': 'Lisinopril 10 MG'}},
+        {'resourceType': 'MedicationRequest', 'id': 'm2', 'subject': subject,
+         'medicationCodeableConcept': {'coding': [{'code': '197361', 'display': 'Amlodipine 5 MG'}]}}
+    ]
+    for day, (sys_value, dia_value) in enumerate(zip(systolic, diastolic), start=1):
+        time = f'2025-01-0{day}T08:00:00+01:00'
+        resources += [
+            _observation(patient_id, f'o{day}s', '8480-6', 'Systolic BP', sys_value, 'mmHg', time),
+            _observation(patient_id, f'o{day}d', '8462-4', 'Diastolic BP', dia_value, 'mmHg', time),
+            _observation(patient_id, f'o{day}h', '8867-4', 'Heart rate', 60 + day, '/min', time),
+            _observation(patient_id, f'o{day}w', '29463-7', 'Weight', 70 + day / 2, 'kg', time)
+        ]
+    return resources
+
+
+def _reference_record(resources):
+    """Per-type extraction as fetch_patient originally did it (last reading of each display wins)"""
+    by_type = {}
+    for resource in resources:
+        by_type.setdefault(resource['resourceType'], []).append(resource)
+
+    conditions = [r.get('code', {}).get('coding', [{}])[0].get('display', 'Unknown Condition')
+                  for r in by_type.get('Condition', [])]
+    medications = []
+    for resource in by_type.get('MedicationRequest', []):
+        concept = resource.get('medicationCodeableConcept', {})
+        if 'text' in concept:
+            medications.append(concept['text'])
+        elif concept.get('coding'):
+            medications.append(concept['coding'][0].get('display', 'Unknown Medication'))
+    vitals = {}
+    for resource in by_type.get('Observation', []):
+        coding = resource.get('code', {}).get('coding', [{}])[0]
+        quantity = resource.get('valueQuantity', {})
+        if coding.get('code') and quantity.get('value'):
+            vitals[coding.get('display', 'Unknown Vital')] = {'value': quantity['value'], 'unit': quantity['unit']}
+
+    return finalize_patient_data({'conditions': conditions, 'medications': medications, 'vitals': vitals})
+
+
+def test_single_pass_matches_the_per_type_extraction():
+    resources = _bundle("p1")
+
+    record = build_patient_records(resources)["p1"].build()
+    expected = _reference_record(resources)
+
+    assert record['demographics']['name'] == "Ann Lee-p1"
+    assert record['demographics']['gender'] == "female"
+    for key in ('conditions', 'medications', 'vitals', 'bp_category', 'has_hypertension'):
+        assert record[key] == expected[key]
+    assert record['bp_category'] == "Hypertension Stage 1"
+
+
+def test_resources_are_demultiplexed_in_any_order():
+    bundles = {"p1": _bundle("p1"), "p2": _bundle("p2", systolic=(118, 112), diastolic=(76, 72))}
+    resources = bundles["p1"] + bundles["p2"]
+    shuffled = [resources[i] for i in np.random.default_rng(0).permutation(len(resources))]
+
+    records = build_patient_records(shuffled)
+    for patient_id, bundle in bundles.items():
+        record = records[patient_id].build()
+        expected = _reference_record(bundle)
+        assert record['vitals'] == expected['vitals']
+        assert sorted(record['medications']) == sorted(expected['medications'])
+    assert records["p2"].build()['bp_category'] == "Normal"
+
+    # Patients filtered out, or never seen as a Patient resource, get no record
+    assert list(build_patient_records(shuffled, ["p2", "p3"])) == ["p2"]
+
+
+def test_batched_build_matches_one_patient_at_a_time():
+    resources = _bundle("p1") + _bundle("p2", systolic=(118, 112), diastolic=(76, 72))
+    one_by_one = {patient_id: json.dumps(builder.build())
+                  for patient_id, builder in build_patient_records(resources).items()}
+
+    batched = build_patient_data(build_patient_records(resources))
+
+    assert {patient_id: json.dumps(data) for patient_id, data in batched.items()} == one_by_one
+
+
+def test_panel_components_and_bad_values():
+    builder = PatientRecordBuilder("p1", {'resourceType': 'Patient', 'id': 'p1'})
+    builder.add({'resourceType': 'Observation', 'category': [{'coding': [{'code': 'vital-signs'}]}],
+                 'code': {'coding': [{'system': LOINC, 'code': '85354-9'}]},
+                 'effectiveDateTime': '2025-01-01T08:00:00Z',
+                 'component': [
+                     {'code': {'coding': [{'code': '8480-6'}]}, 'valueQuantity': {'value': 131, 'unit': 'mm[Hg]'}},
+                     {'code': {'coding': [{'code': '8462-4'}]}, 'valueQuantity': {'value': 'n/a', 'unit': 'mm[Hg]'}}
+                 ]})
+    # Not a vital sign: ignored
+    builder.add({'resourceType': 'Observation', 'category': [{'coding': [{'code': 'laboratory'}]}],
+                 'code': {'coding': [{'code': '2093-3'}]}, 'valueQuantity': {'value': 180, 'unit': 'mg/dL'}})
+    # LOINC coding preferred over a local first coding
+    builder.add({'resourceType': 'Condition', 'code': {'coding': [
+        {'system': 'http://local', 'code': 'x'}, {'system': LOINC, 'code': 'y', 'display': 'Chosen'}
+    ]}})
+
+    series = builder.vitals_series()
+
+    assert series.codes == ['8480-6']
+    assert series.values.tolist() == [131.0]
+    assert series.units == ['mmHg']
+    assert builder.conditions == ["Chosen"]
+
+
+def test_series_round_trips_through_patient_info_json():
+    series = build_patient_records(_bundle("p1"))["p1"].vitals_series()
+    series = VitalsSeries(series.codes, series.displays, series.units, series.code_index,
+                          np.r_[series.times[:-1], np.datetime64('NaT')], series.values, series.unit_index)
+
+    restored = VitalsSeries.from_dict(json.loads(json.dumps(series.to_dict())))
+
+    assert restored.codes == series.codes
+    np.testing.assert_array_equal(restored.times, series.times)
+    np.testing.assert_array_equal(restored.values, series.values)
+    assert restored.latest() == series.latest()
+    # The last weight lost its time, so the dated one before it is the latest
+    assert series.latest()['29463-7']['value'] == pytest.approx(70.5)
+
+
+def _bp_panel(obs_id, time, systolic, diastolic, pulse=None):
+    resource = {'resourceType': 'Observation', 'id': obs_id, 'subject': {'reference': 'Patient/p1'},
+                'category': [{'coding': [{'code': 'vital-signs'}]}],
+                'code': {'coding': [{'system': LOINC, 'code': '85354-9'}]}, 'effectiveDateTime': time,
+                'component': [
+                    {'code': {'coding': [{'code': '8480-6'}]}, 'valueQuantity': {'value': systolic, 'unit': 'mm[Hg]'}},
+                    {'code': {'coding': [{'code': '8462-4'}]}, 'valueQuantity': {'value': diastolic, 'unit': 'mm[Hg]'}}
+                ]}
+    resources = [resource]
+    if pulse is not None:
+        resources.append(_observation('p1', f'{obs_id}h', '8867-4', 'Heart rate', pulse, '/min', time))
+    return resources
+
+
+def test_bp_panels_become_rows_at_their_local_clock_time():
+    builder = PatientRecordBuilder("p1", {'resourceType': 'Patient', 'id': 'p1'})
+    for resource in (_bp_panel('a', '2025-01-02T19:30:00-05:00', 150, 95)
+                     + _bp_panel('b', '2025-01-01T07:45:00+01:00', 131, 84, pulse=66)
+                     + [_observation('p1', 'lone', '8480-6', 'Systolic BP', 170, 'mmHg', '2025-01-03T09:00:00Z')]):
+        builder.add(resource)
+
+    bp = builder.vitals_series().to_bp_frame()
+
+    # Sorted by time; a systolic reading without a diastolic one is not a row
+    assert bp['datetime'].dt.strftime('%Y-%m-%d %H:%M').tolist() == ["2025-01-01 07:45", "2025-01-02 19:30"]
+    assert bp['systolic'].tolist() == [131, 150]
+    assert bp['diastolic'].tolist() == [84, 95]
+    assert bp['pulse'].iloc[0] == 66 and np.isnan(bp['pulse'].iloc[1])
+    assert bp['time_of_day'].tolist() == ["Morning", "Evening"]
+
+
+def test_fhir_bp_readings_are_merged_into_the_device_readings(tmp_path):
+    patient_dir = tmp_path / "p1"
+    (patient_dir / "omron").mkdir(parents=True)
+    shutil.copy(os.path.join(PATIENT_DATA_DIR, "47047908", "omron", "omron_data.csv"), patient_dir / "omron")
+
+    # The first device reading also came in through FHIR (same minute, offset and seconds
+    # added), plus one reading the device never exported
+    builder = PatientRecordBuilder("p1", {'resourceType': 'Patient', 'id': 'p1'})
+    for resource in (_bp_panel('dup', '2025-01-20T06:15:40+01:00', 199, 119, pulse=99)
+                     + _bp_panel('new', '2024-12-31T12:00:00Z', 141, 92, pulse=70)):
+        builder.add(resource)
+    with open(patient_dir / "patient_info.json", "w") as f:
+        json.dump(builder.build(), f)
+
+    integration = FHIRIntegration(data_dir=str(tmp_path), use_cache=False)
+    device, _ = integration.load_device_data("p1", include_fhir_vitals=False, mmap=False)
+    merged, _ = integration.load_device_data("p1", mmap=False)
+
+    assert len(merged) == len(device) + 1
+    assert merged['datetime'].is_monotonic_increasing
+    new_row = merged['datetime'] == pd.Timestamp("2024-12-31 12:00")
+    assert merged.loc[new_row, ['systolic', 'diastolic', 'pulse']].to_numpy().tolist() == [[141, 92, 70]]
+    # Without the FHIR-only reading the merge is the device data in time order,
+    # with the duplicate minute kept from the device
+    expected = device.sort_values('datetime', kind='stable').reset_index(drop=True)
+    pd.testing.assert_frame_equal(merged[~new_row].reset_index(drop=True), expected)
+
+
+def test_same_minute_readings_of_one_source_are_all_kept():
+    def bp(rows):
+        return to_compact_bp(pd.DataFrame(rows, columns=['datetime', 'systolic', 'diastolic', 'pulse']))
+
+    # Two back-to-back device readings 35 s apart, and FHIR readings in that minute and the next
+    device = bp([("2025-01-01 08:00:10", 120, 80, 60), ("2025-01-01 08:00:45", 135, 85, 62)])
+    fhir = bp([("2025-01-01 08:00:30", 199, 119, 99), ("2025-01-01 08:01:05", 131, 84, 61),
+               ("2025-01-01 08:01:50", 133, 86, 63)])
+
+    merged = merge_bp_frames(device, fhir)
+
+    assert merged['systolic'].tolist() == [120, 135, 131, 133]
+    assert merged['datetime'].is_monotonic_increasing
@@ -0,0 +1,188 @@
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from src.data_processing.fhir_sync import FHIRSync
+
+
+def _patient(patient_id, last_updated):
+    return {'resourceType': 'Patient', 'id': patient_id, 'meta': {'lastUpdated': last_updated},
+            'name': [{'given': ['Pat'], 'family': patient_id.upper()}]}
+
+
+def _condition(condition_id, patient_id, text, last_updated):
+    return {'resourceType': 'Condition', 'id': condition_id, 'meta': {'lastUpdated': last_updated},
+            'subject': {'reference': f'Patient/{patient_id}'}, 'code': {'text': text}}
+
+
+def _instant(value):
+    """Parse a FHIR instant the way a server would; a '+' decoded as a space fails here"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class _SyncHandler(BaseHTTPRequestHandler):
+    """Searches honouring _lastUpdated=gt..., and type histories listing the deletions"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        self.server.requests.append((url.path, query))
+        state = self.server.state
+        parts = url.path.strip('/').split('/')
+
+        try:
+            since = _instant(query['_lastUpdated'][2:]) if '_lastUpdated' in query else None
+            history_since = _instant(query['_since']) if '_since' in query else None
+        except ValueError:
+            return self._send(400, {'resourceType': 'OperationOutcome'})
+
+        if parts[-1] == '_history':
+            if state['history_down']:
+                return self._send(500, {'resourceType': 'OperationOutcome'})
+            assert history_since is not None
+            entries = [{'request': {'method': 'DELETE', 'url': f"{reference}/_history/2"}}
+                       for reference in state['deleted'] if reference.startswith(f"{parts[0]}/")]
+            return self._send(200, {'resourceType': 'Bundle', 'type': 'history', 'entry': entries})
+
+        if parts[0] == 'Patient':
+            resources = [r for r in state['Patient'] if r['id'] == query['_id']]
+        else:
+            resources = [r for r in state.get(parts[0], [])
+                         if r['subject']['reference'] == f"Patient/{query['patient']}"]
+        if since is not None:
+            resources = [r for r in resources if _instant(r['meta']['lastUpdated']) > since]
+        self._send(200, {'resourceType': 'Bundle', 'type': 'searchset',
+                         'entry': [{'resource': r} for r in resources]})
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/fhir+json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def sync_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SyncHandler)
+    server.requests = []
+    server.state = {
+        'Patient': [_patient("p1", "2025-01-01T00:00:00+00:00")],
+        'Condition': [_condition("c1", "p1", "Hypertension", "2025-01-02T00:00:00+00:00"),
+                      _condition("c2", "p1", "Asthma", "2025-01-03T00:00:00+00:00")],
+        'deleted': [],
+        'history_down': False
+    }
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _conditions(data_dir, patient_id):
+    with open(data_dir / patient_id / "patient_info.json") as f:
+        return sorted(json.load(f)['conditions'])
+
+
+def test_second_sync_sends_offset_watermarks_intact(tmp_path, sync_server):
+    sync = FHIRSync(sync_server.base_url, str(tmp_path))
+
+    assert sync.sync_patients(["p1", "unknown"]) == {'patients': 1, 'updated': 3, 'deleted': 0}
+    assert _conditions(tmp_path, "p1") == ["Asthma", "Hypertension"]
+    assert not (tmp_path / "unknown").exists()
+
+    # One condition deleted, one added; the patient and c2 are unchanged
+    state = sync_server.state
+    state['Condition'] = [state['Condition'][1],
+                          _condition("c3", "p1", "Diabetes", "2025-01-04T00:00:00+00:00")]
+    state['deleted'] = ["Condition/c1"]
+    sync_server.requests.clear()
+
+    assert sync.sync_patients(["p1"]) == {'patients': 1, 'updated': 1, 'deleted': 1}
+    assert _conditions(tmp_path, "p1") == ["Asthma", "Diabetes"]
+
+    # The '+' of each offset reaches the server instead of being decoded as a space
+    queries = dict(sync_server.requests)
+    assert queries['/Patient']['_lastUpdated'] == "gt2025-01-01T00:00:00+00:00"
+    assert queries['/Condition']['_lastUpdated'] == "gt2025-01-03T00:00:00+00:00"
+    assert queries['/Condition/_history']['_since'].endswith("+00:00")
+
+
+def test_history_errors_do_not_abort_the_sync(tmp_path, sync_server, capsys):
+    sync = FHIRSync(sync_server.base_url, str(tmp_path))
+    sync.sync_patients(["p1"])
+    with open(tmp_path / "sync_state.json") as f:
+        history_watermarks = json.load(f)['history']
+
+    state = sync_server.state
+    state['Condition'] = [state['Condition'][1],
+                          _condition("c3", "p1", "Diabetes", "2025-01-04T00:00:00+00:00")]
+    state['deleted'] = ["Condition/c1"]
+    state['history_down'] = True
+
+    summary = sync.sync_patients(["p1"])
+
+    # Changes are still saved; the deletion waits for the history to come back
+    assert summary == {'patients': 1, 'updated': 1, 'deleted': 0}
+    assert _conditions(tmp_path, "p1") == ["Asthma", "Diabetes", "Hypertension"]
+    assert "Error reading Condition history" in capsys.readouterr().out
+    with open(tmp_path / "sync_state.json") as f:
+        assert json.load(f)['history'] == history_watermarks
+
+    state['history_down'] = False
+
+    assert sync.sync_patients(["p1"])['deleted'] == 1
+    assert _conditions(tmp_path, "p1") == ["Asthma", "Diabetes"]
+
+
+def test_one_history_read_removes_deletions_across_the_panel(tmp_path, sync_server):
+    state = sync_server.state
+    state['Patient'].append(_patient("p2", "2025-01-01T00:00:00+00:00"))
+    state['Condition'].append(_condition("c4", "p2", "Gout", "2025-01-02T00:00:00+00:00"))
+    sync = FHIRSync(sync_server.base_url, str(tmp_path))
+    sync.sync_patients(["p1", "p2"])
+
+    state['Condition'] = [state['Condition'][1]]
+    state['deleted'] = ["Condition/c1", "Condition/c4", "Condition/elsewhere"]
+    sync_server.requests.clear()
+
+    assert sync.sync_patients(["p1", "p2"]) == {'patients': 2, 'updated': 0, 'deleted': 2}
+    assert _conditions(tmp_path, "p1") == ["Asthma"]
+    assert _conditions(tmp_path, "p2") == []
+    history_reads = [path for path, _ in sync_server.requests if path.endswith("/_history")]
+    assert sorted(history_reads) == sorted(f"/{resource_type}/_history" for resource_type in FHIRSync.SYNC_TYPES)
+
+
+def test_watermark_is_the_latest_instant_across_offsets_and_precision():
+    resources = [{'meta': {'lastUpdated': "2025-01-02T10:00:00.5+02:00"}},
+                 {'meta': {'lastUpdated': "2025-01-02T09:30:00Z"}},
+                 {'meta': {'lastUpdated': "2025-01-02T09:00:00.123456+00:00"}},
+                 {'meta': {}}]
+
+    # As strings the '+02:00' reading sorts last, though it is the earliest (08:00 UTC)
+    watermark = FHIRSync._new_watermark(resources, None, "2025-01-03T00:00:00+00:00")
+    assert watermark == "2025-01-02T09:30:00+00:00"
+    assert FHIRSync._new_watermark([], watermark, "2025-01-03T00:00:00+00:00") == watermark
+
+
+def test_synced_records_keep_demographics_and_leave_no_temporary_files(tmp_path, sync_server):
+    sync = FHIRSync(sync_server.base_url, str(tmp_path))
+    sync.sync_patients(["p1"])
+    sync.sync_patients(["p1"])
+
+    with open(tmp_path / "p1" / "patient_info.json") as f:
+        assert json.load(f)['demographics']['name'] == "Pat P1"
+    with open(tmp_path / "p1" / "fhir_resources.json") as f:
+        assert sorted(json.load(f)['Condition']) == ["c1", "c2"]
+    leftovers = [path.name for path in tmp_path.rglob("*.tmp")]
+    assert leftovers == []
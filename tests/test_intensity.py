@@ -0,0 +1,95 @@
+import gc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.analysis.correlation import CorrelationAnalyzer
+from src.analysis.intensity import (
+    CategoricalIntensityScorer, CompositeIntensityScorer, HeartRateIntensityScorer, IntensityScorer,
+    MetIntensityScorer
+)
+
+
+def _reference_scores(exercise_data):
+    """Row-by-row intensity score as the analyzer originally computed it"""
+    intensity_scores = {'Low': 1, 'Moderate': 2, 'High': 3}
+    return exercise_data.apply(
+        lambda row: intensity_scores.get(row['intensity'], 1) * row['duration_minutes'] / 30, axis=1
+    ).to_numpy(dtype=float)
+
+
+def test_categorical_scores_match_the_row_by_row_reference(device_data):
+    _, exercise_data = device_data
+    raw = exercise_data.astype({'intensity': object})
+    raw.loc[[1, 4], 'intensity'] = [None, 'Extreme']
+
+    for frame in (exercise_data, raw):
+        np.testing.assert_allclose(CategoricalIntensityScorer().score(frame), _reference_scores(frame))
+
+
+def test_scores_are_cached_per_frame(device_data):
+    exercise_data = device_data[1].copy()
+    scorer = CategoricalIntensityScorer()
+
+    scores = scorer.score(exercise_data)
+
+    assert scorer.score(exercise_data) is scores
+    assert not scores.flags.writeable
+    assert scorer.score(exercise_data.copy()) is not scores
+    del exercise_data
+    gc.collect()
+    assert scorer._cache == {}
+
+
+def test_heart_rate_scores_follow_the_reserve_bands():
+    exercise_data = pd.DataFrame({
+        'duration_minutes': [30, 30, 30, 60, 30],
+        'intensity': ['High', 'High', 'Low', 'Low', 'Moderate'],
+        # 20%, 45% and 70% of a 60-190 reserve, above the maximum, and missing
+        'avg_heart_rate': [86, 118.5, 151, 250, np.nan]
+    })
+
+    scores = HeartRateIntensityScorer().score(exercise_data)
+
+    np.testing.assert_allclose(scores, [1, 2, 3, 8, 2])
+    np.testing.assert_allclose(HeartRateIntensityScorer().levels(exercise_data.drop(columns='avg_heart_rate')),
+                               [3, 3, 1, 1, 2])
+
+
+def test_met_and_composite_scores():
+    exercise_data = pd.DataFrame({
+        'duration_minutes': [60, 60, 30, 45],
+        'intensity': ['Low', 'Low', 'High', 'Moderate'],
+        # 3, 6 and 9 METs for 70 kg, and no calories logged
+        'calories_burned': [210, 420, 315, 0],
+        'avg_heart_rate': [118.5, 118.5, 118.5, 118.5]
+    })
+
+    met = MetIntensityScorer()
+    np.testing.assert_allclose(met.levels(exercise_data), [1, 2, 3, 2])
+
+    composite = CompositeIntensityScorer([met, HeartRateIntensityScorer()], weights=[3, 1])
+    np.testing.assert_allclose(composite.levels(exercise_data), [1.25, 2, 2.75, 2])
+    np.testing.assert_allclose(composite.score(exercise_data), composite.levels(exercise_data) * [2, 2, 1, 1.5])
+
+
+def test_scorers_must_define_levels():
+    with pytest.raises(TypeError):
+        IntensityScorer()
+
+    class DoubleScorer(CategoricalIntensityScorer):
+        def levels(self, exercise_data):
+            return 2 * super().levels(exercise_data)
+
+    exercise_data = pd.DataFrame({'duration_minutes': [30, 60], 'intensity': ['Low', 'High']})
+    np.testing.assert_allclose(DoubleScorer(reference_minutes=60).score(exercise_data), [1, 6])
+
+
+def test_analyzers_use_the_scorer_they_are_given(device_data):
+    bp_data, exercise_data = device_data
+    scorer = HeartRateIntensityScorer()
+
+    impact = CorrelationAnalyzer(intensity_scorer=scorer).compute_exercise_impact(bp_data, exercise_data)
+
+    np.testing.assert_allclose(impact.intensity_score, scorer.score(exercise_data)[impact.positions])
@@ -0,0 +1,95 @@
+import glob
+import json
+import os
+
+import pytest
+
+from src.data_processing.fhir import FHIRIntegration
+from src.data_processing.fhir_extract import PatientRecordBuilder
+from src.data_processing.loinc import VITALS, lookup_vital, normalize_value, unit_conversion
+
+from conftest import PATIENT_DATA_DIR
+
+LOINC_NAMES = {
+    "8867-4": "Heart rate", "8480-6": "Systolic BP", "8462-4": "Diastolic BP", "8310-5": "Body temperature",
+    "9279-1": "Respiratory rate", "8302-2": "Height", "29463-7": "Weight", "39156-5": "BMI"
+}
+
+
+def _reference_vital_signs(patient_data):
+    """Vital signs as prepare_fhir_data_for_llm originally found them (exact code or display name only)"""
+    vitals = patient_data.get("vitals", {})
+    found = {}
+    for code, name in LOINC_NAMES.items():
+        value = vitals.get(code, vitals.get(name))
+        if value is None:
+            continue
+        if isinstance(value, dict) and "value" in value and "unit" in value:
+            found[name] = f"{value['value']} {value['unit']}"
+        else:
+            found[name] = str(value)
+    return found
+
+
+def _saved_patients():
+    for path in sorted(glob.glob(os.path.join(PATIENT_DATA_DIR, "*", "patient_info.json"))):
+        with open(path) as f:
+            yield json.load(f)
+
+
+def test_llm_vitals_keep_every_exact_match_and_resolve_synonyms():
+    integration = FHIRIntegration(data_dir=PATIENT_DATA_DIR, use_cache=False)
+    patients = list(_saved_patients())
+    assert patients
+
+    resolved_more = 0
+    for patient_data in patients:
+        vital_signs = integration.prepare_fhir_data_for_llm(patient_data)["vital_signs"]
+        expected = _reference_vital_signs(patient_data)
+
+        # Everything the exact lookup found is reported the same way, in canonical order
+        assert {name: vital_signs[name] for name in expected} == expected
+        assert list(vital_signs) == [d.name for d in VITALS.values() if d.name in vital_signs]
+        resolved_more += len(vital_signs) > len(expected)
+
+    # The sample files say 'Heart Rate', which only the case-insensitive index resolves
+    assert resolved_more > 0
+
+
+def test_codes_and_synonyms_resolve_to_one_canonical_vital():
+    assert lookup_vital("8480-6") is lookup_vital("8459-0") is lookup_vital("systolic blood pressure")
+    assert lookup_vital("Heart Rate").code == "8867-4"
+    assert lookup_vital("2093-3") is None and lookup_vital(None) is None
+
+    with pytest.raises(TypeError):
+        VITALS["8480-6"] = None
+
+
+@pytest.mark.parametrize("code,value,unit,expected", [
+    ("8310-5", 98.6, "[degF]", ("Body temperature", 37.0, "Cel")),
+    ("29463-7", 154, "[lb_av]", ("Weight", 69.85, "kg")),
+    ("8302-2", 1.75, "m", ("Height", 175.0, "cm")),
+    ("8480-6", 120, "mm[Hg]", ("Systolic BP", 120, "mmHg")),
+    ("8480-6", 120, "kPa", ("Systolic BP", 120, "kPa")),
+    ("Shoe size", 42, "EU", ("Shoe size", 42, "EU"))
+])
+def test_readings_are_converted_to_canonical_units(code, value, unit, expected):
+    assert normalize_value(code, value, unit) == expected
+
+
+def test_extracted_series_use_canonical_codes_and_units():
+    builder = PatientRecordBuilder("p1", {'resourceType': 'Patient', 'id': 'p1'})
+    readings = [("8331-1", 100.4, "[degF]"), ("8310-5", 37.2, "Cel"), ("3141-9", 176, "[lb_av]")]
+    for i, (code, value, unit) in enumerate(readings):
+        builder.add({'resourceType': 'Observation', 'category': [{'coding': [{'code': 'vital-signs'}]}],
+                     'code': {'coding': [{'system': 'http://loinc.org', 'code': code}]},
+                     'effectiveDateTime': f'2025-01-0{i + 1}T08:00:00Z',
+                     'valueQuantity': {'value': value, 'unit': unit}})
+
+    series = builder.vitals_series()
+
+    assert series.codes == ["8310-5", "29463-7"]
+    assert series.displays == ["Body temperature", "Weight"]
+    assert series.units == ["Cel", "kg"]
+    assert series.values.tolist() == pytest.approx([38.0, 37.2, 176 * 0.45359237])
+    assert unit_conversion(VITALS["8310-5"], "[degF]") == pytest.approx((5 / 9, -32 * 5 / 9))
@@ -0,0 +1,117 @@
+import glob
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from src.data_processing.patient_catalog import PatientCatalog
+from src.data_processing.patient_index import PatientIndex, patient_name
+
+from conftest import PATIENT_DATA_DIR
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """Copy of the bundled patient folders"""
+    shutil.copytree(PATIENT_DATA_DIR, tmp_path / "patient_data",
+                    ignore=shutil.ignore_patterns("columnar", "patient_index.json", "patient_catalog.sqlite"))
+    return tmp_path / "patient_data"
+
+
+def _scan(data_dir):
+    """Catalog fields of every patient, by reading every file as the picker did before the catalog"""
+    patients = {}
+    for folder in sorted(glob.glob(os.path.join(str(data_dir), "*", ""))):
+        patient_id = os.path.basename(os.path.dirname(folder))
+        info_path = os.path.join(folder, "patient_info.json")
+        patient_data = {}
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                patient_data = json.load(f)
+        row = {'name': patient_name(patient_data), 'bp_category': patient_data.get('bp_category')}
+        for prefix, path in [('bp', os.path.join(folder, "omron", "omron_data.csv")),
+                             ('exercise', os.path.join(folder, "google_fit", "google_fit.csv"))]:
+            row[f'{prefix}_rows'], row[f'{prefix}_start'], row[f'{prefix}_end'] = 0, None, None
+            if os.path.exists(path):
+                times = pd.to_datetime(pd.read_csv(path)['date'])
+                row[f'{prefix}_rows'] = len(times)
+                row[f'{prefix}_start'] = times.min().strftime("%Y-%m-%d")
+                row[f'{prefix}_end'] = times.max().strftime("%Y-%m-%d")
+        patients[patient_id] = row
+    return patients
+
+
+def test_catalog_matches_a_scan_of_every_file(data_dir):
+    catalog = PatientCatalog(str(data_dir))
+    assert catalog.refresh() == {'added': len(_scan(data_dir)), 'updated': 0, 'removed': 0}
+
+    expected = _scan(data_dir)
+    listed = catalog.list_patients()
+    assert sorted(listed['id']) == sorted(expected)
+    for patient_id, row in expected.items():
+        patient = catalog.get_patient(patient_id)
+        assert {column: patient[column] for column in row} == row
+
+    hypertensive = catalog.list_patients("has_hypertension = ?", (1,), columns=["id"])
+    assert set(hypertensive['id']) == set(listed.loc[listed['has_hypertension'], 'id'])
+
+
+def test_date_ranges_compare_dates_not_strings(data_dir):
+    patient_dir = data_dir / "new" / "omron"
+    patient_dir.mkdir(parents=True)
+    pd.DataFrame({'date': ["12/30/2024", "1/2/2025", "9/1/2024", "not a date"],
+                  'time': ["07:00", "08:00", "09:00", "10:00"],
+                  'systolic': [120, 130, 125, 140], 'diastolic': [80, 85, 82, 90]}).to_csv(
+        patient_dir / "omron_data.csv", index=False)
+
+    catalog = PatientCatalog(str(data_dir))
+    catalog.refresh()
+
+    patient = catalog.get_patient("new")
+    # Rows without a readable date are not counted, as the loader drops them
+    assert (patient['bp_rows'], patient['bp_start'], patient['bp_end']) == (3, "2024-09-01", "2025-01-02")
+    assert patient['exercise_rows'] == 0 and patient['name'] is None
+
+
+def test_refresh_only_rereads_changed_patients(data_dir):
+    catalog = PatientCatalog(str(data_dir))
+    catalog.refresh()
+    assert catalog.refresh() == {'added': 0, 'updated': 0, 'removed': 0}
+
+    info_path = data_dir / "47047908" / "patient_info.json"
+    patient_data = json.loads(info_path.read_text())
+    patient_data['name'] = "Beth Rodriguez"
+    info_path.write_text(json.dumps(patient_data))
+    os.utime(info_path, (1, 1))
+    shutil.rmtree(data_dir / "47047920")
+    (data_dir / "p9").mkdir()
+    (data_dir / "p9" / "patient_info.json").write_text(json.dumps({"demographics": {"name": "Nia Long", "age": 41}}))
+
+    assert catalog.refresh() == {'added': 1, 'updated': 1, 'removed': 1}
+    assert catalog.get_patient("47047908")['name'] == "Beth Rodriguez"
+    assert catalog.get_patient("47047908")['bp_rows'] == _scan(data_dir)["47047908"]['bp_rows']
+    assert catalog.get_patient("47047920") is None
+    assert catalog.get_patient("p9")['age'] == 41
+
+    catalog.refresh_patient("p9")
+    shutil.rmtree(data_dir / "p9")
+    catalog.refresh_patient("p9")
+    assert catalog.get_patient("p9") is None and len(catalog) == len(_scan(data_dir))
+
+
+def test_catalog_writes_leave_the_patient_folder_untouched(data_dir):
+    index = PatientIndex(str(data_dir))
+    dir_mtime = os.stat(data_dir).st_mtime
+    entries = sorted(os.listdir(data_dir))
+
+    catalog = PatientCatalog(str(data_dir))
+    catalog.refresh()
+    os.utime(data_dir / "47047908" / "patient_info.json", (1, 1))
+    catalog.refresh()
+
+    assert os.path.dirname(catalog.db_path) == os.path.dirname(str(data_dir))
+    assert sorted(os.listdir(data_dir)) == entries
+    # So the name index has nothing to rescan
+    assert os.stat(data_dir).st_mtime == dir_mtime == index._dir_mtime
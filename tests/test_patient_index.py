@@ -0,0 +1,124 @@
+import glob
+import json
+import os
+import shutil
+
+import pytest
+
+from src.data_processing import fhir
+from src.data_processing.fhir import FHIRIntegration
+from src.data_processing.patient_index import PatientIndex, normalize_name, patient_name, save_patient_info
+
+from conftest import PATIENT_DATA_DIR
+
+BASE_URL = "http://fhir.test/baseR4"
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """Copies of the bundled patient_info.json files"""
+    for path in glob.glob(os.path.join(PATIENT_DATA_DIR, "*", "patient_info.json")):
+        patient_dir = tmp_path / os.path.basename(os.path.dirname(path))
+        patient_dir.mkdir()
+        shutil.copy(path, patient_dir)
+    return tmp_path
+
+
+def _scan(data_dir, query):
+    """Ids of saved patients having every query token, by reading every patient_info.json as before the index"""
+    tokens = set(normalize_name(query))
+    matches = []
+    for path in glob.glob(os.path.join(str(data_dir), "*", "patient_info.json")):
+        with open(path) as f:
+            if tokens <= set(normalize_name(patient_name(json.load(f)))):
+                matches.append(os.path.basename(os.path.dirname(path)))
+    return sorted(matches)
+
+
+def test_exact_search_matches_a_scan_of_every_file(data_dir):
+    index = PatientIndex(str(data_dir))
+    names = [entry['name'] for entry in index._entries.values()]
+    assert len(index) == len(names) > 0
+
+    for query in names + [name.split()[-1].upper() for name in names]:
+        results = index.search(query, limit=None)
+        assert sorted(result['id'] for result in results) == _scan(data_dir, query)
+        assert all(result['score'] == 1.0 for result in results)
+
+
+def test_prefix_and_fuzzy_tiers(data_dir):
+    save_patient_info(str(data_dir), "x1", {"name": "Elizabeth Rodriguez-Smith"})
+    save_patient_info(str(data_dir), "x2", {"demographics": {"name": "José O'Brien"}})
+    index = PatientIndex(str(data_dir))
+
+    assert {r['id'] for r in index.search("eli rod")} >= {"47047908", "x1"}
+    assert {r['score'] for r in index.search("eli rod")} == {0.9}
+    assert index.search("jose obrien")[0] == {"id": "x2", "name": "José O'Brien", "score": 1.0}
+
+    fuzzy = index.search("Elizabet Rodriges")
+    assert fuzzy[0]['id'] == "47047908"
+    assert 0.5 <= fuzzy[0]['score'] < 0.9
+    assert index.search("Zzyzx Qwerty") == []
+
+
+def test_find_only_returns_a_single_exact_full_name_match(data_dir):
+    save_patient_info(str(data_dir), "s1", {"name": "John Smithers"})
+    save_patient_info(str(data_dir), "s2", {"name": "John Smith"})
+    save_patient_info(str(data_dir), "s3", {"name": "Mary Smith"})
+    save_patient_info(str(data_dir), "s4", {"name": "Mary Smith"})
+    index = PatientIndex(str(data_dir))
+
+    assert index.find("smith JOHN") == {"id": "s2", "name": "John Smith"}
+    # Prefix, fuzzy, partial and ambiguous matches may be someone else
+    assert index.search("John Smi")[0]['score'] == 0.9 and index.find("John Smi") is None
+    assert index.find("Jon Smithers") is None
+    assert index.find("John") is None
+    assert index.find("Mary Smith") is None
+
+
+def test_near_matches_fall_through_to_the_server(data_dir, monkeypatch):
+    save_patient_info(str(data_dir), "local", {"name": "John Smithers"})
+    searched = []
+
+    class _Response:
+        status_code = 200
+
+        def json(self):
+            return {'total': 1, 'entry': [{'resource': {'id': 'remote',
+                                                        'name': [{'given': ['John'], 'family': 'Smith'}]}}]}
+
+    monkeypatch.setattr(fhir.requests, 'get', lambda url: searched.append(url) or _Response())
+    integration = FHIRIntegration(BASE_URL, str(data_dir), use_cache=False)
+
+    assert integration.search_patient_by_name("John Smith") == {"id": "remote", "name": "John Smith"}
+    assert searched == [f"{BASE_URL}/Patient?name=John Smith"]
+
+    # A saved patient with exactly that name is answered locally
+    assert integration.search_patient_by_name("John Smithers") == {"id": "local", "name": "John Smithers"}
+    assert len(searched) == 1
+
+
+def test_index_is_persisted_and_only_rereads_changed_files(data_dir, monkeypatch):
+    PatientIndex(str(data_dir))
+    assert (data_dir / PatientIndex.INDEX_FILE).exists()
+
+    opened = []
+    real_open = open
+    monkeypatch.setattr("builtins.open", lambda path, *args, **kwargs: opened.append(str(path))
+                        or real_open(path, *args, **kwargs))
+    reloaded = PatientIndex(str(data_dir))
+    assert [os.path.basename(path) for path in opened] == [PatientIndex.INDEX_FILE]
+
+    # Renamed, added and removed patients are picked up on the next search
+    info_path = data_dir / "47047908" / "patient_info.json"
+    patient_data = json.loads(info_path.read_text())
+    patient_data['name'] = "Beth Rodriguez"
+    save_patient_info(str(data_dir), "47047908", patient_data)
+    os.utime(info_path, (1, 1))
+    save_patient_info(str(data_dir), "new", {"name": "Nia Long"})
+    shutil.rmtree(data_dir / "47047920")
+
+    assert reloaded.find("Beth Rodriguez") == {"id": "47047908", "name": "Beth Rodriguez"}
+    assert reloaded.find("Nia Long")['id'] == "new"
+    assert "47047920" not in reloaded._entries
+    assert not glob.glob(str(data_dir / "*.tmp")) and not glob.glob(str(data_dir / "*" / "*.tmp"))
@@ -0,0 +1,14 @@
+from src.llm.prompts import RecommendationPrompts
+
+
+def test_exercise_history_lists_only_types_in_the_slice(device_data):
+    exercise_data = device_data[1]
+    assert exercise_data['exercise_type'].cat.categories.size > 1
+    ex_type = exercise_data['exercise_type'].iloc[0]
+    recent = exercise_data[exercise_data['exercise_type'] == ex_type].head(4)
+
+    prompt = RecommendationPrompts.generate_exercise_recommendation_prompt({}, {}, {}, recent)
+
+    # Categories absent from the slice keep a zero count in value_counts()
+    assert f"- {ex_type}: {len(recent)} sessions" in prompt
+    assert ": 0 sessions" not in prompt
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import pearsonr
+
+from src.analysis import resampling
+from src.analysis.resampling import ResamplingEngine
+
+
+def _groups(seed=0, size=120, groups=4):
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, groups, size)
+    values = np.column_stack([rng.normal(codes * 2.0, 1.0), rng.normal(0, 1, size)])
+    values[rng.random(size) < 0.1, 1] = np.nan
+    return values, codes
+
+
+def _sorted_groups(values, codes):
+    order = np.argsort(codes, kind='stable')
+    sizes = np.bincount(codes)
+    return values[order], codes[order], np.concatenate(([0], np.cumsum(sizes)[:-1])), sizes
+
+
+def test_bootstrap_means_match_a_loop_over_the_same_draws():
+    values, codes, starts, sizes = _sorted_groups(*_groups())
+
+    means = resampling._bootstrap_group_means(np.random.default_rng(5), 30, values, starts, sizes)
+
+    # Replay the draws: each row is replaced by a random row of its own group
+    draws = np.random.default_rng(5).random((30, len(values)))
+    for r in range(30):
+        index = np.repeat(starts, sizes) + (draws[r] * np.repeat(sizes, sizes)).astype(np.int64)
+        expected = pd.DataFrame(values[index]).groupby(codes).mean().to_numpy()
+        np.testing.assert_allclose(means[r], expected)
+
+
+def test_permuted_means_and_correlations_match_a_loop_over_the_same_shuffles():
+    values, codes, starts, sizes = _sorted_groups(*_groups())
+    x, y = values[:, 0], values[:, 1:]
+
+    means = resampling._permuted_group_means(np.random.default_rng(7), 20, values, starts, sizes)
+    correlations = resampling._permuted_correlations(np.random.default_rng(7), 20, x, y)
+
+    shuffles = np.random.default_rng(7).permuted(np.tile(np.arange(len(values)), (20, 1)), axis=1)
+    for r, index in enumerate(shuffles):
+        expected = pd.DataFrame(values[index]).groupby(codes).mean().to_numpy()
+        np.testing.assert_allclose(means[r], expected)
+        present = ~np.isnan(y[:, 0])
+        np.testing.assert_allclose(correlations[r, 0], pearsonr(x[index][present], y[present, 0])[0])
+
+
+def test_group_means_summarize_each_group():
+    values, codes = _groups(size=300)
+    codes[:5] = -1  # left out
+
+    result = ResamplingEngine(n_resamples=500, seed=0).group_means(values, codes, n_groups=5)
+
+    expected = pd.DataFrame(values[5:]).groupby(codes[5:]).mean().to_numpy()
+    np.testing.assert_allclose(result['mean'][:4], expected)
+    assert np.isnan(result['mean'][4]).all() and np.isnan(result['p_value'][4]).all()
+    assert (result['ci_lower'][:4] <= expected).all() and (expected <= result['ci_upper'][:4]).all()
+    # Groups of the first column differ by construction; the second column is noise
+    assert (result['p_value'][[0, 3], 0] < 0.01).all()
+    assert (result['p_value'][:4, 1] > 0.01).all()
+    assert result['resamples'] == 500
+
+
+def test_correlation_intervals_and_p_values():
+    rng = np.random.default_rng(1)
+    x = rng.normal(size=200)
+    y = np.column_stack([0.6 * x + rng.normal(size=200), rng.normal(size=200)])
+    y[::7, 1] = np.nan
+
+    result = ResamplingEngine(n_resamples=1000, seed=0).correlations(x, y)
+
+    present = ~np.isnan(y[:, 1])
+    np.testing.assert_allclose(result['correlation'], [pearsonr(x, y[:, 0])[0],
+                                                       pearsonr(x[present], y[present, 1])[0]])
+    assert (result['ci_lower'] <= result['correlation']).all() and (result['correlation'] <= result['ci_upper']).all()
+    assert result['p_value'][0] == pytest.approx(1 / 1001) and result['p_value'][1] > 0.05
+
+
+def test_seeded_results_do_not_depend_on_the_workers(monkeypatch):
+    monkeypatch.setattr(resampling, 'CHUNK_DRAWS', 1000)
+    values, codes = _groups()
+
+    serial = ResamplingEngine(n_resamples=200, seed=3).group_means(values, codes, 4)
+    threads = ResamplingEngine(n_resamples=200, seed=3, parallel_min_draws=0, max_workers=4).group_means(values, codes, 4)
+
+    for key in ['mean', 'ci_lower', 'ci_upper', 'p_value']:
+        np.testing.assert_array_equal(threads[key], serial[key])
+
+
+def test_large_samples_get_fewer_resamples():
+    engine = ResamplingEngine(n_resamples=10000, full_resample_rows=5000, min_resamples=1000)
+
+    assert [engine.resample_count(rows) for rows in [10, 5000, 10000, 40000, 10**6]] == [10000, 10000, 5000, 1250, 1000]
+    assert engine.correlations(np.arange(8.0), np.arange(8.0)[::-1])['resamples'] == 10000
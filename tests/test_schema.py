@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.data_processing.schema import (
+    date_column, memory_report, time_column, to_compact_bp, to_compact_exercise, valid_exercise_rows
+)
+
+from conftest import PATIENT_DATA_DIR
+
+
+def _raw(folder, name):
+    return pd.read_csv(os.path.join(PATIENT_DATA_DIR, "47047908", folder, name))
+
+
+def test_bp_frames_use_the_compact_schema():
+    raw_data = _raw("omron", "omron_data.csv")
+
+    compact = to_compact_bp(raw_data)
+
+    assert list(compact.columns) == ['datetime', 'systolic', 'diastolic', 'pulse', 'time_of_day']
+    assert compact['datetime'].dtype.kind == 'M'
+    assert all(compact[column].dtype == np.int16 for column in ['systolic', 'diastolic', 'pulse'])
+    assert isinstance(compact['time_of_day'].dtype, pd.CategoricalDtype)
+    # date and time are derived on demand and match the raw columns
+    assert (date_column(compact).dt.strftime('%Y-%m-%d') == raw_data['date']).all()
+    assert (time_column(compact) == raw_data['time']).all()
+
+
+def test_exercise_frames_use_the_compact_schema():
+    compact = to_compact_exercise(_raw("google_fit", "google_fit.csv"))
+
+    assert compact['duration_minutes'].dtype == np.int16
+    assert compact['steps'].dtype == np.int32
+    assert isinstance(compact['exercise_type'].dtype, pd.CategoricalDtype)
+    assert list(compact['intensity'].cat.categories[:3]) == ['Low', 'Moderate', 'High']
+
+
+def test_memory_report_shows_the_per_row_saving():
+    raw_data = _raw("omron", "omron_data.csv")
+
+    report = memory_report(raw_data, to_compact_bp(raw_data))
+
+    assert report['rows'] == len(raw_data)
+    assert report['after_bytes_per_row'] < report['before_bytes_per_row'] / 4
+    assert report['reduction_pct'] > 75
+
+
+def test_memory_report_from_byte_counts():
+    report = memory_report(4000, 1000, rows=100)
+    assert (report['before_bytes_per_row'], report['after_bytes_per_row'], report['reduction_pct']) == (40, 10, 75)
+
+    # Without a row count only the totals are known
+    report = memory_report(4000, 1000)
+    assert report['rows'] is None
+    assert report['before_bytes_per_row'] is None and report['after_bytes_per_row'] is None
+    assert report['reduction_pct'] == 75
+
+
+def test_fractional_values_are_rounded():
+    raw_data = pd.DataFrame({
+        'date': ['2025-01-01'] * 3, 'time': ['08:00', '09:00', '10:00'],
+        'systolic': [120.6, 119.4, 130.5], 'diastolic': [80, 79.5, 81], 'pulse': [70, 71, 72]
+    })
+
+    compact = to_compact_bp(raw_data)
+
+    assert compact['systolic'].dtype == np.int16
+    assert compact['systolic'].tolist() == [121, 119, 130]
+    assert compact['diastolic'].tolist() == [80, 80, 81]
+
+
+def test_values_that_do_not_fit_fail_validation_instead_of_wrapping():
+    raw_data = pd.DataFrame({
+        'date': ['2025-01-01', '2025-01-02'], 'time': ['08:00', '08:00'], 'exercise_type': ['Running'] * 2,
+        'duration_minutes': [30, 45], 'calories_burned': [300, 70000]
+    })
+
+    compact = to_compact_exercise(raw_data)
+
+    assert compact['calories_burned'].tolist() == [300, 70000]
+    assert valid_exercise_rows(compact).tolist() == [True, False]
@@ -0,0 +1,108 @@
+import os
+import stat
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.analysis.bp_categories import BPCategorizer
+from src.data_processing.session_memory import SessionMemoryGovernor
+
+
+def _spill_path(governor, session_id):
+    return governor._spilled[session_id][0]
+
+
+def test_frames_shared_by_keys_and_sessions_are_stored_once(tmp_path, device_data):
+    governor = SessionMemoryGovernor(spill_dir=str(tmp_path))
+    bp_data = device_data[0]
+
+    governor.store("a", "bp_data", bp_data)
+    governor.store("a", "results", {'frames': [bp_data], 'count': 3})
+    governor.store("b", "bp_data", bp_data.copy())
+
+    assert governor.memory_report()['unique_frames'] == 1
+    assert governor.memory_report()['bytes'] == governor.session_memory_report("b")['bytes']
+    assert governor.session_memory_report("b")['shared_bytes'] == governor.session_memory_report("b")['bytes']
+    pd.testing.assert_frame_equal(governor.load("b", "bp_data"), bp_data)
+    assert governor.load("a", "results")['count'] == 3
+
+
+def test_categorized_frames_are_stored_as_added_columns(tmp_path, device_data):
+    governor = SessionMemoryGovernor(spill_dir=str(tmp_path))
+    bp_data = device_data[0]
+    categorized = BPCategorizer().categorize_bp_dataframe(bp_data)
+
+    governor.store("a", "bp_data", bp_data)
+    governor.store("a", "categorized_bp_data", categorized)
+
+    loaded = governor.load("a", "categorized_bp_data")
+    pd.testing.assert_frame_equal(loaded, categorized)
+    # Only the category column is held on top of the base frame
+    assert governor.memory_report() == {
+        'sessions': 1, 'spilled_sessions': 0, 'unique_frames': 2,
+        'bytes': int(bp_data.memory_usage(deep=True).sum() + categorized[['category']].memory_usage(deep=True).sum())
+    }
+    assert np.shares_memory(loaded['systolic'].to_numpy(), governor.load("a", "bp_data")['systolic'].to_numpy())
+
+
+def test_idle_sessions_are_spilled_privately_and_restored(tmp_path, device_data):
+    governor = SessionMemoryGovernor(spill_dir=str(tmp_path), idle_timeout=10)
+    bp_data = device_data[0]
+    governor.store("a", "bp_data", bp_data)
+    governor.store("a", "settings", {'days': 7})
+    governor.store("b", "bp_data", bp_data)
+
+    assert governor.spill_idle_sessions(now=time.time() + 20) == ["a", "b"]
+
+    spill_dirs = [os.path.dirname(_spill_path(governor, session_id)) for session_id in ("a", "b")]
+    assert spill_dirs[0] != spill_dirs[1]
+    for session_id, spill_dir in zip(("a", "b"), spill_dirs):
+        assert stat.S_IMODE(os.stat(spill_dir).st_mode) == 0o700
+        assert stat.S_IMODE(os.stat(_spill_path(governor, session_id)).st_mode) == 0o600
+    assert governor.memory_report()['bytes'] == 0
+    assert governor.session_memory_report("a")['spilled']
+
+    pd.testing.assert_frame_equal(governor.load("a", "bp_data"), bp_data)
+    assert governor.load("a", "settings") == {'days': 7}
+    # Restoring removes the session's spill directory
+    assert not os.path.exists(spill_dirs[0])
+
+
+def test_expired_sessions_are_dropped_with_their_spill_files(tmp_path, device_data):
+    governor = SessionMemoryGovernor(spill_dir=str(tmp_path), idle_timeout=10, expire_timeout=100)
+    governor.store("spilled", "bp_data", device_data[0])
+    governor.store("live", "exercise_data", device_data[1])
+    governor.spill_idle_sessions(now=time.time() + 20)
+    governor.store("live", "exercise_data", device_data[1])
+
+    assert governor.expire_idle_sessions(now=time.time() + 50) == []
+    assert governor.expire_idle_sessions(now=time.time() + 200) == ["live", "spilled"]
+
+    assert os.listdir(tmp_path) == []
+    assert governor.memory_report() == {'sessions': 0, 'spilled_sessions': 0, 'unique_frames': 0, 'bytes': 0}
+    # What the app checks to notice that an open tab lost its data
+    assert not governor.has("spilled", "bp_data")
+
+
+def test_values_stored_as_none_are_kept(tmp_path, device_data):
+    # An exercise-only upload stores no BP frame; the session is still loaded, even after a spill
+    governor = SessionMemoryGovernor(spill_dir=str(tmp_path), idle_timeout=10)
+    governor.store("a", "bp_data", None)
+    governor.store("a", "exercise_data", device_data[1])
+    governor.spill_idle_sessions(now=time.time() + 20)
+
+    assert governor.has("a", "bp_data") and governor.load("a", "bp_data", default="missing") is None
+    assert not governor.has("a", "categorized_bp_data")
+
+
+def test_stale_spills_of_earlier_processes_are_removed(tmp_path):
+    (tmp_path / "session.pkl").write_bytes(b"")
+    stale_dir = tmp_path / "session-stale"
+    stale_dir.mkdir()
+    os.utime(stale_dir, (time.time() - 200, time.time() - 200))
+    (tmp_path / "session-recent").mkdir()
+
+    SessionMemoryGovernor(spill_dir=str(tmp_path), expire_timeout=100)
+
+    assert os.listdir(tmp_path) == ["session-recent"]
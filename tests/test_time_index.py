@@ -0,0 +1,102 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.analysis.bp_categories import BPCategorizer
+from src.data_processing import time_index
+from src.data_processing.schema import date_column
+from src.data_processing.time_index import TimeIndexedStore
+
+RANGES = [(None, None), (date(2025, 1, 25), date(2025, 2, 10)), (date(2025, 2, 1), date(2025, 2, 1)),
+          (date(2024, 1, 1), date(2025, 1, 21)), (date(2025, 3, 1), date(2024, 3, 1)), (date(2026, 1, 1), None)]
+
+
+@pytest.fixture
+def frames(device_data):
+    bp_data, exercise_data = device_data
+    # Shuffled, so the store has to sort them
+    order = np.random.default_rng(0).permutation(len(bp_data))
+    categorized = BPCategorizer().categorize_bp_dataframe(bp_data.iloc[order].reset_index(drop=True))
+    return categorized, exercise_data
+
+
+def _masked(frame, start_date, end_date):
+    """Date-range filter with boolean masks over the calendar date, as filter_by_date_range did before the index"""
+    dates = date_column(frame)
+    mask = np.ones(len(frame), dtype=bool)
+    if start_date is not None:
+        mask &= (dates >= pd.Timestamp(start_date)).to_numpy()
+    if end_date is not None:
+        mask &= (dates <= pd.Timestamp(end_date)).to_numpy()
+    return frame[mask].sort_values('datetime', kind='stable', ignore_index=True)
+
+
+@pytest.mark.parametrize("start_date,end_date", RANGES)
+def test_slices_match_boolean_masks(frames, start_date, end_date):
+    store = TimeIndexedStore(*frames)
+
+    for kind, frame in zip(['bp', 'exercise'], frames):
+        pd.testing.assert_frame_equal(store.slice(kind, start_date, end_date).reset_index(drop=True),
+                                      _masked(frame, start_date, end_date))
+
+
+@pytest.mark.parametrize("start_date,end_date", RANGES)
+def test_summaries_match_the_masked_rows(frames, start_date, end_date):
+    store = TimeIndexedStore(*frames)
+    bp = _masked(frames[0], start_date, end_date)
+    exercise = _masked(frames[1], start_date, end_date)
+
+    bp_summary = store.summary('bp', start_date, end_date)
+    assert bp_summary['count'] == len(bp)
+    for column in ['systolic', 'diastolic', 'pulse']:
+        assert bp_summary['total'][column] == pytest.approx(float(bp[column].sum()))
+        expected_mean = float(bp[column].mean()) if len(bp) else None
+        assert bp_summary['mean'][column] == pytest.approx(expected_mean)
+    distribution = BPCategorizer().get_category_distribution(bp)
+    assert bp_summary['counts'] == distribution.get('counts', {})
+    assert bp_summary['percentages'] == pytest.approx(distribution.get('percentages', {}))
+
+    exercise_summary = store.summary('exercise', start_date, end_date)
+    assert exercise_summary['total']['duration_minutes'] == pytest.approx(float(exercise['duration_minutes'].sum()))
+    assert exercise_summary['counts'] == {k: v for k, v in exercise['exercise_type'].value_counts().items() if v}
+
+
+def test_rollups_cross_block_edges(frames, monkeypatch):
+    monkeypatch.setattr(time_index._DailyRollup, 'BLOCK_ROWS', 4)
+    small_blocks = TimeIndexedStore(*frames)
+    monkeypatch.undo()
+    one_block = TimeIndexedStore(*frames)
+
+    for kind in ['bp', 'exercise']:
+        np.testing.assert_array_equal(small_blocks._rollups[kind].row_offsets, one_block._rollups[kind].row_offsets)
+        assert small_blocks.summary(kind, *RANGES[1]) == one_block.summary(kind, *RANGES[1])
+
+
+def test_rows_without_a_timestamp_are_left_out(frames):
+    bp_data = frames[0].copy()
+    bp_data.loc[[0, 5], 'datetime'] = pd.NaT
+
+    store = TimeIndexedStore(bp_data)
+
+    assert len(store.slice('bp')) == len(bp_data) - 2
+    assert store.slice('exercise') is None and store.summary('exercise') is None
+    assert store.date_range() == (date_column(bp_data).min().date(), date_column(bp_data).max().date())
+
+
+def test_results_are_cached_by_the_rows_a_range_covers(frames):
+    store = TimeIndexedStore(*frames, max_cached_ranges=2)
+    calls = []
+
+    def compute(bp, exercise):
+        calls.append((len(bp), len(exercise)))
+        return len(calls)
+
+    # The sample has no data after its last day, so both ranges select the same rows
+    last_day = store.date_range()[1]
+    assert store.cached('n', None, last_day, compute) == store.cached('n', None, date(2030, 1, 1), compute) == 1
+    store.cached('n', *RANGES[1], compute)
+    store.cached('n', *RANGES[2], compute)
+    assert store.cached('n', None, None, compute) == 4
+    assert len(calls) == 4